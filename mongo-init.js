@@ -4,6 +4,8 @@ db = db.getSiblingDB('edgeup');
 db.createCollection('users');
 db.createCollection('text_chunks');
 db.createCollection('dialogues');
+db.createCollection('documents');
+db.createCollection('ingestion_checkpoints');
 
 // indexes for better performance
 db.users.createIndex({ "firebase_id": 1 }, { unique: true });
@@ -12,9 +14,33 @@ db.users.createIndex({ "email": 1 });
 db.text_chunks.createIndex({ "user_id": 1 });
 db.text_chunks.createIndex({ "document_id": 1 });
 db.text_chunks.createIndex({ "user_id": 1, "document_id": 1 });
+db.text_chunks.createIndex({ "document_id": 1, "user_id": 1, "chunk_index": 1 });
 
 db.dialogues.createIndex({ "user_id": 1 });
-db.dialogues.createIndex({ "user_id": 1, "timestamp": -1 });
+db.dialogues.createIndex({ "user_id": 1, "timestamp": -1, "_id": -1 });
 db.dialogues.createIndex({ "previous_dialogue_id": 1 });
 
+db.documents.createIndex({ "document_id": 1 }, { unique: true });
+db.documents.createIndex({ "user_id": 1, "created_at": -1, "document_id": -1 });
+db.documents.createIndex({ "user_id": 1, "content_hash": 1, "status": 1 });
+db.document_backfills.createIndex({ "user_id": 1 }, { unique: true });
+
+db.ingestion_checkpoints.createIndex({ "document_id": 1, "user_id": 1 }, { unique: true });
+
+db.jobs.createIndex({ "job_id": 1 }, { unique: true });
+db.jobs.createIndex({ "user_id": 1, "created_at": -1 });
+db.jobs.createIndex({ "durable": 1, "status": 1, "kind": 1, "priority": 1, "available_at": 1 });
+db.jobs.createIndex({ "durable": 1, "status": 1, "lease_expires_at": 1 });
+
+db.document_pages.createIndex({ "document_id": 1, "user_id": 1, "page": 1 });
+db.document_pages.createIndex({ "user_id": 1 });
+
+db.index_versions.createIndex({ "version": 1 });
+db.index_versions.createIndex({ "status": 1 });
+db.reindex_progress.createIndex({ "version": 1, "user_id": 1, "document_id": 1 }, { unique: true });
+
+db.openai_usage.createIndex({ "at": 1 });
+db.openai_usage.createIndex({ "user_id": 1, "at": 1 });
+db.openai_usage.createIndex({ "document_id": 1, "at": 1 });
+
 print("document ai mongo database initialized successfully");
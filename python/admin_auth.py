@@ -0,0 +1,23 @@
+# the one operator secret: sent as X-Admin-Token to the admin endpoints (/profiles, /usage) and as X-Profile-Token to have a
+# request profiled. while it is unset the admin endpoints do not exist and nothing is profiled.
+import hmac
+import os
+from typing import Optional
+
+from fastapi import HTTPException, Request
+
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")
+ADMIN_HEADER = "x-admin-token"
+
+def enabled() -> bool:
+    return bool(ADMIN_API_TOKEN)
+
+def authorized(token: Optional[str]) -> bool:
+    return bool(ADMIN_API_TOKEN) and token is not None and hmac.compare_digest(token.encode(), ADMIN_API_TOKEN.encode())
+
+def require_admin(request: Request) -> None:
+    # fastapi dependency of the admin endpoints
+    if not ADMIN_API_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not authorized(request.headers.get(ADMIN_HEADER)):
+        raise HTTPException(status_code=403, detail="a valid admin token is required")
@@ -1,29 +1,66 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query
+import time
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Request, Response, Depends, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
 import tempfile
 import os
 import shutil
 import uuid
 import logging
-from typing import Optional, List
+from typing import Optional, List, Literal, Callable
+from datetime import datetime, timedelta
 import uvicorn
-from document_processor import debug_embeddings, get_file_type
-from text_extractor import extract_text_from_pdf
+from document_processor import debug_embeddings, file_digest
 from image_extractor import extract_text_from_image_as_pages
 from dotenv import load_dotenv
 from bson import ObjectId
+from serialization import convert_objectid_to_str, debug_objectids
 
-from mongo_connection import client
+from mongo_connection import mongo_manager
 from user_model import UserModel
-from text_chunk_model import TextChunkModel
+from text_chunk_model import TextChunkModel, compute_chunks_etag
 from dialogue_model import DialogueModel
+from document_model import DocumentModel, compute_listing_etag
+from dependencies import get_user_model, get_chunk_model, get_dialogue_model, get_document_model, get_checkpoint_model, get_job_model, get_page_model, get_upload_store, get_usage_model
+from document_pages import DocumentPageModel
+from index_versions import IndexVersionModel, index_layouts
+from ingestion import IngestionCheckpointModel, IngestionInProgress, CheckpointMissing, ingest_document, replace_document
+import metrics
+import profiler
+from log_config import configure_logging, diagnostics_enabled
+from openai_limiter import limiter as openai_limiter
+from chat_pipeline import run_chat, REFERENCE_MODES
+from retrieval import chunk_id, chunk_texts, parse_chunk_id
+from batch_chat import prepare_batch, stream_batch, read_report, MAX_BATCH_QUESTIONS
+from dialogue_spool import dialogue_spool
+from jobs import JobModel, run_job
+from upload_store import UploadStore
+from usage_ledger import UsageLedgerModel, GROUP_FIELDS, bind_scope, usage_writer
+from deletion import delete_documents, purge_user
+from admin_auth import require_admin
+from warmup import warmup
 
 class ChatQueryRequest(BaseModel):
     query: str
     user_id: str
     document_ids: Optional[List[str]] = None
     previous_dialogue_id: Optional[str] = None
+    reference_mode: Optional[Literal["full", "lean"]] = None
+
+class BatchChatRequest(BaseModel):
+    user_id: str
+    questions: List[str]
+    document_ids: Optional[List[str]] = None
+    report: bool = False
+    reference_mode: Optional[Literal["full", "lean"]] = None
+
+class BulkDeleteRequest(BaseModel):
+    user_id: str
+    document_ids: List[str]
 
 class ChatQueryResponse(BaseModel):
     success: bool
@@ -34,13 +71,38 @@ class ChatQueryResponse(BaseModel):
     context_chunks_count: int
     searched_documents: List[str]
 
-logging.basicConfig(level=logging.WARNING, 
-                   format='%(levelname)s: %(message)s',
-                   force=True)
-
 load_dotenv()
 
-app = FastAPI(title="document processing api")
+MAX_BULK_DELETE = int(os.getenv("MAX_BULK_DELETE", "1000"))
+# inline: /process-sequence ingests the upload itself; queue: it stores the upload and queues a job for worker.py
+INGESTION_MODE = os.getenv("INGESTION_MODE", "inline").lower()
+MAX_CHUNK_IDS = int(os.getenv("MAX_CHUNK_IDS", "50"))
+# how long a browser may reuse /chunks text before revalidating it with the etag
+CHUNKS_CACHE_MAX_AGE = int(os.getenv("CHUNKS_CACHE_MAX_AGE", "300"))
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# requests that should not count as the first real request of the process
+PROBE_PATHS = {"/health", "/ready", "/metrics"}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    mongo_manager.start()
+    index_layouts.bind(lambda: mongo_manager.model(IndexVersionModel))
+    if os.getenv("DIALOGUE_WRITE_BEHIND", "true").lower() in ("1", "true", "yes"):
+        dialogue_spool.start(lambda dialogues: mongo_manager.model(DialogueModel).insert_dialogues(dialogues))
+    usage_writer.start(lambda entries: mongo_manager.model(UsageLedgerModel).insert_entries(entries))
+    warmup.start(blocking=os.getenv("WARMUP_BLOCKING", "").lower() in ("1", "true", "yes"))
+    yield
+    warmup.stop()
+    dialogue_spool.stop()
+    usage_writer.stop()
+    mongo_manager.close()
+
+app = FastAPI(title="document processing api", lifespan=lifespan)
+# attributes threadpool workers to profiled requests; routes declared below pick it up
+app.router.route_class = profiler.ProfiledRoute
 
 app.add_middleware(
     CORSMiddleware,
@@ -48,42 +110,110 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id", "Server-Timing", "X-Batch-Id", "X-Profile-Id"],
 )
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # give every request a trace id and report its stage timings back in the response headers
+    trace = metrics.start_trace(request.headers.get("x-trace-id"))
+    bind_scope(endpoint=request.url.path)
+    profile, profile_thread = None, None
+    profile_token = profiler.requested_token(request.headers, request.query_params)
+    if profile_token is not None:
+        if profiler.authorized(profile_token):
+            profile = profiler.start(request.method, request.url.path)
+            profile_thread = profile.enter()
+        else:
+            logger.warning(f"ignoring a profiling request with an invalid token on {request.url.path}")
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Trace-Id"] = trace.trace_id
+        if profile is not None:
+            response.headers["X-Profile-Id"] = profile.profile_id
+        server_timing = trace.server_timing()
+        if server_timing:
+            response.headers["Server-Timing"] = server_timing
+        return response
+    finally:
+        route = request.scope.get("route")
+        elapsed = time.perf_counter() - trace.started_at
+        if profile is not None:
+            profile.leave(profile_thread)
+            try:
+                profiler.finish(profile, elapsed * 1000, status)
+            except Exception as e:
+                # a profile that cannot be written never fails the request it profiled
+                logger.error(f"could not save profile {profile.profile_id}: {str(e)}")
+        if route is not None and route.path not in PROBE_PATHS:
+            warmup.record_first_request(elapsed)
+        metrics.http_request_duration.observe(
+            elapsed,
+            method=request.method,
+            route=route.path if route is not None else "unmatched",
+            status=str(status)
+        )
+        if trace.timings:
+            logger.info(
+                "request completed",
+                extra={"method": request.method, "path": request.url.path, "status": status, "duration_ms": round(elapsed * 1000, 1), "stages": trace.summary()}
+            )
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/profiles", dependencies=[Depends(require_admin)])
+def get_profiles():
+    return {"success": True, "profiles": profiler.list_profiles()}
+
+@app.get("/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+def get_profile(profile_id: str):
+    # folded stacks: flamegraph.pl profile.folded > profile.svg, or drop the file on speedscope.app
+    folded = profiler.read_profile(profile_id)
+    if folded is None:
+        raise HTTPException(status_code=404, detail="profile not found")
+    return PlainTextResponse(folded, headers={"Content-Disposition": f'attachment; filename="{profile_id}.folded"'})
+
 @app.get("/health")
 def health_check():
     try:
-        client.admin.command('ismaster')
+        mongo_manager.client.admin.command('ismaster')
         mongo_status = "connected"
     except Exception as e:
         mongo_status = f"error: {str(e)}"
-    return {"status": "ok", "mongo": mongo_status}
+    return {"status": "ok", "mongo": mongo_status, "mongo_pool": mongo_manager.pool_stats(), "openai_limiter": openai_limiter.stats(), "dialogue_spool": dialogue_spool.stats(), "usage_ledger": usage_writer.stats()}
+
+@app.get("/ready")
+def readiness_check(response: Response):
+    # 503 until the startup warm-up has finished, so load balancers only route to warm processes
+    status = warmup.status()
+    if not status["ready"]:
+        response.status_code = 503
+    return status
 
 @app.get("/sign-in")
-def sign_on(name: str = "Anonymous", firebase_id: str = "", email: str = ""):
+def sign_on(name: str = "Anonymous", firebase_id: str = "", email: str = "", user_model: UserModel = Depends(get_user_model)):
     try:
-        db = client.get_database("edgeup")
-        user_model = UserModel(db)
         if not firebase_id:
-            logging.warning("sign-in attempt with missing firebase_id.")
+            logger.warning("sign-in attempt with missing firebase_id.")
             return {"success": False, "error": "firebase_id is required"}
         user = user_model.get_user_by_firebase_id(firebase_id)
         if not user:
             user = user_model.create_user(name=name, firebase_id=firebase_id, email=email)
             created = True
-            print(f"[sign-in] created new mongodb user for firebase_id={firebase_id}, email={email}")
-            logging.info(f"created new mongodb user for firebase_id={firebase_id}, email={email}")
+            logger.info(f"created new mongodb user for firebase_id={firebase_id}")
         else:
             created = False
-            print(f"[sign-in] authentication successful, mongodb user exists for firebase_id={firebase_id}, email={user.get('email')}")
-            logging.info(f"authentication successful, mongodb user exists for firebase_id={firebase_id}, email={user.get('email')}")
-        print(f"[mongo user doc] user document: {user}")
+            logger.debug(f"sign-in for existing mongodb user firebase_id={firebase_id}")
         if user and '_id' in user:
             user = dict(user)
             user['_id'] = str(user['_id'])
         return {"success": True, "created": created, "user": user}
     except Exception as e:
-        logging.error(f"sign-in error: {str(e)}")
+        logger.error(f"sign-in error: {str(e)}")
         return {"success" : False, "error": str(e)}
 
 @app.get("/debug-embedding")
@@ -94,32 +224,110 @@ def debug_embedding():
     except Exception as e:
         return {"success": False, "error": str(e)}
 
-def convert_objectid_to_str(obj):
-    if isinstance(obj, ObjectId):
-        return str(obj)
-    elif isinstance(obj, dict):
-        return {k: convert_objectid_to_str(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_objectid_to_str(i) for i in obj]
-    elif hasattr(obj, '__dict__'):
-        return {k: convert_objectid_to_str(v) for k, v in obj.__dict__.items()}
+def ingestion_response(filename: str, result: dict, user_id: str, resumed: bool) -> dict:
+    # response body shared by /process-sequence and /resume-ingestion
+    return {
+        "success": True,
+        "filename": str(filename),
+        "document_id": str(result["document_id"]),
+        "steps_completed": 5,
+        "resumed": resumed,
+        "resumed_batches": result["resumed_batches"],
+        "text_extraction": {
+            "page_count": result["page_count"],
+            "first_page_preview": result["first_page_preview"]
+        },
+        "chunking": {
+            "chunk_count": result["chunk_count"],
+            "first_chunk_preview": result["first_chunk_preview"],
+            "dedup": result.get("dedup")
+        },
+        "embedding": {
+            "vectors_created": result["chunk_count"],
+            "embedding_dimensions": result["embedding_dimensions"],
+            "sample_embedding": result["sample_embedding"],
+            "batches": result["batch_count"]
+        },
+        "vector_storage": {
+            "stored_count": result["chunk_count"],
+            "database": "pinecone",
+            "document_id": str(result["document_id"]),
+            "user_namespace": str(user_id)
+        },
+        "mongo_storage": {
+            "stored_count": result["chunk_count"],
+            "database": "mongodb"
+        }
+    }
+
+def run_ingestion(document_id: str, user_id: str, filename: str, file_path: Optional[str], document_model: DocumentModel,
+                  chunk_model: TextChunkModel, checkpoints: IngestionCheckpointModel, page_model: DocumentPageModel) -> dict:
+    # run the checkpointed pipeline and keep the document record's status in step with it
+    try:
+        return ingest_document(document_id, user_id, filename, file_path, checkpoints, document_model, chunk_model, page_model=page_model)
+    except IngestionInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except CheckpointMissing as e:
+        document_model.mark_failed(document_id, user_id, str(e))
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        try:
+            document_model.mark_failed(document_id, user_id, str(e))
+        except Exception as mark_error:
+            logger.error(f"failed to mark document {document_id} as failed: {str(mark_error)}")
+        raise HTTPException(status_code=500, detail=f"error processing {filename}: {str(e)}")
+
+def queue_ingestion(kind: str, document_id: str, user_id: str, filename: str, file_path: str, size_bytes: int, content_hash: str,
+                    jobs: JobModel, uploads: UploadStore) -> JSONResponse:
+    # hand an upload to the worker fleet; the client polls /jobs/{job_id}, and the document shows as processing until then. the
+    # same file uploaded again while its job is still open gets that job rather than a second one.
+    job = jobs.find_open(kind, user_id, document_id, content_hash)
+    if job is not None:
+        logger.info(f"{kind} of {filename} is already queued", extra={"document_id": document_id, "job_id": job["job_id"]})
     else:
-        return obj
-
-def debug_objectids(obj, path=""):
-    if isinstance(obj, dict):
-        for k, v in obj.items():
-            debug_objectids(v, f"{path}.{k}")
-    elif isinstance(obj, list):
-        for i, v in enumerate(obj):
-            debug_objectids(v, f"{path}[{i}]")
-    elif isinstance(obj, ObjectId):
-        print(f"found objectid at {path}: {obj}")
-    return obj
+        file_id = uploads.put(file_path, filename, user_id, document_id, content_hash)
+        job = jobs.enqueue(kind, user_id, {"document_id": document_id, "filename": filename, "file_id": file_id, "size_bytes": size_bytes, "content_hash": content_hash})
+        logger.info(f"queued {kind} of {filename}", extra={"document_id": document_id, "job_id": job["job_id"]})
+    return JSONResponse(status_code=202, content={
+        "success": True, "queued": True, "document_id": document_id, "filename": filename, "job_id": job["job_id"], "status": job["status"]
+    })
+
+def replace_existing_document(document_id: str, user_id: str, file_path: str, size_bytes: int, content_hash: str, document_model: DocumentModel,
+                              chunk_model: TextChunkModel, checkpoints: IngestionCheckpointModel, page_model: DocumentPageModel,
+                              enqueue: Optional[Callable[[], JSONResponse]] = None):
+    # the replace mode of /process-sequence; with enqueue, a changed file is queued for a worker instead of replaced here
+    document = document_model.get_document(document_id, user_id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="document to replace not found or access denied")
+    if document.get("content_hash") == content_hash and document.get("status") == "ready":
+        return {"success": True, "document_id": document_id, "filename": document.get("filename"), "replaced": False, "message": "document content is unchanged"}
+    if enqueue is not None:
+        return enqueue()
+    try:
+        result = replace_document(document_id, user_id, file_path, size_bytes, content_hash, checkpoints, document_model, chunk_model, page_model=page_model)
+    except IngestionInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    logger.info(
+        f"replaced document {document_id}",
+        extra={"document_id": document_id, "embedded_chunks": result["embedded_chunks"], "upserted_chunks": result["upserted_chunks"], "deleted_chunks": result["deleted_chunks"]}
+    )
+    return {"success": True, "replaced": True, **result}
 
 @app.post("/process-sequence")
-async def process_sequence(file: UploadFile = File(...), user_id: str = Form("anonymous")):
-    # process a document (pdf or image) through extraction, chunking, embedding, and vector storage in sequence with detailed output
+def process_sequence(
+    file: UploadFile = File(...),
+    user_id: str = Form("anonymous"),
+    replace_document_id: Optional[str] = Form(None),
+    document_model: DocumentModel = Depends(get_document_model),
+    chunk_model: TextChunkModel = Depends(get_chunk_model),
+    checkpoints: IngestionCheckpointModel = Depends(get_checkpoint_model),
+    page_model: DocumentPageModel = Depends(get_page_model),
+    jobs: JobModel = Depends(get_job_model),
+    uploads: UploadStore = Depends(get_upload_store)
+):
+    # process a document (pdf or image) through extraction, chunking, embedding, and vector storage. re-uploading a file whose ingestion failed resumes it;
+    # passing replace_document_id ingests the file as a new revision of that document, re-embedding only the chunks that changed.
+    # with INGESTION_MODE=queue the work is queued for worker.py and the response (202) carries the job id instead of the result.
     file_extension = file.filename.lower().split('.')[-1] if '.' in file.filename else ''
     supported_pdf = file_extension == 'pdf'
     supported_image = file_extension in ['jpg', 'jpeg', 'png', 'gif', 'bmp', 'tiff', 'webp']
@@ -133,117 +341,123 @@ async def process_sequence(file: UploadFile = File(...), user_id: str = Form("an
         temp_file_path = temp_file.name
         shutil.copyfileobj(file.file, temp_file)
     try:
-        file_type = get_file_type(temp_file_path)
-        print(f"\n\033[1;34mstep 1: extracting text from {file.filename} (type: {file_type})\033[0m\n")
-        if file_type == 'pdf':
-            pages = extract_text_from_pdf(temp_file_path)
-        elif file_type == 'image':
-            pages = extract_text_from_image_as_pages(temp_file_path)
+        size_bytes, content_hash = file_digest(temp_file_path)
+        queued = INGESTION_MODE == "queue"
+        if replace_document_id:
+            enqueue = (lambda: queue_ingestion("replace", replace_document_id, user_id, file.filename, temp_file_path, size_bytes, content_hash, jobs, uploads)) if queued else None
+            return replace_existing_document(replace_document_id, user_id, temp_file_path, size_bytes, content_hash, document_model, chunk_model, checkpoints, page_model, enqueue)
+        previous = document_model.find_resumable(user_id, content_hash)
+        if previous is not None:
+            document_id = previous["document_id"]
+            logger.info(f"resuming ingestion of {file.filename} as document {document_id}")
+            document_model.mark_processing(document_id, user_id)
         else:
-            raise ValueError(f"unsupported file type: {file_type}")
-        print(f"\n\033[1;34mstep 2: creating chunks from extracted text\033[0m\n")
-        from doc_chunks import chunk_pages
-        chunks = chunk_pages(pages, max_tokens=500, overlap=50)
-        print(f"\n\033[1;34mstep 3: generating embeddings for {len(chunks)} chunks\033[0m\n")
-        from embeddings import embed_chunks
-        embedded_chunks = embed_chunks(chunks)
-        print(f"\n\033[1;32membeddings generated for {len(embedded_chunks)} chunks.\033[0m\n")
-        print(f"\n\033[1;34mstep 4: storing vectors in pinecone database\033[0m\n")
-        document_id = str(uuid.uuid4())
-        from pinecone_vectors import store_document_chunks
-        import copy
-        embedded_chunks_copy = copy.deepcopy(embedded_chunks)
-        vector_count = store_document_chunks(
-            embedded_chunks_copy,
-            document_id=document_id,
-            user_id=user_id,
-            filename=file.filename
-        )
-        print(f"\n\033[1;32msuccessfully stored {vector_count} vectors in pinecone\033[0m\n")
-        print(f"\n\033[1;34mstep 5: storing chunks in mongodb\033[0m\n")
-        db = client.get_database("edgeup")
-        chunk_model = TextChunkModel(db)
-        mongo_inserted_count = chunk_model.insert_chunks(embedded_chunks, document_id, user_id, file.filename)
-        print(f"\n\033[1;32msuccessfully stored {mongo_inserted_count} chunks in mongodb\033[0m\n")
-        embedded_chunks = convert_objectid_to_str(embedded_chunks)
-        pages = convert_objectid_to_str(pages)
-        chunks = convert_objectid_to_str(chunks)
-        sample_embedding = None
-        if embedded_chunks and len(embedded_chunks) > 0 and 'embedding' in embedded_chunks[0]:
-            sample_embedding = embedded_chunks[0]['embedding'][:10]
-        response = {
-            "success": True,
-            "filename": str(file.filename),
-            "document_id": str(document_id),
-            "steps_completed": 5,
-            "text_extraction": {
-                "page_count": len(pages),
-                "first_page_preview": str(pages[0][:200]) if pages else ""
-            },
-            "chunking": {
-                "chunk_count": len(chunks),
-                "first_chunk_preview": str(chunks[0]["text"][:200]) if chunks else ""
-            },
-            "embedding": {
-                "vectors_created": len(embedded_chunks),
-                "embedding_dimensions": len(embedded_chunks[0]["embedding"]) if embedded_chunks and "embedding" in embedded_chunks[0] else 0,
-                "sample_embedding": sample_embedding
-            },
-            "vector_storage": {
-                "stored_count": int(vector_count),
-                "database": "pinecone",
-                "document_id": str(document_id),
-                "user_namespace": str(user_id)
-            },
-            "mongo_storage": {
-                "stored_count": int(mongo_inserted_count),
-                "database": "mongodb"
-            }
-        }
-        debug_objectids(response, "response")
-        response = convert_objectid_to_str(response)
-        try:
-            import json
-            json.dumps(response, default=str)
-        except Exception as e:
-            print(f"error: response still contains non-serializable objects: {e}")
-            response = convert_objectid_to_str(response)
-        return response
+            document_id = str(uuid.uuid4())
+            document_model.create_document(document_id, user_id, file.filename, size_bytes, content_hash)
+        if queued:
+            return queue_ingestion("ingest", document_id, user_id, file.filename, temp_file_path, size_bytes, content_hash, jobs, uploads)
+        result = run_ingestion(document_id, user_id, file.filename, temp_file_path, document_model, chunk_model, checkpoints, page_model)
+        logger.info(f"ingested {result['chunk_count']} chunks of {file.filename}", extra={"document_id": document_id, "resumed_batches": result["resumed_batches"]})
+        response = ingestion_response(file.filename, result, user_id, resumed=previous is not None)
+        if diagnostics_enabled():
+            debug_objectids(response, "response")
+        return convert_objectid_to_str(response)
+    except HTTPException:
+        raise
     except Exception as e:
+        logger.error(f"error processing {file.filename}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"error processing {file.filename}: {str(e)}")
     finally:
         if os.path.exists(temp_file_path):
             os.remove(temp_file_path)
 
+@app.post("/resume-ingestion")
+def resume_ingestion(
+    document_id: str = Form(...),
+    user_id: str = Form(...),
+    document_model: DocumentModel = Depends(get_document_model),
+    chunk_model: TextChunkModel = Depends(get_chunk_model),
+    checkpoints: IngestionCheckpointModel = Depends(get_checkpoint_model),
+    page_model: DocumentPageModel = Depends(get_page_model)
+):
+    # resume a failed ingestion from its checkpoint without re-uploading the file
+    try:
+        document = document_model.get_document(document_id, user_id)
+        if document is None:
+            raise HTTPException(status_code=404, detail="document not found or access denied")
+        if document.get("status") == "ready":
+            return {"success": True, "document_id": document_id, "status": "ready", "resumed": False}
+        document_model.mark_processing(document_id, user_id)
+        result = run_ingestion(document_id, user_id, document.get("filename"), None, document_model, chunk_model, checkpoints, page_model)
+        return ingestion_response(document.get("filename"), result, user_id, resumed=True)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"error resuming document {document_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"error resuming document {document_id}: {str(e)}")
+
 @app.get("/user-files")
-def get_user_files(user_id: str = Query(...)):
-    db = client.get_database("edgeup")
-    chunk_model = TextChunkModel(db)
-    files = chunk_model.get_files_by_user(user_id)
-    files = convert_objectid_to_str(files)
-    return {"success": True, "files": files}
+def get_user_files(
+    request: Request,
+    response: Response,
+    user_id: str = Query(...),
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = Query(None),
+    document_model: DocumentModel = Depends(get_document_model),
+    chunk_model: TextChunkModel = Depends(get_chunk_model)
+):
+    try:
+        files, next_cursor = document_model.list_documents(user_id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not cursor and not document_model.is_backfilled(user_id):
+        if document_model.backfill_from_chunks(chunk_model.collection, user_id):
+            files, next_cursor = document_model.list_documents(user_id, limit)
+    etag = compute_listing_etag(files, next_cursor)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return {"success": True, "files": files, "next_cursor": next_cursor}
 
 @app.delete("/delete-file")
-async def delete_file(document_id: str = Query(...), user_id: str = Query(...)):
+async def delete_file(
+    document_id: str = Query(...),
+    user_id: str = Query(...),
+    document_model: DocumentModel = Depends(get_document_model),
+    chunk_model: TextChunkModel = Depends(get_chunk_model),
+    checkpoints: IngestionCheckpointModel = Depends(get_checkpoint_model),
+    page_model: DocumentPageModel = Depends(get_page_model)
+):
     try:
-        db = client.get_database("edgeup")
-        chunk_model = TextChunkModel(db)
-        doc_info = chunk_model.get_document_info(document_id, user_id)
+        doc_info = document_model.get_document(document_id, user_id) or chunk_model.get_document_info(document_id, user_id)
         if not doc_info:
             raise HTTPException(status_code=404, detail="file not found or access denied")
         filename = doc_info.get('filename', 'unknown')
-        print(f"\n\033[1;34mdeleting file: {filename} (document_id: {document_id})\033[0m")
-        print(f"\033[1;33mstep 1: deleting chunks from mongodb...\033[0m")
+        logger.debug(f"deleting file: {filename} (document_id: {document_id})")
+        logger.debug("step 1: deleting chunks from mongodb...")
         mongo_deleted_count = chunk_model.delete_chunks_by_document(document_id, user_id)
-        print(f"\033[1;32mdeleted {mongo_deleted_count} chunks from mongodb\033[0m")
-        print(f"\033[1;33mstep 2: deleting vectors from pinecone...\033[0m")
-        from pinecone_vectors import delete_document_vectors
-        pinecone_success = delete_document_vectors(document_id, user_id)
+        logger.info(f"deleted {mongo_deleted_count} chunks from mongodb")
+        logger.debug("step 2: deleting vectors from pinecone...")
+        from pinecone_vectors import delete_documents_vectors
+        try:
+            active = index_layouts.active()
+            for layout in index_layouts.live():
+                # the recorded chunk count only describes the active version's chunking
+                chunk_count = int(doc_info.get("chunk_count") or 0) if layout == active else 0
+                delete_documents_vectors(user_id, {document_id: chunk_count}, layout=layout)
+            pinecone_success = True
+        except Exception as e:
+            logger.error(f"error deleting vectors for document {document_id}: {str(e)}")
+            pinecone_success = False
         if pinecone_success:
-            print(f"\033[1;32msuccessfully deleted vectors from pinecone\033[0m")
+            logger.debug("successfully deleted vectors from pinecone")
         else:
-            print(f"\033[1;31mwarning: failed to delete some vectors from pinecone\033[0m")
-        print(f"\033[1;32mfile '{filename}' successfully deleted\033[0m\n")
+            logger.warning(f"failed to delete some vectors from pinecone for document {document_id}")
+        checkpoints.delete(document_id, user_id)
+        page_model.delete_document_pages([document_id], user_id)
+        document_model.delete_document(document_id, user_id)
+        logger.info(f"file '{filename}' successfully deleted")
         return {
             "success": True,
             "message": f"file '{filename}' deleted successfully",
@@ -254,287 +468,282 @@ async def delete_file(document_id: str = Query(...), user_id: str = Query(...)):
     except HTTPException:
         raise
     except Exception as e:
-        print(f"\033[1;31merror deleting file: {str(e)}\033[0m")
+        logger.error(f"error deleting file: {str(e)}")
         raise HTTPException(status_code=500, detail=f"error deleting file: {str(e)}")
 
+@app.post("/delete-files", status_code=202)
+def delete_files(
+    request: BulkDeleteRequest,
+    background_tasks: BackgroundTasks,
+    document_model: DocumentModel = Depends(get_document_model),
+    chunk_model: TextChunkModel = Depends(get_chunk_model),
+    checkpoints: IngestionCheckpointModel = Depends(get_checkpoint_model),
+    page_model: DocumentPageModel = Depends(get_page_model),
+    jobs: JobModel = Depends(get_job_model)
+):
+    # queue the deletion of several documents; poll /jobs/{job_id} for progress
+    user_id = request.user_id
+    document_ids = list(dict.fromkeys(request.document_ids))
+    if not document_ids:
+        raise HTTPException(status_code=400, detail="document_ids is empty")
+    if len(document_ids) > MAX_BULK_DELETE:
+        raise HTTPException(status_code=400, detail=f"at most {MAX_BULK_DELETE} documents can be deleted per request")
+    try:
+        documents = document_model.get_documents(document_ids, user_id)
+        if not documents:
+            raise HTTPException(status_code=404, detail="files not found or access denied")
+        found = [doc["document_id"] for doc in documents]
+        document_model.mark_deleting(found, user_id)
+        job = jobs.create_job("delete_documents", user_id, {"document_ids": found}, total=len(found))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"error queueing deletion: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"error queueing deletion: {str(e)}")
+    background_tasks.add_task(
+        run_job, jobs, job["job_id"],
+        lambda report: delete_documents(user_id, documents, document_model, chunk_model, checkpoints, page_model, report)
+    )
+    found_ids = set(found)
+    return {
+        "success": True,
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "document_count": len(found),
+        "not_found": [document_id for document_id in document_ids if document_id not in found_ids]
+    }
+
+@app.post("/purge-user", status_code=202)
+def purge_user_data(
+    background_tasks: BackgroundTasks,
+    user_id: str = Form(...),
+    user_model: UserModel = Depends(get_user_model),
+    document_model: DocumentModel = Depends(get_document_model),
+    chunk_model: TextChunkModel = Depends(get_chunk_model),
+    dialogue_model: DialogueModel = Depends(get_dialogue_model),
+    checkpoints: IngestionCheckpointModel = Depends(get_checkpoint_model),
+    page_model: DocumentPageModel = Depends(get_page_model),
+    jobs: JobModel = Depends(get_job_model)
+):
+    # queue the removal of the user's account and everything stored for it
+    try:
+        job = jobs.create_job("purge_user", user_id, total=0)
+    except Exception as e:
+        logger.error(f"error queueing purge: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"error queueing purge: {str(e)}")
+    background_tasks.add_task(
+        run_job, jobs, job["job_id"],
+        lambda report: purge_user(user_id, user_model, document_model, chunk_model, dialogue_model, checkpoints, page_model, report)
+    )
+    return {"success": True, "job_id": job["job_id"], "status": job["status"]}
+
+@app.get("/usage/users", dependencies=[Depends(require_admin)])
+def get_usage_users(hours: float = Query(24, gt=0), sort: Literal["total_tokens", "latency_ms", "calls", "errors"] = "total_tokens",
+                    limit: int = Query(20, ge=1, le=500), usage: UsageLedgerModel = Depends(get_usage_model)):
+    # the users behind the most openai tokens (or latency, calls, errors) over the last hours
+    users = usage.top_users(datetime.utcnow() - timedelta(hours=hours), sort=sort, limit=limit)
+    return {"success": True, "hours": hours, "users": users}
+
+@app.get("/usage/breakdown", dependencies=[Depends(require_admin)])
+def get_usage_breakdown(group_by: str = "endpoint,operation,model", hours: float = Query(24, gt=0), user_id: Optional[str] = None,
+                        document_id: Optional[str] = None, sort: Literal["total_tokens", "latency_ms", "calls", "errors"] = "total_tokens",
+                        limit: int = Query(50, ge=1, le=1000), usage: UsageLedgerModel = Depends(get_usage_model)):
+    fields = [field.strip() for field in group_by.split(",") if field.strip()]
+    if not fields or any(field not in GROUP_FIELDS for field in fields):
+        raise HTTPException(status_code=400, detail=f"group_by must be a comma-separated list of {', '.join(GROUP_FIELDS)}")
+    match = {key: value for key, value in (("user_id", user_id), ("document_id", document_id)) if value}
+    rows = usage.breakdown(datetime.utcnow() - timedelta(hours=hours), fields, sort=sort, limit=limit, match=match)
+    return {"success": True, "hours": hours, "group_by": fields, "rows": rows}
+
+@app.get("/usage/regressions", dependencies=[Depends(require_admin)])
+def get_usage_regressions(window_hours: float = Query(24, gt=0), group_by: str = "endpoint,operation,model", min_calls: int = Query(20, ge=1),
+                          threshold: float = Query(0.25, gt=0), usage: UsageLedgerModel = Depends(get_usage_model)):
+    # groups whose latency, tokens per call or error rate grew between the previous window and the last one
+    fields = [field.strip() for field in group_by.split(",") if field.strip()]
+    if not fields or any(field not in GROUP_FIELDS for field in fields):
+        raise HTTPException(status_code=400, detail=f"group_by must be a comma-separated list of {', '.join(GROUP_FIELDS)}")
+    found = usage.regressions(window_hours, fields, min_calls, threshold)
+    return {"success": True, "window_hours": window_hours, "regressions": found}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str, user_id: str = Query(...), jobs: JobModel = Depends(get_job_model)):
+    job = jobs.get_job(job_id, user_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="job not found or access denied")
+    return {"success": True, "job": job}
+
 @app.post("/chat-query")
-async def chat_query(
+def chat_query(
     query: str = Form(...),
     user_id: str = Form(...),
     document_ids: Optional[str] = Form(None),
-    previous_dialogue_id: Optional[str] = Form(None)
+    previous_dialogue_id: Optional[str] = Form(None),
+    reference_mode: Optional[str] = Form(None),
+    dialogue_model: DialogueModel = Depends(get_dialogue_model),
+    chunk_model: TextChunkModel = Depends(get_chunk_model)
 ):
+    if reference_mode is not None and reference_mode not in REFERENCE_MODES:
+        raise HTTPException(status_code=400, detail=f"reference_mode must be one of {', '.join(REFERENCE_MODES)}")
+    if previous_dialogue_id and not ObjectId.is_valid(previous_dialogue_id):
+        raise HTTPException(status_code=400, detail="invalid previous_dialogue_id")
     try:
         doc_ids_list = []
         if document_ids and document_ids.strip():
             doc_ids_list = [doc_id.strip() for doc_id in document_ids.split(",") if doc_id.strip()]
-        print(f"\n\033[1;34mchat query: {query[:100]}{'...' if len(query) > 100 else ''}\033[0m")
-        print(f"\033[1;34muser id: {user_id}\033[0m")
-        if doc_ids_list:
-            print(f"\033[1;34msearching in documents: {doc_ids_list}\033[0m")
-        else:
-            print(f"\033[1;34msearching in all user documents\033[0m")
-        full_context_for_openai = ""
-        if previous_dialogue_id:
-            print(f"\033[1;35mfollow-up question detected. previous dialogue id: {previous_dialogue_id}\033[0m")
-            db = client.get_database("edgeup")
-            dialogue_model = DialogueModel(db)
-            full_context_for_openai = dialogue_model.build_full_context_for_openailsls(previous_dialogue_id, user_id)
-            print(f"\033[1;35mbuilt full conversation context ({len(full_context_for_openai)} characters)\033[0m")
-        print(f"\n\033[1;33mstep 1: generating embedding for query...\033[0m")
-        enhanced_query = query
-        if full_context_for_openai:
-            db = client.get_database("edgeup")
-            dialogue_model = DialogueModel(db)
-            conversation_context = dialogue_model.build_conversation_context(previous_dialogue_id, user_id)
-            enhanced_query = f"{conversation_context}\n\nCurrent Question: {query}"
-            print(f"\033[1;35menhanced query with conversation context for similarity search\033[0m")
-        from embeddings import get_embeddings_direct
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise HTTPException(status_code=500, detail="openai api key not configured")
-        query_embedding = get_embeddings_direct(enhanced_query, api_key)
-        print(f"\033[1;32mquery embedding generated (dimension: {len(query_embedding)})\033[0m")
-        print(f"\n\033[1;33mstep 2: performing similarity search...\033[0m")
-        from pinecone_vectors import query_document_chunks
-        all_matches = []
-        if doc_ids_list:
-            for doc_id in doc_ids_list:
-                matches = query_document_chunks(
-                    query_embedding=query_embedding,
-                    user_id=user_id,
-                    document_id=doc_id,
-                    top_k=5
-                )
-                all_matches.extend(matches)
-        else:
-            all_matches = query_document_chunks(
-                query_embedding=query_embedding,
-                user_id=user_id,
-                document_id=None,
-                top_k=10
-            )
-        all_matches.sort(key=lambda x: x.score, reverse=True)
-        top_matches = all_matches[:8]
-        print(f"\033[1;32mfound {len(top_matches)} relevant text chunks\033[0m")
-        print(f"\n\033[1;33mstep 3: preparing context from similar chunks...\033[0m")
-        context_chunks = []
-        references = []
-        for match in top_matches:
-            chunk_text = match.metadata.get('text', '')
-            filename = match.metadata.get('filename', 'unknown')
-            page_num = match.metadata.get('page_num', 0)
-            doc_id = match.metadata.get('document_id', '')
-            context_chunks.append(f"[from {filename}, page {page_num}]: {chunk_text}")
-            references.append({
-                "text": chunk_text,
-                "filename": filename,
-                "page_num": page_num,
-                "document_id": doc_id,
-                "similarity_score": float(match.score)
-            })
-        context = "\n\n".join(context_chunks)
-        print(f"\033[1;32mprepared context from {len(references)} chunks\033[0m")
-        print(f"\n\033[1;33mstep 4: generating ai response...\033[0m")
-        system_prompt = """you are a helpful ai assistant that answers questions based on the provided document context. 
-        you must cite your sources in your response. when you reference information from the context, include the source in square brackets like [document.pdf, page x].
-        use the exact filename and page number provided in the context.
-        if the context doesn't contain enough information to answer the question fully, say so clearly.
-        your response should be well-structured and informative, with proper source citations throughout."""
-        user_prompt = f"""context from documents:
-{context}
-
-user question: {query}
-
-please provide a helpful answer based on the context above. important: you must cite your sources using the format [filename, page x] whenever you reference information from the documents."""
-        from openai import OpenAI
-        client_openai = OpenAI(api_key=api_key)
-        response = client_openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            max_tokens=1000,
-            temperature=0.7
-        )
-        ai_response = response.choices[0].message.content
-        print(f"\033[1;32mai response generated ({len(ai_response)} characters)\033[0m")
-        print(f"\n\033[1;33mstep 5: storing dialogue in mongodb...\033[0m")
-        db = client.get_database("edgeup")
-        dialogue_model = DialogueModel(db)
-        dialogue_id = dialogue_model.create_dialogue(
-            user_id=user_id,
-            query=query,
-            references=references,
-            response=ai_response,
-            document_ids=doc_ids_list,
-            previous_dialogue_id=previous_dialogue_id
-        )
-        print(f"\033[1;32mdialogue stored with id: {dialogue_id}\033[0m")
+        logger.info(f"chat query from user {user_id} over {len(doc_ids_list) if doc_ids_list else 'all'} documents")
+        logger.debug(f"query: {query[:100]}{'...' if len(query) > 100 else ''}")
+        result = run_chat(query, user_id, doc_ids_list, previous_dialogue_id, dialogue_model, chunk_model, reference_mode=reference_mode)
+        logger.debug(f"dialogue {result['dialogue_id']} answered from {len(result['references'])} chunks")
         response_data = {
             "success": True,
-            "dialogue_id": dialogue_id,
+            "dialogue_id": result["dialogue_id"],
             "query": query,
-            "response": ai_response,
-            "references": references,
-            "context_chunks_count": len(references),
+            "response": result["response"],
+            "references": result["references"],
+            "context_chunks_count": len(result["references"]),
             "searched_documents": doc_ids_list if doc_ids_list else "all_user_documents"
         }
-        response_data = convert_objectid_to_str(response_data)
-        print(f"\n\033[1;32mchat query completed successfully\033[0m\n")
-        return response_data
+        return convert_objectid_to_str(response_data)
     except Exception as e:
-        print(f"\033[1;31merror processing chat query: {str(e)}\033[0m")
+        logger.error(f"error processing chat query: {str(e)}")
         raise HTTPException(status_code=500, detail=f"error processing chat query: {str(e)}")
 
 @app.get("/user-dialogues")
-def get_user_dialogues(user_id: str = Query(...), limit: int = Query(50)):
+def get_user_dialogues(
+    user_id: str = Query(...),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None),
+    view: str = Query("summary", pattern="^(summary|full)$"),
+    dialogue_model: DialogueModel = Depends(get_dialogue_model)
+):
     try:
-        db = client.get_database("edgeup")
-        dialogue_model = DialogueModel(db)
-        dialogues = dialogue_model.get_user_dialogues(user_id, limit)
-        dialogues = convert_objectid_to_str(dialogues)
-        return {"success": True, "dialogues": dialogues}
+        if view == "summary":
+            dialogues, next_cursor = dialogue_model.list_dialogue_summaries(user_id, limit, cursor)
+        else:
+            dialogues, next_cursor = dialogue_model.get_user_dialogues(user_id, limit, cursor)
+            dialogues = convert_objectid_to_str(dialogues)
+        return {"success": True, "dialogues": dialogues, "next_cursor": next_cursor}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"error retrieving dialogues: {str(e)}")
 
+@app.get("/dialogues/{dialogue_id}")
+def get_dialogue_detail(dialogue_id: str, user_id: str = Query(...), dialogue_model: DialogueModel = Depends(get_dialogue_model)):
+    if not ObjectId.is_valid(dialogue_id):
+        raise HTTPException(status_code=404, detail="dialogue not found or access denied")
+    dialogue = dialogue_model.get_dialogue_by_id(dialogue_id, user_id)
+    if not dialogue:
+        raise HTTPException(status_code=404, detail="dialogue not found or access denied")
+    return {"success": True, "dialogue": convert_objectid_to_str(dialogue)}
+
+@app.get("/chunks")
+def get_chunks(
+    request: Request,
+    response: Response,
+    user_id: str = Query(...),
+    ids: str = Query(..., description="comma-separated chunk ids from references"),
+    hashes: Optional[str] = Query(None, description="comma-separated content_hash of the same references, in the order of ids"),
+    version: Optional[int] = Query(None, ge=0, description="index_version of the references; defaults to the active version"),
+    chunk_model: TextChunkModel = Depends(get_chunk_model)
+):
+    # text of cited chunks, for expanding lean references. ids the user cannot see, whose version was dropped, or whose text was
+    # replaced since the reference was stored (its hash no longer matches) come back as missing
+    values = [value for value in ids.split(",") if value.strip()]
+    try:
+        parsed = [parse_chunk_id(value) for value in values]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    keys = list(dict.fromkeys(parsed))
+    if not keys or len(keys) > MAX_CHUNK_IDS:
+        raise HTTPException(status_code=400, detail=f"between 1 and {MAX_CHUNK_IDS} chunk ids are allowed")
+    expected_hashes = hashes.split(",") if hashes is not None else []
+    if hashes is not None and len(expected_hashes) != len(values):
+        raise HTTPException(status_code=400, detail="hashes must list one content_hash (possibly empty) per chunk id")
+    version = index_layouts.active().version if version is None else version
+    expected = {(version, *key): value.strip() for key, value in zip(parsed, expected_hashes) if value.strip()}
+    try:
+        found = chunk_texts([(version, document_id, chunk_index) for document_id, chunk_index in keys], user_id, chunk_model, expected)
+    except Exception as e:
+        logger.error(f"error loading chunks: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"error loading chunks: {str(e)}")
+    chunks, missing = [], []
+    for document_id, chunk_index in keys:
+        chunk = found.get((version, document_id, chunk_index))
+        if chunk is None:
+            missing.append(chunk_id(document_id, chunk_index))
+            continue
+        chunks.append({
+            "chunk_id": chunk_id(document_id, chunk_index), "document_id": document_id, "chunk_index": chunk_index, "index_version": version,
+            "filename": chunk["filename"], "page_num": chunk["page_num"], "text": chunk["text"]
+        })
+    etag = compute_chunks_etag(chunks, missing)
+    headers = {"ETag": etag, "Cache-Control": f"private, max-age={CHUNKS_CACHE_MAX_AGE}"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return {"success": True, "chunks": chunks, "missing": missing}
+
 @app.post("/chat-query-json")
-async def chat_query_json(request: ChatQueryRequest):
+def chat_query_json(request: ChatQueryRequest, dialogue_model: DialogueModel = Depends(get_dialogue_model),
+                    chunk_model: TextChunkModel = Depends(get_chunk_model)):
+    if request.previous_dialogue_id and not ObjectId.is_valid(request.previous_dialogue_id):
+        raise HTTPException(status_code=400, detail="invalid previous_dialogue_id")
     try:
-        query = request.query
-        user_id = request.user_id
         doc_ids_list = request.document_ids or []
-        previous_dialogue_id = request.previous_dialogue_id
-        print(f"\n\033[1;34mchat query (json): {query[:100]}{'...' if len(query) > 100 else ''}\033[0m")
-        print(f"\033[1;34muser id: {user_id}\033[0m")
-        if doc_ids_list:
-            print(f"\033[1;34msearching in documents: {doc_ids_list}\033[0m")
-        else:
-            print(f"\033[1;34msearching in all user documents\033[0m")
-        conversation_context = ""
-        if previous_dialogue_id:
-            print(f"\033[1;35mfollow-up question detected. previous dialogue id: {previous_dialogue_id}\033[0m")
-            db = client.get_database("edgeup")
-            dialogue_model = DialogueModel(db)
-            conversation_context = dialogue_model.build_conversation_context(previous_dialogue_id, user_id)
-            print(f"\033[1;35mbuilt conversation context ({len(conversation_context)} characters)\033[0m")
-        print(f"\n\033[1;33mstep 1: generating embedding for query...\033[0m")
-        enhanced_query = query
-        if conversation_context:
-            enhanced_query = f"{conversation_context}\n\nCurrent Question: {query}"
-            print(f"\033[1;35menhanced query with conversation context for similarity search\033[0m")
-        from embeddings import get_embeddings_direct
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise HTTPException(status_code=500, detail="openai api key not configured")
-        query_embedding = get_embeddings_direct(enhanced_query, api_key)
-        print(f"\033[1;32mquery embedding generated (dimension: {len(query_embedding)})\033[0m")
-        print(f"\n\033[1;33mstep 2: performing similarity search...\033[0m")
-        from pinecone_vectors import query_document_chunks
-        all_matches = []
-        if doc_ids_list:
-            for doc_id in doc_ids_list:
-                matches = query_document_chunks(
-                    query_embedding=query_embedding,
-                    user_id=user_id,
-                    document_id=doc_id,
-                    top_k=5
-                )
-                all_matches.extend(matches)
-        else:
-            all_matches = query_document_chunks(
-                query_embedding=query_embedding,
-                user_id=user_id,
-                document_id=None,
-                top_k=10
-            )
-        all_matches.sort(key=lambda x: x.score, reverse=True)
-        top_matches = all_matches[:8]
-        print(f"\033[1;32mfound {len(top_matches)} relevant text chunks\033[0m")
-        if not top_matches:
-            return {
-                "success": True,
-                "dialogue_id": None,
-                "query": query,
-                "response": "i couldn't find any relevant information in your uploaded documents to answer this question. please make sure you have uploaded documents that contain information related to your query.",
-                "references": [],
-                "context_chunks_count": 0,
-                "searched_documents": doc_ids_list if doc_ids_list else []
-            }
-        print(f"\n\033[1;33mstep 3: preparing context from similar chunks...\033[0m")
-        context_chunks = []
-        references = []
-        for match in top_matches:
-            chunk_text = match.metadata.get('text', '')
-            filename = match.metadata.get('filename', 'unknown')
-            page_num = match.metadata.get('page_num', 0)
-            doc_id = match.metadata.get('document_id', '')
-            context_chunks.append(f"[from {filename}, page {page_num}]: {chunk_text}")
-            references.append({
-                "text": chunk_text,
-                "filename": filename,
-                "page_num": page_num,
-                "document_id": doc_id,
-                "similarity_score": float(match.score)
-            })
-        context = "\n\n".join(context_chunks)
-        print(f"\033[1;32mprepared context from {len(references)} chunks\033[0m")
-        print(f"\n\033[1;33mstep 4: generating ai response...\033[0m")
-        system_prompt = """you are a helpful ai assistant that answers questions based on the provided document context. 
-        you must cite your sources in your response. when you reference information from the context, include the source in square brackets like [document.pdf, page x].
-        use the exact filename and page number provided in the context.
-        if the context doesn't contain enough information to answer the question fully, say so clearly.
-        your response should be well-structured and informative, with proper source citations throughout."""
-        user_prompt = f"""context from documents:
-{context}
-
-user question: {query}
-
-please provide a helpful answer based on the context above. important: you must cite your sources using the format [filename, page x] whenever you reference information from the documents."""
-        from openai import OpenAI
-        client_openai = OpenAI(api_key=api_key)
-        response = client_openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            max_tokens=1000,
-            temperature=0.7
-        )
-        ai_response = response.choices[0].message.content
-        print(f"\033[1;32mai response generated ({len(ai_response)} characters)\033[0m")
-        print(f"\n\033[1;33mstep 5: storing dialogue in mongodb...\033[0m")
-        db = client.get_database("edgeup")
-        dialogue_model = DialogueModel(db)
-        dialogue_id = dialogue_model.create_dialogue(
-            user_id=user_id,
-            query=query,
-            references=references,
-            response=ai_response,
-            document_ids=doc_ids_list,
-            previous_dialogue_id=previous_dialogue_id
-        )
-        print(f"\033[1;32mdialogue stored with id: {dialogue_id}\033[0m")
+        logger.info(f"chat query (json) from user {request.user_id} over {len(doc_ids_list) if doc_ids_list else 'all'} documents")
+        logger.debug(f"query: {request.query[:100]}{'...' if len(request.query) > 100 else ''}")
+        result = run_chat(request.query, request.user_id, doc_ids_list, request.previous_dialogue_id, dialogue_model, chunk_model,
+                          require_matches=True, reference_mode=request.reference_mode)
+        logger.debug(f"dialogue {result['dialogue_id']} answered from {len(result['references'])} chunks")
         response_data = {
             "success": True,
-            "dialogue_id": dialogue_id,
-            "query": query,
-            "response": ai_response,
-            "references": references,
-            "context_chunks_count": len(references),
-            "searched_documents": doc_ids_list if doc_ids_list else []
+            "dialogue_id": result["dialogue_id"],
+            "query": request.query,
+            "response": result["response"],
+            "references": result["references"],
+            "context_chunks_count": len(result["references"]),
+            "searched_documents": doc_ids_list
         }
-        response_data = convert_objectid_to_str(response_data)
-        print(f"\n\033[1;32mchat query completed successfully\033[0m\n")
-        return response_data
+        return convert_objectid_to_str(response_data)
     except Exception as e:
-        print(f"\033[1;31merror processing chat query: {str(e)}\033[0m")
+        logger.error(f"error processing chat query: {str(e)}")
         raise HTTPException(status_code=500, detail=f"error processing chat query: {str(e)}")
 
+@app.post("/chat-batch")
+def chat_batch(request: BatchChatRequest, chunk_model: TextChunkModel = Depends(get_chunk_model)):
+    # answers stream back as ndjson in the order they finish, each tagged with its question's index, followed by a summary line
+    questions = [question for question in request.questions if question.strip()]
+    if not questions:
+        raise HTTPException(status_code=400, detail="no questions given")
+    if len(questions) > MAX_BATCH_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"at most {MAX_BATCH_QUESTIONS} questions per batch")
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise HTTPException(status_code=500, detail="openai api key not configured")
+    doc_ids_list = request.document_ids or []
+    logger.info(f"chat batch of {len(questions)} questions from user {request.user_id} over {len(doc_ids_list) if doc_ids_list else 'all'} documents")
+    try:
+        prepared = prepare_batch(questions, request.user_id, doc_ids_list, chunk_model, api_key, reference_mode=request.reference_mode)
+    except Exception as e:
+        logger.error(f"error preparing chat batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"error preparing chat batch: {str(e)}")
+    batch_id = uuid.uuid4().hex
+    return StreamingResponse(
+        stream_batch(prepared, request.user_id, request.report, batch_id),
+        media_type="application/x-ndjson",
+        headers={"X-Batch-Id": batch_id}
+    )
+
+@app.get("/chat-batch/{batch_id}/report")
+def get_chat_batch_report(batch_id: str, user_id: str = Query(...)):
+    report = read_report(batch_id, user_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="report not found or access denied")
+    return PlainTextResponse(report, media_type="application/x-ndjson")
+
 @app.post("/test-image-ocr")
-async def test_image_ocr(file: UploadFile = File(...)):
+def test_image_ocr(file: UploadFile = File(...)):
     file_extension = file.filename.lower().split('.')[-1] if '.' in file.filename else ''
     supported_image = file_extension in ['jpg', 'jpeg', 'png', 'gif', 'bmp', 'tiff', 'webp']
     if not supported_image:
@@ -547,9 +756,9 @@ async def test_image_ocr(file: UploadFile = File(...)):
         temp_file_path = temp_file.name
         shutil.copyfileobj(file.file, temp_file)
     try:
-        print(f"\n\033[1;34mtesting ocr on image: {file.filename}\033[0m\n")
+        logger.info(f"testing ocr on image: {file.filename}")
         extracted_text = extract_text_from_image_as_pages(temp_file_path)
-        print(f"\033[1;32msuccessfully extracted text from {file.filename}\033[0m")
+        logger.info(f"successfully extracted text from {file.filename}")
         return {
             "success": True,
             "filename": file.filename,
@@ -558,13 +767,14 @@ async def test_image_ocr(file: UploadFile = File(...)):
             "file_type": "image"
         }
     except Exception as e:
-        print(f"\033[1;31merror processing image {file.filename}: {str(e)}\033[0m")
+        logger.error(f"error processing image {file.filename}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"error processing image {file.filename}: {str(e)}")
     finally:
         if os.path.exists(temp_file_path):
             os.remove(temp_file_path)
 
+warmup.record_import(_import_started, time.perf_counter())
+
 if __name__ == "__main__":
-    print("\n\033[1;32mstarting fastapi server on http://0.0.0.0:8000\033[0m")
-    print("\033[1;32mcheck the console for embedding details when files are processed\033[0m\n")
+    logger.info("starting fastapi server on http://0.0.0.0:8000")
     uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=True, log_level="error")
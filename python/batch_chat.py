@@ -0,0 +1,164 @@
+# many questions against one document set in a single request. the questions are embedded in one call and searched together,
+# chunk text is hydrated once for the whole batch, questions that select the same chunks share one packed context, and
+# completions run with bounded concurrency so results can be streamed back as they finish.
+import json
+import logging
+import os
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional
+
+from chat_pipeline import generate_answer, to_references, NO_MATCHES_RESPONSE
+from context_packing import pack_context
+from index_versions import current_layout
+from metrics import registry, stage
+from openai_limiter import BULK
+from retrieval import hydrate, rerank, retrieval_plan, search
+from usage_ledger import current_scope, usage_scope
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_QUESTIONS = int(os.getenv("MAX_BATCH_QUESTIONS", "200"))
+# completions in flight for one batch; they go through the shared limiter at bulk priority so interactive chat keeps precedence
+BATCH_CHAT_CONCURRENCY = int(os.getenv("BATCH_CHAT_CONCURRENCY", "4"))
+BATCH_RETRIEVAL_CONCURRENCY = int(os.getenv("BATCH_RETRIEVAL_CONCURRENCY", "8"))
+CHAT_REPORT_DIR = os.getenv("CHAT_REPORT_DIR", os.path.join("uploads", "chat-reports"))
+
+batch_questions = registry.counter("edgeup_chat_batch_questions_total", "questions answered through /chat-batch", ("outcome",))
+batch_shared = registry.counter("edgeup_chat_batch_shared_total", "work skipped in /chat-batch because another question in the batch already did it", ("kind",))
+
+def normalize_question(question: str) -> str:
+    return re.sub(r"\s+", " ", question).strip().lower()
+
+def prepare_batch(questions: List[str], user_id: str, document_ids: Optional[List[str]], chunk_model, api_key: str, limit: int = 8,
+                  reference_mode: Optional[str] = None) -> Dict[str, Any]:
+    # embed, search, rerank, hydrate and pack for every distinct question. returns the distinct questions with their packed
+    # context and, for each submitted question, the position of its distinct question.
+    from embeddings import get_embeddings_batch
+    distinct: Dict[str, int] = {}
+    positions = [distinct.setdefault(normalize_question(question), len(distinct)) for question in questions]
+    unique = [None] * len(distinct)
+    for question, position in zip(questions, positions):
+        unique[position] = unique[position] or question
+    if len(unique) < len(questions):
+        batch_shared.inc(len(questions) - len(unique), kind="question")
+    pool_size, relevance_weight, diversify = retrieval_plan(limit)
+    layout = current_layout()
+    with stage("chat_batch.query_embedding"), usage_scope(user_id=user_id):
+        embeddings = get_embeddings_batch(unique, api_key, model=layout.embedding_model, priority=BULK)
+    with stage("chat_batch.retrieval"):
+        with ThreadPoolExecutor(max_workers=BATCH_RETRIEVAL_CONCURRENCY, thread_name_prefix="chat-batch-search") as executor:
+            searches = list(executor.map(lambda embedding: search(embedding, user_id, document_ids, pool_size, diversify, layout=layout), embeddings))
+    with stage("chat_batch.rerank"):
+        selections = []
+        for candidates, embedding in zip(searches, embeddings):
+            selected = rerank(candidates, embedding, limit, relevance_weight)
+            for candidate in selected:
+                candidate.pop("values", None)
+            selections.append(selected)
+    with stage("chat_batch.hydrate"):
+        # each chunk once for the whole batch; scores stay per question, so the text is copied onto every selection
+        shared = {}
+        for selected in selections:
+            for candidate in selected:
+                shared.setdefault(candidate["vector_id"], dict(candidate))
+        hydrate(list(shared.values()), user_id, chunk_model)
+        for selected in selections:
+            for candidate in selected:
+                stored = shared[candidate["vector_id"]]
+                candidate.update(text=stored["text"], filename=stored["filename"], page_num=stored["page_num"])
+        selected_total = sum(len(selected) for selected in selections)
+        if selected_total > len(shared):
+            batch_shared.inc(selected_total - len(shared), kind="chunk")
+    with stage("chat_batch.context_packing"):
+        packed_by_chunks: Dict[tuple, Dict[str, Any]] = {}
+        contexts = []
+        for selected in selections:
+            key = tuple(sorted(candidate["vector_id"] for candidate in selected))
+            if key in packed_by_chunks:
+                batch_shared.inc(kind="context")
+                packed = dict(packed_by_chunks[key])
+                # same chunks and text, but the references carry this question's scores
+                by_id = {candidate["vector_id"]: candidate for candidate in selected}
+                packed["candidates"] = [by_id[candidate["vector_id"]] for candidate in packed["candidates"]]
+            else:
+                packed = packed_by_chunks[key] = pack_context(selected)
+            contexts.append(packed)
+    return {"questions": unique, "contexts": contexts, "positions": positions, "index_version": layout.version, "reference_mode": reference_mode,
+            "usage_scope": {**current_scope(), "user_id": user_id}}
+
+def answer_batch(prepared: Dict[str, Any], concurrency: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    # one result per submitted question, in the order the completions finish. a failed completion is reported in its result
+    # rather than ending the batch.
+    concurrency = concurrency or BATCH_CHAT_CONCURRENCY
+    waiting: Dict[int, List[int]] = {}
+    for index, position in enumerate(prepared["positions"]):
+        waiting.setdefault(position, []).append(index)
+
+    def answer(position: int) -> Dict[str, Any]:
+        packed = prepared["contexts"][position]
+        if not packed["candidates"]:
+            return {"response": NO_MATCHES_RESPONSE, "references": []}
+        started = time.perf_counter()
+        # completions run on pool threads that do not inherit the request context
+        with usage_scope(**prepared.get("usage_scope", {})):
+            response = generate_answer(packed["text"], prepared["questions"][position], priority=BULK)
+        references = to_references(packed["candidates"], prepared.get("reference_mode"), prepared.get("index_version", 0))
+        return {"response": response, "references": references, "llm_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="chat-batch-llm") as executor:
+        futures = {executor.submit(answer, position): position for position in waiting}
+        for future in as_completed(futures):
+            position = futures[future]
+            try:
+                outcome = {"success": True, **future.result()}
+            except Exception as e:
+                logger.error(f"batch question {position} failed: {str(e)}")
+                outcome = {"success": False, "error": str(e)}
+            batch_questions.inc(len(waiting[position]), outcome="answered" if outcome["success"] else "failed")
+            for index in waiting[position]:
+                yield {"index": index, "question": prepared["questions"][position], **outcome}
+
+def report_path(batch_id: str) -> str:
+    return os.path.join(CHAT_REPORT_DIR, f"{batch_id}.jsonl")
+
+def stream_batch(prepared: Dict[str, Any], user_id: str, write_report: bool, batch_id: Optional[str] = None) -> Iterator[str]:
+    # ndjson lines: one per question as it finishes, then a summary. with write_report the same lines go to a jsonl report
+    # whose first line records the owner.
+    batch_id = batch_id or uuid.uuid4().hex
+    report = None
+    if write_report:
+        os.makedirs(CHAT_REPORT_DIR, exist_ok=True)
+        report = open(report_path(batch_id), "w", encoding="utf-8")
+        report.write(json.dumps({"batch_id": batch_id, "user_id": user_id, "questions": len(prepared["positions"])}) + "\n")
+    failed = 0
+    try:
+        for result in answer_batch(prepared):
+            failed += not result["success"]
+            line = json.dumps(result, default=str) + "\n"
+            if report:
+                report.write(line)
+                report.flush()
+            yield line
+        summary = {"done": True, "batch_id": batch_id, "answered": len(prepared["positions"]) - failed, "failed": failed, "report": bool(report)}
+        if report:
+            report.write(json.dumps(summary) + "\n")
+        yield json.dumps(summary) + "\n"
+    finally:
+        if report:
+            report.close()
+
+def read_report(batch_id: str, user_id: str) -> Optional[str]:
+    # a finished or in-progress report, or None when it does not exist or belongs to someone else
+    if not re.fullmatch(r"[0-9a-f]{32}", batch_id):
+        return None
+    try:
+        with open(report_path(batch_id), encoding="utf-8") as f:
+            header = f.readline()
+            if not header or json.loads(header).get("user_id") != user_id:
+                return None
+            return header + f.read()
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,85 @@
+# regenerates the checked-in benchmark fixtures. the output is deterministic, so re-running it should leave git clean.
+import os
+import random
+from PIL import Image, ImageDraw
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+WORDS = (
+    "agreement party shall term payment notice section clause liability warranty service data "
+    "customer provider obligation confidential information period renewal invoice fee law court "
+    "system report figure table revenue quarter growth risk control policy process review audit"
+).split()
+
+def _sentences(rng, count):
+    for _ in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(8, 18))]
+        yield " ".join(words).capitalize() + "."
+
+def _page_lines(rng, line_count=48, width=95):
+    text = " ".join(_sentences(rng, 40))
+    lines, current = [], ""
+    for word in text.split():
+        if len(current) + len(word) + 1 > width:
+            lines.append(current)
+            current = word
+        else:
+            current = f"{current} {word}".strip()
+        if len(lines) == line_count:
+            break
+    return lines
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def write_pdf(path, page_count, seed):
+    # minimal hand-written pdf: one helvetica content stream per page, no compression
+    rng = random.Random(seed)
+    objects = [None, None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page_num in range(page_count):
+        lines = _page_lines(rng)
+        lines[0] = f"Page {page_num + 1} - Confidential - Example Corp"
+        stream = "BT /F1 10 Tf 12 TL 50 780 Td " + " ".join(f"({_escape(line)}) '" for line in lines) + " ET"
+        stream_bytes = stream.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream_bytes) + stream_bytes + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[1] = b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % i for i in page_ids) + b"] /Count %d >>" % page_count
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    with open(path, "wb") as f:
+        f.write(bytes(out))
+
+def write_image(path, size, seed):
+    # a scanned-page lookalike: dark text lines on an off-white page
+    rng = random.Random(seed)
+    image = Image.new("RGB", size, (250, 249, 245))
+    draw = ImageDraw.Draw(image)
+    y = 20
+    for line in _page_lines(rng, line_count=size[1] // 16, width=size[0] // 7):
+        draw.text((20, y), line, fill=(20, 20, 20))
+        y += 16
+    image.save(path, **({"quality": 60} if path.endswith(".jpg") else {}))
+
+def main():
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    write_pdf(os.path.join(FIXTURES_DIR, "contract_8p.pdf"), 8, seed=1)
+    write_pdf(os.path.join(FIXTURES_DIR, "manual_40p.pdf"), 40, seed=2)
+    write_image(os.path.join(FIXTURES_DIR, "scan_page.png"), (850, 1100), seed=3)
+    write_image(os.path.join(FIXTURES_DIR, "receipt.jpg"), (600, 900), seed=4)
+
+if __name__ == "__main__":
+    main()
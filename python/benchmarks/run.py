@@ -0,0 +1,267 @@
+# cpu hot-path microbenchmarks. run from the python/ directory:
+#   python -m benchmarks.run                      # run everything, compare against benchmarks/baseline.json
+#   python -m benchmarks.run --quick --filter pdf # shorter run of a subset
+#   python -m benchmarks.run --update-baseline    # record the current numbers as the new baseline
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(BENCH_DIR, "fixtures")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+CASES = []
+
+class SkipCase(Exception):
+    pass
+
+def case(name, unit):
+    # register a benchmark. the decorated function does any setup and returns (callable, units handled per call).
+    def register(setup):
+        CASES.append((name, unit, setup))
+        return setup
+    return register
+
+def fixture(name):
+    return os.path.join(FIXTURES_DIR, name)
+
+# cases
+
+@case("pdf_extract_contract_8p", "pages")
+def bench_pdf_extract_small():
+    from text_extractor import extract_text_from_pdf
+    path = fixture("contract_8p.pdf")
+    return (lambda: extract_text_from_pdf(path)), 8
+
+@case("pdf_extract_manual_40p", "pages")
+def bench_pdf_extract_large():
+    from text_extractor import extract_text_from_pdf
+    path = fixture("manual_40p.pdf")
+    return (lambda: extract_text_from_pdf(path)), 40
+
+@case("chunk_pages_manual_40p", "chunks")
+def bench_chunk_pages():
+    from text_extractor import extract_text_from_pdf
+    from doc_chunks import chunk_pages
+    pages = extract_text_from_pdf(fixture("manual_40p.pdf"))
+    try:
+        chunks = chunk_pages(pages, max_tokens=500, overlap=50)
+    except Exception as e:
+        raise SkipCase(f"tokenizer unavailable: {e.__class__.__name__}")
+    return (lambda: chunk_pages(pages, max_tokens=500, overlap=50)), len(chunks)
+
+def _fake_chunk_text(seed, words=380):
+    vocabulary = "the agreement shall remain in force until terminated by either party with written notice".split()
+    return " ".join(vocabulary[(seed + i) % len(vocabulary)] for i in range(words))
+
+def _chat_response(reference_count=8):
+    from bson import ObjectId
+    return {
+        "success": True,
+        "dialogue_id": ObjectId(),
+        "query": "what are the termination conditions?",
+        "response": _fake_chunk_text(7, 250),
+        "references": [
+            {
+                "text": _fake_chunk_text(i),
+                "filename": f"contract_{i % 3}.pdf",
+                "page_num": i + 1,
+                "document_id": f"doc-{i % 3}",
+                "similarity_score": 0.9 - i * 0.01,
+                "_id": ObjectId()
+            }
+            for i in range(reference_count)
+        ],
+        "context_chunks_count": reference_count,
+        "searched_documents": ["doc-0", "doc-1", "doc-2"]
+    }
+
+@case("serialize_chat_response", "responses")
+def bench_serialize_chat_response():
+    from serialization import convert_objectid_to_str
+    response = _chat_response()
+    return (lambda: convert_objectid_to_str(response)), 1
+
+@case("serialize_dialogue_listing_50", "dialogues")
+def bench_serialize_dialogue_listing():
+    from serialization import convert_objectid_to_str
+    dialogues = [_chat_response() for _ in range(50)]
+    return (lambda: convert_objectid_to_str(dialogues)), 50
+
+@case("build_conversation_context_10_turns", "turns")
+def bench_conversation_context():
+    from dialogue_model import format_conversation_context
+    history = [_chat_response() for _ in range(10)]
+    return (lambda: format_conversation_context(history)), 10
+
+@case("build_chunk_documents_900", "chunks")
+def bench_build_chunk_documents():
+    import random
+    from text_chunk_model import build_chunk_documents
+    rng = random.Random(0)
+    embedding = [rng.uniform(-0.05, 0.05) for _ in range(3072)]
+    chunks = [{"text": _fake_chunk_text(i), "metadata": {"page": i // 2 + 1}, "embedding": embedding} for i in range(900)]
+    return (lambda: build_chunk_documents(chunks, "doc-1", "user-1", "manual.pdf")), 900
+
+@case("mmr_rerank_24_of_3072d", "candidates")
+def bench_mmr_rerank():
+    import numpy as np
+    from reranking import mmr_select
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(24, 3072)).astype(np.float32).tolist()
+    query = rng.normal(size=3072).tolist()
+    return (lambda: mmr_select(query, embeddings, 8, 0.7)), 24
+
+@case("image_encode_validate_2", "images")
+def bench_image_encode():
+    from image_extractor import encode_image, validate_image
+    paths = [fixture("scan_page.png"), fixture("receipt.jpg")]
+    def run():
+        for path in paths:
+            validate_image(path)
+            encode_image(path)
+    return run, len(paths)
+
+# runner
+
+def measure(fn, min_time, max_iterations):
+    fn()
+    gc.collect()
+    times = []
+    while len(times) < max_iterations and (len(times) < 3 or sum(times) < min_time):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return times, peak
+
+def run_cases(name_filter=None, quick=False):
+    results = {}
+    min_time = 0.2 if quick else 1.0
+    max_iterations = 50 if quick else 1000
+    for name, unit, setup in CASES:
+        if name_filter and name_filter not in name:
+            continue
+        try:
+            fn, units = setup()
+        except SkipCase as e:
+            results[name] = {"status": "skipped", "reason": str(e)}
+            continue
+        times, peak = measure(fn, min_time, max_iterations)
+        mean = statistics.fmean(times)
+        ordered = sorted(times)
+        results[name] = {
+            "status": "ok",
+            "unit": unit,
+            "iterations": len(times),
+            "mean_ms": round(mean * 1000, 4),
+            "median_ms": round(statistics.median(times) * 1000, 4),
+            "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 4),
+            "ops_per_sec": round(1.0 / mean, 3),
+            "units_per_sec": round(units / mean, 3),
+            "peak_alloc_bytes": peak
+        }
+    return results
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def compare(results, baseline, threshold):
+    # per-case throughput and allocation deltas against the baseline. a case regresses when throughput drops, or peak allocation grows, by more than threshold.
+    rows = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if current.get("status") != "ok" or not base or base.get("status") != "ok":
+            rows.append({"name": name, "status": current.get("status") if current.get("status") != "ok" else "new"})
+            continue
+        throughput_delta = current["units_per_sec"] / base["units_per_sec"] - 1.0 if base["units_per_sec"] else 0.0
+        alloc_delta = current["peak_alloc_bytes"] / base["peak_alloc_bytes"] - 1.0 if base["peak_alloc_bytes"] else 0.0
+        regressed = throughput_delta < -threshold or alloc_delta > threshold
+        rows.append({
+            "name": name,
+            "status": "regressed" if regressed else "ok",
+            "throughput_delta": round(throughput_delta, 4),
+            "alloc_delta": round(alloc_delta, 4)
+        })
+    return rows
+
+def missing_from_baseline(baseline, name_filter=None):
+    # cases the suite defines that the baseline has no numbers for, so a regression in them would go unnoticed
+    return [name for name, _, _ in CASES if (not name_filter or name_filter in name) and (baseline.get(name) or {}).get("status") != "ok"]
+
+def print_report(results, rows):
+    by_name = {row["name"]: row for row in rows}
+    print(f"{'case':42} {'median ms':>11} {'units/s':>12} {'peak KiB':>10} {'Δ thrpt':>9} {'Δ alloc':>9}  status")
+    for name, result in results.items():
+        row = by_name.get(name, {})
+        if result.get("status") != "ok":
+            print(f"{name:42} {'-':>11} {'-':>12} {'-':>10} {'-':>9} {'-':>9}  {result['status']}: {result.get('reason', '')}")
+            continue
+        throughput = f"{row['throughput_delta']:+.1%}" if "throughput_delta" in row else "-"
+        alloc = f"{row['alloc_delta']:+.1%}" if "alloc_delta" in row else "-"
+        print(f"{name:42} {result['median_ms']:>11.3f} {result['units_per_sec']:>12.1f} {result['peak_alloc_bytes'] / 1024:>10.1f} {throughput:>9} {alloc:>9}  {row.get('status', 'new')}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="cpu hot-path microbenchmarks")
+    parser.add_argument("--quick", action="store_true", help="shorter timing loops")
+    parser.add_argument("--filter", help="only run cases whose name contains this string")
+    parser.add_argument("--output", "-o", help="write machine-readable results to this json file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline json to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.15, help="relative change that counts as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit non-zero when a case regresses")
+    args = parser.parse_args(argv)
+
+    results = run_cases(args.filter, args.quick)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get("results", {})
+    rows = compare(results, baseline, args.threshold)
+    print_report(results, rows)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": args.quick
+        },
+        "results": results,
+        "comparison": rows
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.update_baseline:
+        baseline = dict(baseline)
+        baseline.update({name: result for name, result in results.items() if result.get("status") == "ok"})
+        with open(args.baseline, "w") as f:
+            json.dump({"meta": report["meta"], "results": baseline}, f, indent=2)
+            f.write("\n")
+    missing = missing_from_baseline(baseline, args.filter)
+    if missing:
+        print(f"warning: {args.baseline} has no numbers for {', '.join(missing)}; record them with --update-baseline where the cases run",
+              file=sys.stderr)
+    if args.fail_on_regression and (missing or any(row["status"] == "regressed" for row in rows)):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+# cold-start numbers for the api: import time (with an import-time profile), and, against the load-testing stand-ins,
+# time until /ready reports warm plus the latency of the first and of later requests. run from the python/ directory:
+#   python -m benchmarks.startup                                   # import time and the slowest imports
+#   python -m benchmarks.startup --mongo-uri mongodb://127.0.0.1:27017 -o startup.json
+#   python -m benchmarks.startup --update-baseline                 # record the current numbers in benchmarks/startup_baseline.json
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+
+from benchmarks.run import _git_commit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PYTHON_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "startup_baseline.json")
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def _env(extra=None):
+    env = dict(os.environ)
+    # pinecone_vectors refuses to import without a key; nothing here talks to pinecone unless the stack is started
+    env.setdefault("PINECONE_API_KEY", "startup-benchmark")
+    env.update(extra or {})
+    return env
+
+def parse_importtime(stderr: str, top: int = 15):
+    # -X importtime output -> the modules with the largest cumulative import time, in seconds
+    rows = []
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append({"module": module, "self_seconds": int(self_us) / 1e6, "cumulative_seconds": int(cumulative_us) / 1e6, "depth": len(indent) // 2})
+    rows.sort(key=lambda row: row["cumulative_seconds"], reverse=True)
+    return rows[:top]
+
+def measure_import(module: str = "api", repeat: int = 5):
+    # each sample is a fresh interpreter so nothing is cached in sys.modules
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", code], cwd=PYTHON_DIR, env=_env(), capture_output=True, text=True, check=True).stdout
+        samples.append(float(output.strip().splitlines()[-1]))
+    profile = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=PYTHON_DIR, env=_env(), capture_output=True, text=True, check=True)
+    return samples, parse_importtime(profile.stderr)
+
+def _get(url: str, timeout: float = 30.0):
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+def _post_json(url: str, body: dict, timeout: float = 120.0):
+    request = urllib.request.Request(url, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+def measure_stack(mongo_uri: str, api_port: int, openai_port: int, pinecone_port: int, warm_requests: int = 5, timeout: float = 120.0):
+    # start the stand-ins, then the api, and time it from process start to ready and through its first chat requests
+    from loadtest.stack import uvicorn, wait_for
+    processes = []
+    try:
+        fake_env = _env({"FAKE_OPENAI_LATENCY_MS": "0", "FAKE_PINECONE_LATENCY_MS": "0"})
+        processes.append(uvicorn("loadtest.fake_openai:app", openai_port, fake_env))
+        processes.append(uvicorn("loadtest.fake_pinecone:app", pinecone_port, fake_env))
+        wait_for(f"http://127.0.0.1:{openai_port}/v1/models")
+        wait_for(f"http://127.0.0.1:{pinecone_port}/indexes")
+        api_env = _env({
+            "OPENAI_API_KEY": "sk-startup",
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+            "PINECONE_API_KEY": "startup",
+            "PINECONE_CONTROLLER_HOST": f"http://127.0.0.1:{pinecone_port}",
+            "MONGO_CONNECTION_STRING": mongo_uri,
+            "MONGO_DB_NAME": os.getenv("MONGO_DB_NAME", "edgeup_startup_benchmark"),
+            "WARMUP_RETRY_SECONDS": "0.5"
+        })
+        started = time.perf_counter()
+        processes.append(uvicorn("api:app", api_port, api_env))
+        base_url = f"http://127.0.0.1:{api_port}"
+        listening = None
+        while time.perf_counter() - started < timeout:
+            try:
+                status, body = _get(f"{base_url}/ready", timeout=1)
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.05)
+                continue
+            listening = listening or time.perf_counter() - started
+            if status == 200:
+                break
+            time.sleep(0.05)
+        else:
+            raise RuntimeError(f"api did not report ready within {timeout}s")
+        ready = time.perf_counter() - started
+        report = json.loads(body)
+        chat = {"query": "what are the payment terms?", "user_id": "startup-benchmark-user"}
+        latencies = []
+        for _ in range(warm_requests + 1):
+            request_started = time.perf_counter()
+            _post_json(f"{base_url}/chat-query-json", chat)
+            latencies.append(time.perf_counter() - request_started)
+        return {
+            "listening_seconds": round(listening, 4),
+            "ready_seconds": round(ready, 4),
+            "first_request_ms": round(latencies[0] * 1000, 2),
+            "warm_request_ms": round(statistics.median(latencies[1:]) * 1000, 2),
+            "warmup_steps": {name: step["seconds"] for name, step in report["steps"].items()}
+        }
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+def compare(results, baseline, threshold):
+    # every number here is a duration, so a case regresses when it grows by more than threshold
+    rows = []
+    for name, value in results.items():
+        base = baseline.get(name)
+        if not isinstance(value, (int, float)) or not base:
+            rows.append({"name": name, "status": "new"})
+            continue
+        delta = value / base - 1.0
+        rows.append({"name": name, "status": "regressed" if delta > threshold else "ok", "delta": round(delta, 4)})
+    return rows
+
+def print_report(results, rows, profile):
+    print(f"{'slowest imports':48} {'cumulative s':>12} {'self s':>9}")
+    for row in profile:
+        print(f"{'  ' * row['depth'] + row['module']:48} {row['cumulative_seconds']:>12.3f} {row['self_seconds']:>9.3f}")
+    print()
+    by_name = {row["name"]: row for row in rows}
+    print(f"{'measure':32} {'value':>12} {'Δ':>9}  status")
+    for name, value in results.items():
+        row = by_name.get(name, {})
+        delta = f"{row['delta']:+.1%}" if "delta" in row else "-"
+        print(f"{name:32} {value:>12.4f} {delta:>9}  {row.get('status', 'new')}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="api startup and first-request benchmarks")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters to time the import in")
+    parser.add_argument("--top", type=int, default=15, help="imports to list in the profile")
+    parser.add_argument("--mongo-uri", help="also start the api against the load-testing stand-ins and this mongo, and time readiness and first requests")
+    parser.add_argument("--api-port", type=int, default=8200)
+    parser.add_argument("--openai-port", type=int, default=8201)
+    parser.add_argument("--pinecone-port", type=int, default=8202)
+    parser.add_argument("--output", "-o", help="write machine-readable results to this json file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline json to compare against")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="relative growth that counts as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit non-zero when a measure regresses")
+    args = parser.parse_args(argv)
+
+    samples, profile = measure_import(repeat=args.repeat)
+    results = {"import_api_seconds": round(statistics.median(samples), 4)}
+    steps = {}
+    if args.mongo_uri:
+        stack = measure_stack(args.mongo_uri, args.api_port, args.openai_port, args.pinecone_port)
+        steps = stack.pop("warmup_steps")
+        results.update(stack)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f).get("results", {})
+    rows = compare(results, baseline, args.threshold)
+    print_report(results, rows, profile)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform()
+        },
+        "results": results,
+        "warmup_steps": steps,
+        "import_profile": profile,
+        "comparison": rows
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.update_baseline:
+        merged = dict(baseline)
+        merged.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump({"meta": report["meta"], "results": merged}, f, indent=2)
+            f.write("\n")
+    if args.fail_on_regression and any(row["status"] == "regressed" for row in rows):
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+class GroupedTTLCache:
+    # small in-process cache whose entries expire after ttl seconds and can be dropped a whole group at a time (e.g. everything cached for one user)
+    def __init__(self, ttl_seconds: float = 30.0, max_groups: int = 1024, max_entries_per_group: int = 32):
+        self.ttl_seconds = ttl_seconds
+        self.max_groups = max_groups
+        self.max_entries_per_group = max_entries_per_group
+        self._groups: "OrderedDict[Hashable, OrderedDict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, group: Hashable, key: Hashable) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entries = self._groups.get(group)
+            if entries is None:
+                return None
+            item = entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= now:
+                del entries[key]
+                return None
+            self._groups.move_to_end(group)
+            return value
+
+    def set(self, group: Hashable, key: Hashable, value: Any) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            entries = self._groups.setdefault(group, OrderedDict())
+            entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries_per_group:
+                entries.popitem(last=False)
+            self._groups.move_to_end(group)
+            while len(self._groups) > self.max_groups:
+                self._groups.popitem(last=False)
+
+    def invalidate(self, group: Hashable) -> None:
+        with self._lock:
+            self._groups.pop(group, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._groups.clear()
+
+class GroupedLRUCache:
+    # bounded least-recently-used cache over all entries, whose keys belong to groups that can be dropped together (e.g. every chunk of one document)
+    def __init__(self, max_entries: int = 4096, ttl_seconds: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._groups: dict = {}
+        self._lock = threading.Lock()
+
+    def get_many(self, group_keys) -> dict:
+        # {(group, key): value} for the pairs that are cached and fresh
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for group_key in group_keys:
+                item = self._entries.get(group_key)
+                if item is None:
+                    continue
+                expires_at, value = item
+                if expires_at <= now:
+                    self._remove(group_key)
+                    continue
+                self._entries.move_to_end(group_key)
+                found[group_key] = value
+        return found
+
+    def set_many(self, items: dict) -> None:
+        if self.max_entries <= 0 or self.ttl_seconds <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            for group_key, value in items.items():
+                self._entries[group_key] = (expires_at, value)
+                self._entries.move_to_end(group_key)
+                self._groups.setdefault(group_key[0], set()).add(group_key)
+            while len(self._entries) > self.max_entries:
+                oldest, _ = self._entries.popitem(last=False)
+                self._discard_from_group(oldest)
+
+    def invalidate(self, group: Hashable) -> None:
+        with self._lock:
+            for group_key in self._groups.pop(group, ()):
+                self._entries.pop(group_key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, group_key: tuple) -> None:
+        self._entries.pop(group_key, None)
+        self._discard_from_group(group_key)
+
+    def _discard_from_group(self, group_key: tuple) -> None:
+        keys = self._groups.get(group_key[0])
+        if keys is not None:
+            keys.discard(group_key)
+            if not keys:
+                del self._groups[group_key[0]]
@@ -0,0 +1,248 @@
+# the chat request as a small graph of stages. stages that do not depend on each other (the thread lookup, conversation history,
+# retrieval for the bare question) run concurrently on a shared pool; the dialogue id is allocated up front and the finished
+# dialogue goes to the write-behind spool rather than being inserted on the request path.
+import contextvars
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+
+from context_packing import pack_context
+from dialogue_model import format_conversation_context
+from index_versions import current_layout
+from metrics import registry, stage
+from openai_limiter import chat_completion, INTERACTIVE
+from retrieval import chunk_id, chunk_texts, hydrate, merge_candidates, previous_candidates, rerank, retrieval_plan, reuse_previous, search
+from text_chunk_model import chunk_hash
+from usage_ledger import usage_scope
+
+logger = logging.getLogger(__name__)
+
+CHAT_PIPELINE_WORKERS = int(os.getenv("CHAT_PIPELINE_WORKERS", "16"))
+# on follow-ups, also search with the bare question while the history loads; costs one extra embedding and vector query
+FOLLOW_UP_RAW_RETRIEVAL = os.getenv("CHAT_FOLLOW_UP_RAW_RETRIEVAL", "true").lower() in ("1", "true", "yes")
+# on follow-ups, first rescore the chunks the previous answer cited against the bare question using their stored embeddings; when
+# enough of them still match, the vector searches and the history-enhanced embedding are skipped
+FOLLOW_UP_REUSE = os.getenv("CHAT_FOLLOW_UP_REUSE", "true").lower() in ("1", "true", "yes")
+# full references carry the chunk text; lean ones only its id, score, filename and page, with the text fetched from /chunks.
+# dialogues are stored with the same references the response returns.
+REFERENCE_MODES = ("full", "lean")
+REFERENCE_MODE = os.getenv("CHAT_REFERENCE_MODE", "full").lower()
+
+SYSTEM_PROMPT = """you are a helpful ai assistant that answers questions based on the provided document context.
+        you must cite your sources in your response. when you reference information from the context, include the source in square brackets like [document.pdf, page x].
+        use the exact filename and page number provided in the context.
+        if the context doesn't contain enough information to answer the question fully, say so clearly.
+        your response should be well-structured and informative, with proper source citations throughout."""
+
+NO_MATCHES_RESPONSE = "i couldn't find any relevant information in your uploaded documents to answer this question. please make sure you have uploaded documents that contain information related to your query."
+
+follow_up_retrievals = registry.counter("edgeup_follow_up_retrievals_total", "follow-up questions by how their chunks were found", ("path",))
+
+_executor = ThreadPoolExecutor(max_workers=CHAT_PIPELINE_WORKERS, thread_name_prefix="chat-stage")
+
+class StageScheduler:
+    def __init__(self, executor: Optional[ThreadPoolExecutor] = None, prefix: str = "chat"):
+        self.executor = executor or _executor
+        self.prefix = prefix
+        self._stages: Dict[str, tuple] = {}
+
+    def add(self, name: str, fn: Callable[[Dict[str, Any]], Any], after: Iterable[str] = ()) -> None:
+        # fn receives the results of the stages named in after, keyed by name. stages can only depend on stages added before them.
+        after = tuple(after)
+        if name in self._stages:
+            raise ValueError(f"stage {name} added twice")
+        missing = [dep for dep in after if dep not in self._stages]
+        if missing:
+            raise ValueError(f"stage {name} depends on unknown stages {missing}")
+        self._stages[name] = (fn, after)
+
+    def run(self) -> Dict[str, Any]:
+        # run every stage as soon as its dependencies are done and return all results. a stage that is the only one runnable
+        # runs on the calling thread; the first failure is re-raised and stages that have not started are cancelled.
+        results: Dict[str, Any] = {}
+        waiting = dict(self._stages)
+        running = {}
+        while waiting or running:
+            ready = [name for name, (_, after) in waiting.items() if all(dep in results for dep in after)]
+            for name in ready:
+                fn, after = waiting.pop(name)
+                inputs = {dep: results[dep] for dep in after}
+                if len(ready) == 1 and not running:
+                    results[name] = self._run_stage(name, fn, inputs)
+                else:
+                    # copied per stage so the request's trace collects timings from the pool threads
+                    running[self.executor.submit(contextvars.copy_context().run, self._run_stage, name, fn, inputs)] = name
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception:
+                    for other in running:
+                        other.cancel()
+                    raise
+        return results
+
+    def _run_stage(self, name: str, fn, inputs: Dict[str, Any]):
+        with stage(f"{self.prefix}.{name}"):
+            return fn(inputs)
+
+def build_user_prompt(context: str, query: str) -> str:
+    return f"""context from documents:
+{context}
+
+user question: {query}
+
+please provide a helpful answer based on the context above. important: you must cite your sources using the format [filename, page x] whenever you reference information from the documents."""
+
+def generate_answer(context: str, query: str, priority: int = INTERACTIVE) -> str:
+    response = chat_completion(
+        model="gpt-3.5-turbo",
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": build_user_prompt(context, query)}
+        ],
+        max_tokens=1000,
+        temperature=0.7,
+        priority=priority
+    )
+    return response.choices[0].message.content
+
+def to_references(candidates: List[Dict[str, Any]], mode: Optional[str] = None, index_version: int = 0) -> List[Dict[str, Any]]:
+    lean = (mode or REFERENCE_MODE) == "lean"
+    references = []
+    for match in sorted(candidates, key=lambda match: match["score"], reverse=True):
+        reference = {
+            "chunk_id": chunk_id(match["document_id"], match["chunk_index"]),
+            "document_id": match["document_id"],
+            "chunk_index": match["chunk_index"],
+            "index_version": index_version,
+            "filename": match["filename"],
+            "page_num": match["page_num"],
+            "similarity_score": match["score"]
+        }
+        if lean:
+            # positions are rewritten in place when a document is replaced; the hash tells whether the text at it is still this
+            reference["content_hash"] = chunk_hash(match["text"] or "")
+        else:
+            reference["text"] = match["text"]
+        references.append(reference)
+    return references
+
+def with_reference_texts(history: List[Dict[str, Any]], user_id: str, chunk_model) -> List[Dict[str, Any]]:
+    # copies of the dialogues with the text of lean references filled in from the chunk store, so a follow-up sees the
+    # same sources whichever mode the earlier turns were stored in
+    def key(reference):
+        return (reference.get("index_version", 0), reference["document_id"], reference["chunk_index"])
+    lean = [reference for dialogue in history for reference in dialogue.get("references") or []
+            if not reference.get("text") and reference.get("chunk_index") is not None]
+    if not lean:
+        return history
+    # a chunk rewritten since it was cited is left without text rather than filled in with what replaced it
+    texts = chunk_texts([key(reference) for reference in lean], user_id, chunk_model,
+                        {key(reference): reference["content_hash"] for reference in lean if reference.get("content_hash")})
+    resolved = []
+    for dialogue in history:
+        references = []
+        for reference in dialogue.get("references") or []:
+            chunk = texts.get(key(reference)) if not reference.get("text") and reference.get("chunk_index") is not None else None
+            references.append(dict(reference, text=chunk["text"]) if chunk else reference)
+        resolved.append(dict(dialogue, references=references))
+    return resolved
+
+def run_chat(query: str, user_id: str, document_ids: List[str], previous_dialogue_id: Optional[str], dialogue_model, chunk_model,
+             require_matches: bool = False, limit: int = 8, reference_mode: Optional[str] = None) -> Dict[str, Any]:
+    # answer one question and persist the dialogue. with require_matches, a question nothing matched gets a canned answer and no dialogue.
+    from embeddings import get_embeddings_direct
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("openai api key not configured")
+    dialogue_id = ObjectId()
+    pool_size, relevance_weight, diversify = retrieval_plan(limit)
+    layout = current_layout()
+
+    def embed(text: str) -> List[float]:
+        return get_embeddings_direct(text, api_key, model=layout.embedding_model, priority=INTERACTIVE)
+
+    def find(embedding: List[float]) -> List[Dict[str, Any]]:
+        return search(embedding, user_id, document_ids, pool_size, diversify, layout=layout)
+
+    def enhanced_query(history: str) -> str:
+        return f"{history}\n\nCurrent Question: {query}" if history else query
+
+    def select(results: Dict[str, Any]) -> List[Dict[str, Any]]:
+        candidates = merge_candidates(*(results[name] or [] for name in searches))
+        candidates = rerank(candidates, results["query_embedding"] or results.get("raw_query_embedding"), limit, relevance_weight)
+        for candidate in candidates:
+            candidate.pop("values", None)
+        return candidates
+
+    def answer(results: Dict[str, Any]) -> Optional[str]:
+        if require_matches and not results["hydrate"]:
+            return None
+        return generate_answer(results["context_packing"]["text"], query)
+
+    def reuse(results: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        reused = reuse_previous(results["previous_candidates"], results["raw_query_embedding"])
+        follow_up_retrievals.inc(path="reused" if reused else "searched")
+        return reused
+
+    scheduler = StageScheduler()
+    searches = ["retrieval"]
+    rerank_after = ["query_embedding"]
+    if previous_dialogue_id:
+        # the previous dialogue is looked up once (waiting for it if another process still has it spooled) and shared by the
+        # thread, history and reuse stages
+        scheduler.add("previous", lambda _: dialogue_model.find_previous(previous_dialogue_id, user_id))
+        scheduler.add("thread", lambda r: dialogue_model.thread_of(r["previous"], previous_dialogue_id, user_id), after=("previous",))
+        scheduler.add("history", lambda r: format_conversation_context(
+            with_reference_texts(dialogue_model.history_from(r["previous"], user_id), user_id, chunk_model)
+        ), after=("previous",))
+        if FOLLOW_UP_REUSE or FOLLOW_UP_RAW_RETRIEVAL:
+            scheduler.add("raw_query_embedding", lambda _: embed(query))
+            rerank_after.append("raw_query_embedding")
+        if FOLLOW_UP_REUSE:
+            scheduler.add("previous_candidates", lambda r: previous_candidates(
+                (r["previous"] or {}).get("references") or [], user_id, document_ids, chunk_model, layout.version
+            ), after=("previous",))
+            scheduler.add("reuse", reuse, after=("raw_query_embedding", "previous_candidates"))
+            searches.append("reuse")
+        # with reuse on, the enhanced embedding and the searches wait for its verdict and are skipped when it found enough
+        skip = ("reuse",) if FOLLOW_UP_REUSE else ()
+        scheduler.add("query_embedding", lambda r: None if r.get("reuse") else embed(enhanced_query(r["history"])), after=("history", *skip))
+        if FOLLOW_UP_RAW_RETRIEVAL:
+            scheduler.add("raw_retrieval", lambda r: [] if r.get("reuse") else find(r["raw_query_embedding"]), after=("raw_query_embedding", *skip))
+            searches.append("raw_retrieval")
+    else:
+        scheduler.add("query_embedding", lambda _: embed(query))
+    scheduler.add("retrieval", lambda r: find(r["query_embedding"]) if r["query_embedding"] is not None else [], after=("query_embedding",))
+    scheduler.add("rerank", select, after=(*rerank_after, *searches))
+    scheduler.add("hydrate", lambda r: hydrate(r["rerank"], user_id, chunk_model), after=("rerank",))
+    scheduler.add("context_packing", lambda r: pack_context(r["hydrate"]), after=("hydrate",))
+    scheduler.add("llm", answer, after=("hydrate", "context_packing"))
+    with usage_scope(user_id=user_id):
+        results = scheduler.run()
+
+    packed = results["context_packing"]
+    logger.debug(f"packed {len(packed['candidates'])} of {len(results['hydrate'])} chunks into {len(packed['blocks'])} blocks ({packed['tokens']} tokens)")
+    if results["llm"] is None:
+        return {"dialogue_id": None, "response": NO_MATCHES_RESPONSE, "references": []}
+    references = to_references(packed["candidates"], reference_mode, layout.version)
+    with stage("chat.dialogue_store"):
+        dialogue = dialogue_model.new_dialogue(
+            user_id=user_id,
+            query=query,
+            references=references,
+            response=results["llm"],
+            document_ids=document_ids,
+            previous_dialogue_id=previous_dialogue_id,
+            thread_id=results.get("thread") or str(dialogue_id),
+            dialogue_id=dialogue_id
+        )
+        dialogue_model.save_dialogue(dialogue)
+    return {"dialogue_id": str(dialogue_id), "response": results["llm"], "references": references}
@@ -0,0 +1,120 @@
+# turns retrieved chunks into the prompt context: neighbouring chunks of the same page are stitched together without the
+# tokens chunk_pages repeats between them, and blocks are added in score order until the token budget is spent
+import logging
+import os
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# a block that does not fit is cut down to the remaining budget only if at least this many tokens of it would survive
+MIN_PARTIAL_TOKENS = 64
+# characters compared when looking for where the next chunk starts inside the previous one; shorter shared text is treated as coincidence
+OVERLAP_PROBE_CHARS = 32
+# between neighbours with no overlap found (short chunks, or neighbours only since a duplicate between them was collapsed)
+BLOCK_SEPARATOR = "\n"
+
+@lru_cache(maxsize=1)
+def _default_counter() -> Callable[[str], int]:
+    try:
+        from doc_chunks import get_tokenizer
+        tokenizer = get_tokenizer()
+        return lambda text: len(tokenizer.encode(text))
+    except Exception as e:
+        logger.warning(f"tokenizer unavailable, estimating context tokens: {e.__class__.__name__}")
+        from openai_limiter import estimate_tokens
+        return estimate_tokens
+
+def overlap_length(previous: str, following: str) -> int:
+    # length of the longest suffix of previous that is also a prefix of following, if it is at least OVERLAP_PROBE_CHARS long
+    if len(previous) < OVERLAP_PROBE_CHARS or len(following) < OVERLAP_PROBE_CHARS:
+        return 0
+    probe = following[:OVERLAP_PROBE_CHARS]
+    start = max(0, len(previous) - len(following))
+    position = previous.find(probe, start)
+    while position != -1:
+        tail = previous[position:]
+        if following.startswith(tail):
+            return len(tail)
+        position = previous.find(probe, position + 1)
+    return 0
+
+def merge_adjacent(candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # one block per run of consecutive chunk_index values on the same document page, overlap removed or, where none is found,
+    # separated; a block scores as its best chunk
+    ordered = sorted(
+        (c for c in candidates if c.get("text")),
+        key=lambda c: (c["document_id"], c["chunk_index"] if c.get("chunk_index") is not None else -1)
+    )
+    blocks: List[Dict[str, Any]] = []
+    for candidate in ordered:
+        last = blocks[-1] if blocks else None
+        adjacent = (
+            last is not None
+            and candidate.get("chunk_index") is not None
+            and last["document_id"] == candidate["document_id"]
+            and last["page_num"] == candidate["page_num"]
+            and last["chunk_indexes"][-1] == candidate["chunk_index"] - 1
+        )
+        if adjacent:
+            text = candidate["text"]
+            overlap = overlap_length(last["text"], text)
+            last["text"] += text[overlap:] if overlap else BLOCK_SEPARATOR + text
+            last["chunk_indexes"].append(candidate["chunk_index"])
+            last["candidates"].append(candidate)
+            last["score"] = max(last["score"], candidate["score"])
+            continue
+        blocks.append({
+            "document_id": candidate["document_id"],
+            "filename": candidate.get("filename") or "unknown",
+            "page_num": candidate["page_num"],
+            "chunk_indexes": [candidate.get("chunk_index")],
+            "text": candidate["text"],
+            "score": candidate["score"],
+            "candidates": [candidate]
+        })
+    return blocks
+
+def _truncate(text: str, tokens: int, count_tokens: Callable[[str], int]) -> str:
+    # the longest run of leading words that fits in this many tokens, found by bisection
+    words = text.split(" ")
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(" ".join(words[:middle])) <= tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return " ".join(words[:low])
+
+def pack_context(candidates: List[Dict[str, Any]], token_budget: Optional[int] = None,
+                 count_tokens: Optional[Callable[[str], int]] = None) -> Dict[str, Any]:
+    # prompt context from scored candidates. returns the context text, the blocks used and the candidates they cover.
+    token_budget = CONTEXT_TOKEN_BUDGET if token_budget is None else token_budget
+    count_tokens = count_tokens or _default_counter()
+    blocks = sorted(merge_adjacent(candidates), key=lambda block: block["score"], reverse=True)
+    packed, used, total = [], [], 0
+    for block in blocks:
+        header = f"[from {block['filename']}, page {block['page_num']}]: "
+        header_tokens = count_tokens(header)
+        tokens = header_tokens + count_tokens(block["text"])
+        remaining = token_budget - total
+        if tokens > remaining:
+            if remaining - header_tokens < MIN_PARTIAL_TOKENS:
+                continue
+            block = dict(block, text=_truncate(block["text"], remaining - header_tokens, count_tokens), truncated=True)
+            tokens = header_tokens + count_tokens(block["text"])
+            if tokens > remaining:
+                continue
+        block["context"] = header + block["text"]
+        packed.append(block)
+        used.extend(block["candidates"])
+        total += tokens
+    return {
+        "text": "\n\n".join(block["context"] for block in packed),
+        "blocks": packed,
+        "candidates": used,
+        "tokens": total,
+        "dropped": len(blocks) - len(packed)
+    }
@@ -0,0 +1,56 @@
+# bulk document deletion and whole-user purge, written as job bodies for jobs.run_job
+import logging
+from typing import Any, Callable, Dict, List
+
+from index_versions import index_layouts
+
+logger = logging.getLogger(__name__)
+
+Report = Callable[..., None]
+
+def delete_documents(user_id: str, documents: List[Dict[str, Any]], document_model, chunk_model, checkpoints, page_model, report: Report) -> Dict[str, Any]:
+    # remove several documents: chunks, pages and checkpoints with one delete_many each, vectors by id in batches, the records last so a failed job can be rerun.
+    # chunks and vectors are removed from every index version still searchable or kept for rollback.
+    from pinecone_vectors import delete_documents_vectors
+    document_ids = [doc["document_id"] for doc in documents]
+    total = len(document_ids)
+    report("chunks", 0, total)
+    chunks_deleted = chunk_model.delete_chunks_by_documents(document_ids, user_id)
+    report("vectors", 0, total)
+    chunk_counts = {doc["document_id"]: int(doc.get("chunk_count") or 0) for doc in documents}
+    vectors_deleted = 0
+    for layout in index_layouts.live():
+        # stored chunk counts describe the active version; other versions chunk differently, so their ids are listed
+        counts = chunk_counts if layout == index_layouts.active() else dict.fromkeys(chunk_counts, 0)
+        vectors_deleted += delete_documents_vectors(user_id, counts, progress=lambda done: report("vectors", done, total), layout=layout)
+    report("records", total, total)
+    checkpoints.delete_many(document_ids, user_id)
+    page_model.delete_document_pages(document_ids, user_id)
+    documents_deleted = document_model.delete_documents(document_ids, user_id)
+    logger.info(f"deleted {documents_deleted} documents for user {user_id}", extra={"chunks": chunks_deleted, "vectors": vectors_deleted})
+    return {"documents_deleted": documents_deleted, "chunks_deleted": chunks_deleted, "vectors_deleted": vectors_deleted, "document_ids": document_ids}
+
+PURGE_STEPS = ("vectors", "chunks", "pages", "checkpoints", "dialogues", "documents", "user")
+
+def purge_user(user_id: str, user_model, document_model, chunk_model, dialogue_model, checkpoints, page_model, report: Report) -> Dict[str, Any]:
+    # remove everything stored for a user: the vector namespace of every index version, then every mongo collection with one delete_many each, the user record last
+    from pinecone_vectors import delete_user_namespace
+    total = len(PURGE_STEPS)
+    result: Dict[str, Any] = {}
+    report("vectors", 0, total)
+    result["namespace_deleted"] = any([delete_user_namespace(user_id, layout=layout) for layout in index_layouts.live()])
+    report("chunks", 1, total)
+    result["chunks_deleted"] = chunk_model.delete_user_chunks(user_id)["deleted_count"]
+    report("pages", 2, total)
+    result["pages_deleted"] = page_model.delete_user_pages(user_id)
+    report("checkpoints", 3, total)
+    result["checkpoints_deleted"] = checkpoints.delete_user_checkpoints(user_id)
+    report("dialogues", 4, total)
+    result["dialogues_deleted"] = dialogue_model.delete_user_dialogues(user_id)
+    report("documents", 5, total)
+    result["documents_deleted"] = document_model.delete_user_documents(user_id)
+    report("user", 6, total)
+    result["user_deleted"] = user_model.delete_user(user_id)
+    report("done", total, total)
+    logger.info(f"purged user {user_id}", extra=result)
+    return result
@@ -0,0 +1,38 @@
+# fastapi dependencies that hand out the process-wide model instances
+from mongo_connection import mongo_manager
+from user_model import UserModel
+from text_chunk_model import TextChunkModel
+from dialogue_model import DialogueModel
+from document_model import DocumentModel
+from ingestion import IngestionCheckpointModel
+from jobs import JobModel
+from document_pages import DocumentPageModel
+from upload_store import UploadStore
+from usage_ledger import UsageLedgerModel
+
+def get_user_model() -> UserModel:
+    return mongo_manager.model(UserModel)
+
+def get_chunk_model() -> TextChunkModel:
+    return mongo_manager.model(TextChunkModel)
+
+def get_dialogue_model() -> DialogueModel:
+    return mongo_manager.model(DialogueModel)
+
+def get_document_model() -> DocumentModel:
+    return mongo_manager.model(DocumentModel)
+
+def get_checkpoint_model() -> IngestionCheckpointModel:
+    return mongo_manager.model(IngestionCheckpointModel)
+
+def get_job_model() -> JobModel:
+    return mongo_manager.model(JobModel)
+
+def get_page_model() -> DocumentPageModel:
+    return mongo_manager.model(DocumentPageModel)
+
+def get_upload_store() -> UploadStore:
+    return mongo_manager.model(UploadStore)
+
+def get_usage_model() -> UsageLedgerModel:
+    return mongo_manager.model(UsageLedgerModel)
@@ -1,105 +1,227 @@
 # DialogueModel for MongoDB
 from pymongo.collection import Collection
-from typing import List, Dict, Any
+from pymongo.errors import BulkWriteError
+from typing import List, Dict, Any, Optional, Tuple, Callable
 from datetime import datetime
+from bson import ObjectId
+import logging
+import os
+import time
+from cache import GroupedTTLCache
+from pagination import encode_cursor, decode_cursor
+from dialogue_spool import dialogue_spool
+
+logger = logging.getLogger(__name__)
+
+QUERY_PREVIEW_LENGTH = 120
+DUPLICATE_KEY = 11000
+# how long a follow-up waits for its previous dialogue to reach mongo when another api process answered it and still has it spooled
+FOLLOW_UP_WAIT_SECONDS = float(os.getenv("DIALOGUE_FOLLOW_UP_WAIT_SECONDS", "2"))
+
+# short-lived per-user cache of dialogue list pages, dropped whenever the user's dialogues change. it is only dropped in the process
+# that made the change, so it is off by default; enable it only for a single api process.
+dialogue_list_cache = GroupedTTLCache(ttl_seconds=float(os.getenv("DIALOGUE_CACHE_TTL_SECONDS", "0")))
 
 class DialogueModel:
     def __init__(self, db):
         self.collection: Collection = db["dialogues"]
 
-    def create_dialogue(self, user_id: str, query: str, references: List[Dict[str, Any]], response: str, document_ids: List[str] = None, previous_dialogue_id: str = None) -> str:
-        # create a new dialogue entry
-        dialogue_doc = {
+    def create_dialogue(self, user_id: str, query: str, references: List[Dict[str, Any]], response: str, document_ids: List[str] = None, previous_dialogue_id: str = None, thread_id: Optional[str] = None) -> str:
+        # create a new dialogue entry and store it right away
+        dialogue = self.new_dialogue(user_id, query, references, response, document_ids, previous_dialogue_id, thread_id)
+        self.insert_dialogues([dialogue])
+        return str(dialogue["_id"])
+
+    def new_dialogue(self, user_id: str, query: str, references: List[Dict[str, Any]], response: str, document_ids: List[str] = None, previous_dialogue_id: str = None,
+                     thread_id: Optional[str] = None, dialogue_id: Optional[ObjectId] = None) -> Dict[str, Any]:
+        # build a dialogue document. the id is allocated up front so the first dialogue of a thread can name itself as the thread.
+        dialogue_id = dialogue_id or ObjectId()
+        if not thread_id:
+            thread_id = self.get_thread_id(previous_dialogue_id, user_id) if previous_dialogue_id else str(dialogue_id)
+        return {
+            "_id": dialogue_id,
             "user_id": user_id,
             "query": query,
             "references": references,
             "response": response,
             "document_ids": document_ids or [],
             "previous_dialogue_id": previous_dialogue_id,
+            "thread_id": thread_id,
             "timestamp": datetime.utcnow()
         }
-        result = self.collection.insert_one(dialogue_doc)
-        return str(result.inserted_id)
 
-    def get_user_dialogues(self, user_id: str, limit: int = 50) -> List[Dict[str, Any]]:
-        # get recent dialogues for a user
-        return list(self.collection.find(
-            {"user_id": user_id}
-        ).sort("timestamp", -1).limit(limit))
+    def save_dialogue(self, dialogue: Dict[str, Any]) -> None:
+        # hand a dialogue to the write-behind spool, or store it directly when the spool is not running
+        if dialogue_spool.running:
+            dialogue_spool.enqueue(dialogue)
+            dialogue_list_cache.invalidate(dialogue["user_id"])
+        else:
+            self.insert_dialogues([dialogue])
+
+    def insert_dialogues(self, dialogues: List[Dict[str, Any]]) -> None:
+        # store dialogues, skipping ones already stored; a spool replay can repeat an insert that reached mongo before a crash
+        try:
+            self.collection.insert_many(dialogues, ordered=False)
+        except BulkWriteError as e:
+            if any(error.get("code") != DUPLICATE_KEY for error in e.details.get("writeErrors", [])) or e.details.get("writeConcernErrors"):
+                raise
+        for user_id in {dialogue["user_id"] for dialogue in dialogues}:
+            dialogue_list_cache.invalidate(user_id)
+
+    def _find_dialogue(self, dialogue_id: str, user_id: str, projection: Optional[Dict[str, int]] = None) -> Optional[Dict[str, Any]]:
+        # a dialogue still waiting in the spool is served from there, so a follow-up can be asked before it reaches mongo
+        spooled = dialogue_spool.pending(ObjectId(dialogue_id))
+        if spooled is not None:
+            return spooled if spooled["user_id"] == user_id else None
+        return self.collection.find_one({"_id": ObjectId(dialogue_id), "user_id": user_id}, projection)
+
+    def find_previous(self, dialogue_id: str, user_id: str, projection: Optional[Dict[str, int]] = None) -> Optional[Dict[str, Any]]:
+        # the dialogue a follow-up continues. only this process' spool is visible here, so a dialogue another process answered moments
+        # ago may not be in mongo yet: the read is retried for up to FOLLOW_UP_WAIT_SECONDS before the dialogue is taken as missing.
+        # a follow-up looks it up once and hands it to thread_of and history_from, so a missing dialogue is only waited for once.
+        deadline = time.monotonic() + FOLLOW_UP_WAIT_SECONDS
+        delay = 0.05
+        while True:
+            dialogue = self._find_dialogue(dialogue_id, user_id, projection)
+            if dialogue is not None or time.monotonic() + delay > deadline:
+                break
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        if dialogue is None:
+            logger.warning(f"previous dialogue {dialogue_id} not found for user {user_id}; answering without it")
+        return dialogue
+
+    def get_thread_id(self, dialogue_id: str, user_id: str) -> str:
+        # the thread a dialogue belongs to
+        return self.thread_of(self.find_previous(dialogue_id, user_id, {"thread_id": 1, "previous_dialogue_id": 1}), dialogue_id, user_id)
+
+    def thread_of(self, dialogue: Optional[Dict[str, Any]], dialogue_id: str, user_id: str) -> str:
+        # the thread of an already looked-up dialogue; a dialogue that was not found starts its own
+        if not dialogue:
+            return dialogue_id
+        return dialogue.get("thread_id") or self._resolve_thread(dialogue, user_id)
+
+    def _resolve_thread(self, dialogue: Dict[str, Any], user_id: str) -> str:
+        # dialogues stored before threads were recorded belong to the thread of the first dialogue of their chain. the chain is
+        # walked back once and the thread written onto the dialogues walked, so the next lookup reads it directly.
+        chain = [dialogue["_id"]]
+        seen = {str(dialogue["_id"])}
+        thread_id = None
+        current = dialogue
+        while current.get("previous_dialogue_id") and current["previous_dialogue_id"] not in seen:
+            seen.add(current["previous_dialogue_id"])
+            previous = self._find_dialogue(current["previous_dialogue_id"], user_id, {"thread_id": 1, "previous_dialogue_id": 1})
+            if not previous:
+                break
+            if previous.get("thread_id"):
+                thread_id = previous["thread_id"]
+                break
+            chain.append(previous["_id"])
+            current = previous
+        thread_id = thread_id or str(chain[-1])
+        self.collection.update_many({"_id": {"$in": chain}, "user_id": user_id, "thread_id": None}, {"$set": {"thread_id": thread_id}})
+        dialogue_list_cache.invalidate(user_id)
+        return thread_id
+
+    def get_references(self, dialogue_id: str, user_id: str) -> List[Dict[str, Any]]:
+        # the references a dialogue was answered from
+        dialogue = self.find_previous(dialogue_id, user_id, {"references": 1})
+        return (dialogue or {}).get("references") or []
+
+    def get_user_dialogues(self, user_id: str, limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        # get recent full dialogues for a user, one page at a time
+        return self._page(user_id, limit, cursor, None)
+
+    def list_dialogue_summaries(self, user_id: str, limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        # get a page of lightweight dialogue summaries for the history sidebar
+        cached = dialogue_list_cache.get(user_id, (limit, cursor))
+        if cached is not None:
+            return cached
+        dialogues, next_cursor = self._page(
+            user_id, limit, cursor,
+            {"query": 1, "timestamp": 1, "thread_id": 1, "previous_dialogue_id": 1}
+        )
+        summaries = []
+        for dialogue in dialogues:
+            query = dialogue.get("query", "")
+            dialogue_id = str(dialogue["_id"])
+            summaries.append({
+                "dialogue_id": dialogue_id,
+                "query_preview": query[:QUERY_PREVIEW_LENGTH] + ("..." if len(query) > QUERY_PREVIEW_LENGTH else ""),
+                "timestamp": dialogue.get("timestamp"),
+                "thread_id": dialogue.get("thread_id") or self._resolve_thread(dialogue, user_id)
+            })
+        result = (summaries, next_cursor)
+        dialogue_list_cache.set(user_id, (limit, cursor), result)
+        return result
+
+    def _page(self, user_id: str, limit: int, cursor: Optional[str], projection: Optional[Dict[str, int]]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        # keyset pagination on (user_id, timestamp desc, _id desc)
+        query: Dict[str, Any] = {"user_id": user_id}
+        if cursor:
+            timestamp, last_id = decode_cursor(cursor)
+            if not ObjectId.is_valid(last_id):
+                raise ValueError("invalid cursor")
+            query["$or"] = [
+                {"timestamp": {"$lt": timestamp}},
+                {"timestamp": timestamp, "_id": {"$lt": ObjectId(last_id)}}
+            ]
+        dialogues = list(self.collection.find(query, projection).sort(
+            [("timestamp", -1), ("_id", -1)]
+        ).limit(limit + 1))
+        next_cursor = None
+        if len(dialogues) > limit:
+            dialogues = dialogues[:limit]
+            next_cursor = encode_cursor(dialogues[-1]["timestamp"], str(dialogues[-1]["_id"]))
+        return dialogues, next_cursor
 
     def get_dialogue_by_id(self, dialogue_id: str, user_id: str) -> Dict[str, Any]:
         # get a specific dialogue by id (with user access check)
-        from bson import ObjectId
-        return self.collection.find_one({
-            "_id": ObjectId(dialogue_id),
-            "user_id": user_id
-        })
+        return self._find_dialogue(dialogue_id, user_id)
 
     def delete_dialogue(self, dialogue_id: str, user_id: str) -> bool:
-        # delete a dialogue (with user access check)
-        from bson import ObjectId
+        # delete a dialogue (with user access check); a spooled copy is stored first so it cannot reappear afterwards
+        if dialogue_spool.pending(ObjectId(dialogue_id)) is not None:
+            dialogue_spool.flush()
         result = self.collection.delete_one({
             "_id": ObjectId(dialogue_id),
             "user_id": user_id
         })
+        dialogue_list_cache.invalidate(user_id)
         return result.deleted_count > 0
 
+    def delete_user_dialogues(self, user_id: str) -> int:
+        # delete every dialogue of a user, including any still in the spool
+        if dialogue_spool.running:
+            dialogue_spool.flush()
+        result = self.collection.delete_many({"user_id": user_id})
+        dialogue_list_cache.invalidate(user_id)
+        return result.deleted_count
+
     def get_dialogue_history(self, dialogue_id: str, user_id: str) -> List[Dict[str, Any]]:
         # get the conversation history by traversing the dialogue chain backwards
-        from bson import ObjectId
+        return self.history_from(self.find_previous(dialogue_id, user_id), user_id)
+
+    def history_from(self, dialogue: Optional[Dict[str, Any]], user_id: str) -> List[Dict[str, Any]]:
+        # the conversation ending at an already looked-up dialogue, oldest first. the earlier dialogues were stored before it, so
+        # they are read without waiting.
         dialogues = []
-        current_id = dialogue_id
-        while current_id:
-            dialogue = self.collection.find_one({
-                "_id": ObjectId(current_id),
-                "user_id": user_id
-            })
-            if not dialogue:
-                break
+        while dialogue:
             dialogues.append(dialogue)
-            current_id = dialogue.get("previous_dialogue_id")
+            previous_id = dialogue.get("previous_dialogue_id")
+            dialogue = self._find_dialogue(previous_id, user_id) if previous_id else None
         return list(reversed(dialogues))
     
-    def build_conversation_context(self, previous_dialogue_id: str, user_id: str) -> str:
-        # build a comprehensive context string from all previous dialogues in the conversation thread
+    def build_conversation_context(self, previous_dialogue_id: str, user_id: str,
+                                   resolve_references: Optional[Callable[[List[Dict[str, Any]]], List[Dict[str, Any]]]] = None) -> str:
+        # build a comprehensive context string from all previous dialogues in the conversation thread. resolve_references
+        # fills in the text of references stored without it.
         if not previous_dialogue_id:
             return ""
-        conversation_history = self.get_dialogue_history(previous_dialogue_id, user_id)
-        if not conversation_history:
-            return ""
-        context_parts = []
-        context_parts.append("=== CONVERSATION HISTORY ===")
-        all_reference_content = []
-        reference_sources = set()
-        for i, dialogue in enumerate(conversation_history, 1):
-            context_parts.append(f"\n--- Previous Exchange {i} ---")
-            context_parts.append(f"Question: {dialogue['query']}")
-            context_parts.append(f"Answer: {dialogue['response']}")
-            if dialogue.get('references'):
-                for ref in dialogue['references']:
-                    if ref.get('text'):
-                        ref_id = f"{ref.get('filename', 'unknown')}_page_{ref.get('page_num', 'unknown')}"
-                        if ref_id not in reference_sources:
-                            reference_sources.add(ref_id)
-                            ref_info = {
-                                'text': ref['text'],
-                                'filename': ref.get('filename', 'Unknown Document'),
-                                'page_num': ref.get('page_num', 'Unknown Page'),
-                                'document_id': ref.get('document_id', ''),
-                                'similarity_score': ref.get('similarity_score', 0.0)
-                            }
-                            all_reference_content.append(ref_info)
-        if all_reference_content:
-            context_parts.append(f"\n=== ALL REFERENCE DOCUMENTS FROM CONVERSATION ===")
-            context_parts.append(f"Total Documents Referenced: {len(all_reference_content)}")
-            for i, ref in enumerate(all_reference_content, 1):
-                context_parts.append(f"\n--- Reference {i} ---")
-                context_parts.append(f"Source: {ref['filename']} (Page {ref['page_num']})")
-                context_parts.append(f"Content: {ref['text']}")
-                if ref.get('similarity_score'):
-                    context_parts.append(f"Relevance: {ref['similarity_score']:.1%}")
-        context_parts.append("\n=== END CONVERSATION HISTORY ===")
-        return "\n".join(context_parts)
+        history = self.get_dialogue_history(previous_dialogue_id, user_id)
+        if resolve_references:
+            history = resolve_references(history)
+        return format_conversation_context(history)
     
     def build_full_context_for_openai(self, current_query: str, previous_dialogue_id: str, user_id: str, current_references: List[Dict[str, Any]] = None) -> str:
         # build complete context for openai including conversation history and current references
@@ -120,3 +242,41 @@ class DialogueModel:
                     context_parts.append(f"Relevance: {ref['similarity_score']:.1%}")
         context_parts.append(f"\nPlease provide a comprehensive answer using all available information from the conversation history and current references. If referencing previous information, please mention the source document and page.")
         return "\n".join(context_parts)
+
+def format_conversation_context(conversation_history: List[Dict[str, Any]]) -> str:
+    # render a dialogue chain (oldest first) as the history block sent along with a follow-up question
+    if not conversation_history:
+        return ""
+    context_parts = []
+    context_parts.append("=== CONVERSATION HISTORY ===")
+    all_reference_content = []
+    reference_sources = set()
+    for i, dialogue in enumerate(conversation_history, 1):
+        context_parts.append(f"\n--- Previous Exchange {i} ---")
+        context_parts.append(f"Question: {dialogue['query']}")
+        context_parts.append(f"Answer: {dialogue['response']}")
+        if dialogue.get('references'):
+            for ref in dialogue['references']:
+                if ref.get('text'):
+                    ref_id = f"{ref.get('filename', 'unknown')}_page_{ref.get('page_num', 'unknown')}"
+                    if ref_id not in reference_sources:
+                        reference_sources.add(ref_id)
+                        ref_info = {
+                            'text': ref['text'],
+                            'filename': ref.get('filename', 'Unknown Document'),
+                            'page_num': ref.get('page_num', 'Unknown Page'),
+                            'document_id': ref.get('document_id', ''),
+                            'similarity_score': ref.get('similarity_score', 0.0)
+                        }
+                        all_reference_content.append(ref_info)
+    if all_reference_content:
+        context_parts.append(f"\n=== ALL REFERENCE DOCUMENTS FROM CONVERSATION ===")
+        context_parts.append(f"Total Documents Referenced: {len(all_reference_content)}")
+        for i, ref in enumerate(all_reference_content, 1):
+            context_parts.append(f"\n--- Reference {i} ---")
+            context_parts.append(f"Source: {ref['filename']} (Page {ref['page_num']})")
+            context_parts.append(f"Content: {ref['text']}")
+            if ref.get('similarity_score'):
+                context_parts.append(f"Relevance: {ref['similarity_score']:.1%}")
+    context_parts.append("\n=== END CONVERSATION HISTORY ===")
+    return "\n".join(context_parts)
@@ -0,0 +1,221 @@
+# write-behind persistence for dialogues. the chat endpoints append each finished dialogue to a local spool file and answer
+# right away; a writer thread batches the spooled dialogues into mongo and deletes a spool segment once all of it is stored.
+# segments left behind by a stopped or crashed process are queued again on start. dialogue ids are allocated up front, so a replay that
+# races the original insert only produces a duplicate key, which is ignored.
+import fcntl
+import glob
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from bson import json_util
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_MAX_ENTRIES = 1000
+
+spool_depth = registry.gauge("edgeup_dialogue_spool_depth", "dialogues spooled but not yet stored in mongo")
+spool_flush_failures = registry.counter("edgeup_dialogue_spool_flush_failures_total", "failed attempts to store spooled dialogues")
+
+class _Segment:
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "ab")
+        # held for the life of the segment so another process replaying the directory leaves it alone
+        try:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.file.close()
+            raise
+        self.written = 0
+        self.stored = 0
+        self.sealed = False
+
+    def close_and_remove(self) -> None:
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+class DialogueSpool:
+    def __init__(self, directory: str, batch_size: int = 100, fsync: bool = False, retry_seconds: float = 1.0):
+        self.directory = directory
+        self.batch_size = batch_size
+        self.fsync = fsync
+        self.retry_seconds = retry_seconds
+        self._store: Optional[Callable[[List[Dict[str, Any]]], None]] = None
+        self._queue: deque = deque()
+        self._pending: Dict[Any, Dict[str, Any]] = {}
+        self._segments: List[_Segment] = []
+        self._segment: Optional[_Segment] = None
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._in_flight = 0
+
+    @classmethod
+    def from_env(cls) -> "DialogueSpool":
+        return cls(
+            directory=os.getenv("DIALOGUE_SPOOL_DIR", os.path.join("uploads", "dialogue-spool")),
+            batch_size=int(os.getenv("DIALOGUE_SPOOL_BATCH_SIZE", "100")),
+            fsync=os.getenv("DIALOGUE_SPOOL_FSYNC", "").lower() in ("1", "true", "yes")
+        )
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, store: Callable[[List[Dict[str, Any]]], None]) -> int:
+        # store(docs) must insert the dialogues, ignoring ones that already exist. leftover segments are queued ahead of new
+        # dialogues and stored by the writer thread, so a mongo outage does not hold up startup; returns how many were recovered.
+        os.makedirs(self.directory, exist_ok=True)
+        self._store = store
+        with self._cond:
+            self._stopping = False
+            recovered = self._replay()
+            self._segment = self._open_segment()
+        self._thread = threading.Thread(target=self._run, name="dialogue-spool", daemon=True)
+        self._thread.start()
+        return recovered
+
+    def enqueue(self, doc: Dict[str, Any]) -> None:
+        line = json_util.dumps(doc).encode("utf-8") + b"\n"
+        with self._cond:
+            segment = self._segment
+            segment.file.write(line)
+            segment.file.flush()
+            if self.fsync:
+                os.fsync(segment.file.fileno())
+            segment.written += 1
+            self._queue.append((segment, doc))
+            self._pending[doc["_id"]] = doc
+            spool_depth.set(len(self._pending))
+            if segment.written >= SEGMENT_MAX_ENTRIES:
+                self._rotate()
+            self._cond.notify_all()
+
+    def pending(self, dialogue_id) -> Optional[Dict[str, Any]]:
+        # a spooled dialogue that may not have reached mongo yet
+        return self._pending.get(dialogue_id)
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        # wait until everything spooled so far is stored
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._queue or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stop(self, timeout: float = 10.0) -> None:
+        # drain what can be stored within timeout; anything left stays in its segment and is replayed on the next start
+        if self._thread is None:
+            return
+        self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._thread = None
+        with self._cond:
+            for segment in self._segments:
+                if segment.stored >= segment.written:
+                    segment.close_and_remove()
+                else:
+                    segment.file.close()
+            self._segments = []
+            self._segment = None
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"pending": len(self._pending), "segments": len(self._segments), "running": self.running}
+
+    def _open_segment(self) -> _Segment:
+        segment = _Segment(os.path.join(self.directory, f"dialogues-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl"))
+        self._segments.append(segment)
+        return segment
+
+    def _rotate(self) -> None:
+        self._segment.sealed = True
+        self._segment = self._open_segment()
+        self._cleanup()
+
+    def _cleanup(self) -> None:
+        # delete sealed segments whose every entry is stored
+        for segment in list(self._segments):
+            if segment.sealed and segment.stored >= segment.written:
+                segment.close_and_remove()
+                self._segments.remove(segment)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopping:
+                    self._cond.wait()
+                if self._stopping and not self._queue:
+                    return
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                self._in_flight = len(batch)
+            try:
+                self._store([doc for _, doc in batch])
+            except Exception as e:
+                spool_flush_failures.inc()
+                logger.error(f"storing {len(batch)} spooled dialogues failed, retrying: {str(e)}")
+                with self._cond:
+                    self._queue.extendleft(reversed(batch))
+                    self._in_flight = 0
+                    self._cond.notify_all()
+                    if self._stopping:
+                        return
+                    self._cond.wait(self.retry_seconds)
+                continue
+            with self._cond:
+                for segment, doc in batch:
+                    segment.stored += 1
+                    self._pending.pop(doc["_id"], None)
+                self._in_flight = 0
+                spool_depth.set(len(self._pending))
+                # an idle, fully stored segment is swapped for a fresh one so the spool directory stays empty between bursts
+                if not self._queue and self._segment is not None and self._segment.written and self._segment.stored >= self._segment.written:
+                    self._rotate()
+                else:
+                    self._cleanup()
+                self._cond.notify_all()
+
+    def _replay(self) -> int:
+        # queue the contents of segments no live process holds; each is deleted once everything in it is stored
+        recovered = 0
+        for path in sorted(glob.glob(os.path.join(self.directory, "dialogues-*.jsonl"))):
+            try:
+                segment = _Segment(path)
+            except OSError:
+                continue
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        doc = json_util.loads(line)
+                    except ValueError:
+                        # a line cut short by a crash was never acknowledged to anyone
+                        continue
+                    self._queue.append((segment, doc))
+                    self._pending[doc["_id"]] = doc
+                    segment.written += 1
+            segment.sealed = True
+            self._segments.append(segment)
+            recovered += segment.written
+        spool_depth.set(len(self._pending))
+        self._cleanup()
+        if recovered:
+            logger.info(f"queued {recovered} dialogues left in the spool by an earlier process")
+        return recovered
+
+dialogue_spool = DialogueSpool.from_env()
@@ -0,0 +1,397 @@
+# directory mode of the document_processor cli, for back-office backfills. files are hashed and extracted (text, ocr, chunking)
+# in a process pool, while the main process feeds every file's chunks through one embedding batcher, so requests are full
+# regardless of file size, and one vector upserter. files whose content the user already has are skipped, and a jsonl manifest
+# records each file's outcome so an interrupted run picks up where it stopped.
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from embeddings import EMBEDDING_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".ingest-manifest.jsonl"
+# embeddings requests and vector upserts in flight; the shared openai limiter still applies on top
+DIRECTORY_EMBED_CONCURRENCY = int(os.getenv("DIRECTORY_EMBED_CONCURRENCY", "2"))
+DIRECTORY_UPSERT_CONCURRENCY = int(os.getenv("DIRECTORY_UPSERT_CONCURRENCY", "4"))
+
+class FileState:
+    # one file on its way through the run
+    def __init__(self, path: str, relative: str, size_bytes: int, mtime: float, content_hash: str):
+        self.path = path
+        self.relative = relative
+        self.size_bytes = size_bytes
+        self.mtime = mtime
+        self.content_hash = content_hash
+        self.document_id: Optional[str] = None
+        self.pages: List[str] = []
+        self.chunks: List[Dict[str, Any]] = []
+        self.dedup: Dict[str, Any] = {}
+        self.remaining = 0
+        self.error: Optional[str] = None
+        self.lock = threading.Lock()
+
+    def settle(self, count: int, error: Optional[BaseException] = None) -> bool:
+        # account for count chunks that were stored (or failed); True once nothing is outstanding
+        with self.lock:
+            if error is not None and self.error is None:
+                self.error = str(error)[:500]
+            self.remaining -= count
+            return self.remaining == 0
+
+def walk_files(directory: str) -> List[str]:
+    # supported files under directory, in a stable order
+    from document_processor import get_file_type
+    found = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if get_file_type(path) != "unknown":
+                found.append(path)
+    return found
+
+def load_manifest(path: str) -> Dict[str, Dict[str, Any]]:
+    # the last entry recorded for each file; a line cut short by a crash is ignored
+    entries: Dict[str, Dict[str, Any]] = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            entries[entry["path"]] = entry
+    return entries
+
+class Manifest:
+    # append-only jsonl; each line is flushed so a crash loses at most the line being written
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = load_manifest(path)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def unchanged_done(self, relative: str, size_bytes: int, mtime: float) -> Optional[Dict[str, Any]]:
+        # a file finished by an earlier run and not touched since, so it need not even be hashed
+        entry = self.entries.get(relative)
+        if entry and entry["status"] in ("done", "skipped") and entry.get("size_bytes") == size_bytes and entry.get("mtime") == mtime:
+            return entry
+        return None
+
+    def record(self, state: FileState, status: str, **fields) -> None:
+        entry = {
+            "path": state.relative, "status": status, "content_hash": state.content_hash, "size_bytes": state.size_bytes,
+            "mtime": state.mtime, "document_id": state.document_id, "at": datetime.utcnow().isoformat(), **fields
+        }
+        self.entries[state.relative] = entry
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+class Progress:
+    # one status line, redrawn in place on a terminal and printed every few seconds otherwise
+    def __init__(self, total: int, stream=None, interval: float = 0.5):
+        self.total = total
+        self.stream = stream or sys.stderr
+        self.interactive = self.stream.isatty()
+        self.interval = interval if self.interactive else 10.0
+        self.started = time.monotonic()
+        self.counts = {"done": 0, "skipped": 0, "failed": 0, "chunks": 0, "pages": 0, "embeddings_saved": 0}
+        self._shown_at = 0.0
+
+    def add(self, **counts) -> None:
+        for key, value in counts.items():
+            self.counts[key] += value
+        if time.monotonic() - self._shown_at >= self.interval:
+            self.show()
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return {
+            **self.counts, "total": self.total, "elapsed_seconds": round(elapsed, 1),
+            "files_per_second": round(self.counts["done"] / elapsed, 2), "chunks_per_second": round(self.counts["chunks"] / elapsed, 1)
+        }
+
+    def show(self, final: bool = False) -> None:
+        self._shown_at = time.monotonic()
+        s = self.summary()
+        finished = s["done"] + s["skipped"] + s["failed"]
+        line = (f"{finished}/{s['total']} files ({s['done']} ingested, {s['skipped']} skipped, {s['failed']} failed), "
+                f"{s['chunks']} chunks, {s['files_per_second']} files/s, {s['chunks_per_second']} chunks/s, {s['elapsed_seconds']}s")
+        if self.interactive:
+            self.stream.write("\r" + line + ("\n" if final else ""))
+        else:
+            self.stream.write(line + "\n")
+        self.stream.flush()
+
+def _stat_and_hash(path: str) -> Tuple[int, float, Optional[str], Optional[str]]:
+    # runs in a worker process. an unreadable file yields its error instead of ending the run
+    from document_processor import file_digest
+    try:
+        stat = os.stat(path)
+        size_bytes, content_hash = file_digest(path)
+    except OSError as e:
+        return 0, 0.0, None, str(e)
+    return size_bytes, stat.st_mtime, content_hash, None
+
+def _extract(path: str, max_tokens: int, overlap: int) -> Tuple[List[str], List[Dict[str, Any]], Dict[str, Any]]:
+    # runs in a worker process: extraction (or ocr), chunking and near-duplicate suppression, the cpu-heavy part of ingestion
+    from ingestion import extract_pages
+    from near_duplicates import chunk_without_duplicates
+    pages = extract_pages(path)
+    chunks, dedup = chunk_without_duplicates(pages, max_tokens, overlap)
+    return pages, chunks, dedup
+
+class EmbeddingBatcher:
+    # collects chunks from every file into full embeddings requests and hands each embedded batch on
+    def __init__(self, embed: Callable[[List[str]], List[List[float]]], on_embedded: Callable[[List[Tuple[FileState, int]], Optional[BaseException]], None],
+                 batch_size: int = EMBEDDING_BATCH_SIZE, concurrency: int = DIRECTORY_EMBED_CONCURRENCY):
+        self.embed = embed
+        self.on_embedded = on_embedded
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ingest-embed")
+        self.pending: List[Tuple[FileState, int]] = []
+        self.futures: Set[Future] = set()
+
+    def add(self, state: FileState) -> None:
+        self.pending.extend((state, index) for index in range(len(state.chunks)))
+        while len(self.pending) >= self.batch_size:
+            items, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+            self._submit(items)
+
+    def flush(self) -> None:
+        if self.pending:
+            items, self.pending = self.pending, []
+            self._submit(items)
+        wait(self.futures)
+        self.executor.shutdown()
+
+    def _submit(self, items: List[Tuple[FileState, int]]) -> None:
+        # bounded, so extraction cannot run arbitrarily far ahead of embedding
+        while len(self.futures) >= self.concurrency * 2:
+            done, self.futures = wait(self.futures, return_when=FIRST_COMPLETED)
+        self.futures.add(self.executor.submit(self._run, items))
+
+    def _run(self, items: List[Tuple[FileState, int]]) -> None:
+        try:
+            embeddings = self.embed([state.chunks[index]["text"] for state, index in items])
+        except Exception as e:
+            self.on_embedded(items, e)
+            return
+        for (state, index), embedding in zip(items, embeddings):
+            state.chunks[index]["embedding"] = embedding
+        self.on_embedded(items, None)
+
+class VectorUpserter:
+    # writes embedded chunks to the vector store, one upsert per file per batch, and reports files with nothing outstanding
+    def __init__(self, store: Callable[[FileState, List[Dict[str, Any]]], Any], finished: "queue.Queue[FileState]",
+                 concurrency: int = DIRECTORY_UPSERT_CONCURRENCY):
+        self.store = store
+        self.finished = finished
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ingest-upsert")
+        self.futures: Set[Future] = set()
+        self._lock = threading.Lock()
+
+    def submit(self, items: List[Tuple[FileState, int]], error: Optional[BaseException] = None) -> None:
+        by_file: Dict[int, Tuple[FileState, List[int]]] = {}
+        for state, index in items:
+            by_file.setdefault(id(state), (state, []))[1].append(index)
+        for state, indexes in by_file.values():
+            if error is not None:
+                self._settle(state, len(indexes), error)
+                continue
+            future = self.executor.submit(self._run, state, indexes)
+            with self._lock:
+                self.futures.add(future)
+
+    def drain(self) -> None:
+        while True:
+            with self._lock:
+                futures = set(self.futures)
+            if not futures:
+                break
+            wait(futures)
+            with self._lock:
+                self.futures -= futures
+        self.executor.shutdown()
+
+    def _run(self, state: FileState, indexes: List[int]) -> None:
+        error = None
+        try:
+            if state.error is None:
+                # the chunk's own position makes the vector id, so a rerun overwrites rather than duplicates
+                self.store(state, [dict(state.chunks[index], chunk_index=index) for index in indexes])
+        except Exception as e:
+            error = e
+        self._settle(state, len(indexes), error)
+
+    def _settle(self, state: FileState, count: int, error: Optional[BaseException]) -> None:
+        if state.settle(count, error):
+            self.finished.put(state)
+
+def ingest_directory(directory: str, user_id: str, db=None, manifest_path: Optional[str] = None, workers: Optional[int] = None,
+                     max_tokens: Optional[int] = None, overlap: Optional[int] = None, batch_size: Optional[int] = None,
+                     progress_stream=None, layout=None, embed: Optional[Callable[[List[str]], List[List[float]]]] = None,
+                     store: Optional[Callable[[FileState, List[Dict[str, Any]]], Any]] = None) -> Dict[str, Any]:
+    # ingest every supported file under directory for user_id and return the run's summary. layout defaults to the active index
+    # version, embed and store to openai and pinecone; they are parameters so the pipeline can run against stand-ins.
+    from document_model import DocumentModel
+    from document_pages import DocumentPageModel
+    from index_versions import IndexVersionModel
+    from text_chunk_model import TextChunkModel
+    if db is None:
+        from mongo_connection import mongo_manager
+        db = mongo_manager.get_database()
+    layout = layout or IndexVersionModel(db).active_layout()
+    max_tokens = max_tokens or layout.max_tokens
+    overlap = layout.overlap if overlap is None else overlap
+    if embed is None:
+        from embeddings import get_embeddings_batch
+        from openai_limiter import BULK
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY environment variable is not set")
+        from usage_ledger import usage_scope
+        def embed(texts: List[str]) -> List[List[float]]:
+            # batches mix files, so the ledger attributes them to the user only
+            with usage_scope(user_id=user_id, endpoint="directory_ingest"):
+                return get_embeddings_batch(texts, api_key, model=layout.embedding_model, priority=BULK)
+    if store is None:
+        from pinecone_vectors import store_document_chunks
+        store = lambda state, chunks: store_document_chunks(
+            chunks, document_id=state.document_id, user_id=user_id, filename=os.path.basename(state.path), layout=layout
+        )
+    documents = DocumentModel(db)
+    chunk_model = TextChunkModel(db, layout)
+    page_model = DocumentPageModel(db)
+    workers = workers or os.cpu_count() or 2
+
+    paths = walk_files(directory)
+    manifest = Manifest(manifest_path or os.path.join(directory, MANIFEST_NAME))
+    progress = Progress(len(paths), progress_stream)
+    finished: "queue.Queue[FileState]" = queue.Queue()
+    upserter = VectorUpserter(store, finished)
+    batcher = EmbeddingBatcher(embed, upserter.submit, batch_size or EMBEDDING_BATCH_SIZE)
+
+    def skip(state: FileState, reason: str) -> None:
+        manifest.record(state, "skipped", reason=reason)
+        progress.add(skipped=1)
+
+    def complete(state: FileState) -> None:
+        # chunks and pages go to mongo once every vector of the file is stored, as in ingestion
+        try:
+            if state.error:
+                raise RuntimeError(state.error)
+            chunk_model.delete_chunks_by_document(state.document_id, user_id)
+            chunk_model.insert_chunks(state.chunks, state.document_id, user_id, os.path.basename(state.path))
+            page_model.save_pages(state.document_id, user_id, state.pages)
+            documents.mark_ready(state.document_id, user_id, len(state.pages), len(state.chunks))
+            documents.record_dedup(state.document_id, user_id, state.dedup)
+        except Exception as e:
+            fail(state, e)
+            return
+        saved = state.dedup.get("embeddings_saved", 0)
+        manifest.record(state, "done", chunk_count=len(state.chunks), page_count=len(state.pages), embeddings_saved=saved)
+        progress.add(done=1, chunks=len(state.chunks), pages=len(state.pages), embeddings_saved=saved)
+        state.pages, state.chunks = [], []
+
+    def fail(state: FileState, error: BaseException) -> None:
+        logger.error(f"ingesting {state.relative} failed: {str(error)}")
+        if state.document_id:
+            documents.mark_failed(state.document_id, user_id, str(error))
+        manifest.record(state, "failed", error=str(error)[:500])
+        progress.add(failed=1)
+
+    def complete_finished() -> None:
+        while True:
+            try:
+                complete(finished.get_nowait())
+            except queue.Empty:
+                return
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # hash what changed since the last run, then drop content the user already has
+            states: List[FileState] = []
+            to_hash = []
+            for path in paths:
+                relative = os.path.relpath(path, directory)
+                stat = os.stat(path)
+                if manifest.unchanged_done(relative, stat.st_size, stat.st_mtime):
+                    progress.add(skipped=1)
+                else:
+                    to_hash.append((path, relative))
+            for (path, relative), (size_bytes, mtime, content_hash, error) in zip(to_hash, pool.map(_stat_and_hash, [p for p, _ in to_hash], chunksize=16)):
+                state = FileState(path, relative, size_bytes, mtime, content_hash)
+                if error:
+                    fail(state, OSError(error))
+                else:
+                    states.append(state)
+            ready: Set[str] = set()
+            hashes = sorted({state.content_hash for state in states})
+            for start in range(0, len(hashes), 1000):
+                ready |= documents.ready_hashes(user_id, hashes[start:start + 1000])
+            queued: List[FileState] = []
+            seen: Set[str] = set()
+            for state in states:
+                if state.content_hash in ready:
+                    skip(state, "already ingested")
+                elif state.content_hash in seen:
+                    skip(state, "duplicate of another file in this run")
+                else:
+                    seen.add(state.content_hash)
+                    queued.append(state)
+
+            # extraction in the pool, at most a few files ahead of the embedder
+            in_flight: Dict[Future, FileState] = {}
+            pending = iter(queued)
+            def refill() -> None:
+                for state in pending:
+                    in_flight[pool.submit(_extract, state.path, max_tokens, overlap)] = state
+                    if len(in_flight) >= workers * 2:
+                        return
+            refill()
+            while in_flight:
+                done, _ = wait(list(in_flight), timeout=1.0, return_when=FIRST_COMPLETED)
+                for future in done:
+                    state = in_flight.pop(future)
+                    try:
+                        state.pages, state.chunks, state.dedup = future.result()
+                        resumable = documents.find_resumable(user_id, state.content_hash)
+                        if resumable is not None:
+                            state.document_id = resumable["document_id"]
+                            documents.mark_processing(state.document_id, user_id)
+                        else:
+                            state.document_id = str(uuid.uuid4())
+                            documents.create_document(state.document_id, user_id, os.path.basename(state.path), state.size_bytes, state.content_hash)
+                    except Exception as e:
+                        fail(state, e)
+                        continue
+                    manifest.record(state, "started")
+                    state.remaining = len(state.chunks)
+                    if state.chunks:
+                        batcher.add(state)
+                    else:
+                        finished.put(state)
+                refill()
+                complete_finished()
+                progress.add()
+        batcher.flush()
+        upserter.drain()
+        complete_finished()
+    finally:
+        manifest.close()
+    progress.show(final=True)
+    return progress.summary()
@@ -1,8 +1,13 @@
-from nltk.tokenize import sent_tokenize
+from functools import lru_cache
 
-def chunk_pages(pages, max_tokens=500, overlap=50):
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    # the cl100k_base bpe ranks are read (and downloaded on first use) when the encoding is built, so build it once per process
     from tiktoken import get_encoding
-    tokenizer = get_encoding("cl100k_base")
+    return get_encoding("cl100k_base")
+
+def chunk_pages(pages, max_tokens=500, overlap=50):
+    tokenizer = get_tokenizer()
     chunks = []
     for i, page_text in enumerate(pages):
         tokens = tokenizer.encode(page_text)
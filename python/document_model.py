@@ -0,0 +1,213 @@
+from pymongo.collection import Collection
+from typing import List, Dict, Any, Optional, Tuple
+from datetime import datetime
+import hashlib
+from pagination import encode_cursor, decode_cursor
+
+# users whose legacy chunks this process has already backfilled records for
+_backfilled_users: set = set()
+
+class DocumentModel:
+    def __init__(self, db):
+        self.collection: Collection = db["documents"]
+        self.backfills: Collection = db["document_backfills"]
+
+    def create_document(self, document_id: str, user_id: str, filename: str, size_bytes: int = 0, content_hash: Optional[str] = None, status: str = "processing") -> Dict[str, Any]:
+        # record a document at ingest time, before its chunks are written
+        now = datetime.utcnow()
+        doc = {
+            "document_id": document_id,
+            "user_id": user_id,
+            "filename": filename,
+            "page_count": 0,
+            "chunk_count": 0,
+            "size_bytes": int(size_bytes),
+            "content_hash": content_hash,
+            "status": status,
+            "created_at": now,
+            "updated_at": now
+        }
+        self.collection.insert_one(dict(doc))
+        return doc
+
+    def mark_ready(self, document_id: str, user_id: str, page_count: int, chunk_count: int) -> bool:
+        # mark a document as fully ingested and record its counts
+        result = self.collection.update_one(
+            {"document_id": document_id, "user_id": user_id},
+            {"$set": {
+                "page_count": int(page_count),
+                "chunk_count": int(chunk_count),
+                "status": "ready",
+                "updated_at": datetime.utcnow()
+            }, "$unset": {"error": ""}}
+        )
+        return result.matched_count > 0
+
+    def record_dedup(self, document_id: str, user_id: str, report: Dict[str, Any]) -> bool:
+        # what near-duplicate suppression removed before the document's chunks were embedded
+        result = self.collection.update_one(
+            {"document_id": document_id, "user_id": user_id},
+            {"$set": {"dedup": report, "updated_at": datetime.utcnow()}}
+        )
+        return result.matched_count > 0
+
+    def mark_replaced(self, document_id: str, user_id: str, size_bytes: int, content_hash: str, page_count: int, chunk_count: int) -> bool:
+        # record a new revision of a document ingested in place
+        result = self.collection.update_one(
+            {"document_id": document_id, "user_id": user_id},
+            {"$set": {
+                "size_bytes": int(size_bytes),
+                "content_hash": content_hash,
+                "page_count": int(page_count),
+                "chunk_count": int(chunk_count),
+                "status": "ready",
+                "updated_at": datetime.utcnow()
+            }, "$inc": {"revision": 1}, "$unset": {"error": ""}}
+        )
+        return result.matched_count > 0
+
+    def mark_failed(self, document_id: str, user_id: str, error: str) -> bool:
+        # mark a document whose ingestion did not complete
+        result = self.collection.update_one(
+            {"document_id": document_id, "user_id": user_id},
+            {"$set": {"status": "failed", "error": error[:500], "updated_at": datetime.utcnow()}}
+        )
+        return result.matched_count > 0
+
+    def mark_processing(self, document_id: str, user_id: str) -> bool:
+        # flag a failed document as being ingested again
+        result = self.collection.update_one(
+            {"document_id": document_id, "user_id": user_id},
+            {"$set": {"status": "processing", "updated_at": datetime.utcnow()}, "$unset": {"error": ""}}
+        )
+        return result.matched_count > 0
+
+    def find_resumable(self, user_id: str, content_hash: str) -> Optional[Dict[str, Any]]:
+        # the most recent unfinished ingestion of the same file content, if any
+        return self.collection.find_one(
+            {"user_id": user_id, "content_hash": content_hash, "status": {"$in": ["failed", "processing"]}},
+            {"_id": 0},
+            sort=[("created_at", -1)]
+        )
+
+    def ready_hashes(self, user_id: str, content_hashes: List[str]) -> set:
+        # which of the given file contents the user already has fully ingested
+        return set(self.collection.distinct("content_hash", {"user_id": user_id, "content_hash": {"$in": list(content_hashes)}, "status": "ready"}))
+
+    def get_document(self, document_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        # get the metadata record of one document (with user access check)
+        return self.collection.find_one({"document_id": document_id, "user_id": user_id}, {"_id": 0})
+
+    def list_documents(self, user_id: str, limit: int = 100, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        # list a user's documents newest first, one page at a time. returns the page and the cursor of the next one.
+        query: Dict[str, Any] = {"user_id": user_id}
+        if cursor:
+            created_at, document_id = decode_cursor(cursor)
+            query["$or"] = [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "document_id": {"$lt": document_id}}
+            ]
+        docs = list(self.collection.find(query, {"_id": 0}).sort(
+            [("created_at", -1), ("document_id", -1)]
+        ).limit(limit + 1))
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            next_cursor = encode_cursor(docs[-1]["created_at"], docs[-1]["document_id"])
+        return docs, next_cursor
+
+    def is_backfilled(self, user_id: str) -> bool:
+        # whether records were already built for the user's legacy chunks, by any process
+        if user_id in _backfilled_users:
+            return True
+        if self.backfills.find_one({"user_id": user_id}, {"_id": 1}) is None:
+            return False
+        _backfilled_users.add(user_id)
+        return True
+
+    def delete_document(self, document_id: str, user_id: str) -> bool:
+        # remove the metadata record of a deleted document
+        result = self.collection.delete_one({"document_id": document_id, "user_id": user_id})
+        return result.deleted_count > 0
+
+    def get_documents(self, document_ids: List[str], user_id: str) -> List[Dict[str, Any]]:
+        # the records of several documents in one query, limited to those the user owns
+        return list(self.collection.find(
+            {"document_id": {"$in": list(document_ids)}, "user_id": user_id},
+            {"_id": 0, "document_id": 1, "filename": 1, "chunk_count": 1, "status": 1}
+        ))
+
+    def list_document_ids(self, user_id: str) -> List[Dict[str, Any]]:
+        # id, filename and chunk count of every document of a user
+        return list(self.collection.find({"user_id": user_id}, {"_id": 0, "document_id": 1, "filename": 1, "chunk_count": 1}))
+
+    def list_ready_documents(self) -> List[Dict[str, Any]]:
+        # every fully ingested document of every user, with what a re-index needs to tell whether it changed since
+        return list(self.collection.find(
+            {"status": "ready"},
+            {"_id": 0, "document_id": 1, "user_id": 1, "filename": 1, "content_hash": 1, "revision": 1}
+        ).sort([("user_id", 1), ("document_id", 1)]))
+
+    def mark_deleting(self, document_ids: List[str], user_id: str) -> int:
+        # flag documents whose deletion job has been queued
+        result = self.collection.update_many(
+            {"document_id": {"$in": list(document_ids)}, "user_id": user_id},
+            {"$set": {"status": "deleting", "updated_at": datetime.utcnow()}}
+        )
+        return result.modified_count
+
+    def delete_documents(self, document_ids: List[str], user_id: str) -> int:
+        result = self.collection.delete_many({"document_id": {"$in": list(document_ids)}, "user_id": user_id})
+        return result.deleted_count
+
+    def delete_user_documents(self, user_id: str) -> int:
+        result = self.collection.delete_many({"user_id": user_id})
+        return result.deleted_count
+
+    def backfill_from_chunks(self, chunk_collection: Collection, user_id: str) -> int:
+        # build records for documents ingested before this collection existed: every document_id in the user's chunks without a
+        # record, whether or not the user has uploaded new files since. runs once per user, then the user is flagged as backfilled.
+        recorded = self.collection.distinct("document_id", {"user_id": user_id})
+        pipeline = [
+            {"$match": {"user_id": user_id, "document_id": {"$nin": recorded}}},
+            {"$group": {
+                "_id": "$document_id",
+                "filename": {"$first": "$filename"},
+                "chunk_count": {"$sum": 1},
+                "page_count": {"$max": "$metadata.page"},
+                "first_chunk_id": {"$min": "$_id"}
+            }}
+        ]
+        count = 0
+        for group in chunk_collection.aggregate(pipeline):
+            created_at = group["first_chunk_id"].generation_time.replace(tzinfo=None)
+            self.collection.update_one(
+                {"document_id": group["_id"], "user_id": user_id},
+                {"$setOnInsert": {
+                    "filename": group.get("filename"),
+                    "page_count": int(group.get("page_count") or 0),
+                    "chunk_count": int(group["chunk_count"]),
+                    "size_bytes": 0,
+                    "content_hash": None,
+                    "status": "ready",
+                    "created_at": created_at,
+                    "updated_at": created_at
+                }},
+                upsert=True
+            )
+            count += 1
+        self.backfills.update_one(
+            {"user_id": user_id},
+            {"$set": {"backfilled_at": datetime.utcnow(), "documents": count}},
+            upsert=True
+        )
+        _backfilled_users.add(user_id)
+        return count
+
+def compute_listing_etag(docs: List[Dict[str, Any]], next_cursor: Optional[str]) -> str:
+    # weak etag over the fields that change when a listing page changes
+    digest = hashlib.sha1()
+    for doc in docs:
+        digest.update(f"{doc.get('document_id')}|{doc.get('status')}|{doc.get('chunk_count')}|{doc.get('updated_at')}\n".encode("utf-8"))
+    digest.update(str(next_cursor).encode("utf-8"))
+    return f'W/"{digest.hexdigest()}"'
@@ -0,0 +1,51 @@
+# extracted page text of every document, kept so a re-index can re-chunk and re-embed without extraction or ocr
+from datetime import datetime
+from typing import Any, Dict, List
+
+from pymongo.collection import Collection
+
+class DocumentPageModel:
+    def __init__(self, db):
+        self.collection: Collection = db["document_pages"]
+
+    def save_pages(self, document_id: str, user_id: str, pages: List[str], source: str = "extraction") -> int:
+        # one record per page, replacing whatever was stored for the document. source says whether the text came from
+        # extraction or was rebuilt from stored chunks.
+        self.collection.delete_many({"document_id": document_id, "user_id": user_id})
+        if not pages:
+            return 0
+        now = datetime.utcnow()
+        docs = [
+            {"document_id": document_id, "user_id": user_id, "page": number, "text": text, "source": source, "created_at": now}
+            for number, text in enumerate(pages, start=1)
+        ]
+        return len(self.collection.insert_many(docs, ordered=False).inserted_ids)
+
+    def get_pages(self, document_id: str, user_id: str) -> List[str]:
+        # the page texts in page order; empty when nothing is stored
+        cursor = self.collection.find({"document_id": document_id, "user_id": user_id}, {"_id": 0, "page": 1, "text": 1}).sort("page", 1)
+        return [doc["text"] for doc in cursor]
+
+    def delete_document_pages(self, document_ids: List[str], user_id: str) -> int:
+        result = self.collection.delete_many({"document_id": {"$in": list(document_ids)}, "user_id": user_id})
+        return result.deleted_count
+
+    def delete_user_pages(self, user_id: str) -> int:
+        result = self.collection.delete_many({"user_id": user_id})
+        return result.deleted_count
+
+def pages_from_chunks(chunks: List[Dict[str, Any]]) -> List[str]:
+    # rebuild page text from a document's stored chunks (in chunk order) by joining each page's chunks without their
+    # repeated overlap; for documents ingested before page text was kept. chunks never cross a page, so pages rebuild independently.
+    from context_packing import overlap_length
+    pages: Dict[int, str] = {}
+    for chunk in chunks:
+        page = (chunk.get("metadata") or {}).get("page", 1)
+        text = chunk.get("text", "")
+        if page not in pages:
+            pages[page] = text
+            continue
+        pages[page] += text[overlap_length(pages[page], text):]
+    if not pages:
+        return []
+    return [pages.get(number, "") for number in range(1, max(pages) + 1)]
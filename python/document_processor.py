@@ -3,16 +3,16 @@ import argparse
 import json
 import tempfile
 import uuid
+import hashlib
 import logging
 from text_extractor import extract_text_from_pdf
 from image_extractor import extract_text_from_image_as_pages
-from doc_chunks import chunk_pages
+from near_duplicates import chunk_without_duplicates
 from embeddings import embed_chunks
 from pinecone_vectors import store_document_chunks
+from log_config import configure_logging
 
-logging.basicConfig(level=logging.WARNING, 
-                    format='%(levelname)s: %(message)s',
-                    force=True)
+logger = logging.getLogger(__name__)
 
 def get_file_type(file_path):
     # determine the file type based on extension
@@ -24,6 +24,16 @@ def get_file_type(file_path):
     else:
         return 'unknown'
 
+def file_digest(file_path, block_size=1024 * 1024):
+    # return the size in bytes and the sha256 hex digest of a file
+    digest = hashlib.sha256()
+    size = 0
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+            size += len(block)
+    return size, digest.hexdigest()
+
 def process_document(file_path, output_path=None, max_tokens=500, overlap=50, user_id="anonymous"):
     file_type = get_file_type(file_path)
     if file_type == 'unknown':
@@ -32,27 +42,31 @@ def process_document(file_path, output_path=None, max_tokens=500, overlap=50, us
         pages = extract_text_from_pdf(file_path)
     elif file_type == 'image':
         pages = extract_text_from_image_as_pages(file_path)
-    chunks = chunk_pages(pages, max_tokens=max_tokens, overlap=overlap)
-    print("\n" + "=" * 80)
-    print("\033[1;36mGENERATING EMBEDDINGS - EMBEDDING OUTPUT WILL FOLLOW:\033[0m")
-    print("=" * 80 + "\n")
+    chunks, dedup = chunk_without_duplicates(pages, max_tokens, overlap)
     try:
         embedded_chunks = embed_chunks(chunks)
         embedding_dim = len(embedded_chunks[0]['embedding']) if embedded_chunks and 'embedding' in embedded_chunks[0] else 0
-        print(f"\033[1;32mSUCCESS: Generated {len(embedded_chunks)} embeddings with dimension {embedding_dim}\033[0m")
+        logger.info(f"generated {len(embedded_chunks)} embeddings with dimension {embedding_dim}")
     except Exception as e:
-        print(f"\033[1;31mERROR GENERATING EMBEDDINGS: {str(e)}\033[0m")
+        logger.error(f"error generating embeddings: {str(e)}")
         raise
     document_id = str(uuid.uuid4())
     filename = os.path.basename(file_path)
+    stored_in_mongo = False
     try:
-        from mongo_connection import client
+        from mongo_connection import mongo_manager
         from text_chunk_model import TextChunkModel
-        db = client.get_database()
-        chunk_model = TextChunkModel(db)
+        from document_model import DocumentModel
+        size_bytes, content_hash = file_digest(file_path)
+        document_model = mongo_manager.model(DocumentModel)
+        document_model.create_document(document_id, user_id, filename, size_bytes, content_hash)
+        chunk_model = mongo_manager.model(TextChunkModel)
         chunk_model.insert_chunks(embedded_chunks, document_id, user_id, filename)
+        document_model.mark_ready(document_id, user_id, len(pages), len(embedded_chunks))
+        document_model.record_dedup(document_id, user_id, dedup)
+        stored_in_mongo = True
     except Exception as e:
-        logging.warning(f"Failed to store chunks in MongoDB: {str(e)}")
+        logger.warning(f"Failed to store chunks in MongoDB: {str(e)}")
     vector_count = 0
     if embedded_chunks:
         try:
@@ -60,15 +74,18 @@ def process_document(file_path, output_path=None, max_tokens=500, overlap=50, us
                 embedded_chunks, 
                 document_id=document_id, 
                 user_id=user_id,
-                filename=filename
+                filename=filename,
+                # without the text_chunks copy the text has to live in the vector metadata
+                metadata_mode=None if stored_in_mongo else "full"
             )
         except Exception as e:
-            logging.error(f"Error storing vectors: {str(e)}")
+            logger.error(f"Error storing vectors: {str(e)}")
     result = {
         "document_id": document_id,
         "filename": filename,
         "page_count": len(pages),
         "chunk_count": len(chunks),
+        "dedup": dedup,
         "vector_count": vector_count,
         "chunks": [
             {
@@ -98,23 +115,47 @@ def debug_embeddings(text):
     return False
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Process PDF documents")
-    parser.add_argument("pdf_path", help="Path to the PDF file")
+    parser = argparse.ArgumentParser(description="Process PDF documents, or every PDF and image under a directory")
+    parser.add_argument("pdf_path", help="Path to the PDF file, or a directory to ingest")
     parser.add_argument("--output", "-o", help="Path to save output JSON")
-    parser.add_argument("--max-tokens", type=int, default=500, help="Maximum tokens per chunk")
-    parser.add_argument("--overlap", type=int, default=50, help="Overlapping tokens between chunks")
+    parser.add_argument("--max-tokens", type=int, default=None, help="Maximum tokens per chunk (default: the active index version's)")
+    parser.add_argument("--overlap", type=int, default=None, help="Overlapping tokens between chunks (default: the active index version's)")
     parser.add_argument("--user-id", default="anonymous", help="User ID")
     parser.add_argument("--debug", action="store_true", help="Run in debug mode")
+    parser.add_argument("--workers", type=int, help="Directory mode: extraction processes (default: cpu count)")
+    parser.add_argument("--manifest", help="Directory mode: resumable manifest (default: .ingest-manifest.jsonl in the directory)")
+    parser.add_argument("--batch-size", type=int, help="Directory mode: chunks per embeddings request")
     args = parser.parse_args()
+    configure_logging()
     if args.debug:
-        logging.info("Running in debug mode...")
+        logger.info("Running in debug mode...")
         result = debug_embeddings("This is a test text to check if embeddings are working correctly.")
-        logging.info(f"Debug test result: {'Success' if result else 'Failed'}")
+        logger.info(f"Debug test result: {'Success' if result else 'Failed'}")
+    elif os.path.isdir(args.pdf_path):
+        from directory_ingest import ingest_directory
+        from mongo_connection import mongo_manager
+        from usage_ledger import UsageLedgerModel, usage_writer
+        usage_writer.start(UsageLedgerModel(mongo_manager.get_database()).insert_entries)
+        try:
+            summary = ingest_directory(
+                args.pdf_path,
+                args.user_id,
+                manifest_path=args.manifest,
+                workers=args.workers,
+                max_tokens=args.max_tokens,
+                overlap=args.overlap,
+                batch_size=args.batch_size
+            )
+        finally:
+            usage_writer.stop()
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(summary, f, indent=2)
     else:
         process_document(
             args.pdf_path, 
             output_path=args.output,
-            max_tokens=args.max_tokens,
-            overlap=args.overlap,
+            max_tokens=args.max_tokens or 500,
+            overlap=50 if args.overlap is None else args.overlap,
             user_id=args.user_id
-        )
\ No newline at end of file
+        )
@@ -1,74 +1,130 @@
 import numpy as np
-import sys
+import logging
 import requests
 import os
+import threading
+import time
 from dotenv import load_dotenv
+from metrics import outbound, record_tokens
+from openai_limiter import limiter, OpenAIRetryableError, parse_retry_after, estimate_tokens, BULK
+from log_config import diagnostics_enabled
+from usage_ledger import record_call
 
 load_dotenv()
 
-def print_embedding_info(embedding, text_preview_length=50):
-    # print summary information about an embedding vector in a very visible way
-    emb_array = np.array(embedding)
-    dim = len(embedding)
-    mean = np.mean(emb_array)
-    std = np.std(emb_array)
-    min_val = np.min(emb_array)
-    max_val = np.max(emb_array)
-    print("\n" + "#" * 80)
-    print("\033[1;32m>>> EMBEDDING GENERATED <<<\033[0m")
-    print("#" * 80)
-    print(f"\033[1mDimensions:\033[0m {dim}")
-    print(f"\033[1mStatistics:\033[0m mean={mean:.6f}, std={std:.6f}, min={min_val:.6f}, max={max_val:.6f}")
-    print("#" * 80 + "\n")
+logger = logging.getLogger(__name__)
 
-def get_embeddings_direct(text, api_key, model="text-embedding-3-large"):
-    # generate embeddings using direct http request to avoid client initialization issues
-    text = text.replace("\n", " ")
+# same variable the openai sdk reads, so the chat client and these direct calls always hit the same server
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+
+def log_embedding_info(embedding, chunk_index=None):
+    # log summary statistics of an embedding vector. skipped outright (no numpy work) unless diagnostics are enabled and debug logging is on.
+    if not diagnostics_enabled() or not logger.isEnabledFor(logging.DEBUG):
+        return
+    emb_array = np.asarray(embedding, dtype=np.float32)
+    logger.debug(
+        "embedding generated",
+        extra={
+            "sample": True,
+            "chunk_index": chunk_index,
+            "dimensions": int(emb_array.shape[0]),
+            "mean": round(float(emb_array.mean()), 6),
+            "std": round(float(emb_array.std()), 6),
+            "min": round(float(emb_array.min()), 6),
+            "max": round(float(emb_array.max()), 6)
+        }
+    )
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    # one keep-alive session for the process so embeddings calls reuse pooled connections instead of a new tls handshake each time
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                pool_size = int(os.getenv("OPENAI_HTTP_POOL_SIZE", "32"))
+                session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=pool_size))
+                session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=pool_size))
+                _session = session
+    return _session
+
+# chunks sent per embeddings request; the api accepts up to 2048 inputs per call
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+
+def _request_embeddings(inputs, api_key, model, priority):
+    # one embeddings request for one or more inputs, through the shared limiter. returns the embeddings in input order.
+    inputs = [text.replace("\n", " ") for text in inputs]
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {api_key}"
     }
     payload = {
-        "input": text,
+        "input": inputs[0] if len(inputs) == 1 else inputs,
         "model": model
     }
-    response = requests.post(
-        "https://api.openai.com/v1/embeddings",
-        headers=headers,
-        json=payload
-    )
-    if response.status_code != 200:
-        raise Exception(f"API request failed with status {response.status_code}: {response.text}")
-    result = response.json()
-    return result["data"][0]["embedding"]
+    def send():
+        with outbound("openai", "embeddings"):
+            response = get_session().post(
+                f"{OPENAI_BASE_URL}/embeddings",
+                headers=headers,
+                json=payload,
+                timeout=60
+            )
+            if response.status_code == 429 or response.status_code >= 500:
+                raise OpenAIRetryableError(
+                    f"API request failed with status {response.status_code}: {response.text}",
+                    status_code=response.status_code,
+                    retry_after=parse_retry_after(response.headers)
+                )
+            if response.status_code != 200:
+                raise Exception(f"API request failed with status {response.status_code}: {response.text}")
+        return response.json()
+    estimated = sum(estimate_tokens(text) for text in inputs)
+    started = time.perf_counter()
+    try:
+        result = limiter.call(model, send, estimated, priority)
+    except Exception as e:
+        record_call("embeddings", model, time.perf_counter() - started, error=e)
+        raise
+    usage = result.get("usage") or {}
+    record_call("embeddings", model, time.perf_counter() - started, usage)
+    limiter.settle(model, estimated, usage.get("prompt_tokens"))
+    record_tokens(model, usage)
+    return [item["embedding"] for item in sorted(result["data"], key=lambda item: item["index"])]
 
-def embed_chunks(chunks):
-    # generate embeddings for a list of text chunks
+def get_embeddings_direct(text, api_key, model="text-embedding-3-large", priority=BULK):
+    # generate embeddings using direct http request to avoid client initialization issues
+    return _request_embeddings([text], api_key, model, priority)[0]
+
+def get_embeddings_batch(texts, api_key, model="text-embedding-3-large", priority=BULK):
+    # embeddings for several texts in a single request
+    if not texts:
+        return []
+    return _request_embeddings(list(texts), api_key, model, priority)
+
+def embed_chunks(chunks, batch_size=None):
+    # generate embeddings for a list of text chunks, a batch per request
+    batch_size = batch_size or EMBEDDING_BATCH_SIZE
     embedded_chunks = []
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
-        print("\033[1;31mERROR: OPENAI_API_KEY environment variable is not set!\033[0m")
+        logger.error("OPENAI_API_KEY environment variable is not set")
         raise ValueError("OPENAI_API_KEY environment variable is not set")
-    print("\n" + "!" * 100)
-    print(f"\033[1;33m>>> STARTING EMBEDDING GENERATION FOR {len(chunks)} CHUNKS <<<\033[0m")
-    print("!" * 100 + "\n")
-    for i, chunk in enumerate(chunks):
-        text_preview = chunk['text'][:50] + "..." if len(chunk['text']) > 50 else chunk['text']
-        print(f"\n\033[1;33m>>> GENERATING EMBEDDING FOR CHUNK {i+1}/{len(chunks)} <<<\033[0m")
-        print(f"Text: {text_preview}")
+    logger.info("starting embedding generation", extra={"chunk_count": len(chunks)})
+    for start in range(0, len(chunks), batch_size):
+        batch = chunks[start:start + batch_size]
+        logger.debug("embedding batch", extra={"sample": True, "start": start, "batch_size": len(batch), "chunk_count": len(chunks)})
         try:
-            print(f"\033[1mSending text to OpenAI API for embedding...\033[0m")
-            sys.stdout.flush()
-            embedding = get_embeddings_direct(chunk['text'], api_key)
-            print(f"\033[1;32mReceived embedding response from OpenAI API\033[0m")
-            sys.stdout.flush()
-            chunk['embedding'] = embedding
-            embedded_chunks.append(chunk)
-            print_embedding_info(embedding)
+            embeddings = get_embeddings_batch([chunk['text'] for chunk in batch], api_key)
         except Exception as e:
-            print(f"\n\033[1;31mERROR GENERATING EMBEDDING: {str(e)}\033[0m")
+            logger.error(f"error generating embeddings for chunks {start + 1}-{start + len(batch)}/{len(chunks)}: {str(e)}")
             raise
-    print("\n" + "=" * 100)
-    print(f"\033[1;32m>>> EMBEDDING GENERATION COMPLETE: {len(embedded_chunks)} EMBEDDINGS GENERATED <<<\033[0m")
-    print("=" * 100 + "\n")
-    return embedded_chunks
\ No newline at end of file
+        for offset, (chunk, embedding) in enumerate(zip(batch, embeddings)):
+            chunk['embedding'] = embedding
+            embedded_chunks.append(chunk)
+            log_embedding_info(embedding, start + offset)
+    logger.info("embedding generation complete", extra={"embedding_count": len(embedded_chunks)})
+    return embedded_chunks
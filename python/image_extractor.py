@@ -2,16 +2,13 @@ import os
 import base64
 import logging
 from PIL import Image
-import openai
 from dotenv import load_dotenv
+from openai_limiter import chat_completion, BULK
 
 load_dotenv()
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-openai.api_key = os.getenv('OPENAI_API_KEY')
-
 def encode_image(image_path):
     # encode an image file to base64 string
     try:
@@ -43,7 +40,7 @@ def extract_text_from_image(image_path):
     try:
         logger.info(f"Processing image: {image_path}")
         base64_image = encode_image(image_path)
-        response = openai.chat.completions.create(
+        response = chat_completion(
             model="gpt-4o",
             messages=[
                 {
@@ -63,7 +60,9 @@ def extract_text_from_image(image_path):
                 }
             ],
             max_tokens=2000,
-            temperature=0.1
+            temperature=0.1,
+            priority=BULK,
+            operation="ocr"
         )
         extracted_text = response.choices[0].message.content
         if not extracted_text or extracted_text.strip() == "":
@@ -2,10 +2,9 @@ import os
 import base64
 import requests
 from dotenv import load_dotenv
-import openai
+from openai_limiter import chat_completion, BULK
 
 load_dotenv()
-openai.api_key = os.getenv('OPENAI_API_KEY')
 
 def encode_image(image_path):
     with open(image_path, "rb") as image_file:
@@ -18,7 +17,7 @@ def extract_text_from_image(image_source):
             image_url = f"data:image/jpeg;base64,{base64_image}"
         else:
             image_url = image_source
-        response = openai.chat.completions.create(
+        response = chat_completion(
             model="gpt-4o",
             messages=[
                 {
@@ -36,7 +35,9 @@ def extract_text_from_image(image_source):
                 }
             ],
             max_tokens=2000,
-            temperature=0.1
+            temperature=0.1,
+            priority=BULK,
+            operation="ocr"
         )
         extracted_text = response.choices[0].message.content
         return extracted_text if extracted_text else "no text found in image"
@@ -0,0 +1,223 @@
+# versions of the search index. a version fixes how documents are chunked and embedded and where the results live: a pinecone
+# index and namespace per user, and a text_chunks collection. chat and ingestion use the active version; a re-index builds a new
+# version alongside it and switches the active pointer with one conditional update, so the old version stays available for rollback.
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+BASE_INDEX_NAME = "doc-ai"
+DEFAULT_EMBEDDING_MODEL = "text-embedding-3-large"
+DEFAULT_DIMENSION = 3072
+# how long a process keeps using the active version it last read before checking for a switch
+INDEX_VERSION_REFRESH_SECONDS = float(os.getenv("INDEX_VERSION_REFRESH_SECONDS", "5"))
+
+class IndexLayout(NamedTuple):
+    version: int
+    index_name: str
+    chunk_collection: str
+    embedding_model: str
+    dimension: int
+    max_tokens: int
+    overlap: int
+
+    def namespace(self, user_id: str) -> str:
+        # version 0 is the layout that predates versioning, with the bare user id as namespace
+        return user_id if self.version == 0 else f"{user_id}__v{self.version}"
+
+LEGACY_LAYOUT = IndexLayout(0, BASE_INDEX_NAME, "text_chunks", DEFAULT_EMBEDDING_MODEL, DEFAULT_DIMENSION, 500, 50)
+
+def layout_from_record(record: Optional[Dict[str, Any]]) -> IndexLayout:
+    if not record:
+        return LEGACY_LAYOUT
+    return IndexLayout(
+        record["version"], record["index_name"], record["chunk_collection"], record["embedding_model"],
+        record["dimension"], record["max_tokens"], record["overlap"]
+    )
+
+class IndexVersionModel:
+    def __init__(self, db):
+        self.db = db
+        self.collection: Collection = db["index_versions"]
+        self.progress: Collection = db["reindex_progress"]
+
+    def create_version(self, max_tokens: int, overlap: int, embedding_model: str = DEFAULT_EMBEDDING_MODEL, dimension: int = DEFAULT_DIMENSION) -> Dict[str, Any]:
+        # register a version to build. it shares the pinecone index when the dimension is unchanged and gets its own index otherwise.
+        if overlap >= max_tokens:
+            raise ValueError("overlap must be smaller than max_tokens")
+        latest = self.collection.find_one({"version": {"$exists": True}}, sort=[("version", -1)])
+        version = (latest["version"] if latest else 0) + 1
+        now = datetime.utcnow()
+        record = {
+            "_id": f"v{version}",
+            "version": version,
+            "index_name": BASE_INDEX_NAME if dimension == DEFAULT_DIMENSION else f"{BASE_INDEX_NAME}-v{version}",
+            "chunk_collection": f"text_chunks_v{version}",
+            "embedding_model": embedding_model,
+            "dimension": int(dimension),
+            "max_tokens": int(max_tokens),
+            "overlap": int(overlap),
+            "status": "building",
+            "documents_done": 0,
+            "documents_total": 0,
+            "created_at": now,
+            "updated_at": now
+        }
+        self.collection.insert_one(record)
+        chunks = self.db[record["chunk_collection"]]
+        chunks.create_index([("user_id", 1), ("document_id", 1)])
+        chunks.create_index([("document_id", 1), ("user_id", 1), ("chunk_index", 1)])
+        return record
+
+    def get_version(self, version: int) -> Optional[Dict[str, Any]]:
+        return self.collection.find_one({"_id": f"v{version}"})
+
+    def list_versions(self) -> List[Dict[str, Any]]:
+        return list(self.collection.find({"version": {"$exists": True}}).sort("version", 1))
+
+    def active_version(self) -> int:
+        pointer = self.collection.find_one({"_id": "active"})
+        return pointer["version"] if pointer else 0
+
+    def active_layout(self) -> IndexLayout:
+        version = self.active_version()
+        return layout_from_record(self.get_version(version)) if version else LEGACY_LAYOUT
+
+    def standby_layouts(self) -> List[IndexLayout]:
+        # versions being built or kept for rollback, including the pre-versioning layout until it is dropped
+        layouts = [layout_from_record(record) for record in self.collection.find({"status": {"$in": ["building", "retired"]}})]
+        pointer = self.collection.find_one({"_id": "active"})
+        if pointer and pointer["version"] != 0 and not pointer.get("legacy_dropped"):
+            layouts.append(LEGACY_LAYOUT)
+        return layouts
+
+    def mark_dropped(self, version: int) -> None:
+        if version == 0:
+            self.collection.update_one({"_id": "active"}, {"$set": {"legacy_dropped": True}})
+        else:
+            self.set_fields(version, status="dropped", dropped_at=datetime.utcnow())
+
+    def activate(self, version: int, expected: int) -> bool:
+        # point chat and ingestion at version, provided the active version is still expected. returns False when someone switched first.
+        now = datetime.utcnow()
+        if version:
+            record = self.get_version(version)
+            if record is None or record["status"] == "dropped":
+                raise LookupError(f"index version {version} does not exist")
+        if expected == 0 and self.collection.find_one({"_id": "active"}) is None:
+            try:
+                self.collection.insert_one({"_id": "active", "version": version, "previous": 0, "switched_at": now})
+            except DuplicateKeyError:
+                return False
+        else:
+            result = self.collection.update_one(
+                {"_id": "active", "version": expected},
+                {"$set": {"version": version, "previous": expected, "switched_at": now}}
+            )
+            if result.matched_count == 0:
+                return False
+        if version:
+            self.set_fields(version, status="active", activated_at=now)
+        if expected:
+            self.set_fields(expected, status="retired", retired_at=now)
+        return True
+
+    def claim_build(self, version: int, owner: str, lease_seconds: int) -> bool:
+        # take the build lease of a version so two runners do not re-index the same corpus at once
+        now = datetime.utcnow()
+        record = self.collection.find_one_and_update(
+            {"_id": f"v{version}", "status": "building", "$or": [{"lease_owner": owner}, {"lease_owner": None}, {"lease_expires_at": {"$lt": now}}]},
+            {"$set": {"lease_owner": owner, "lease_expires_at": now + timedelta(seconds=lease_seconds), "updated_at": now}},
+            return_document=ReturnDocument.AFTER
+        )
+        return record is not None
+
+    def release_build(self, version: int, owner: str) -> None:
+        self.collection.update_one({"_id": f"v{version}", "lease_owner": owner}, {"$set": {"lease_owner": None, "lease_expires_at": None}})
+
+    def set_fields(self, version: int, **fields) -> None:
+        fields["updated_at"] = datetime.utcnow()
+        self.collection.update_one({"_id": f"v{version}"}, {"$set": fields})
+
+    def mark_document_done(self, version: int, document: Dict[str, Any], chunk_count: int) -> None:
+        # resume marker: the document is in the version as of this content hash
+        self.progress.update_one(
+            {"version": version, "document_id": document["document_id"], "user_id": document["user_id"]},
+            {"$set": {"content_hash": document.get("content_hash"), "revision": document.get("revision", 0), "chunk_count": chunk_count, "done_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    def done_documents(self, version: int) -> Dict[tuple, tuple]:
+        cursor = self.progress.find({"version": version}, {"_id": 0, "document_id": 1, "user_id": 1, "content_hash": 1, "revision": 1})
+        return {(doc["user_id"], doc["document_id"]): (doc.get("content_hash"), doc.get("revision", 0)) for doc in cursor}
+
+    def clear_progress(self, version: int) -> int:
+        return self.progress.delete_many({"version": version}).deleted_count
+
+class ActiveLayouts:
+    # the active layout as seen by this process, re-read at most every refresh_seconds
+    def __init__(self, refresh_seconds: float = INDEX_VERSION_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._loader: Optional[Callable[[], IndexVersionModel]] = None
+        self._active = LEGACY_LAYOUT
+        self._standby: List[IndexLayout] = []
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[IndexLayout, IndexLayout], None]] = []
+
+    def bind(self, loader: Callable[[], IndexVersionModel]) -> None:
+        # loader returns the version model; until one is bound (tests, tools without mongo) the legacy layout is used
+        self._loader = loader
+        self._loaded_at = 0.0
+
+    def on_change(self, listener: Callable[[IndexLayout, IndexLayout], None]) -> None:
+        self._listeners.append(listener)
+
+    def active(self) -> IndexLayout:
+        self._refresh()
+        return self._active
+
+    def live(self) -> List[IndexLayout]:
+        # the active layout and those being built or kept for rollback; deletions have to reach all of them
+        self._refresh()
+        return [self._active] + [layout for layout in self._standby if layout.version != self._active.version]
+
+    def refresh(self) -> None:
+        self._loaded_at = 0.0
+        self._refresh()
+
+    def _refresh(self) -> None:
+        if self._loader is None or time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return
+        with self._lock:
+            if time.monotonic() - self._loaded_at < self.refresh_seconds:
+                return
+            try:
+                model = self._loader()
+                active = model.active_layout()
+                standby = model.standby_layouts()
+            except Exception as e:
+                # keep serving the last known layout; mongo being briefly unreachable should not change where chat searches
+                logger.warning(f"could not read the active index version: {str(e)}")
+                self._loaded_at = time.monotonic()
+                return
+            previous = self._active
+            self._active, self._standby = active, standby
+            self._loaded_at = time.monotonic()
+        if active != previous:
+            logger.info(f"active index version is now {active.version} (was {previous.version})")
+            for listener in self._listeners:
+                listener(previous, active)
+
+index_layouts = ActiveLayouts()
+
+def current_layout() -> IndexLayout:
+    return index_layouts.active()
@@ -0,0 +1,344 @@
+# resumable ingestion: extracted pages, chunks and finished embedding batches are checkpointed per document,
+# so a retry after a failure picks up at the first batch that did not complete
+import os
+import logging
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+from pymongo.errors import DuplicateKeyError
+import metrics
+from metrics import stage
+from index_versions import current_layout
+from near_duplicates import chunk_without_duplicates
+from usage_ledger import usage_scope
+
+logger = logging.getLogger(__name__)
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+INGEST_LEASE_SECONDS = int(os.getenv("INGEST_LEASE_SECONDS", "300"))
+# extracted pages above this size are not checkpointed (mongo documents are capped at 16MB); a resume then needs the file again
+MAX_CHECKPOINT_PAGES_BYTES = 12 * 1024 * 1024
+
+class IngestionInProgress(Exception):
+    pass
+
+class CheckpointMissing(Exception):
+    pass
+
+class IngestionCheckpointModel:
+    def __init__(self, db):
+        self.collection: Collection = db["ingestion_checkpoints"]
+        self._index_ready = False
+
+    def _ensure_index(self) -> None:
+        # claim() relies on the unique key to turn a lost race into DuplicateKeyError instead of a second checkpoint
+        if not self._index_ready:
+            self.collection.create_index([("document_id", 1), ("user_id", 1)], unique=True)
+            self._index_ready = True
+
+    def claim(self, document_id: str, user_id: str, filename: str, owner: str, lease_seconds: int = INGEST_LEASE_SECONDS) -> Dict[str, Any]:
+        # take the ingestion lease of a document, creating its checkpoint on first use. raises IngestionInProgress if another worker holds a live lease.
+        self._ensure_index()
+        now = datetime.utcnow()
+        query = {
+            "document_id": document_id,
+            "user_id": user_id,
+            "$or": [{"lease_owner": owner}, {"lease_expires_at": {"$lt": now}}, {"lease_owner": None}]
+        }
+        update = {
+            "$set": {"lease_owner": owner, "lease_expires_at": now + timedelta(seconds=lease_seconds), "updated_at": now},
+            "$setOnInsert": {"filename": filename, "completed_batches": [], "created_at": now}
+        }
+        try:
+            checkpoint = self.collection.find_one_and_update(query, update, upsert=True, return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError:
+            # the checkpoint exists and its lease is held by someone else
+            checkpoint = None
+        if checkpoint is None:
+            raise IngestionInProgress(f"document {document_id} is already being ingested")
+        return checkpoint
+
+    def release(self, document_id: str, user_id: str, owner: str) -> None:
+        self.collection.update_one(
+            {"document_id": document_id, "user_id": user_id, "lease_owner": owner},
+            {"$set": {"lease_owner": None, "lease_expires_at": None, "updated_at": datetime.utcnow()}}
+        )
+
+    def save_pages(self, document_id: str, user_id: str, pages: List[str]) -> bool:
+        # keep the extraction output so a retry does not pay for extraction or ocr again
+        if sum(len(page) for page in pages) * 4 > MAX_CHECKPOINT_PAGES_BYTES:
+            logger.info(f"extracted text of document {document_id} is too large to checkpoint")
+            return False
+        self.collection.update_one(
+            {"document_id": document_id, "user_id": user_id},
+            {"$set": {"pages": pages, "page_count": len(pages), "updated_at": datetime.utcnow()}}
+        )
+        return True
+
+    def mark_chunked(self, document_id: str, user_id: str, chunk_count: int, batch_size: int) -> None:
+        # chunks are in text_chunks; fix the batch boundaries so every resume splits them the same way
+        self.collection.update_one(
+            {"document_id": document_id, "user_id": user_id},
+            {"$set": {"chunk_count": chunk_count, "batch_size": batch_size, "completed_batches": [], "updated_at": datetime.utcnow()}}
+        )
+
+    def complete_batch(self, document_id: str, user_id: str, batch_number: int, owner: str, lease_seconds: int = INGEST_LEASE_SECONDS) -> None:
+        # record a batch whose vectors and embeddings are stored, and extend the lease. a worker whose lease expired and was taken
+        # over gets IngestionInProgress and stops, rather than taking the lease back and running alongside the new owner.
+        now = datetime.utcnow()
+        result = self.collection.update_one(
+            {"document_id": document_id, "user_id": user_id, "lease_owner": owner},
+            {
+                "$addToSet": {"completed_batches": batch_number},
+                "$set": {"lease_expires_at": now + timedelta(seconds=lease_seconds), "updated_at": now}
+            }
+        )
+        if result.matched_count == 0:
+            raise IngestionInProgress(f"lost the ingestion lease of document {document_id} to another worker")
+
+    def get(self, document_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        return self.collection.find_one({"document_id": document_id, "user_id": user_id}, {"_id": 0})
+
+    def delete(self, document_id: str, user_id: str) -> bool:
+        result = self.collection.delete_one({"document_id": document_id, "user_id": user_id})
+        return result.deleted_count > 0
+
+    def delete_many(self, document_ids: List[str], user_id: str) -> int:
+        result = self.collection.delete_many({"document_id": {"$in": list(document_ids)}, "user_id": user_id})
+        return result.deleted_count
+
+    def delete_user_checkpoints(self, user_id: str) -> int:
+        result = self.collection.delete_many({"user_id": user_id})
+        return result.deleted_count
+
+def extract_pages(file_path: str) -> List[str]:
+    # text of each page of a pdf, or the ocr text of an image as a single page
+    from document_processor import get_file_type
+    file_type = get_file_type(file_path)
+    if file_type == 'pdf':
+        from text_extractor import extract_text_from_pdf
+        return extract_text_from_pdf(file_path)
+    if file_type == 'image':
+        from image_extractor import extract_text_from_image_as_pages
+        return extract_text_from_image_as_pages(file_path)
+    raise ValueError(f"unsupported file type: {file_type}")
+
+def ingest_document(
+    document_id: str,
+    user_id: str,
+    filename: str,
+    file_path: Optional[str],
+    checkpoints: IngestionCheckpointModel,
+    document_model,
+    chunk_model,
+    batch_size: Optional[int] = None,
+    max_tokens: Optional[int] = None,
+    overlap: Optional[int] = None,
+    page_model=None
+) -> Dict[str, Any]:
+    # run or resume the ingestion of one document. file_path may be None when resuming from checkpointed or stored pages.
+    # chunking, embedding model and vector location follow the active index version.
+    from embeddings import get_embeddings_batch
+    from pinecone_vectors import store_document_chunks
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY environment variable is not set")
+    layout = current_layout()
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    checkpoint = checkpoints.claim(document_id, user_id, filename, owner)
+    try:
+        pages = checkpoint.get("pages")
+        if pages is None and page_model is not None and file_path is None:
+            pages = page_model.get_pages(document_id, user_id) or None
+        if pages is None:
+            if file_path is None:
+                raise CheckpointMissing(f"no extracted text is checkpointed for document {document_id}; upload the file again")
+            with stage("ingest.extraction"), usage_scope(user_id=user_id, document_id=document_id):
+                pages = extract_pages(file_path)
+            checkpoints.save_pages(document_id, user_id, pages)
+            if page_model is not None:
+                page_model.save_pages(document_id, user_id, pages)
+
+        chunk_count = checkpoint.get("chunk_count")
+        # on a resume the report is already on the document
+        dedup = None
+        if chunk_count is None:
+            with stage("ingest.chunking"):
+                chunks, dedup = chunk_without_duplicates(pages, max_tokens or layout.max_tokens, layout.overlap if overlap is None else overlap)
+            metrics.chunks_total.inc(len(chunks))
+            document_model.record_dedup(document_id, user_id, dedup)
+            if dedup["embeddings_saved"]:
+                logger.info(f"document {document_id}: {dedup['embeddings_saved']} of {dedup['chunks_before']} chunks were repeated content and will not be embedded")
+            with stage("ingest.mongo_store"):
+                # a crash between these two writes leaves partial chunks, so start from a clean slate
+                chunk_model.delete_chunks_by_document(document_id, user_id)
+                chunk_model.insert_chunks(chunks, document_id, user_id, filename)
+            batch_size = batch_size or INGEST_BATCH_SIZE
+            checkpoints.mark_chunked(document_id, user_id, len(chunks), batch_size)
+            completed = set()
+        else:
+            chunks = chunk_model.get_chunks(document_id, user_id)
+            if len(chunks) != chunk_count:
+                raise CheckpointMissing(f"expected {chunk_count} stored chunks for document {document_id}, found {len(chunks)}")
+            batch_size = checkpoint.get("batch_size") or batch_size or INGEST_BATCH_SIZE
+            completed = set(checkpoint.get("completed_batches") or [])
+
+        batch_count = (len(chunks) + batch_size - 1) // batch_size
+        if completed:
+            logger.info(f"resuming document {document_id} at batch {len(completed) + 1}/{batch_count}")
+        sample_embedding = None
+        embedding_dimensions = 0
+        for batch_number in range(batch_count):
+            if batch_number in completed:
+                continue
+            start = batch_number * batch_size
+            batch = chunks[start:start + batch_size]
+            with stage("ingest.embedding"), usage_scope(user_id=user_id, document_id=document_id):
+                embeddings = get_embeddings_batch([chunk["text"] for chunk in batch], api_key, model=layout.embedding_model)
+            for chunk, embedding in zip(batch, embeddings):
+                chunk["embedding"] = embedding
+            with stage("ingest.vector_store"):
+                store_document_chunks(batch, document_id=document_id, user_id=user_id, filename=filename, start_index=start, layout=layout)
+            with stage("ingest.mongo_store"):
+                chunk_model.set_embeddings(document_id, user_id, start, embeddings)
+            checkpoints.complete_batch(document_id, user_id, batch_number, owner)
+            if sample_embedding is None and embeddings:
+                sample_embedding = embeddings[0][:10]
+                embedding_dimensions = len(embeddings[0])
+            for chunk in batch:
+                chunk.pop("embedding", None)
+
+        document_model.mark_ready(document_id, user_id, len(pages), len(chunks))
+        checkpoints.delete(document_id, user_id)
+        return {
+            "document_id": document_id,
+            "page_count": len(pages),
+            "chunk_count": len(chunks),
+            "batch_count": batch_count,
+            "resumed_batches": len(completed),
+            "dedup": dedup,
+            "first_page_preview": str(pages[0][:200]) if pages else "",
+            "first_chunk_preview": str(chunks[0]["text"][:200]) if chunks else "",
+            "embedding_dimensions": embedding_dimensions,
+            "sample_embedding": sample_embedding
+        }
+    except Exception:
+        checkpoints.release(document_id, user_id, owner)
+        raise
+
+def plan_replacement(stored: List[Dict[str, Any]], new_chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # compare the stored chunk fingerprints of a document with its new chunks, position by position.
+    # a position whose page and text are unchanged needs no work; otherwise its embedding is reused when the same text is stored
+    # anywhere in the document, and computed only when the text is new.
+    from text_chunk_model import chunk_hash
+    stored_by_index = {chunk["chunk_index"]: chunk for chunk in stored}
+    stored_by_hash = {}
+    for chunk in stored:
+        if chunk.get("has_embedding", True):
+            stored_by_hash.setdefault(chunk["content_hash"], chunk["chunk_index"])
+    unchanged, reuse, embed = [], {}, []
+    for index, chunk in enumerate(new_chunks):
+        digest = chunk_hash(chunk["text"])
+        current = stored_by_index.get(index)
+        if current and current["content_hash"] == digest and current.get("page") == chunk["metadata"].get("page") and current.get("has_embedding", True):
+            unchanged.append(index)
+        elif digest in stored_by_hash:
+            reuse[index] = stored_by_hash[digest]
+        else:
+            embed.append(index)
+    removed = sorted(index for index in stored_by_index if index >= len(new_chunks))
+    return {"unchanged": unchanged, "reuse": reuse, "embed": embed, "removed": removed}
+
+def replace_document(
+    document_id: str,
+    user_id: str,
+    file_path: str,
+    size_bytes: int,
+    content_hash: str,
+    checkpoints: IngestionCheckpointModel,
+    document_model,
+    chunk_model,
+    batch_size: Optional[int] = None,
+    max_tokens: Optional[int] = None,
+    overlap: Optional[int] = None,
+    page_model=None
+) -> Dict[str, Any]:
+    # ingest a new revision of an existing document in place, embedding and writing only the chunks that changed.
+    # vectors are written before their mongo chunks, so an interrupted replace can simply be run again: the diff against mongo redoes whatever did not land.
+    from embeddings import get_embeddings_batch
+    from pinecone_vectors import store_document_chunks, delete_chunk_vectors
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY environment variable is not set")
+    layout = current_layout()
+    document = document_model.get_document(document_id, user_id)
+    if document is None:
+        raise LookupError(f"document {document_id} not found")
+    filename = document.get("filename")
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    checkpoints.claim(document_id, user_id, filename, owner)
+    try:
+        with stage("ingest.extraction"), usage_scope(user_id=user_id, document_id=document_id):
+            pages = extract_pages(file_path)
+        with stage("ingest.chunking"):
+            chunks, dedup = chunk_without_duplicates(pages, max_tokens or layout.max_tokens, layout.overlap if overlap is None else overlap)
+        with stage("ingest.diff"):
+            plan = plan_replacement(chunk_model.get_chunk_fingerprints(document_id, user_id), chunks)
+        logger.info(
+            f"replacing document {document_id}: {len(plan['embed'])} new, {len(plan['reuse'])} moved, "
+            f"{len(plan['unchanged'])} unchanged, {len(plan['removed'])} removed chunks"
+        )
+        metrics.chunks_total.inc(len(plan["embed"]))
+
+        stored_embeddings = chunk_model.get_embeddings(document_id, user_id, sorted(set(plan["reuse"].values())))
+        for index, source_index in plan["reuse"].items():
+            if source_index in stored_embeddings:
+                chunks[index]["embedding"] = stored_embeddings[source_index]
+            else:
+                plan["embed"].append(index)
+        plan["embed"].sort()
+
+        batch_size = batch_size or INGEST_BATCH_SIZE
+        for start in range(0, len(plan["embed"]), batch_size):
+            indexes = plan["embed"][start:start + batch_size]
+            with stage("ingest.embedding"), usage_scope(user_id=user_id, document_id=document_id):
+                embeddings = get_embeddings_batch([chunks[index]["text"] for index in indexes], api_key, model=layout.embedding_model)
+            for index, embedding in zip(indexes, embeddings):
+                chunks[index]["embedding"] = embedding
+
+        changed = sorted(plan["embed"] + [index for index in plan["reuse"] if index not in plan["embed"]])
+        for start in range(0, len(changed), batch_size):
+            batch = [dict(chunks[index], chunk_index=index) for index in changed[start:start + batch_size]]
+            with stage("ingest.vector_store"):
+                store_document_chunks(batch, document_id=document_id, user_id=user_id, filename=filename, layout=layout)
+            with stage("ingest.mongo_store"):
+                chunk_model.replace_chunks(batch, document_id, user_id, filename)
+        if plan["removed"]:
+            with stage("ingest.vector_store"):
+                delete_chunk_vectors(document_id, user_id, plan["removed"], layout=layout)
+            with stage("ingest.mongo_store"):
+                chunk_model.delete_chunks_from(document_id, user_id, len(chunks))
+
+        if page_model is not None:
+            page_model.save_pages(document_id, user_id, pages)
+        document_model.mark_replaced(document_id, user_id, size_bytes, content_hash, len(pages), len(chunks))
+        document_model.record_dedup(document_id, user_id, dedup)
+        checkpoints.delete(document_id, user_id)
+        return {
+            "document_id": document_id,
+            "filename": filename,
+            "page_count": len(pages),
+            "chunk_count": len(chunks),
+            "unchanged_chunks": len(plan["unchanged"]),
+            "embedded_chunks": len(plan["embed"]),
+            "reused_embeddings": len(changed) - len(plan["embed"]),
+            "upserted_chunks": len(changed),
+            "deleted_chunks": len(plan["removed"]),
+            "dedup": dedup
+        }
+    except Exception:
+        checkpoints.release(document_id, user_id, owner)
+        raise
@@ -0,0 +1,189 @@
+# background jobs and the progress records clients poll. bulk deletion and user purges run inside the api process; durable jobs
+# (ingestion) are a work queue in the same collection, claimed atomically by worker processes under a lease they keep renewing.
+# a job whose worker disappears is requeued once its lease expires, failures are retried with backoff, and a job that keeps
+# failing is dead-lettered (status "dead") for someone to look at and requeue.
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.collection import Collection
+
+logger = logging.getLogger(__name__)
+
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+# delay before the first retry of a failed job; doubled for every further attempt
+JOB_RETRY_BACKOFF_SECONDS = float(os.getenv("JOB_RETRY_BACKOFF_SECONDS", "30"))
+
+class JobModel:
+    def __init__(self, db):
+        self.collection: Collection = db["jobs"]
+
+    def create_job(self, kind: str, user_id: str, params: Optional[Dict[str, Any]] = None, total: int = 0) -> Dict[str, Any]:
+        now = datetime.utcnow()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "kind": kind,
+            "user_id": user_id,
+            "params": params or {},
+            "status": "queued",
+            "step": None,
+            "done": 0,
+            "total": int(total),
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now
+        }
+        self.collection.insert_one(dict(job))
+        return job
+
+    def enqueue(self, kind: str, user_id: str, params: Optional[Dict[str, Any]] = None, max_attempts: Optional[int] = None, priority: int = 0) -> Dict[str, Any]:
+        # a durable job, run by whichever worker claims it first. lower priority values are claimed first.
+        now = datetime.utcnow()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "kind": kind,
+            "user_id": user_id,
+            "params": params or {},
+            "status": "queued",
+            "durable": True,
+            "priority": int(priority),
+            "attempts": 0,
+            "max_attempts": int(max_attempts or JOB_MAX_ATTEMPTS),
+            "available_at": now,
+            "lease_owner": None,
+            "lease_expires_at": None,
+            "step": None,
+            "done": 0,
+            "total": 0,
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now
+        }
+        self.collection.insert_one(dict(job))
+        return job
+
+    def find_open(self, kind: str, user_id: str, document_id: str, content_hash: str) -> Optional[Dict[str, Any]]:
+        # a queued or running durable job already handling this upload of the document
+        return self.collection.find_one(
+            {"durable": True, "kind": kind, "user_id": user_id, "params.document_id": document_id, "params.content_hash": content_hash,
+             "status": {"$in": ["queued", "running"]}},
+            {"_id": 0}
+        )
+
+    def claim(self, owner: str, kinds: Iterable[str], lease_seconds: int = JOB_LEASE_SECONDS) -> Optional[Dict[str, Any]]:
+        # take the next due durable job of one of kinds, or None when there is none. one find_one_and_update, so two workers
+        # can never claim the same job.
+        now = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {"durable": True, "status": "queued", "kind": {"$in": list(kinds)}, "available_at": {"$lte": now}},
+            {"$set": {"status": "running", "lease_owner": owner, "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                      "started_at": now, "updated_at": now}, "$inc": {"attempts": 1}},
+            sort=[("priority", 1), ("available_at", 1)],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def heartbeat(self, job_id: str, owner: str, lease_seconds: int = JOB_LEASE_SECONDS) -> bool:
+        # extend the lease; False means the job is no longer this worker's (its lease expired and it was requeued)
+        now = datetime.utcnow()
+        result = self.collection.update_one(
+            {"job_id": job_id, "status": "running", "lease_owner": owner},
+            {"$set": {"lease_expires_at": now + timedelta(seconds=lease_seconds), "updated_at": now}}
+        )
+        return result.matched_count > 0
+
+    def finish(self, job_id: str, owner: str, result: Dict[str, Any]) -> bool:
+        # complete a claimed job, unless the lease was lost in the meantime
+        now = datetime.utcnow()
+        update = self.collection.update_one(
+            {"job_id": job_id, "status": "running", "lease_owner": owner},
+            {"$set": {"status": "completed", "step": None, "result": result, "error": None, "lease_owner": None,
+                      "lease_expires_at": None, "finished_at": now, "updated_at": now}}
+        )
+        return update.matched_count > 0
+
+    def retry_or_dead(self, job_id: str, owner: str, error: str) -> Optional[str]:
+        # after a failed attempt: back to the queue with exponential backoff, or dead-lettered once attempts run out.
+        # returns the new status, or None when the lease was lost.
+        job = self.collection.find_one({"job_id": job_id, "status": "running", "lease_owner": owner}, {"attempts": 1, "max_attempts": 1})
+        if job is None:
+            return None
+        now = datetime.utcnow()
+        fields: Dict[str, Any] = {"error": error[:500], "lease_owner": None, "lease_expires_at": None, "updated_at": now}
+        if job["attempts"] >= job.get("max_attempts", JOB_MAX_ATTEMPTS):
+            fields.update(status="dead", finished_at=now)
+        else:
+            fields.update(status="queued", available_at=now + timedelta(seconds=JOB_RETRY_BACKOFF_SECONDS * 2 ** (job["attempts"] - 1)))
+        update = self.collection.update_one({"job_id": job_id, "status": "running", "lease_owner": owner}, {"$set": fields})
+        return fields["status"] if update.matched_count else None
+
+    def requeue_expired(self) -> int:
+        # jobs whose worker stopped renewing the lease (crashed, killed, partitioned): requeued, or dead-lettered when that
+        # was their last attempt
+        now = datetime.utcnow()
+        expired = {"durable": True, "status": "running", "lease_expires_at": {"$lt": now}}
+        dead = self.collection.update_many(
+            {**expired, "$expr": {"$gte": ["$attempts", "$max_attempts"]}},
+            {"$set": {"status": "dead", "error": "lease expired on the last attempt", "lease_owner": None, "finished_at": now, "updated_at": now}}
+        )
+        requeued = self.collection.update_many(
+            expired,
+            {"$set": {"status": "queued", "available_at": now, "lease_owner": None, "lease_expires_at": None, "updated_at": now}}
+        )
+        if dead.modified_count or requeued.modified_count:
+            logger.warning(f"requeued {requeued.modified_count} and dead-lettered {dead.modified_count} jobs with expired leases")
+        return requeued.modified_count + dead.modified_count
+
+    def requeue_dead(self, job_ids: Optional[List[str]] = None) -> int:
+        # give dead-lettered jobs a fresh set of attempts
+        query: Dict[str, Any] = {"durable": True, "status": "dead"}
+        if job_ids:
+            query["job_id"] = {"$in": list(job_ids)}
+        now = datetime.utcnow()
+        return self.collection.update_many(query, {"$set": {"status": "queued", "attempts": 0, "available_at": now, "updated_at": now}}).modified_count
+
+    def queue_counts(self) -> Dict[str, int]:
+        # durable jobs by status
+        cursor = self.collection.aggregate([{"$match": {"durable": True}}, {"$group": {"_id": "$status", "count": {"$sum": 1}}}])
+        return {doc["_id"]: doc["count"] for doc in cursor}
+
+    def start(self, job_id: str) -> None:
+        self._set(job_id, status="running", started_at=datetime.utcnow())
+
+    def progress(self, job_id: str, step: str, done: Optional[int] = None, total: Optional[int] = None) -> None:
+        fields: Dict[str, Any] = {"step": step}
+        if done is not None:
+            fields["done"] = int(done)
+        if total is not None:
+            fields["total"] = int(total)
+        self._set(job_id, **fields)
+
+    def complete(self, job_id: str, result: Dict[str, Any]) -> None:
+        self._set(job_id, status="completed", step=None, result=result, finished_at=datetime.utcnow())
+
+    def fail(self, job_id: str, error: str) -> None:
+        self._set(job_id, status="failed", error=error[:500], finished_at=datetime.utcnow())
+
+    def get_job(self, job_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+        return self.collection.find_one({"job_id": job_id, "user_id": user_id}, {"_id": 0})
+
+    def _set(self, job_id: str, **fields) -> None:
+        fields["updated_at"] = datetime.utcnow()
+        self.collection.update_one({"job_id": job_id}, {"$set": fields})
+
+def run_job(jobs: JobModel, job_id: str, work) -> None:
+    # run work(report) as the body of a job. report(step, done, total) records progress; the return value becomes the job's result.
+    jobs.start(job_id)
+    def report(step: str, done: Optional[int] = None, total: Optional[int] = None) -> None:
+        jobs.progress(job_id, step, done, total)
+    try:
+        jobs.complete(job_id, work(report))
+    except Exception as e:
+        logger.error(f"job {job_id} failed: {str(e)}")
+        jobs.fail(job_id, str(e))
@@ -0,0 +1,214 @@
+# local stand-in for the openai embeddings and chat completions endpoints, for load tests that should not cost money.
+#   uvicorn loadtest.fake_openai:app --port 8101
+# point the api at it with OPENAI_BASE_URL=http://127.0.0.1:8101/v1. behaviour is configured through FAKE_OPENAI_* variables.
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import time
+import uuid
+from collections import deque
+from typing import Dict, List, Optional
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+EMBEDDING_DIMENSIONS = {"text-embedding-3-large": 3072, "text-embedding-3-small": 1536, "text-embedding-ada-002": 1536}
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+SOURCE_PATTERN = re.compile(r"\[from (.+?), page (\d+)\]")
+
+class FakeOpenAIConfig:
+    def __init__(self, latency_ms: float = 40.0, jitter_ms: float = 20.0, per_item_ms: float = 2.0, per_token_ms: float = 8.0,
+                 rpm_limit: int = 0, tpm_limit: int = 0, error_rate: float = 0.0, completion_tokens: int = 120):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.per_item_ms = per_item_ms
+        self.per_token_ms = per_token_ms
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self.error_rate = error_rate
+        self.completion_tokens = completion_tokens
+
+    @classmethod
+    def from_env(cls) -> "FakeOpenAIConfig":
+        return cls(
+            latency_ms=float(os.getenv("FAKE_OPENAI_LATENCY_MS", "40")),
+            jitter_ms=float(os.getenv("FAKE_OPENAI_JITTER_MS", "20")),
+            per_item_ms=float(os.getenv("FAKE_OPENAI_PER_ITEM_MS", "2")),
+            per_token_ms=float(os.getenv("FAKE_OPENAI_PER_TOKEN_MS", "8")),
+            rpm_limit=int(os.getenv("FAKE_OPENAI_RPM", "0")),
+            tpm_limit=int(os.getenv("FAKE_OPENAI_TPM", "0")),
+            error_rate=float(os.getenv("FAKE_OPENAI_ERROR_RATE", "0")),
+            completion_tokens=int(os.getenv("FAKE_OPENAI_COMPLETION_TOKENS", "120"))
+        )
+
+def estimate_tokens(text: str) -> int:
+    # roughly four characters per token, which is close enough for rate limiting and usage blocks
+    return max(1, len(text) // 4)
+
+def fake_embedding(text: str, dimensions: int) -> np.ndarray:
+    # hashed bag of words: texts that share words get a high cosine similarity, so retrieval over fake vectors still ranks sensibly
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in WORD_PATTERN.findall(text.lower()):
+        digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dimensions
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = float(np.linalg.norm(vector))
+    if norm == 0.0:
+        vector[0] = 1.0
+        return vector
+    return vector / norm
+
+class RateLimiter:
+    # sliding one-minute window of requests and tokens per model, mirroring openai's rpm/tpm limits
+    def __init__(self, rpm_limit: int, tpm_limit: int):
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self._events: Dict[str, deque] = {}
+
+    def check(self, model: str, tokens: int, now: Optional[float] = None):
+        # returns (allowed, seconds until a retry could succeed, remaining requests, remaining tokens)
+        now = time.monotonic() if now is None else now
+        events = self._events.setdefault(model, deque())
+        while events and now - events[0][0] >= 60.0:
+            events.popleft()
+        used_tokens = sum(count for _, count in events)
+        over_requests = self.rpm_limit and len(events) >= self.rpm_limit
+        over_tokens = self.tpm_limit and used_tokens + tokens > self.tpm_limit
+        if over_requests or over_tokens:
+            retry_after = max(0.05, 60.0 - (now - events[0][0])) if events else 1.0
+            return False, retry_after, max(0, self.rpm_limit - len(events)), max(0, self.tpm_limit - used_tokens)
+        events.append((now, tokens))
+        return True, 0.0, max(0, self.rpm_limit - len(events)), max(0, self.tpm_limit - used_tokens - tokens)
+
+def _message_text(messages: List[dict]) -> str:
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(part.get("text", "") for part in content if isinstance(part, dict))
+    return "\n".join(parts)
+
+def fake_answer(prompt: str, max_tokens: int) -> str:
+    # a deterministic answer that cites the first sources found in the prompt, the way the real model is asked to
+    sources = SOURCE_PATTERN.findall(prompt)[:3]
+    citations = " ".join(f"[{filename}, page {page}]" for filename, page in sources)
+    words = WORD_PATTERN.findall(prompt.lower())
+    filler = []
+    seed = int(hashlib.sha1(prompt.encode()).hexdigest()[:8], 16)
+    while words and len(filler) < max_tokens:
+        filler.append(words[(seed + len(filler) * 7) % len(words)])
+    body = " ".join(filler[:max_tokens]) or "no context was provided"
+    return f"{body.capitalize()}. {citations}".strip()
+
+def _error(status: int, message: str, error_type: str, headers: Optional[dict] = None) -> JSONResponse:
+    return JSONResponse(status_code=status, content={"error": {"message": message, "type": error_type, "param": None, "code": None}}, headers=headers)
+
+def create_app(config: Optional[FakeOpenAIConfig] = None) -> FastAPI:
+    config = config or FakeOpenAIConfig.from_env()
+    limiter = RateLimiter(config.rpm_limit, config.tpm_limit)
+    app = FastAPI(title="fake openai")
+    app.state.config = config
+    app.state.requests_served = 0
+
+    async def admit(model: str, tokens: int):
+        # the rate-limit and injected-failure checks every endpoint shares; returns an error response or None
+        allowed, retry_after, remaining_requests, remaining_tokens = limiter.check(model, tokens)
+        if not allowed:
+            headers = {
+                "retry-after": f"{retry_after:.2f}",
+                "x-ratelimit-limit-requests": str(config.rpm_limit),
+                "x-ratelimit-remaining-requests": str(remaining_requests),
+                "x-ratelimit-limit-tokens": str(config.tpm_limit),
+                "x-ratelimit-remaining-tokens": str(remaining_tokens)
+            }
+            return _error(429, f"rate limit reached for {model}", "requests", headers)
+        if config.error_rate and random.random() < config.error_rate:
+            return _error(500, "injected failure", "server_error")
+        app.state.requests_served += 1
+        return None
+
+    async def delay(extra_ms: float = 0.0):
+        jitter = random.uniform(-config.jitter_ms, config.jitter_ms) if config.jitter_ms else 0.0
+        await asyncio.sleep(max(0.0, config.latency_ms + jitter + extra_ms) / 1000.0)
+
+    @app.get("/v1/models")
+    async def list_models():
+        models = list(EMBEDDING_DIMENSIONS) + ["gpt-3.5-turbo", "gpt-4o"]
+        return {"object": "list", "data": [{"id": model, "object": "model", "created": 0, "owned_by": "fake"} for model in models]}
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        model = body.get("model", "text-embedding-3-large")
+        inputs = body.get("input")
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        if not inputs:
+            return _error(400, "input is required", "invalid_request_error")
+        tokens = sum(estimate_tokens(text) for text in inputs)
+        rejected = await admit(model, tokens)
+        if rejected is not None:
+            return rejected
+        await delay(config.per_item_ms * len(inputs))
+        dimensions = int(body.get("dimensions") or EMBEDDING_DIMENSIONS.get(model, 1536))
+        data = []
+        for index, text in enumerate(inputs):
+            vector = fake_embedding(text, dimensions)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.astype(np.float32).tobytes()).decode()
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        return {"object": "list", "data": data, "model": model, "usage": {"prompt_tokens": tokens, "total_tokens": tokens}}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "gpt-3.5-turbo")
+        prompt = _message_text(body.get("messages") or [])
+        prompt_tokens = estimate_tokens(prompt)
+        max_tokens = min(int(body.get("max_tokens") or config.completion_tokens), config.completion_tokens)
+        rejected = await admit(model, prompt_tokens + max_tokens)
+        if rejected is not None:
+            return rejected
+        answer = fake_answer(prompt, max_tokens)
+        completion_tokens = estimate_tokens(answer)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+        if body.get("stream"):
+            async def events():
+                await delay()
+                base = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model}
+                yield "data: " + json.dumps({**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]}) + "\n\n"
+                for word in answer.split(" "):
+                    await asyncio.sleep(config.per_token_ms / 1000.0)
+                    yield "data: " + json.dumps({**base, "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}]}) + "\n\n"
+                final = {**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    final["usage"] = usage
+                yield "data: " + json.dumps(final) + "\n\n"
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await delay(config.per_token_ms * completion_tokens)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop", "logprobs": None}],
+            "usage": usage
+        }
+
+    return app
+
+app = create_app()
@@ -0,0 +1,225 @@
+# local stand-in for the subset of the pinecone control and data plane rest api the app uses, kept in memory.
+#   uvicorn loadtest.fake_pinecone:app --port 8102
+# point the api at it with PINECONE_CONTROLLER_HOST=http://127.0.0.1:8102; indexes advertise this same server as their data plane host.
+import asyncio
+import os
+import random
+from typing import Dict, List, Optional
+
+import numpy as np
+from fastapi import FastAPI, HTTPException, Query, Request
+
+def matches_filter(metadata: dict, filter_spec: Optional[dict]) -> bool:
+    # evaluate a pinecone metadata filter ($eq, $ne, $in, $nin, $gt, $gte, $lt, $lte, $and, $or, and bare equality)
+    if not filter_spec:
+        return True
+    for key, condition in filter_spec.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, part) for part in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches_filter(metadata, part) for part in condition):
+                return False
+            continue
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, operand in condition.items():
+            if operator == "$eq" and value != operand:
+                return False
+            if operator == "$ne" and value == operand:
+                return False
+            if operator == "$in" and value not in operand:
+                return False
+            if operator == "$nin" and value in operand:
+                return False
+            if operator in ("$gt", "$gte", "$lt", "$lte"):
+                if value is None:
+                    return False
+                if operator == "$gt" and not value > operand:
+                    return False
+                if operator == "$gte" and not value >= operand:
+                    return False
+                if operator == "$lt" and not value < operand:
+                    return False
+                if operator == "$lte" and not value <= operand:
+                    return False
+    return True
+
+class Namespace:
+    # vectors of one namespace, with a lazily rebuilt normalized matrix for queries
+    def __init__(self):
+        self.vectors: Dict[str, np.ndarray] = {}
+        self.metadata: Dict[str, dict] = {}
+        self._ids: List[str] = []
+        self._matrix: Optional[np.ndarray] = None
+
+    def upsert(self, vector_id: str, values: List[float], metadata: Optional[dict]) -> None:
+        self.vectors[vector_id] = np.asarray(values, dtype=np.float32)
+        self.metadata[vector_id] = metadata or {}
+        self._matrix = None
+
+    def delete(self, vector_ids) -> None:
+        for vector_id in vector_ids:
+            self.vectors.pop(vector_id, None)
+            self.metadata.pop(vector_id, None)
+        self._matrix = None
+
+    def query(self, vector: np.ndarray, top_k: int, filter_spec: Optional[dict]) -> List[tuple]:
+        if not self.vectors:
+            return []
+        if self._matrix is None:
+            self._ids = list(self.vectors)
+            matrix = np.stack([self.vectors[vector_id] for vector_id in self._ids])
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            self._matrix = matrix / np.where(norms == 0, 1.0, norms)
+        norm = float(np.linalg.norm(vector)) or 1.0
+        scores = self._matrix @ (vector / norm)
+        ranked = []
+        for index in np.argsort(-scores):
+            vector_id = self._ids[index]
+            if matches_filter(self.metadata[vector_id], filter_spec):
+                ranked.append((vector_id, float(scores[index])))
+                if len(ranked) >= top_k:
+                    break
+        return ranked
+
+def _vector_payload(namespace: Namespace, vector_id: str, include_values: bool = True, include_metadata: bool = True) -> dict:
+    payload = {"id": vector_id}
+    if include_values:
+        payload["values"] = namespace.vectors[vector_id].tolist()
+    if include_metadata:
+        payload["metadata"] = namespace.metadata[vector_id]
+    return payload
+
+def create_app(latency_ms: Optional[float] = None, public_host: Optional[str] = None) -> FastAPI:
+    latency_ms = float(os.getenv("FAKE_PINECONE_LATENCY_MS", "15")) if latency_ms is None else latency_ms
+    public_host = public_host or os.getenv("FAKE_PINECONE_HOST")
+    app = FastAPI(title="fake pinecone")
+    indexes: Dict[str, dict] = {}
+    namespaces: Dict[str, Namespace] = {}
+
+    async def delay():
+        if latency_ms:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * latency_ms / 1000.0)
+
+    def describe(name: str, request: Request) -> dict:
+        index = indexes[name]
+        host = public_host or str(request.base_url).rstrip("/")
+        return {
+            "name": name,
+            "dimension": index["dimension"],
+            "metric": index["metric"],
+            "host": host,
+            "vector_type": "dense",
+            "deletion_protection": "disabled",
+            "spec": {"serverless": {"cloud": "aws", "region": "us-east-1"}},
+            "status": {"ready": True, "state": "Ready"}
+        }
+
+    def namespace(name: str) -> Namespace:
+        return namespaces.setdefault(name or "", Namespace())
+
+    # control plane
+
+    @app.get("/indexes")
+    async def list_indexes(request: Request):
+        return {"indexes": [describe(name, request) for name in indexes]}
+
+    @app.post("/indexes", status_code=201)
+    async def create_index(request: Request):
+        body = await request.json()
+        name = body["name"]
+        if name in indexes:
+            raise HTTPException(status_code=409, detail=f"index {name} already exists")
+        indexes[name] = {"dimension": body.get("dimension", 1536), "metric": body.get("metric", "cosine")}
+        return describe(name, request)
+
+    @app.get("/indexes/{name}")
+    async def describe_index(name: str, request: Request):
+        if name not in indexes:
+            raise HTTPException(status_code=404, detail=f"index {name} not found")
+        return describe(name, request)
+
+    @app.delete("/indexes/{name}", status_code=202)
+    async def delete_index(name: str):
+        indexes.pop(name, None)
+        namespaces.clear()
+        return None
+
+    # data plane. a single fake index is enough for the app, so every index shares the namespaces below.
+
+    @app.post("/vectors/upsert")
+    async def upsert(request: Request):
+        body = await request.json()
+        await delay()
+        target = namespace(body.get("namespace"))
+        for vector in body.get("vectors", []):
+            target.upsert(vector["id"], vector["values"], vector.get("metadata"))
+        return {"upsertedCount": len(body.get("vectors", []))}
+
+    @app.post("/query")
+    async def query(request: Request):
+        body = await request.json()
+        await delay()
+        target = namespace(body.get("namespace"))
+        vector = body.get("vector")
+        if vector is None and body.get("id") in target.vectors:
+            vector = target.vectors[body["id"]]
+        if vector is None:
+            raise HTTPException(status_code=400, detail="query needs a vector or an existing id")
+        ranked = target.query(np.asarray(vector, dtype=np.float32), int(body.get("topK", 10)), body.get("filter"))
+        matches = []
+        for vector_id, score in ranked:
+            match = _vector_payload(target, vector_id, body.get("includeValues", False), body.get("includeMetadata", False))
+            match["score"] = score
+            matches.append(match)
+        return {"matches": matches, "namespace": body.get("namespace", ""), "usage": {"readUnits": 1}}
+
+    @app.get("/vectors/fetch")
+    async def fetch(ids: List[str] = Query(...), namespace_name: str = Query("", alias="namespace")):
+        await delay()
+        target = namespace(namespace_name)
+        vectors = {vector_id: _vector_payload(target, vector_id) for vector_id in ids if vector_id in target.vectors}
+        return {"vectors": vectors, "namespace": namespace_name, "usage": {"readUnits": 1}}
+
+    @app.get("/vectors/list")
+    async def list_vectors(prefix: str = "", limit: int = 100, namespace_name: str = Query("", alias="namespace"), pagination_token: Optional[str] = Query(None, alias="paginationToken")):
+        await delay()
+        target = namespace(namespace_name)
+        vector_ids = sorted(vector_id for vector_id in target.vectors if vector_id.startswith(prefix))
+        start = int(pagination_token) if pagination_token else 0
+        page = vector_ids[start:start + limit]
+        response = {"vectors": [{"id": vector_id} for vector_id in page], "namespace": namespace_name, "usage": {"readUnits": 1}}
+        if start + limit < len(vector_ids):
+            response["pagination"] = {"next": str(start + limit)}
+        return response
+
+    @app.post("/vectors/delete")
+    async def delete(request: Request):
+        body = await request.json()
+        await delay()
+        target = namespace(body.get("namespace"))
+        if body.get("deleteAll"):
+            target.delete(list(target.vectors))
+        elif body.get("filter"):
+            target.delete([vector_id for vector_id, metadata in target.metadata.items() if matches_filter(metadata, body["filter"])])
+        else:
+            target.delete(body.get("ids", []))
+        return {}
+
+    @app.delete("/namespaces/{name}", status_code=202)
+    async def delete_namespace(name: str):
+        namespaces.pop(name, None)
+        return {}
+
+    @app.post("/describe_index_stats")
+    async def describe_index_stats():
+        counts = {name: {"vectorCount": len(ns.vectors)} for name, ns in namespaces.items()}
+        dimension = next(iter(indexes.values()))["dimension"] if indexes else 0
+        return {"namespaces": counts, "dimension": dimension, "indexFullness": 0.0, "totalVectorCount": sum(c["vectorCount"] for c in counts.values())}
+
+    return app
+
+app = create_app()
@@ -0,0 +1,182 @@
+# closed-loop load generator for the api. each worker keeps one request in flight, choosing endpoints by weight.
+#   python -m loadtest.loadgen --base-url http://127.0.0.1:8000 --concurrency 32 --duration 60 --mix chat=70,files=25,upload=5
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+
+DEFAULT_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "fixtures", "contract_8p.pdf")
+QUESTIONS = [
+    "what are the payment terms?",
+    "how can either party terminate the agreement?",
+    "summarize the liability and warranty clauses",
+    "what notice period applies to renewal?",
+    "which obligations does the provider have around confidential information?",
+    "what happens if an invoice is late?"
+]
+ENDPOINTS = ("chat", "files", "upload")
+
+def parse_mix(value: str) -> Dict[str, float]:
+    # "chat=70,files=25,upload=5" -> weights per endpoint
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r}, expected one of {', '.join(ENDPOINTS)}")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("mix needs at least one positive weight")
+    return mix
+
+def percentile(ordered: List[float], fraction: float) -> float:
+    # nearest-rank percentile of an already sorted list
+    if not ordered:
+        return 0.0
+    rank = max(1, int(round(fraction * len(ordered) + 0.4999)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(self, endpoint: str, seconds: float, status: str) -> None:
+        self.latencies[endpoint].append(seconds)
+        self.statuses[endpoint][status] += 1
+
+    def summary(self, elapsed: float) -> Dict[str, dict]:
+        report = {}
+        for endpoint, samples in self.latencies.items():
+            ordered = sorted(samples)
+            statuses = dict(self.statuses[endpoint])
+            errors = sum(count for status, count in statuses.items() if not status.startswith("2") and status != "304")
+            report[endpoint] = {
+                "requests": len(samples),
+                "errors": errors,
+                "throughput_rps": round(len(samples) / elapsed, 3) if elapsed else 0.0,
+                "p50_ms": round(percentile(ordered, 0.50) * 1000, 1),
+                "p95_ms": round(percentile(ordered, 0.95) * 1000, 1),
+                "p99_ms": round(percentile(ordered, 0.99) * 1000, 1),
+                "max_ms": round(ordered[-1] * 1000, 1),
+                "mean_ms": round(sum(ordered) / len(ordered) * 1000, 1),
+                "statuses": statuses
+            }
+        return report
+
+class LoadGenerator:
+    def __init__(self, client: httpx.AsyncClient, users: int, file_path: str, follow_up_rate: float, seed: Optional[int] = None):
+        self.client = client
+        self.users = [f"loadtest-user-{i}" for i in range(users)]
+        self.file_path = file_path
+        with open(file_path, "rb") as f:
+            self.file_bytes = f.read()
+        self.follow_up_rate = follow_up_rate
+        self.rng = random.Random(seed)
+        self.last_dialogue: Dict[str, str] = {}
+        self.recorder = Recorder()
+
+    async def timed(self, endpoint: str, send) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        try:
+            response = await send()
+            status = str(response.status_code)
+        except httpx.HTTPError as e:
+            response, status = None, e.__class__.__name__
+        self.recorder.record(endpoint, time.perf_counter() - start, status)
+        return response
+
+    async def upload(self, user_id: str) -> Optional[httpx.Response]:
+        files = {"file": (os.path.basename(self.file_path), self.file_bytes, "application/pdf")}
+        return await self.timed("upload", lambda: self.client.post("/process-sequence", files=files, data={"user_id": user_id}))
+
+    async def chat(self, user_id: str) -> None:
+        body = {"query": self.rng.choice(QUESTIONS), "user_id": user_id}
+        previous = self.last_dialogue.get(user_id)
+        if previous and self.rng.random() < self.follow_up_rate:
+            body["previous_dialogue_id"] = previous
+        response = await self.timed("chat", lambda: self.client.post("/chat-query-json", json=body))
+        if response is not None and response.status_code == 200:
+            dialogue_id = response.json().get("dialogue_id")
+            if dialogue_id:
+                self.last_dialogue[user_id] = dialogue_id
+
+    async def files(self, user_id: str) -> None:
+        await self.timed("files", lambda: self.client.get("/user-files", params={"user_id": user_id}))
+
+    async def seed(self, concurrency: int) -> None:
+        # give every user one document so chat requests have something to retrieve; not part of the measured run
+        semaphore = asyncio.Semaphore(concurrency)
+        async def seed_user(user_id):
+            async with semaphore:
+                await self.upload(user_id)
+        await asyncio.gather(*(seed_user(user_id) for user_id in self.users))
+        self.recorder = Recorder()
+
+    async def worker(self, mix: Dict[str, float], deadline: float, remaining: List[int]) -> None:
+        names, weights = list(mix), list(mix.values())
+        while time.perf_counter() < deadline:
+            if remaining[0] is not None:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            endpoint = self.rng.choices(names, weights)[0]
+            user_id = self.rng.choice(self.users)
+            if endpoint == "upload":
+                await self.upload(user_id)
+            else:
+                await getattr(self, endpoint)(user_id)
+
+    async def run(self, mix: Dict[str, float], concurrency: int, duration: float, total_requests: Optional[int] = None) -> dict:
+        start = time.perf_counter()
+        remaining = [total_requests]
+        await asyncio.gather(*(self.worker(mix, start + duration, remaining) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        return {"elapsed_seconds": round(elapsed, 3), "concurrency": concurrency, "endpoints": self.recorder.summary(elapsed)}
+
+def print_report(report: dict) -> None:
+    print(f"{report['elapsed_seconds']}s at concurrency {report['concurrency']}")
+    print(f"{'endpoint':10} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for endpoint, row in sorted(report["endpoints"].items()):
+        print(f"{endpoint:10} {row['requests']:>9} {row['errors']:>7} {row['throughput_rps']:>8.2f} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f} {row['max_ms']:>9.1f}")
+
+async def _main(args) -> dict:
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        generator = LoadGenerator(client, args.users, args.file, args.follow_up_rate, args.seed)
+        if not args.skip_seed:
+            await generator.seed(args.concurrency)
+        return await generator.run(args.mix, args.concurrency, args.duration, args.requests)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="load generator for the document api")
+    parser.add_argument("--base-url", default=os.getenv("LOADTEST_BASE_URL", "http://127.0.0.1:8000"))
+    parser.add_argument("--concurrency", type=int, default=16, help="requests kept in flight")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds to run")
+    parser.add_argument("--requests", type=int, default=None, help="stop after this many requests instead of at the deadline")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("chat=70,files=25,upload=5"), help="endpoint weights, e.g. chat=70,files=25,upload=5")
+    parser.add_argument("--users", type=int, default=20, help="distinct user ids to spread requests over")
+    parser.add_argument("--file", default=DEFAULT_FILE, help="document uploaded by the upload endpoint")
+    parser.add_argument("--follow-up-rate", type=float, default=0.3, help="fraction of chat requests sent as follow-ups")
+    parser.add_argument("--skip-seed", action="store_true", help="do not upload one document per user before the run")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", "-o", help="write the report as json")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(_main(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
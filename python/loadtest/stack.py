@@ -0,0 +1,101 @@
+# runs the api against the local stand-ins without docker: fake openai, fake pinecone, and a throwaway mongod when one is installed.
+#   python -m loadtest.stack                                   # then, in another shell: python -m loadtest.loadgen
+#   python -m loadtest.stack --mongo-uri mongodb://127.0.0.1:27017 --openai-rpm 500
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def wait_for(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1)
+            return
+        except urllib.error.HTTPError:
+            return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+def uvicorn(app: str, port: int, env: dict, workers: int = 1) -> subprocess.Popen:
+    command = [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning", "--workers", str(workers)]
+    return subprocess.Popen(command, cwd=PYTHON_DIR, env=env)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="start the api with local openai, pinecone and mongo stand-ins")
+    parser.add_argument("--api-port", type=int, default=8000)
+    parser.add_argument("--api-workers", type=int, default=1)
+    parser.add_argument("--openai-port", type=int, default=8101)
+    parser.add_argument("--pinecone-port", type=int, default=8102)
+    parser.add_argument("--mongo-uri", default=None, help="use this mongo instead of starting a throwaway mongod")
+    parser.add_argument("--mongo-port", type=int, default=27018)
+    parser.add_argument("--openai-latency-ms", type=float, default=40.0)
+    parser.add_argument("--openai-rpm", type=int, default=0, help="requests per minute per model before the fake returns 429 (0 = unlimited)")
+    parser.add_argument("--openai-tpm", type=int, default=0, help="tokens per minute per model before the fake returns 429 (0 = unlimited)")
+    parser.add_argument("--openai-error-rate", type=float, default=0.0)
+    parser.add_argument("--pinecone-latency-ms", type=float, default=15.0)
+    args = parser.parse_args(argv)
+
+    processes = []
+    data_dir = None
+    env = dict(os.environ)
+    try:
+        mongo_uri = args.mongo_uri
+        if mongo_uri is None:
+            mongod = shutil.which("mongod")
+            if mongod is None:
+                parser.error("no mongod on PATH; pass --mongo-uri or use docker-compose.loadtest.yml")
+            data_dir = tempfile.mkdtemp(prefix="edgeup-loadtest-mongo-")
+            processes.append(subprocess.Popen([mongod, "--dbpath", data_dir, "--port", str(args.mongo_port), "--bind_ip", "127.0.0.1", "--quiet"], stdout=subprocess.DEVNULL))
+            mongo_uri = f"mongodb://127.0.0.1:{args.mongo_port}"
+
+        fake_env = dict(env)
+        fake_env.update({
+            "FAKE_OPENAI_LATENCY_MS": str(args.openai_latency_ms),
+            "FAKE_OPENAI_RPM": str(args.openai_rpm),
+            "FAKE_OPENAI_TPM": str(args.openai_tpm),
+            "FAKE_OPENAI_ERROR_RATE": str(args.openai_error_rate),
+            "FAKE_PINECONE_LATENCY_MS": str(args.pinecone_latency_ms)
+        })
+        processes.append(uvicorn("loadtest.fake_openai:app", args.openai_port, fake_env))
+        processes.append(uvicorn("loadtest.fake_pinecone:app", args.pinecone_port, fake_env))
+        wait_for(f"http://127.0.0.1:{args.openai_port}/v1/models")
+        wait_for(f"http://127.0.0.1:{args.pinecone_port}/indexes")
+
+        env.update({
+            "OPENAI_API_KEY": "sk-loadtest",
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{args.openai_port}/v1",
+            "PINECONE_API_KEY": "loadtest",
+            "PINECONE_CONTROLLER_HOST": f"http://127.0.0.1:{args.pinecone_port}",
+            "MONGO_CONNECTION_STRING": mongo_uri,
+            "MONGO_DB_NAME": env.get("MONGO_DB_NAME", "edgeup_loadtest")
+        })
+        processes.append(uvicorn("api:app", args.api_port, env, args.api_workers))
+        wait_for(f"http://127.0.0.1:{args.api_port}/health", timeout=60.0)
+        print(f"api ready on http://127.0.0.1:{args.api_port} (openai :{args.openai_port}, pinecone :{args.pinecone_port}, mongo {mongo_uri}); ctrl-c to stop", flush=True)
+        while all(process.poll() is None for process in processes):
+            time.sleep(1)
+        return 1
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if data_dir:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
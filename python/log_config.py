@@ -0,0 +1,110 @@
+# logging setup shared by the api and the cli: records are handed to a queue on the calling thread and formatted/written by a background listener
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None)).keys()) | {"message", "asctime", "sample"}
+
+_listener = None
+
+def is_production() -> bool:
+    return os.getenv("APP_ENV", "").lower() in ("prod", "production")
+
+def diagnostics_enabled() -> bool:
+    # diagnostic-only work (embedding statistics, response introspection) is skipped entirely in production unless forced on
+    value = os.getenv("LOG_DIAGNOSTICS")
+    if value is not None:
+        return value.lower() in ("1", "true", "yes")
+    return not is_production()
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            entry["trace_id"] = trace_id
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and key != "trace_id":
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        trace_id = getattr(record, "trace_id", None)
+        return f"{line} [trace={trace_id}]" if trace_id else line
+
+class SamplingFilter(logging.Filter):
+    # keeps only a fraction of high-volume records; a record opts in with extra={"sample": True}. warnings and errors are never dropped.
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = max(0.0, min(1.0, rate))
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not getattr(record, "sample", False):
+            return True
+        return self.rate >= 1.0 or random.random() < self.rate
+
+class TraceContextFilter(logging.Filter):
+    # stamps the current trace id while still on the calling thread, before the record crosses the queue
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "trace_id"):
+            from metrics import current_trace_id
+            record.trace_id = current_trace_id()
+        return True
+
+def configure_logging(level: str = None, fmt: str = None, sample_rate: float = None) -> None:
+    # install the queue handler on the root logger. safe to call more than once; later calls replace the earlier setup.
+    global _listener
+    level = (level or os.getenv("LOG_LEVEL") or "INFO").upper()
+    fmt = (fmt or os.getenv("LOG_FORMAT") or ("json" if is_production() else "text")).lower()
+    if sample_rate is None:
+        sample_rate = float(os.getenv("LOG_SAMPLE_RATE", "0.01" if is_production() else "1.0"))
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+    queue_handler.addFilter(TraceContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    for noisy in ("httpx", "httpcore", "urllib3", "openai", "pymongo"):
+        logging.getLogger(noisy).setLevel(max(logging.WARNING, root.level))
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+def shutdown_logging() -> None:
+    # flush whatever is still queued
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(shutdown_logging)
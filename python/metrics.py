@@ -0,0 +1,263 @@
+# in-process metrics with prometheus text exposition, plus per-request trace ids that tie stage timings together
+import bisect
+import contextvars
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, help_text, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._callback = callback
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def _samples(self) -> List[str]:
+        if self._callback is not None:
+            return [f"{self.name} {_format_value(self._callback())}"]
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], List] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return series[2] if series else 0
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = [(key, list(series[0]), series[1], series[2]) for key, series in self._series.items()]
+        for key, bucket_counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), callback: Optional[Callable[[], float]] = None) -> Gauge:
+        return self._register(Gauge(name, help_text, labelnames, callback))
+
+    def histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+
+http_request_duration = registry.histogram("edgeup_http_request_duration_seconds", "time spent serving http requests", ("method", "route", "status"))
+stage_duration = registry.histogram("edgeup_stage_duration_seconds", "time spent in each pipeline stage", ("stage",))
+outbound_duration = registry.histogram("edgeup_outbound_request_duration_seconds", "latency of calls to external services", ("service", "operation"))
+errors_total = registry.counter("edgeup_errors_total", "errors raised inside pipeline stages and outbound calls", ("source",))
+chunks_total = registry.counter("edgeup_chunks_total", "text chunks produced by ingestion")
+tokens_total = registry.counter("edgeup_openai_tokens_total", "openai tokens reported by the api", ("model", "kind"))
+
+# tracing
+
+class Trace:
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.started_at = time.perf_counter()
+        self.timings: List[Tuple[str, float]] = []
+        # a profiler.RequestProfile when an admin asked for this request to be profiled
+        self.profile = None
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.timings.append((name, seconds))
+
+    def server_timing(self) -> str:
+        # Server-Timing header value; repeated stage names are summed
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for name, seconds in self.timings:
+                totals[name] = totals.get(name, 0.0) + seconds
+        return ", ".join(f"{name.replace('.', '_')};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            return {name: round(seconds, 6) for name, seconds in self.timings}
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("edgeup_trace", default=None)
+
+def start_trace(trace_id: Optional[str] = None) -> Trace:
+    # begin a trace for the current request or job; child tasks and threadpool calls inherit it through the context
+    trace = Trace(trace_id or uuid.uuid4().hex)
+    _current_trace.set(trace)
+    return trace
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.trace_id if trace else None
+
+@contextmanager
+def stage(name: str):
+    # time one pipeline stage; a profiled request also gets the stage's thread sampled
+    start = time.perf_counter()
+    trace = _current_trace.get()
+    profile = trace.profile if trace is not None else None
+    thread_id = profile.enter() if profile is not None else None
+    try:
+        yield
+    except Exception:
+        errors_total.inc(source=f"stage:{name}")
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_duration.observe(elapsed, stage=name)
+        if profile is not None:
+            profile.leave(thread_id)
+        if trace is not None:
+            trace.record(name, elapsed)
+
+@contextmanager
+def outbound(service: str, operation: str):
+    # time one call to openai, pinecone or mongo
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        errors_total.inc(source=f"{service}:{operation}")
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        outbound_duration.observe(elapsed, service=service, operation=operation)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.record(f"{service}.{operation}", elapsed)
+
+def record_outbound(service: str, operation: str, seconds: float, failed: bool = False) -> None:
+    # same as outbound() for callers that only learn the duration afterwards, like driver event listeners
+    outbound_duration.observe(seconds, service=service, operation=operation)
+    if failed:
+        errors_total.inc(source=f"{service}:{operation}")
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.record(f"{service}.{operation}", seconds)
+
+def record_tokens(model: str, usage) -> None:
+    # count the prompt/completion tokens of an openai usage block (a raw json dict or an sdk object)
+    if not usage:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        value = usage.get(kind) if isinstance(usage, dict) else getattr(usage, kind, None)
+        if value:
+            tokens_total.inc(value, model=model, kind=kind.replace("_tokens", ""))
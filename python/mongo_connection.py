@@ -1,12 +1,192 @@
 from dotenv import load_dotenv
 import os
-from pymongo import MongoClient
+import threading
+import time
+from typing import Optional
+from pymongo import MongoClient, monitoring
+from metrics import registry, record_outbound
 
 load_dotenv()
 
-mongo_connection_string = os.getenv("MONGO_CONNECTION_STRING")
+pool_checkout_wait = registry.histogram(
+    "edgeup_mongo_pool_checkout_wait_seconds", "time spent waiting for a pooled mongo connection",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
 
-client = MongoClient(mongo_connection_string)
+class CommandMetricsListener(monitoring.CommandListener):
+    # reports every mongo command as an outbound call, timed by the driver
+    def started(self, event):
+        pass
 
+    def succeeded(self, event):
+        record_outbound("mongo", event.command_name, event.duration_micros / 1e6)
 
-# this finally works
+    def failed(self, event):
+        record_outbound("mongo", event.command_name, event.duration_micros / 1e6, failed=True)
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    # tracks how long callers wait to check out a pooled connection and how many connections are in use
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.in_use = 0
+        self.open_connections = 0
+
+    def connection_check_out_started(self, event):
+        # checkout runs synchronously on the calling thread, so a thread-local start time is enough
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        waited = time.perf_counter() - getattr(self._local, "started", time.perf_counter())
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        pool_checkout_wait.observe(waited)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections = max(0, self.open_connections - 1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "checkout_wait_seconds_total": round(self.wait_seconds_total, 6),
+                "checkout_wait_seconds_avg": round(self.wait_seconds_total / self.checkouts, 6) if self.checkouts else 0.0,
+                "checkout_wait_seconds_max": round(self.wait_seconds_max, 6),
+                "connections_in_use": self.in_use,
+                "connections_open": self.open_connections
+            }
+
+def _parse_write_concern(value: Optional[str]):
+    # "majority", a tag set name, or a number of acknowledging members
+    if not value:
+        return None
+    return int(value) if value.isdigit() else value
+
+class MongoConnectionManager:
+    # owns the single MongoClient of the process, its pool settings, and the model objects built on top of it
+    def __init__(self, uri: Optional[str], db_name: str = "edgeup", max_pool_size: int = 50, min_pool_size: int = 0,
+                 connect_timeout_ms: int = 5000, server_selection_timeout_ms: int = 5000, socket_timeout_ms: int = 30000,
+                 wait_queue_timeout_ms: int = 5000, write_concern=None, journal: Optional[bool] = None):
+        self.uri = uri
+        self.db_name = db_name
+        self.max_pool_size = max_pool_size
+        self.min_pool_size = min_pool_size
+        self.connect_timeout_ms = connect_timeout_ms
+        self.server_selection_timeout_ms = server_selection_timeout_ms
+        self.socket_timeout_ms = socket_timeout_ms
+        self.wait_queue_timeout_ms = wait_queue_timeout_ms
+        self.write_concern = write_concern
+        self.journal = journal
+        self.pool_metrics = PoolMetricsListener()
+        self.command_metrics = CommandMetricsListener()
+        self._client: Optional[MongoClient] = None
+        self._models = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_env(cls) -> "MongoConnectionManager":
+        return cls(
+            uri=os.getenv("MONGO_CONNECTION_STRING") or os.getenv("MONGODB_URI"),
+            db_name=os.getenv("MONGO_DB_NAME", "edgeup"),
+            max_pool_size=int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+            min_pool_size=int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+            connect_timeout_ms=int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+            server_selection_timeout_ms=int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+            socket_timeout_ms=int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000")),
+            wait_queue_timeout_ms=int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000")),
+            write_concern=_parse_write_concern(os.getenv("MONGO_WRITE_CONCERN")),
+            journal=True if os.getenv("MONGO_WRITE_JOURNAL", "").lower() in ("1", "true", "yes") else None
+        )
+
+    def start(self) -> MongoClient:
+        # build the client. pymongo connects lazily, so this does not block on the server being reachable.
+        with self._lock:
+            if self._client is None:
+                options = {
+                    "maxPoolSize": self.max_pool_size,
+                    "minPoolSize": self.min_pool_size,
+                    "connectTimeoutMS": self.connect_timeout_ms,
+                    "serverSelectionTimeoutMS": self.server_selection_timeout_ms,
+                    "socketTimeoutMS": self.socket_timeout_ms,
+                    "waitQueueTimeoutMS": self.wait_queue_timeout_ms,
+                    "event_listeners": [self.pool_metrics, self.command_metrics]
+                }
+                if self.write_concern is not None:
+                    options["w"] = self.write_concern
+                if self.journal is not None:
+                    options["journal"] = self.journal
+                self._client = MongoClient(self.uri, **options)
+            return self._client
+
+    def close(self) -> None:
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+            self._models.clear()
+
+    @property
+    def client(self) -> MongoClient:
+        client = self._client
+        return client if client is not None else self.start()
+
+    def get_database(self):
+        return self.client.get_database(self.db_name)
+
+    def model(self, model_class):
+        # one instance per model class for the lifetime of the client
+        instance = self._models.get(model_class)
+        if instance is None:
+            with self._lock:
+                instance = self._models.get(model_class)
+                if instance is None:
+                    instance = model_class(self.get_database())
+                    self._models[model_class] = instance
+        return instance
+
+    def pool_stats(self) -> dict:
+        stats = self.pool_metrics.snapshot()
+        stats["max_pool_size"] = self.max_pool_size
+        return stats
+
+mongo_manager = MongoConnectionManager.from_env()
+
+registry.gauge("edgeup_mongo_pool_connections_in_use", "mongo connections currently checked out", callback=lambda: mongo_manager.pool_metrics.in_use)
+registry.gauge("edgeup_mongo_pool_connections_open", "mongo connections currently open", callback=lambda: mongo_manager.pool_metrics.open_connections)
+registry.gauge("edgeup_mongo_pool_max_size", "configured mongo pool size", callback=lambda: mongo_manager.max_pool_size)
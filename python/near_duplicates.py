@@ -0,0 +1,147 @@
+# near-duplicate suppression before embedding. page furniture (running headers, footers, page numbers, disclaimers repeated on
+# most pages) is cut from the page text before chunking, and chunks whose word shingles are near-identical to an earlier chunk
+# of the same document (minhash signatures, lsh banding) are collapsed into it. pages are stored as extracted; only chunking sees the
+# cleaned text, so a re-index with different settings starts from the original.
+import os
+import re
+import zlib
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import registry
+
+NEAR_DUPLICATES_ENABLED = os.getenv("NEAR_DUPLICATES_ENABLED", "true").lower() in ("1", "true", "yes")
+# a line repeated on at least this share of the pages (and on FURNITURE_MIN_PAGES of them) is page furniture
+FURNITURE_MIN_PAGE_FRACTION = float(os.getenv("FURNITURE_MIN_PAGE_FRACTION", "0.5"))
+FURNITURE_MIN_PAGES = int(os.getenv("FURNITURE_MIN_PAGES", "3"))
+# lines looked at from the top and bottom of each page; repeated lines further in only count if they are this long
+FURNITURE_EDGE_LINES = int(os.getenv("FURNITURE_EDGE_LINES", "4"))
+FURNITURE_MIN_INTERIOR_CHARS = int(os.getenv("FURNITURE_MIN_INTERIOR_CHARS", "40"))
+# estimated jaccard similarity of word shingles above which a chunk is collapsed into an earlier one
+NEAR_DUPLICATE_SIMILARITY = float(os.getenv("NEAR_DUPLICATE_SIMILARITY", "0.9"))
+SHINGLE_WORDS = 3
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 16
+
+duplicates_total = registry.counter("edgeup_duplicate_chunks_total", "chunks not embedded because they repeated earlier content", ("kind",))
+
+_MERSENNE = (1 << 61) - 1
+_rng = np.random.RandomState(1)
+# fixed seed: signatures must be comparable across processes and runs
+_PERM_A = _rng.randint(1, 1 << 31, size=MINHASH_PERMUTATIONS, dtype=np.int64).astype(np.uint64)
+_PERM_B = _rng.randint(0, 1 << 31, size=MINHASH_PERMUTATIONS, dtype=np.int64).astype(np.uint64)
+_DIGITS = re.compile(r"\d+")
+_SPACE = re.compile(r"\s+")
+_WORD = re.compile(r"\w+")
+
+def normalize_line(line: str, mask_digits: bool = True) -> str:
+    # page numbers and dates in headers and footers differ from page to page, so digits are masked there
+    line = line.strip().lower()
+    return _SPACE.sub(" ", _DIGITS.sub("#", line) if mask_digits else line)
+
+def _candidate_lines(lines: List[str]) -> List[Tuple[int, str]]:
+    filled = [index for index, line in enumerate(lines) if line.strip()]
+    edges = set(filled[:FURNITURE_EDGE_LINES] + filled[-FURNITURE_EDGE_LINES:])
+    # body lines must repeat exactly: a running balance or a row label with changing figures is content
+    return [
+        (index, normalize_line(lines[index], mask_digits=index in edges))
+        for index in filled
+        if index in edges or len(lines[index].strip()) >= FURNITURE_MIN_INTERIOR_CHARS
+    ]
+
+def strip_page_furniture(pages: List[str]) -> Tuple[List[str], int]:
+    # pages without the lines repeated across most of them, and how many lines were removed
+    if len(pages) < FURNITURE_MIN_PAGES:
+        return list(pages), 0
+    split = [page.split("\n") for page in pages]
+    candidates = [_candidate_lines(lines) for lines in split]
+    seen = Counter(key for page in candidates for key in {key for _, key in page if key})
+    needed = max(FURNITURE_MIN_PAGES, FURNITURE_MIN_PAGE_FRACTION * len(pages))
+    furniture = {key for key, pages_with in seen.items() if pages_with >= needed}
+    if not furniture:
+        return list(pages), 0
+    removed = 0
+    cleaned = []
+    for lines, page in zip(split, candidates):
+        drop = {index for index, key in page if key in furniture}
+        removed += len(drop)
+        cleaned.append("\n".join(line for index, line in enumerate(lines) if index not in drop))
+    return cleaned, removed
+
+def shingles(text: str) -> List[int]:
+    words = _WORD.findall(text.lower())
+    if len(words) < SHINGLE_WORDS:
+        return [zlib.crc32(" ".join(words).encode("utf-8"))] if words else []
+    return list({zlib.crc32(" ".join(words[i:i + SHINGLE_WORDS]).encode("utf-8")) for i in range(len(words) - SHINGLE_WORDS + 1)})
+
+def minhash(text: str) -> Optional[np.ndarray]:
+    # MINHASH_PERMUTATIONS minima of universal hashes over the word shingles; None for text without words
+    hashed = shingles(text)
+    if not hashed:
+        return None
+    values = np.asarray(hashed, dtype=np.uint64)
+    return ((np.outer(values, _PERM_A) + _PERM_B) % _MERSENNE).min(axis=0)
+
+def collapse_near_duplicates(chunks: List[Dict[str, Any]], similarity: float = NEAR_DUPLICATE_SIMILARITY) -> Tuple[List[Dict[str, Any]], int]:
+    # chunks in order without those nearly identical to an earlier kept one; a kept chunk lists the other pages its text was on
+    rows = MINHASH_PERMUTATIONS // LSH_BANDS
+    buckets: Dict[Tuple[int, bytes], List[int]] = {}
+    signatures: List[Optional[np.ndarray]] = []
+    kept: List[Dict[str, Any]] = []
+    collapsed = 0
+    for chunk in chunks:
+        signature = minhash(chunk.get("text", ""))
+        if signature is None:
+            kept.append(chunk)
+            signatures.append(None)
+            continue
+        keys = [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(LSH_BANDS)]
+        candidates = {position for key in keys for position in buckets.get(key, ())}
+        match = next((position for position in sorted(candidates) if float(np.mean(signatures[position] == signature)) >= similarity), None)
+        if match is not None:
+            original = kept[match]
+            page = chunk.get("metadata", {}).get("page")
+            if page is not None and page != original.get("metadata", {}).get("page"):
+                pages = original.setdefault("metadata", {}).setdefault("duplicate_pages", [])
+                if page not in pages:
+                    pages.append(page)
+            collapsed += 1
+            continue
+        for key in keys:
+            buckets.setdefault(key, []).append(len(kept))
+        kept.append(chunk)
+        signatures.append(signature)
+    return kept, collapsed
+
+def chunk_without_duplicates(pages: List[str], max_tokens: int, overlap: int,
+                             chunker: Optional[Callable[..., List[Dict[str, Any]]]] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    # chunk_pages with page furniture and near-duplicate chunks removed, plus a report of what that saved
+    if chunker is None:
+        import doc_chunks
+        chunker = doc_chunks.chunk_pages
+    if not NEAR_DUPLICATES_ENABLED:
+        chunks = chunker(pages, max_tokens=max_tokens, overlap=overlap)
+        return chunks, dedup_report(len(chunks), len(chunks), 0, 0)
+    cleaned, furniture_lines = strip_page_furniture(pages)
+    chunks = chunker(cleaned, max_tokens=max_tokens, overlap=overlap)
+    # what chunking the extracted text as it is would have produced; only worth computing when furniture was cut
+    original = len(chunker(pages, max_tokens=max_tokens, overlap=overlap)) if furniture_lines else len(chunks)
+    kept, collapsed = collapse_near_duplicates(chunks)
+    if original > len(chunks):
+        duplicates_total.inc(original - len(chunks), kind="furniture")
+    if collapsed:
+        duplicates_total.inc(collapsed, kind="near_duplicate")
+    return kept, dedup_report(original, len(kept), furniture_lines, collapsed)
+
+def dedup_report(original: int, kept: int, furniture_lines: int, collapsed: int) -> Dict[str, Any]:
+    saved = max(original - kept, 0)
+    return {
+        "chunks_before": original,
+        "chunks_after": kept,
+        "furniture_lines_removed": furniture_lines,
+        "near_duplicates_collapsed": collapsed,
+        "embeddings_saved": saved,
+        "dedup_ratio": round(saved / original, 4) if original else 0.0,
+    }
@@ -0,0 +1,308 @@
+# client-side throttling shared by every openai call in the process: per-model requests/tokens-per-minute buckets,
+# interactive work ahead of bulk ingestion, and retries with jittered backoff that honour retry-after
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import openai
+import requests
+from metrics import registry, outbound, record_tokens, current_trace
+from usage_ledger import record_call
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# (requests per minute, tokens per minute); override with OPENAI_RATE_LIMITS="model=rpm:tpm,..."
+DEFAULT_LIMITS = {
+    "text-embedding-3-large": (3000, 1000000),
+    "gpt-3.5-turbo": (3500, 160000),
+    "gpt-4o": (500, 30000)
+}
+DEFAULT_MODEL_LIMIT = (500, 30000)
+
+limiter_queue_depth = registry.gauge("edgeup_openai_limiter_queue_depth", "callers waiting for openai rate limit capacity", ("model", "priority"))
+limiter_wait = registry.histogram(
+    "edgeup_openai_limiter_wait_seconds", "time callers waited for openai rate limit capacity", ("model", "priority"),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+rate_limited_total = registry.counter("edgeup_openai_rate_limited_total", "429 responses received from openai", ("model",))
+retries_total = registry.counter("edgeup_openai_retries_total", "openai calls retried after a retryable failure", ("model",))
+
+class OpenAIRetryableError(Exception):
+    # raised by direct http callers for 429 and 5xx responses so the limiter can back off and retry
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+class LimiterTimeout(Exception):
+    pass
+
+def parse_limits(value: Optional[str]) -> Dict[str, Tuple[int, int]]:
+    # "gpt-4o=500:30000,text-embedding-3-large=3000:1000000" -> {model: (rpm, tpm)}
+    limits = {}
+    for part in (value or "").split(","):
+        if not part.strip():
+            continue
+        model, _, numbers = part.partition("=")
+        rpm, _, tpm = numbers.partition(":")
+        limits[model.strip()] = (int(rpm), int(tpm or 0))
+    return limits
+
+def parse_retry_after(headers) -> Optional[float]:
+    # openai sends retry-after-ms as well as the standard retry-after (seconds)
+    if not headers:
+        return None
+    for name, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value) * scale)
+        except ValueError:
+            continue
+    return None
+
+def estimate_tokens(text: str) -> int:
+    # about four characters per token; good enough to budget against a tokens-per-minute limit
+    return max(1, len(text) // 4)
+
+def estimate_message_tokens(messages) -> int:
+    total = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            total += estimate_tokens(content)
+        elif isinstance(content, list):
+            for part in content:
+                total += estimate_tokens(part.get("text", "")) if part.get("type") == "text" else 1000
+    return total
+
+def classify_error(error: Exception) -> Tuple[bool, Optional[int], Optional[float]]:
+    # (retryable, http status, retry-after seconds) for the errors the sdk and direct http calls raise
+    if isinstance(error, OpenAIRetryableError):
+        return True, error.status_code, error.retry_after
+    if isinstance(error, openai.APIStatusError):
+        status = error.status_code
+        if status == 429 and getattr(error, "code", None) == "insufficient_quota":
+            return False, status, None
+        return status == 429 or status >= 500, status, parse_retry_after(error.response.headers)
+    if isinstance(error, (openai.APIConnectionError, requests.ConnectionError, requests.Timeout)):
+        return True, None, None
+    return False, None, None
+
+class _ModelState:
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.available_requests = float(rpm)
+        self.available_tokens = float(tpm)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.waiters = []
+
+    def refill(self, now: float) -> None:
+        elapsed = now - self.updated
+        self.updated = now
+        if self.rpm:
+            self.available_requests = min(self.rpm, self.available_requests + elapsed * self.rpm / 60.0)
+        if self.tpm:
+            self.available_tokens = min(self.tpm, self.available_tokens + elapsed * self.tpm / 60.0)
+
+    def wait_needed(self, tokens: int, now: float) -> float:
+        # seconds until a request of this size fits in both buckets; zero when it fits now
+        wait = max(0.0, self.blocked_until - now)
+        if self.rpm and self.available_requests < 1.0:
+            wait = max(wait, (1.0 - self.available_requests) * 60.0 / self.rpm)
+        if self.tpm:
+            needed = min(tokens, self.tpm)
+            if self.available_tokens < needed:
+                wait = max(wait, (needed - self.available_tokens) * 60.0 / self.tpm)
+        return wait
+
+    def consume(self, tokens: int) -> None:
+        if self.rpm:
+            self.available_requests -= 1.0
+        if self.tpm:
+            self.available_tokens -= min(tokens, self.tpm)
+
+class OpenAILimiter:
+    def __init__(self, limits: Optional[Dict[str, Tuple[int, int]]] = None, default_limit: Tuple[int, int] = DEFAULT_MODEL_LIMIT,
+                 max_retries: int = 5, base_backoff: float = 0.5, max_backoff: float = 30.0, interactive_max_wait: Optional[float] = 30.0):
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self.default_limit = default_limit
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.interactive_max_wait = interactive_max_wait
+        self._states: Dict[str, _ModelState] = {}
+        self._cond = threading.Condition()
+        self._sequence = itertools.count()
+
+    @classmethod
+    def from_env(cls) -> "OpenAILimiter":
+        limits = dict(DEFAULT_LIMITS)
+        limits.update(parse_limits(os.getenv("OPENAI_RATE_LIMITS")))
+        max_wait = float(os.getenv("OPENAI_INTERACTIVE_MAX_WAIT_SECONDS", "30"))
+        return cls(
+            limits=limits,
+            max_retries=int(os.getenv("OPENAI_MAX_RETRIES", "5")),
+            base_backoff=float(os.getenv("OPENAI_BACKOFF_BASE_SECONDS", "0.5")),
+            max_backoff=float(os.getenv("OPENAI_BACKOFF_MAX_SECONDS", "30")),
+            interactive_max_wait=max_wait if max_wait > 0 else None
+        )
+
+    def _state(self, model: str) -> _ModelState:
+        state = self._states.get(model)
+        if state is None:
+            rpm, tpm = self.limits.get(model, self.default_limit)
+            state = self._states[model] = _ModelState(rpm, tpm)
+        return state
+
+    def acquire(self, model: str, tokens: int, priority: int = BULK, max_wait: Optional[float] = None) -> float:
+        # block until the model has capacity for one request of this many tokens. callers are served by priority, then in arrival order.
+        started = time.monotonic()
+        priority_name = PRIORITY_NAMES.get(priority, str(priority))
+        entry = (priority, next(self._sequence))
+        limiter_queue_depth.inc(model=model, priority=priority_name)
+        try:
+            with self._cond:
+                state = self._state(model)
+                heapq.heappush(state.waiters, entry)
+                try:
+                    while True:
+                        now = time.monotonic()
+                        state.refill(now)
+                        at_head = state.waiters[0] == entry
+                        wait = state.wait_needed(tokens, now) if at_head else 1.0
+                        if at_head and wait <= 0:
+                            state.consume(tokens)
+                            heapq.heappop(state.waiters)
+                            self._cond.notify_all()
+                            break
+                        timeout = min(wait, 1.0)
+                        if max_wait is not None:
+                            remaining = max_wait - (now - started)
+                            # fail fast when even the head of the queue cannot be served in time
+                            if remaining <= 0 or (at_head and wait > remaining):
+                                raise LimiterTimeout(f"no {model} rate limit capacity within {max_wait}s")
+                            timeout = min(timeout, remaining)
+                        self._cond.wait(timeout)
+                except BaseException:
+                    state.waiters.remove(entry)
+                    heapq.heapify(state.waiters)
+                    self._cond.notify_all()
+                    raise
+        finally:
+            limiter_queue_depth.dec(model=model, priority=priority_name)
+        waited = time.monotonic() - started
+        limiter_wait.observe(waited, model=model, priority=priority_name)
+        trace = current_trace()
+        if trace is not None and waited > 0.001:
+            trace.record("openai.limiter_wait", waited)
+        return waited
+
+    def settle(self, model: str, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        # correct the token bucket once the response reports real usage
+        if not actual_tokens:
+            return
+        with self._cond:
+            state = self._state(model)
+            if state.tpm:
+                state.available_tokens = min(state.tpm, state.available_tokens + min(estimated_tokens, state.tpm) - actual_tokens)
+
+    def penalize(self, model: str, seconds: float) -> None:
+        # stop every caller of this model until the server-requested pause is over
+        with self._cond:
+            state = self._state(model)
+            state.blocked_until = max(state.blocked_until, time.monotonic() + seconds)
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        ceiling = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+        if retry_after is not None:
+            return min(self.max_backoff, retry_after) + random.uniform(0, ceiling / 2)
+        return random.uniform(ceiling / 2, ceiling)
+
+    def call(self, model: str, fn: Callable, tokens: int, priority: int = BULK):
+        # run fn under the limiter, retrying 429s, 5xx and connection errors
+        max_wait = self.interactive_max_wait if priority == INTERACTIVE else None
+        attempt = 0
+        while True:
+            self.acquire(model, tokens, priority, max_wait)
+            try:
+                return fn()
+            except Exception as e:
+                retryable, status, retry_after = classify_error(e)
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt, retry_after)
+                attempt += 1
+                retries_total.inc(model=model)
+                logger.warning(
+                    f"openai {model} call failed ({status or e.__class__.__name__}), retrying in {delay:.2f}s",
+                    extra={"model": model, "attempt": attempt, "status": status, "retry_after": retry_after}
+                )
+                if status == 429:
+                    rate_limited_total.inc(model=model)
+                    self.penalize(model, delay)
+                else:
+                    time.sleep(delay)
+
+    def stats(self) -> dict:
+        with self._cond:
+            now = time.monotonic()
+            result = {}
+            for model, state in self._states.items():
+                state.refill(now)
+                waiting = {name: 0 for name in PRIORITY_NAMES.values()}
+                for priority, _ in state.waiters:
+                    waiting[PRIORITY_NAMES.get(priority, str(priority))] += 1
+                result[model] = {
+                    "rpm_limit": state.rpm,
+                    "tpm_limit": state.tpm,
+                    "available_requests": round(state.available_requests, 2),
+                    "available_tokens": round(state.available_tokens),
+                    "blocked_for_seconds": round(max(0.0, state.blocked_until - now), 3),
+                    "waiting": waiting
+                }
+            return result
+
+limiter = OpenAILimiter.from_env()
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client() -> openai.OpenAI:
+    # one sdk client for the process; its own retries are off because the limiter retries
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+    return _client
+
+def chat_completion(messages, model: str = "gpt-3.5-turbo", max_tokens: int = 1000, temperature: float = 0.7,
+                    priority: int = INTERACTIVE, operation: str = "chat_completions"):
+    # chat completion through the shared limiter, with token accounting
+    estimated = estimate_message_tokens(messages) + max_tokens
+    def send():
+        with outbound("openai", operation):
+            return get_client().chat.completions.create(model=model, messages=messages, max_tokens=max_tokens, temperature=temperature)
+    started = time.perf_counter()
+    try:
+        response = limiter.call(model, send, estimated, priority)
+    except Exception as e:
+        record_call(operation, model, time.perf_counter() - started, error=e)
+        raise
+    record_call(operation, model, time.perf_counter() - started, response.usage)
+    limiter.settle(model, estimated, getattr(response.usage, "total_tokens", None))
+    record_tokens(model, response.usage)
+    return response
@@ -0,0 +1,17 @@
+from datetime import datetime
+from typing import Tuple
+import base64
+import json
+
+# opaque keyset cursors for listings sorted by (timestamp desc, id desc)
+
+def encode_cursor(sort_value: datetime, tie_breaker: str) -> str:
+    raw = json.dumps({"c": sort_value.isoformat(), "d": str(tie_breaker)}).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(raw["c"]), str(raw["d"])
+    except Exception:
+        raise ValueError("invalid cursor")
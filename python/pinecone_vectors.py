@@ -1,105 +1,198 @@
 import os
 import time
-from typing import List, Dict, Any
-from pinecone import Pinecone
+import logging
+import threading
+from typing import List, Dict, Any, Optional
+from pinecone import Pinecone, ServerlessSpec
+from pinecone.exceptions import NotFoundException
 from dotenv import load_dotenv
+from metrics import outbound
+from index_versions import IndexLayout, current_layout, BASE_INDEX_NAME, DEFAULT_DIMENSION
+from text_chunk_model import chunk_hash
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 api_key = os.getenv("PINECONE_API_KEY")
 if not api_key:
     raise ValueError("pinecone_api_key environment variable is not set")
 
 pc = Pinecone(api_key=api_key)
 
-INDEX_NAME = "doc-ai"
+INDEX_NAME = BASE_INDEX_NAME
 
-def ensure_index_exists(dimension: int = 3072):
-    # make sure the pinecone index exists, creating it if necessary
-    if INDEX_NAME not in pc.list_indexes().names():
-        print(f"creating pinecone index '{INDEX_NAME}'...")
-        pc.create_index(
-            name=INDEX_NAME,
-            dimension=dimension,
-            metric="cosine"
-        )
-        time.sleep(1)
-    return pc.Index(INDEX_NAME)
+# "light" vectors carry only document_id, page_num and chunk_index; their text and filename are read back from text_chunks.
+# "full" also copies text, filename and a timestamp into pinecone, for stores without mongo.
+METADATA_MODE = os.getenv("PINECONE_METADATA_MODE", "light")
+
+_indexes: Dict[str, Any] = {}
+_index_lock = threading.Lock()
+
+def ensure_index_exists(dimension: Optional[int] = None, name: Optional[str] = None):
+    # make sure a pinecone index exists (by default the active version's), creating it if necessary. handles are cached, so only the first call per index and process pays for the control plane round trip.
+    if name is None:
+        layout = current_layout()
+        name, dimension = layout.index_name, dimension or layout.dimension
+    index = _indexes.get(name)
+    if index is not None:
+        return index
+    with _index_lock:
+        if name in _indexes:
+            return _indexes[name]
+        with outbound("pinecone", "list_indexes"):
+            index_names = pc.list_indexes().names()
+        if name not in index_names:
+            logger.info(f"creating pinecone index '{name}'")
+            with outbound("pinecone", "create_index"):
+                pc.create_index(
+                    name=name,
+                    dimension=dimension or DEFAULT_DIMENSION,
+                    metric="cosine",
+                    spec=ServerlessSpec(cloud=os.getenv("PINECONE_CLOUD", "aws"), region=os.getenv("PINECONE_REGION", "us-east-1"))
+                )
+            time.sleep(1)
+        _indexes[name] = pc.Index(name)
+        return _indexes[name]
+
+def layout_index(layout: Optional[IndexLayout]):
+    # the index and layout to use: the given version's, or the active one
+    layout = layout or current_layout()
+    return ensure_index_exists(layout.dimension, layout.index_name), layout
+
+def reset_index_cache() -> None:
+    # forget the cached handles, e.g. after an index was deleted and recreated
+    with _index_lock:
+        _indexes.clear()
+
+def warm_index() -> dict:
+    # resolve the active index handle and make one data plane call so its connection pool is open before the first query
+    index, layout = layout_index(None)
+    with outbound("pinecone", "describe_index_stats"):
+        stats = index.describe_index_stats()
+    return {"index": layout.index_name, "version": layout.version, "total_vector_count": getattr(stats, "total_vector_count", None)}
+
+def chunk_vector_id(document_id: str, chunk_index: int) -> str:
+    return f"{document_id}_chunk_{chunk_index}"
+
+def vector_metadata(chunk: Dict[str, Any], document_id: str, user_id: str, filename: str, chunk_index: int, mode: str) -> Dict[str, Any]:
+    metadata = {
+        "document_id": document_id,
+        "page_num": chunk["metadata"].get("page", 0),
+        "chunk_index": chunk_index,
+        # lets readers tell whether cached or cited text is still the text this vector was embedded from
+        "content_hash": chunk_hash(chunk.get("text", ""))
+    }
+    if mode == "full":
+        metadata.update(user_id=user_id, filename=filename, text=chunk["text"], timestamp=time.time())
+    return metadata
 
 def store_document_chunks(
     chunks: List[Dict[str, Any]], 
     document_id: str, 
     user_id: str,
-    filename: str
+    filename: str,
+    start_index: int = 0,
+    metadata_mode: str = None,
+    layout: Optional[IndexLayout] = None
 ) -> int:
-    # store document chunks in pinecone
-    index = ensure_index_exists()
+    # store document chunks in pinecone. ids are derived from the chunk position (a chunk's own chunk_index, else start_index plus its offset), so upserting the same chunks again overwrites rather than duplicates.
+    index, layout = layout_index(layout)
+    mode = metadata_mode or METADATA_MODE
     vectors = []
-    for i, chunk in enumerate(chunks):
-        vector_id = f"{document_id}_chunk_{i}"
-        metadata = {
-            "document_id": document_id,
-            "user_id": user_id,
-            "filename": filename,
-            "page_num": chunk["metadata"].get("page", 0),
-            "chunk_index": i,
-            "text": chunk["text"],
-            "timestamp": time.time()
-        }
+    for i, chunk in enumerate(chunks, start=start_index):
+        i = chunk.get("chunk_index", i)
         vectors.append({
-            "id": vector_id,
+            "id": chunk_vector_id(document_id, i),
             "values": chunk["embedding"],
-            "metadata": metadata
+            "metadata": vector_metadata(chunk, document_id, user_id, filename, i, mode)
         })
     batch_size = 100
     for i in range(0, len(vectors), batch_size):
         batch = vectors[i:i+batch_size]
-        index.upsert(vectors=batch, namespace=user_id)
+        with outbound("pinecone", "upsert"):
+            index.upsert(vectors=batch, namespace=layout.namespace(user_id))
     return len(vectors)
 
 def query_document_chunks(
     query_embedding: List[float],
     user_id: str,
     document_id: str = None,
-    top_k: int = 5
+    top_k: int = 5,
+    include_values: bool = False,
+    layout: Optional[IndexLayout] = None
 ) -> List[Dict]:
-    # query for similar chunks
-    index = ensure_index_exists()
+    # query for similar chunks; include_values also returns their embeddings
+    index, layout = layout_index(layout)
     filter_dict = None
     if document_id:
         filter_dict = {"document_id": {"$eq": document_id}}
-    results = index.query(
-        vector=query_embedding,
-        namespace=user_id,
-        top_k=top_k,
-        include_metadata=True,
-        filter=filter_dict
-    )
-    return results.matches
-
-def delete_document_vectors(document_id: str, user_id: str) -> bool:
-    # delete all vectors for a specific document from pinecone
-    try:
-        index = ensure_index_exists()
-        dummy_vector = [0.0] * 3072
+    with outbound("pinecone", "query"):
         results = index.query(
-            vector=dummy_vector,
-            namespace=user_id,
-            top_k=10000,
+            vector=query_embedding,
+            namespace=layout.namespace(user_id),
+            top_k=top_k,
             include_metadata=True,
-            filter={"document_id": {"$eq": document_id}}
+            include_values=include_values,
+            filter=filter_dict
         )
-        vector_ids = [match.id for match in results.matches]
-        if vector_ids:
-            batch_size = 1000
-            for i in range(0, len(vector_ids), batch_size):
-                batch = vector_ids[i:i+batch_size]
-                index.delete(ids=batch, namespace=user_id)
-            print(f"deleted {len(vector_ids)} vectors for document {document_id}")
-            return True
+    return results.matches
+
+def delete_chunk_vectors(document_id: str, user_id: str, chunk_indexes: List[int], layout: Optional[IndexLayout] = None) -> int:
+    # delete the vectors of specific chunk positions of a document
+    if not chunk_indexes:
+        return 0
+    index, layout = layout_index(layout)
+    vector_ids = [chunk_vector_id(document_id, i) for i in chunk_indexes]
+    for i in range(0, len(vector_ids), 1000):
+        with outbound("pinecone", "delete"):
+            index.delete(ids=vector_ids[i:i + 1000], namespace=layout.namespace(user_id))
+    return len(vector_ids)
+
+def list_document_vector_ids(document_id: str, user_id: str, layout: Optional[IndexLayout] = None) -> List[str]:
+    # every vector id of a document, found by id prefix; for documents whose chunk count is not recorded
+    index, layout = layout_index(layout)
+    vector_ids = []
+    with outbound("pinecone", "list"):
+        for page in index.list(prefix=f"{document_id}_chunk_", namespace=layout.namespace(user_id)):
+            vector_ids.extend(page)
+    return vector_ids
+
+def delete_documents_vectors(user_id: str, chunk_counts: Dict[str, int], progress=None, layout: Optional[IndexLayout] = None) -> int:
+    # delete the vectors of several documents in batches of 1000 ids. ids follow from each document's chunk count (listed by prefix when unknown),
+    # so nothing is queried first. progress(document_count) is called as documents are finished.
+    index, layout = layout_index(layout)
+    pending: List[str] = []
+    finished = 0
+    deleted = 0
+    def flush():
+        nonlocal pending, deleted
+        for i in range(0, len(pending), 1000):
+            with outbound("pinecone", "delete"):
+                index.delete(ids=pending[i:i + 1000], namespace=layout.namespace(user_id))
+        deleted += len(pending)
+        pending = []
+    for document_id, chunk_count in chunk_counts.items():
+        if chunk_count:
+            pending.extend(chunk_vector_id(document_id, i) for i in range(chunk_count))
         else:
-            print(f"no vectors found for document {document_id}")
-            return True
-    except Exception as e:
-        print(f"error deleting vectors for document {document_id}: {str(e)}")
-        return False
\ No newline at end of file
+            pending.extend(list_document_vector_ids(document_id, user_id, layout))
+        finished += 1
+        if len(pending) >= 1000:
+            flush()
+            if progress:
+                progress(finished)
+    flush()
+    if progress:
+        progress(finished)
+    return deleted
+
+def delete_user_namespace(user_id: str, layout: Optional[IndexLayout] = None) -> bool:
+    # drop every vector of a user at once; each version keeps a user's vectors in one namespace
+    index, layout = layout_index(layout)
+    try:
+        with outbound("pinecone", "delete_namespace"):
+            index.delete(delete_all=True, namespace=layout.namespace(user_id))
+    except NotFoundException:
+        return False
+    return True
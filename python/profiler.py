@@ -0,0 +1,266 @@
+# on-demand sampling profiles of single api requests. an admin sends the admin token as X-Profile-Token with a request; every thread working for
+# that request (the event loop, the threadpool worker running the endpoint, pipeline stage threads) is sampled until the response
+# is ready, and the stacks are saved in folded form ("frame;frame;frame count" lines) for flamegraph.pl, speedscope or inferno.
+# without the token nothing is sampled; the only cost per request is a header lookup and a contextvar read.
+import functools
+import inspect
+import json
+import logging
+import os
+import re
+import sys
+import sysconfig
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi.routing import APIRoute
+
+import admin_auth
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join("uploads", "profiles"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# sampling of a request stops after this long; the artifact is marked truncated
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "120"))
+# older artifacts are removed once there are more than this many
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+
+PROFILE_HEADER = "x-profile-token"
+PROFILE_QUERY = "profile_token"
+
+# the event loop parked in its selector is waiting, not working for the request
+_IDLE_LEAVES = {("selectors.py", "select"), ("selectors.py", "poll")}
+_PATH_PREFIXES = sorted({path for key in ("purelib", "platlib", "stdlib") if (path := sysconfig.get_paths().get(key))}, key=len, reverse=True)
+_PROFILE_ID = re.compile(r"[0-9a-f]{32}")
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    for prefix in _PATH_PREFIXES:
+        if filename.startswith(prefix):
+            filename = filename[len(prefix):].lstrip(os.sep)
+            break
+    else:
+        filename = os.path.relpath(filename) if os.path.isabs(filename) else filename
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({filename}:{code.co_firstlineno})".replace(";", ":")
+
+class RequestProfile:
+    def __init__(self, method: str, path: str, interval: float = PROFILE_INTERVAL_MS / 1000, max_seconds: float = PROFILE_MAX_SECONDS):
+        self.profile_id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.interval = interval
+        self.deadline = time.monotonic() + max_seconds
+        self.started_at = time.time()
+        self.samples = 0
+        self.truncated = False
+        self.stacks: Dict[str, int] = {}
+        self._threads: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def enter(self) -> int:
+        # attribute the calling thread to this request until the matching leave()
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._threads[thread_id] = self._threads.get(thread_id, 0) + 1
+        return thread_id
+
+    def leave(self, thread_id: int) -> None:
+        with self._lock:
+            remaining = self._threads.get(thread_id, 0) - 1
+            if remaining > 0:
+                self._threads[thread_id] = remaining
+            else:
+                self._threads.pop(thread_id, None)
+
+    def sample(self, frames: Dict[int, Any]) -> None:
+        # fold the current stack of every attributed thread into the counts
+        with self._lock:
+            thread_ids = list(self._threads)
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id in thread_ids:
+            frame = frames.get(thread_id)
+            if frame is None:
+                continue
+            leaf = frame.f_code
+            if (os.path.basename(leaf.co_filename), leaf.co_name) in _IDLE_LEAVES:
+                continue
+            labels: List[str] = []
+            while frame is not None:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            labels.append(names.get(thread_id, "thread").replace(";", ":"))
+            stack = ";".join(reversed(labels))
+            # a sample taken just before the sampler dropped the profile can land while finish() is folding it
+            with self._lock:
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        with self._lock:
+            self.samples += 1
+
+    def folded(self) -> str:
+        with self._lock:
+            stacks = sorted(self.stacks.items())
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def summary(self, duration_ms: float, status: int) -> Dict[str, Any]:
+        return {
+            "profile_id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "status": status,
+            "started_at": self.started_at,
+            "duration_ms": round(duration_ms, 1),
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "truncated": self.truncated,
+        }
+
+class Sampler:
+    # one background thread samples every active profile; it sleeps while there are none
+    def __init__(self):
+        self._profiles: List[RequestProfile] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, profile: RequestProfile) -> None:
+        with self._lock:
+            self._profiles.append(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def remove(self, profile: RequestProfile) -> None:
+        with self._lock:
+            if profile in self._profiles:
+                self._profiles.remove(profile)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                profiles = list(self._profiles)
+                if not profiles:
+                    self._wake.clear()
+            if not profiles:
+                self._wake.wait()
+                continue
+            now = time.monotonic()
+            frames = sys._current_frames()
+            for profile in profiles:
+                if now > profile.deadline:
+                    profile.truncated = True
+                    self.remove(profile)
+                    continue
+                try:
+                    profile.sample(frames)
+                except Exception as e:
+                    logger.warning(f"dropping profile {profile.profile_id} after a sampling error: {str(e)}")
+                    self.remove(profile)
+            del frames
+            time.sleep(min(profile.interval for profile in profiles))
+
+sampler = Sampler()
+
+def authorized(token: Optional[str]) -> bool:
+    return admin_auth.authorized(token)
+
+def requested_token(headers, query_params) -> Optional[str]:
+    # the token a request carries, if any; cheap enough to run for every request. profiling is off without an admin token.
+    if not admin_auth.enabled():
+        return None
+    return headers.get(PROFILE_HEADER) or query_params.get(PROFILE_QUERY)
+
+def start(method: str, path: str) -> RequestProfile:
+    # begin sampling the calling request; the trace carries the profile to every thread that inherits the request context
+    profile = RequestProfile(method, path)
+    trace = metrics.current_trace()
+    if trace is not None:
+        trace.profile = profile
+    sampler.add(profile)
+    return profile
+
+def finish(profile: RequestProfile, duration_ms: float, status: int) -> Dict[str, Any]:
+    # stop sampling and write <profile_id>.folded plus a .json summary next to it
+    sampler.remove(profile)
+    summary = profile.summary(duration_ms, status)
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, profile.profile_id)
+    with open(base + ".folded", "w", encoding="utf-8") as f:
+        f.write(profile.folded())
+    with open(base + ".json", "w", encoding="utf-8") as f:
+        json.dump(summary, f)
+    _prune()
+    return summary
+
+def _prune() -> None:
+    summaries = sorted((entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith(".json")), key=lambda entry: entry.stat().st_mtime)
+    for entry in summaries[:max(len(summaries) - PROFILE_KEEP, 0)]:
+        for suffix in (".json", ".folded"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, entry.name[:-len(".json")] + suffix))
+            except FileNotFoundError:
+                pass
+
+def read_profile(profile_id: str) -> Optional[str]:
+    # the folded stacks of a saved profile, or None
+    if not _PROFILE_ID.fullmatch(profile_id):
+        return None
+    try:
+        with open(os.path.join(PROFILE_DIR, f"{profile_id}.folded"), encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def list_profiles() -> List[Dict[str, Any]]:
+    # summaries of the saved profiles, newest first
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    summaries = []
+    for entry in os.scandir(PROFILE_DIR):
+        if entry.name.endswith(".json"):
+            try:
+                with open(entry.path, encoding="utf-8") as f:
+                    summaries.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return sorted(summaries, key=lambda summary: summary.get("started_at", 0), reverse=True)
+
+def _attributed(call: Callable) -> Callable:
+    # run an endpoint attributed to the profile of its request, if there is one
+    if inspect.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def run_async(*args, **kwargs):
+            trace = metrics.current_trace()
+            profile = trace.profile if trace is not None else None
+            if profile is None:
+                return await call(*args, **kwargs)
+            thread_id = profile.enter()
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                profile.leave(thread_id)
+        return run_async
+
+    @functools.wraps(call)
+    def run(*args, **kwargs):
+        trace = metrics.current_trace()
+        profile = trace.profile if trace is not None else None
+        if profile is None:
+            return call(*args, **kwargs)
+        thread_id = profile.enter()
+        try:
+            return call(*args, **kwargs)
+        finally:
+            profile.leave(thread_id)
+    return run
+
+class ProfiledRoute(APIRoute):
+    # sync endpoints run on threadpool workers the middleware cannot see; wrapping the endpoint call attributes that worker to the
+    # request while the endpoint runs
+    def get_route_handler(self) -> Callable:
+        self.dependant.call = _attributed(self.dependant.call)
+        return super().get_route_handler()
@@ -0,0 +1,242 @@
+# corpus-wide re-index into a new index version, after a change of chunking or embedding model. documents are re-chunked and
+# re-embedded from their stored page text, with no extraction or ocr, into a namespace (or index) and chunk collection of their
+# own while chat keeps using the active version. progress is recorded per document, so a stopped run resumes where it left off,
+# and the active pointer is switched once every document is in.
+import argparse
+import logging
+import os
+import socket
+import sys
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from document_model import DocumentModel
+from document_pages import DocumentPageModel, pages_from_chunks
+from index_versions import IndexLayout, IndexVersionModel, index_layouts, layout_from_record, DEFAULT_DIMENSION, DEFAULT_EMBEDDING_MODEL, LEGACY_LAYOUT
+from log_config import configure_logging
+from metrics import stage
+from openai_limiter import BULK
+from near_duplicates import chunk_without_duplicates
+from text_chunk_model import TextChunkModel
+from usage_ledger import UsageLedgerModel, bind_scope, usage_scope, usage_writer
+
+logger = logging.getLogger(__name__)
+
+# chunks per embeddings request
+REINDEX_BATCH_SIZE = int(os.getenv("REINDEX_BATCH_SIZE", "128"))
+# ceiling on chunks embedded per minute across the run, on top of the shared openai limiter; 0 leaves pacing to the limiter
+REINDEX_CHUNKS_PER_MINUTE = int(os.getenv("REINDEX_CHUNKS_PER_MINUTE", "0"))
+REINDEX_LEASE_SECONDS = int(os.getenv("REINDEX_LEASE_SECONDS", "600"))
+# passes over the corpus to pick up documents uploaded or replaced while the previous pass ran
+REINDEX_MAX_PASSES = 5
+
+class Throttle:
+    # spaces work out to at most per_minute units a minute
+    def __init__(self, per_minute: int, clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        self.per_minute = per_minute
+        self.clock = clock
+        self.sleep = sleep
+        self._next_at = 0.0
+
+    def wait(self, units: int) -> None:
+        if self.per_minute <= 0:
+            return
+        now = self.clock()
+        if self._next_at > now:
+            self.sleep(self._next_at - now)
+            now = self._next_at
+        self._next_at = now + units * 60.0 / self.per_minute
+
+def reindex_document(document: Dict[str, Any], layout: IndexLayout, page_model, chunk_model, active_chunk_model, api_key: str,
+                     batch_size: int, throttle: Throttle) -> Optional[int]:
+    # re-chunk and re-embed one document into layout. returns its chunk count, or None when no text is stored for it.
+    # vectors are written before the chunk records, as in ingestion, so a document interrupted halfway is simply redone.
+    from embeddings import get_embeddings_batch
+    from pinecone_vectors import store_document_chunks
+    document_id, user_id, filename = document["document_id"], document["user_id"], document.get("filename", "unknown")
+    pages = page_model.get_pages(document_id, user_id)
+    if not pages:
+        # ingested before page text was kept: rebuild it once from the active version's chunks
+        pages = pages_from_chunks(active_chunk_model.get_chunks(document_id, user_id))
+        if not pages:
+            return None
+        page_model.save_pages(document_id, user_id, pages, source="chunks")
+    with stage("reindex.chunking"):
+        chunks, _ = chunk_without_duplicates(pages, layout.max_tokens, layout.overlap)
+    for start in range(0, len(chunks), batch_size):
+        batch = chunks[start:start + batch_size]
+        throttle.wait(len(batch))
+        with stage("reindex.embedding"), usage_scope(user_id=user_id, document_id=document_id):
+            embeddings = get_embeddings_batch([chunk["text"] for chunk in batch], api_key, model=layout.embedding_model, priority=BULK)
+        for chunk, embedding in zip(batch, embeddings):
+            chunk["embedding"] = embedding
+        with stage("reindex.vector_store"):
+            store_document_chunks(batch, document_id=document_id, user_id=user_id, filename=filename, start_index=start, layout=layout)
+    with stage("reindex.mongo_store"):
+        chunk_model.delete_chunks_by_document(document_id, user_id)
+        chunk_model.insert_chunks(chunks, document_id, user_id, filename)
+    return len(chunks)
+
+def remove_from_version(document_id: str, user_id: str, layout: IndexLayout, chunk_model) -> None:
+    # drop a document's chunks and vectors from one version, e.g. before redoing it after a replace
+    from pinecone_vectors import delete_documents_vectors
+    chunk_model.delete_chunks_by_document(document_id, user_id)
+    delete_documents_vectors(user_id, {document_id: 0}, layout=layout)
+
+def run_reindex(db, version: int, api_key: str, batch_size: Optional[int] = None, chunks_per_minute: Optional[int] = None,
+                activate: bool = True, report: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    # build (or resume building) a version and, with activate, switch to it once every ready document is in. documents that
+    # change during the run are redone in a later pass; documents that fail are retried on the next run and block activation.
+    versions = IndexVersionModel(db)
+    record = versions.get_version(version)
+    if record is None:
+        raise LookupError(f"index version {version} does not exist")
+    if record["status"] != "building":
+        raise ValueError(f"index version {version} is {record['status']}, not building")
+    layout = layout_from_record(record)
+    previous = versions.active_version()
+    documents_model = DocumentModel(db)
+    page_model = DocumentPageModel(db)
+    chunk_model = TextChunkModel(db, layout)
+    active_chunk_model = TextChunkModel(db, versions.active_layout())
+    throttle = Throttle(REINDEX_CHUNKS_PER_MINUTE if chunks_per_minute is None else chunks_per_minute)
+    batch_size = batch_size or REINDEX_BATCH_SIZE
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    if not versions.claim_build(version, owner, REINDEX_LEASE_SECONDS):
+        raise RuntimeError(f"index version {version} is being built by another runner")
+    summary: Dict[str, Any] = {"version": version, "indexed": 0, "skipped": [], "failed": {}, "removed": 0, "activated": False}
+    try:
+        for number in range(1, REINDEX_MAX_PASSES + 1):
+            done = versions.done_documents(version)
+            documents = documents_model.list_ready_documents()
+            current = {(doc["user_id"], doc["document_id"]) for doc in documents}
+            for user_id, document_id in set(done) - current:
+                # deleted since it was indexed; deletions only reach versions that existed at the time
+                remove_from_version(document_id, user_id, layout, chunk_model)
+                versions.progress.delete_one({"version": version, "document_id": document_id, "user_id": user_id})
+                summary["removed"] += 1
+            pending = [
+                doc for doc in documents
+                if done.get((doc["user_id"], doc["document_id"])) != (doc.get("content_hash"), doc.get("revision", 0))
+                and doc["document_id"] not in summary["failed"] and doc["document_id"] not in summary["skipped"]
+            ]
+            completed = len(documents) - len(pending)
+            versions.set_fields(version, documents_total=len(documents), documents_done=completed, passes=number)
+            logger.info(f"re-index v{version} pass {number}: {len(pending)} of {len(documents)} documents to do")
+            if not pending:
+                break
+            for document in pending:
+                if not versions.claim_build(version, owner, REINDEX_LEASE_SECONDS):
+                    raise RuntimeError(f"lost the build lease of index version {version}")
+                key = (document["user_id"], document["document_id"])
+                try:
+                    if key in done:
+                        remove_from_version(document["document_id"], document["user_id"], layout, chunk_model)
+                    chunk_count = reindex_document(document, layout, page_model, chunk_model, active_chunk_model, api_key, batch_size, throttle)
+                except Exception as e:
+                    logger.error(f"re-indexing document {document['document_id']} failed: {str(e)}")
+                    summary["failed"][document["document_id"]] = str(e)[:300]
+                    continue
+                if chunk_count is None:
+                    logger.warning(f"document {document['document_id']} has no stored text and was left out of v{version}")
+                    summary["skipped"].append(document["document_id"])
+                    continue
+                versions.mark_document_done(version, document, chunk_count)
+                summary["indexed"] += 1
+                completed += 1
+                versions.set_fields(version, documents_done=completed)
+                if report:
+                    report({"version": version, "pass": number, "done": completed, "total": len(documents), "document_id": document["document_id"]})
+        versions.set_fields(version, failed_documents=summary["failed"], skipped_documents=summary["skipped"])
+        if activate and not summary["failed"]:
+            summary["activated"] = versions.activate(version, previous)
+            if not summary["activated"]:
+                logger.warning(f"the active index version changed during the run; v{version} was not activated")
+            index_layouts.refresh()
+        return summary
+    finally:
+        versions.release_build(version, owner)
+
+def drop_version(db, version: int) -> Dict[str, Any]:
+    # delete a version that is not active: each user's vectors in it, its chunk collection and its progress records
+    from pinecone_vectors import delete_user_namespace
+    versions = IndexVersionModel(db)
+    if version == versions.active_version():
+        raise ValueError(f"index version {version} is active; activate another version first")
+    layout = versions.active_layout() if version == 0 else layout_from_record(versions.get_version(version))
+    if version and layout.version != version:
+        raise LookupError(f"index version {version} does not exist")
+    users = set(db["documents"].distinct("user_id")) | set(db[layout.chunk_collection].distinct("user_id"))
+    namespaces = sum(delete_user_namespace(user_id, layout=layout) for user_id in users)
+    db.drop_collection(layout.chunk_collection)
+    versions.clear_progress(version)
+    versions.mark_dropped(version)
+    return {"version": version, "namespaces_deleted": namespaces}
+
+def describe_versions(db) -> List[Dict[str, Any]]:
+    versions = IndexVersionModel(db)
+    active = versions.active_version()
+    rows = [{"version": 0, "status": "active" if active == 0 else "retired", "max_tokens": LEGACY_LAYOUT.max_tokens,
+             "overlap": LEGACY_LAYOUT.overlap, "embedding_model": LEGACY_LAYOUT.embedding_model}]
+    for record in versions.list_versions():
+        rows.append({key: record.get(key) for key in ("version", "status", "max_tokens", "overlap", "embedding_model", "index_name", "documents_done", "documents_total")})
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="re-index the whole corpus into a new index version")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create", help="register a new version to build")
+    create.add_argument("--max-tokens", type=int, required=True, help="tokens per chunk")
+    create.add_argument("--overlap", type=int, required=True, help="tokens shared by neighbouring chunks")
+    create.add_argument("--embedding-model", default=DEFAULT_EMBEDDING_MODEL)
+    create.add_argument("--dimension", type=int, default=DEFAULT_DIMENSION, help="embedding size; a new size gets its own pinecone index")
+    run = commands.add_parser("run", help="build or resume a version, then switch to it")
+    run.add_argument("version", type=int)
+    run.add_argument("--batch-size", type=int, help="chunks per embeddings request")
+    run.add_argument("--chunks-per-minute", type=int, help="cap on embedding throughput (0 for none)")
+    run.add_argument("--no-activate", action="store_true", help="build only; switch later with activate")
+    activate = commands.add_parser("activate", help="switch chat and ingestion to a version (also rolls back)")
+    activate.add_argument("version", type=int)
+    drop = commands.add_parser("drop", help="delete an inactive version")
+    drop.add_argument("version", type=int)
+    commands.add_parser("status", help="list versions")
+    args = parser.parse_args(argv)
+
+    configure_logging()
+    from mongo_connection import mongo_manager
+    db = mongo_manager.get_database()
+    versions = IndexVersionModel(db)
+    if args.command == "create":
+        record = versions.create_version(args.max_tokens, args.overlap, args.embedding_model, args.dimension)
+        print(f"created index version {record['version']} ({record['index_name']}, {record['chunk_collection']})")
+    elif args.command == "run":
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            print("OPENAI_API_KEY is not set", file=sys.stderr)
+            return 1
+        bind_scope(endpoint="reindex")
+        usage_writer.start(UsageLedgerModel(db).insert_entries)
+        try:
+            summary = run_reindex(db, args.version, api_key, args.batch_size, args.chunks_per_minute, activate=not args.no_activate,
+                                  report=lambda p: print(f"pass {p['pass']}: {p['done']}/{p['total']} documents", flush=True))
+        finally:
+            usage_writer.stop()
+        print(f"indexed {summary['indexed']}, skipped {len(summary['skipped'])}, failed {len(summary['failed'])}, removed {summary['removed']}; "
+              f"{'activated' if summary['activated'] else 'not activated'}")
+        return 1 if summary["failed"] else 0
+    elif args.command == "activate":
+        current = versions.active_version()
+        if not versions.activate(args.version, current):
+            print("the active version changed concurrently; try again", file=sys.stderr)
+            return 1
+        print(f"active index version: {args.version} (was {current})")
+    elif args.command == "drop":
+        print(drop_version(db, args.version))
+    else:
+        for row in describe_versions(db):
+            print(row)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+# maximal marginal relevance over retrieved chunks, so a prompt is not filled with near-copies of one passage
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+def mmr_select(query_embedding: Sequence[float], embeddings: Sequence[Sequence[float]], k: int, relevance_weight: float = 0.7,
+               relevance: Optional[Sequence[float]] = None) -> List[int]:
+    # indexes of k candidates chosen greedily by relevance_weight * relevance - (1 - relevance_weight) * max similarity to those already chosen.
+    # relevance defaults to the cosine similarity with the query; 1.0 gives plain relevance order, lower values favour diversity.
+    count = len(embeddings)
+    k = min(k, count)
+    if k <= 0:
+        return []
+    vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+    if relevance is None:
+        relevance = vectors @ _normalize(np.asarray(query_embedding, dtype=np.float32))
+    else:
+        relevance = np.asarray(relevance, dtype=np.float32)
+    similarity = vectors @ vectors.T
+    selected = [int(np.argmax(relevance))]
+    # highest similarity of every candidate to anything selected so far, updated one column at a time
+    redundancy = similarity[:, selected[0]].copy()
+    available = np.ones(count, dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < k:
+        scores = relevance_weight * relevance - (1.0 - relevance_weight) * redundancy
+        scores[~available] = -np.inf
+        chosen = int(np.argmax(scores))
+        selected.append(chosen)
+        available[chosen] = False
+        np.maximum(redundancy, similarity[:, chosen], out=redundancy)
+    return selected
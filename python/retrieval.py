@@ -0,0 +1,195 @@
+# similarity search for the chat endpoints: query pinecone, keep the best matches and hydrate their text from mongo
+import logging
+import math
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from metrics import stage
+from reranking import mmr_select
+
+logger = logging.getLogger(__name__)
+
+# matches fetched, with their embeddings, for the diversity reranking to choose from
+RETRIEVAL_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "24"))
+# weight of relevance against novelty in the reranking; 1 keeps plain similarity order and skips fetching embeddings
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# a follow-up is answered from the previous turn's chunks, without a vector search, when at least FOLLOW_UP_REUSE_MIN_MATCHES of
+# them are this similar to the new question
+FOLLOW_UP_REUSE_THRESHOLD = float(os.getenv("FOLLOW_UP_REUSE_THRESHOLD", "0.45"))
+FOLLOW_UP_REUSE_MIN_MATCHES = int(os.getenv("FOLLOW_UP_REUSE_MIN_MATCHES", "2"))
+
+def match_candidate(match) -> Dict[str, Any]:
+    # a pinecone match as a plain dict; text and filename are only present for vectors stored with full metadata
+    metadata = match.metadata or {}
+    document_id = metadata.get("document_id", "")
+    chunk_index = metadata.get("chunk_index")
+    if chunk_index is None and "_chunk_" in match.id:
+        chunk_index = int(match.id.rsplit("_chunk_", 1)[1])
+    return {
+        "vector_id": match.id,
+        "document_id": document_id,
+        "chunk_index": int(chunk_index) if chunk_index is not None else None,
+        "page_num": metadata.get("page_num", 0),
+        "filename": metadata.get("filename"),
+        "text": metadata.get("text"),
+        "score": float(match.score),
+        "content_hash": metadata.get("content_hash"),
+        "values": getattr(match, "values", None) or None
+    }
+
+def hydrate(candidates: List[Dict[str, Any]], user_id: str, chunk_model) -> List[Dict[str, Any]]:
+    # fill in text and filename for light-metadata candidates with one batched lookup
+    keys = [(c["document_id"], c["chunk_index"]) for c in candidates if c["text"] is None and c["chunk_index"] is not None]
+    # vectors written since content hashes were recorded say which text they were embedded from
+    expected = {(c["document_id"], c["chunk_index"]): c["content_hash"] for c in candidates if c.get("content_hash") and c["text"] is None}
+    stored = chunk_model.get_chunk_texts(user_id, keys, expected) if keys else {}
+    for candidate in candidates:
+        if candidate["text"] is not None:
+            if candidate["filename"] is None:
+                candidate["filename"] = "unknown"
+            continue
+        chunk = stored.get((candidate["document_id"], candidate["chunk_index"]))
+        if chunk is None:
+            logger.warning(f"no stored text for vector {candidate['vector_id']}")
+            candidate.update(text="", filename=candidate["filename"] or "unknown")
+            continue
+        candidate["text"] = chunk["text"]
+        candidate["filename"] = candidate["filename"] or chunk["filename"]
+        candidate["page_num"] = candidate["page_num"] or chunk["page_num"]
+    return candidates
+
+def chunk_id(document_id: str, chunk_index: int) -> str:
+    # how references name a chunk; the same form as its vector id
+    return f"{document_id}_chunk_{chunk_index}"
+
+def parse_chunk_id(value: str) -> Tuple[str, int]:
+    document_id, separator, index = value.strip().rpartition("_chunk_")
+    if not separator or not document_id or not index.isdigit():
+        raise ValueError(f"invalid chunk id: {value}")
+    return document_id, int(index)
+
+def chunk_texts(keys: List[Tuple[int, str, int]], user_id: str, chunk_model,
+                expected_hashes: Optional[Dict[Tuple[int, str, int], str]] = None) -> Dict[Tuple[int, str, int], Dict[str, Any]]:
+    # text, filename and page of chunks by (index version, document_id, chunk_index). chunk positions only mean something within
+    # the version that produced them, so each version is read from its own collection; versions since dropped yield nothing.
+    # a replacement rewrites positions in place, so chunks whose content hash is no longer the one in expected_hashes (the hash
+    # stored with a lean reference) are left out too.
+    from index_versions import index_layouts
+    from text_chunk_model import TextChunkModel
+    by_version: Dict[int, List[Tuple[str, int]]] = {}
+    for version, document_id, chunk_index in keys:
+        by_version.setdefault(version, []).append((document_id, chunk_index))
+    live = {layout.version: layout for layout in index_layouts.live()}
+    active = index_layouts.active().version
+    expected_hashes = expected_hashes or {}
+    found = {}
+    for version, version_keys in by_version.items():
+        if version == active:
+            model = chunk_model
+        elif version in live:
+            model = TextChunkModel(chunk_model.db, live[version])
+        else:
+            continue
+        expected = {(document_id, chunk_index): expected_hashes[(version, document_id, chunk_index)]
+                    for document_id, chunk_index in version_keys if (version, document_id, chunk_index) in expected_hashes}
+        for (document_id, chunk_index), chunk in model.get_chunk_texts(user_id, version_keys, expected).items():
+            if expected.get((document_id, chunk_index), chunk["content_hash"]) == chunk["content_hash"]:
+                found[(version, document_id, chunk_index)] = chunk
+    return found
+
+def previous_candidates(references: List[Dict[str, Any]], user_id: str, document_ids: Optional[List[str]], chunk_model,
+                        version: int) -> List[Dict[str, Any]]:
+    # the chunks an earlier answer cited, as candidates carrying their stored embeddings. references from another index version
+    # are skipped: their embeddings are not comparable with a query embedded for this one.
+    keys = list(dict.fromkeys(
+        (reference["document_id"], reference["chunk_index"])
+        for reference in references
+        if reference.get("chunk_index") is not None and reference.get("index_version", 0) == version
+        and (not document_ids or reference["document_id"] in document_ids)
+    ))
+    stored = chunk_model.get_chunk_embeddings(user_id, keys)
+    return [
+        {
+            "vector_id": chunk_id(document_id, chunk_index),
+            "document_id": document_id,
+            "chunk_index": chunk_index,
+            "page_num": chunk["page_num"],
+            "filename": chunk["filename"],
+            "text": chunk["text"],
+            "score": 0.0,
+            "values": chunk["embedding"]
+        }
+        for (document_id, chunk_index), chunk in ((key, stored.get(key)) for key in keys) if chunk is not None
+    ]
+
+def rescore(candidates: List[Dict[str, Any]], query_embedding: List[float]) -> List[Dict[str, Any]]:
+    # cosine similarity of every candidate's embedding with the query in one matrix product, best first
+    if not candidates:
+        return []
+    vectors = np.asarray([candidate["values"] for candidate in candidates], dtype=np.float32)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1) * (np.linalg.norm(query) or 1.0)
+    scores = (vectors @ query) / np.where(norms == 0, 1.0, norms)
+    for candidate, score in zip(candidates, scores):
+        candidate["score"] = float(score)
+    return sorted(candidates, key=lambda candidate: candidate["score"], reverse=True)
+
+def reuse_previous(candidates: List[Dict[str, Any]], query_embedding: List[float], threshold: Optional[float] = None,
+                   min_matches: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+    # the previous turn's candidates that still match the new question, or None when too few do and a vector search is needed
+    threshold = FOLLOW_UP_REUSE_THRESHOLD if threshold is None else threshold
+    min_matches = FOLLOW_UP_REUSE_MIN_MATCHES if min_matches is None else min_matches
+    matching = [candidate for candidate in rescore(candidates, query_embedding) if candidate["score"] >= threshold]
+    return matching if matching and len(matching) >= min_matches else None
+
+def rerank(candidates: List[Dict[str, Any]], query_embedding: List[float], limit: int, relevance_weight: float) -> List[Dict[str, Any]]:
+    # mmr over the candidates that came back with embeddings; without them, keep similarity order
+    if len(candidates) <= limit or any(c["values"] is None for c in candidates):
+        return candidates[:limit]
+    order = mmr_select(query_embedding, [c["values"] for c in candidates], limit, relevance_weight, [c["score"] for c in candidates])
+    return [candidates[i] for i in order]
+
+def search(query_embedding: List[float], user_id: str, document_ids: Optional[List[str]], pool_size: int, include_values: bool,
+           layout=None) -> List[Dict[str, Any]]:
+    # candidates across the requested documents (or all of the user's), best first; layout is the index version the query embedding was made for
+    from pinecone_vectors import query_document_chunks
+    matches = []
+    if document_ids:
+        per_document = max(5, math.ceil(pool_size / len(document_ids))) if include_values else 5
+        for document_id in document_ids:
+            matches.extend(query_document_chunks(query_embedding=query_embedding, user_id=user_id, document_id=document_id, top_k=per_document, include_values=include_values, layout=layout))
+    else:
+        matches = query_document_chunks(query_embedding=query_embedding, user_id=user_id, document_id=None, top_k=pool_size if include_values else 10, include_values=include_values, layout=layout)
+    matches.sort(key=lambda match: match.score, reverse=True)
+    return [match_candidate(match) for match in matches]
+
+def merge_candidates(*candidate_lists: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # union of several searches, keeping each vector once with its best score
+    merged: Dict[str, Dict[str, Any]] = {}
+    for candidates in candidate_lists:
+        for candidate in candidates:
+            current = merged.get(candidate["vector_id"])
+            if current is None or candidate["score"] > current["score"]:
+                merged[candidate["vector_id"]] = candidate
+    return sorted(merged.values(), key=lambda candidate: candidate["score"], reverse=True)
+
+def retrieval_plan(limit: int, pool_size: Optional[int] = None, relevance_weight: Optional[float] = None) -> Tuple[int, float, bool]:
+    # the pool size and relevance weight to use, and whether reranking will need the candidates' embeddings
+    pool_size = RETRIEVAL_CANDIDATES if pool_size is None else pool_size
+    relevance_weight = MMR_LAMBDA if relevance_weight is None else relevance_weight
+    return pool_size, relevance_weight, relevance_weight < 1.0 and pool_size > limit
+
+def retrieve_chunks(query_embedding: List[float], user_id: str, document_ids: Optional[List[str]], chunk_model, limit: int = 8,
+                    pool_size: Optional[int] = None, relevance_weight: Optional[float] = None) -> List[Dict[str, Any]]:
+    # the best matches across the requested documents (or all of the user's), reranked for diversity, with their text
+    pool_size, relevance_weight, diversify = retrieval_plan(limit, pool_size, relevance_weight)
+    with stage("chat.retrieval"):
+        candidates = search(query_embedding, user_id, document_ids, pool_size, diversify)
+    with stage("chat.rerank"):
+        candidates = rerank(candidates, query_embedding, limit, relevance_weight)
+        for candidate in candidates:
+            candidate.pop("values", None)
+    with stage("chat.hydrate"):
+        return hydrate(candidates, user_id, chunk_model)
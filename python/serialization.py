@@ -0,0 +1,28 @@
+# helpers that make mongo documents json-serializable for api responses
+import logging
+from bson import ObjectId
+
+logger = logging.getLogger(__name__)
+
+def convert_objectid_to_str(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    elif isinstance(obj, dict):
+        return {k: convert_objectid_to_str(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [convert_objectid_to_str(i) for i in obj]
+    elif hasattr(obj, '__dict__'):
+        return {k: convert_objectid_to_str(v) for k, v in obj.__dict__.items()}
+    else:
+        return obj
+
+def debug_objectids(obj, path=""):
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            debug_objectids(v, f"{path}.{k}")
+    elif isinstance(obj, list):
+        for i, v in enumerate(obj):
+            debug_objectids(v, f"{path}[{i}]")
+    elif isinstance(obj, ObjectId):
+        logger.debug(f"found objectid at {path}: {obj}")
+    return obj
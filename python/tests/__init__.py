@@ -1,3 +1,24 @@
 from . import test_document_processor
 from . import test_embeddings
-from . import test_user_model
\ No newline at end of file
+from . import test_user_model
+from . import test_document_model
+from . import test_cache
+from . import test_metrics
+from . import test_log_config
+from . import test_benchmarks
+from . import test_loadtest
+from . import test_openai_limiter
+from . import test_ingestion
+from . import test_warmup
+from . import test_retrieval
+from . import test_context_packing
+from . import test_reranking
+from . import test_deletion
+from . import test_chat_pipeline
+from . import test_batch_chat
+from . import test_reindex
+from . import test_directory_ingest
+from . import test_worker
+from . import test_profiler
+from . import test_usage_ledger
+from . import test_near_duplicates
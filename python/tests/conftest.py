@@ -0,0 +1,93 @@
+import pytest
+
+import doc_chunks
+import document_model
+import document_pages
+import text_chunk_model
+
+# in-memory stand-ins for the mongo models the ingestion paths use. each keeps its records in a dict shared through db, the way the
+# real models share a database, so code that builds its own models (directory mode, re-index) sees the same data as the test.
+
+class FakeDocuments:
+    def __init__(self, db):
+        self.records = db.setdefault("documents", {})
+
+    def get_document(self, document_id, user_id):
+        record = self.records.get(document_id)
+        return dict(record) if record and record["user_id"] == user_id else None
+
+    def ready_hashes(self, user_id, hashes):
+        return {r["content_hash"] for r in self.records.values() if r.get("status") == "ready" and r.get("content_hash") in hashes}
+
+    def find_resumable(self, user_id, content_hash):
+        matches = [r for r in self.records.values() if r.get("content_hash") == content_hash and r.get("status") in ("failed", "processing")]
+        return matches[0] if matches else None
+
+    def create_document(self, document_id, user_id, filename, size_bytes=0, content_hash=None, status="processing"):
+        self.records[document_id] = {"document_id": document_id, "user_id": user_id, "filename": filename, "content_hash": content_hash, "status": status}
+
+    def mark_processing(self, document_id, user_id):
+        self.records[document_id]["status"] = "processing"
+
+    def mark_ready(self, document_id, user_id, page_count, chunk_count):
+        self.records.setdefault(document_id, {"document_id": document_id, "user_id": user_id}).update(
+            status="ready", page_count=page_count, chunk_count=chunk_count
+        )
+
+    def mark_failed(self, document_id, user_id, error):
+        self.records[document_id]["status"] = "failed"
+
+    def record_dedup(self, document_id, user_id, report):
+        self.records.setdefault(document_id, {"document_id": document_id, "user_id": user_id})["dedup"] = report
+
+    def list_ready_documents(self):
+        return [dict(r) for r in self.records.values() if r.get("status") == "ready"]
+
+class FakeChunks:
+    def __init__(self, db, layout=None):
+        self.stored = db.setdefault("chunks", {})
+
+    def delete_chunks_by_document(self, document_id, user_id):
+        self.stored.pop(document_id, None)
+
+    def insert_chunks(self, chunks, document_id, user_id, filename):
+        self.stored[document_id] = [
+            {"chunk_index": i, "text": c["text"], "metadata": c["metadata"], "embedding": c.get("embedding")} for i, c in enumerate(chunks)
+        ]
+
+    def get_chunks(self, document_id, user_id):
+        return [{"chunk_index": c["chunk_index"], "text": c["text"], "metadata": c["metadata"]} for c in self.stored.get(document_id, [])]
+
+    def set_embeddings(self, document_id, user_id, start_index, embeddings):
+        for offset, embedding in enumerate(embeddings):
+            self.stored[document_id][start_index + offset]["embedding"] = embedding
+
+class FakePages:
+    def __init__(self, db):
+        self.stored = db.setdefault("pages", {})
+
+    def save_pages(self, document_id, user_id, pages):
+        self.stored[document_id] = pages
+
+def fake_chunk_pages(pages, max_tokens=500, overlap=50):
+    # two chunks per page, without the tokenizer download
+    return [{"text": f"{page} part {i}", "metadata": {"page": n + 1}} for n, page in enumerate(pages) for i in range(2)]
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    # the fake collections by name, with the model classes and the chunker replaced wherever the code under test looks them up
+    monkeypatch.setenv("PINECONE_API_KEY", "test")
+    monkeypatch.setattr(document_model, "DocumentModel", FakeDocuments)
+    monkeypatch.setattr(text_chunk_model, "TextChunkModel", FakeChunks)
+    monkeypatch.setattr(document_pages, "DocumentPageModel", FakePages)
+    # worker processes forked after this chunk with the stand-in too
+    monkeypatch.setattr(doc_chunks, "chunk_pages", fake_chunk_pages)
+    return {}
+
+@pytest.fixture
+def fake_documents(fake_db):
+    return FakeDocuments(fake_db)
+
+@pytest.fixture
+def fake_chunks(fake_db):
+    return FakeChunks(fake_db)
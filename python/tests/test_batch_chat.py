@@ -0,0 +1,68 @@
+import json
+
+import batch_chat
+import embeddings
+from batch_chat import prepare_batch, stream_batch, read_report
+
+class FakeChunkModel:
+    def __init__(self):
+        self.lookups = []
+
+    def get_chunk_texts(self, user_id, keys, expected_hashes=None):
+        self.lookups.append(list(keys))
+        return {key: {"text": f"text of {key[0]} {key[1]}", "filename": f"{key[0]}.pdf", "page_num": key[1] + 1} for key in keys}
+
+def candidate(document_id, chunk_index, score):
+    return {"vector_id": f"{document_id}_chunk_{chunk_index}", "document_id": document_id, "chunk_index": chunk_index, "page_num": 0,
+            "filename": None, "text": None, "score": score, "values": None}
+
+def fake_search(results_by_embedding):
+    def search(embedding, user_id, document_ids, pool_size, include_values, layout=None):
+        return [dict(c) for c in results_by_embedding[embedding[0]]]
+    return search
+
+class TestBatchChat:
+    def test_repeated_questions_and_chunks_are_shared(self, monkeypatch):
+        embedded = []
+        def embed(texts, api_key, model=None, priority=None):
+            embedded.append(list(texts))
+            return [[float(i)] for i in range(len(texts))]
+        monkeypatch.setattr(embeddings, "get_embeddings_batch", embed)
+        monkeypatch.setattr(batch_chat, "search", fake_search({
+            0.0: [candidate("a", 1, 0.9), candidate("a", 7, 0.8)],
+            1.0: [candidate("a", 7, 0.7), candidate("a", 1, 0.6)]
+        }))
+        answered = []
+        monkeypatch.setattr(batch_chat, "generate_answer", lambda context, question, priority=None: answered.append(question) or f"answer to {question}")
+        chunks = FakeChunkModel()
+        prepared = prepare_batch(["What is the term?", "what is  the term?", "Who signs?"], "u1", ["a"], chunks, "key")
+        assert embedded == [["What is the term?", "Who signs?"]]
+        assert prepared["positions"] == [0, 0, 1]
+        assert len(chunks.lookups) == 1 and len(chunks.lookups[0]) == 2
+        assert prepared["contexts"][0]["text"] == prepared["contexts"][1]["text"]
+        assert [c["score"] for c in prepared["contexts"][1]["candidates"]] != [c["score"] for c in prepared["contexts"][0]["candidates"]]
+        lines = [json.loads(line) for line in stream_batch(prepared, "u1", write_report=False)]
+        assert sorted(answered) == ["What is the term?", "Who signs?"]
+        assert sorted(line["index"] for line in lines[:-1]) == [0, 1, 2]
+        assert lines[-1]["done"] and lines[-1]["answered"] == 3
+
+    def test_failed_question_is_reported_and_report_is_owned(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(batch_chat, "CHAT_REPORT_DIR", str(tmp_path))
+        monkeypatch.setattr(embeddings, "get_embeddings_batch", lambda texts, api_key, model=None, priority=None: [[float(i)] for i in range(len(texts))])
+        monkeypatch.setattr(batch_chat, "search", fake_search({0.0: [candidate("a", 1, 0.9)], 1.0: [], 2.0: [candidate("a", 2, 0.5)]}))
+        def answer(context, question, priority=None):
+            if question == "bad":
+                raise RuntimeError("rate limited")
+            return "ok"
+        monkeypatch.setattr(batch_chat, "generate_answer", answer)
+        prepared = prepare_batch(["good", "unmatched", "bad"], "u1", None, FakeChunkModel(), "key")
+        lines = [json.loads(line) for line in stream_batch(prepared, "u1", write_report=True, batch_id="ab" * 16)]
+        by_question = {line["question"]: line for line in lines[:-1]}
+        assert by_question["good"]["success"] and by_question["good"]["references"]
+        assert by_question["unmatched"]["response"] == batch_chat.NO_MATCHES_RESPONSE
+        assert by_question["bad"] == {"index": 2, "question": "bad", "success": False, "error": "rate limited"}
+        assert lines[-1]["failed"] == 1
+        report = read_report("ab" * 16, "u1").splitlines()
+        assert len(report) == 5 and json.loads(report[0])["user_id"] == "u1"
+        assert read_report("ab" * 16, "u2") is None
+        assert read_report("../etc", "u1") is None
@@ -0,0 +1,25 @@
+from benchmarks.run import CASES, compare, missing_from_baseline
+
+def _result(units_per_sec, peak):
+    return {"status": "ok", "units_per_sec": units_per_sec, "peak_alloc_bytes": peak}
+
+class TestBenchmarkCompare:
+    def test_throughput_drop_is_a_regression(self):
+        rows = compare({"case": _result(80.0, 1000)}, {"case": _result(100.0, 1000)}, threshold=0.15)
+        assert rows[0]["status"] == "regressed"
+        assert rows[0]["throughput_delta"] == -0.2
+
+    def test_allocation_growth_is_a_regression(self):
+        rows = compare({"case": _result(100.0, 1300)}, {"case": _result(100.0, 1000)}, threshold=0.15)
+        assert rows[0]["status"] == "regressed"
+
+    def test_small_changes_and_new_cases_pass(self):
+        rows = compare({"case": _result(95.0, 1050), "new": _result(1.0, 1)}, {"case": _result(100.0, 1000)}, threshold=0.15)
+        assert [row["status"] for row in rows] == ["ok", "new"]
+
+    def test_cases_the_baseline_lacks_are_reported(self):
+        names = [name for name, _, _ in CASES]
+        baseline = {name: _result(1.0, 1) for name in names[1:]}
+        baseline[names[2]] = {"status": "skipped", "reason": "tokenizer unavailable"}
+        assert missing_from_baseline(baseline) == [names[0], names[2]]
+        assert missing_from_baseline(baseline, name_filter=names[1]) == []
@@ -0,0 +1,42 @@
+import time
+
+from cache import GroupedTTLCache, GroupedLRUCache
+
+class TestGroupedTTLCache:
+    def test_invalidate_drops_whole_group(self):
+        cache = GroupedTTLCache(ttl_seconds=60)
+        cache.set("user-1", (50, None), "page-1")
+        cache.set("user-1", (50, "cursor"), "page-2")
+        cache.set("user-2", (50, None), "other")
+        cache.invalidate("user-1")
+        assert cache.get("user-1", (50, None)) is None
+        assert cache.get("user-1", (50, "cursor")) is None
+        assert cache.get("user-2", (50, None)) == "other"
+
+    def test_entries_expire(self):
+        cache = GroupedTTLCache(ttl_seconds=0.01)
+        cache.set("user-1", "key", "value")
+        time.sleep(0.02)
+        assert cache.get("user-1", "key") is None
+
+    def test_group_count_is_bounded(self):
+        cache = GroupedTTLCache(ttl_seconds=60, max_groups=2)
+        for user in ("a", "b", "c"):
+            cache.set(user, "key", user)
+        assert cache.get("a", "key") is None
+        assert cache.get("c", "key") == "c"
+
+class TestGroupedLRUCache:
+    def test_evicts_least_recently_used_entry(self):
+        cache = GroupedLRUCache(max_entries=2)
+        cache.set_many({("doc-1", 0): "a", ("doc-1", 1): "b"})
+        cache.get_many([("doc-1", 0)])
+        cache.set_many({("doc-2", 0): "c"})
+        assert cache.get_many([("doc-1", 0), ("doc-1", 1), ("doc-2", 0)]) == {("doc-1", 0): "a", ("doc-2", 0): "c"}
+
+    def test_invalidate_drops_only_that_group(self):
+        cache = GroupedLRUCache(max_entries=10)
+        cache.set_many({("doc-1", 0): "a", ("doc-1", 1): "b", ("doc-2", 0): "c"})
+        cache.invalidate("doc-1")
+        assert cache.get_many([("doc-1", 0), ("doc-1", 1), ("doc-2", 0)]) == {("doc-2", 0): "c"}
+        assert len(cache) == 1
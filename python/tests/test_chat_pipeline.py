@@ -0,0 +1,203 @@
+import os
+import threading
+import time
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+import chat_pipeline
+import dialogue_model
+from chat_pipeline import StageScheduler, to_references, with_reference_texts
+from dialogue_model import DialogueModel
+from dialogue_spool import DialogueSpool
+from text_chunk_model import chunk_hash
+
+class FakeDialogues:
+    def __init__(self):
+        self.docs = {}
+        self.fail = 0
+
+    def insert_many(self, docs, ordered=True):
+        if self.fail:
+            self.fail -= 1
+            raise ConnectionError("mongo unavailable")
+        errors = []
+        for index, doc in enumerate(docs):
+            if doc["_id"] in self.docs:
+                errors.append({"index": index, "code": 11000})
+            else:
+                self.docs[doc["_id"]] = doc
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": []})
+
+    def find_one(self, query, projection=None):
+        doc = self.docs.get(query["_id"])
+        return doc if doc and doc["user_id"] == query["user_id"] else None
+
+    def update_many(self, query, update):
+        for _id in query["_id"]["$in"]:
+            doc = self.docs[_id]
+            if doc["user_id"] == query["user_id"] and doc.get("thread_id") is None:
+                doc.update(update["$set"])
+
+def dialogue(user_id="u1", **fields):
+    return {"_id": ObjectId(), "user_id": user_id, "query": "q", "response": "a", "references": [], "previous_dialogue_id": None, **fields}
+
+class TestStageScheduler:
+    def test_independent_stages_overlap_and_dependencies_wait(self):
+        scheduler = StageScheduler()
+        started = {}
+        def slow(name):
+            def run(inputs):
+                started[name] = time.perf_counter()
+                time.sleep(0.1)
+                return name
+            return run
+        scheduler.add("a", slow("a"))
+        scheduler.add("b", slow("b"))
+        scheduler.add("c", lambda r: r["a"] + r["b"], after=("a", "b"))
+        began = time.perf_counter()
+        results = scheduler.run()
+        assert results == {"a": "a", "b": "b", "c": "ab"}
+        assert time.perf_counter() - began < 0.18
+        assert abs(started["a"] - started["b"]) < 0.05
+
+    def test_failure_is_raised_and_later_stages_never_run(self):
+        scheduler = StageScheduler()
+        ran = []
+        def boom(_):
+            raise ValueError("embedding failed")
+        scheduler.add("a", boom)
+        scheduler.add("b", lambda r: ran.append("b"), after=("a",))
+        with pytest.raises(ValueError, match="embedding failed"):
+            scheduler.run()
+        assert ran == []
+
+    def test_unknown_dependency_is_rejected(self):
+        scheduler = StageScheduler()
+        with pytest.raises(ValueError):
+            scheduler.add("b", lambda r: None, after=("a",))
+
+class TestDialogueSpool:
+    def test_spooled_dialogues_are_stored_and_segments_removed(self, tmp_path):
+        collection = FakeDialogues()
+        model = DialogueModel({"dialogues": collection})
+        spool = DialogueSpool(str(tmp_path), retry_seconds=0.01)
+        spool.start(model.insert_dialogues)
+        collection.fail = 2
+        docs = [dialogue() for _ in range(5)]
+        for doc in docs:
+            spool.enqueue(doc)
+        assert spool.flush(timeout=5)
+        spool.stop()
+        assert set(collection.docs) == {doc["_id"] for doc in docs}
+        assert os.listdir(tmp_path) == []
+
+    def test_leftover_segment_is_replayed_once(self, tmp_path):
+        stopped = DialogueSpool(str(tmp_path))
+        stopped.start(lambda docs: (_ for _ in ()).throw(ConnectionError("down")))
+        doc = dialogue()
+        stopped.enqueue(doc)
+        stopped.stop(timeout=0.05)
+        assert len(os.listdir(tmp_path)) == 1
+        collection = FakeDialogues()
+        collection.docs[doc["_id"]] = doc
+        model = DialogueModel({"dialogues": collection})
+        spool = DialogueSpool(str(tmp_path))
+        assert spool.start(model.insert_dialogues) == 1
+        assert spool.flush(timeout=5)
+        spool.stop()
+        assert list(collection.docs) == [doc["_id"]]
+        assert os.listdir(tmp_path) == []
+
+    def test_pending_dialogue_is_readable_before_it_is_stored(self, tmp_path, monkeypatch):
+        gate = threading.Event()
+        collection = FakeDialogues()
+        model = DialogueModel({"dialogues": collection})
+        spool = DialogueSpool(str(tmp_path))
+        monkeypatch.setattr(dialogue_model, "dialogue_spool", spool)
+        spool.start(lambda docs: (gate.wait(5), model.insert_dialogues(docs)))
+        first = dialogue(thread_id="t1")
+        model.save_dialogue(first)
+        assert collection.docs == {}
+        assert model.get_thread_id(str(first["_id"]), "u1") == "t1"
+        assert model.get_dialogue_by_id(str(first["_id"]), "u2") is None
+        gate.set()
+        spool.stop()
+        assert first["_id"] in collection.docs
+
+    def test_follow_up_waits_for_a_dialogue_spooled_by_another_process(self):
+        collection = FakeDialogues()
+        model = DialogueModel({"dialogues": collection})
+        first = dialogue(thread_id="t1")
+        # the other process' writer stores the dialogue shortly after the follow-up arrives here
+        threading.Timer(0.1, model.insert_dialogues, [[first]]).start()
+        assert model.get_thread_id(str(first["_id"]), "u1") == "t1"
+
+class TestThreads:
+    def test_legacy_chains_resolve_to_their_first_dialogue(self):
+        collection = FakeDialogues()
+        model = DialogueModel({"dialogues": collection})
+        first = dialogue()
+        second = dialogue(previous_dialogue_id=str(first["_id"]))
+        third = dialogue(previous_dialogue_id=str(second["_id"]))
+        model.insert_dialogues([first, second, third])
+        assert model.get_thread_id(str(third["_id"]), "u1") == str(first["_id"])
+        # the walk is recorded, so later lookups read the thread directly
+        assert {doc.get("thread_id") for doc in collection.docs.values()} == {str(first["_id"])}
+
+class TestReferences:
+    def test_lean_references_drop_text_and_follow_ups_fill_it_back_in(self, monkeypatch):
+        candidates = [
+            {"document_id": "doc-a", "chunk_index": 3, "filename": "a.pdf", "page_num": 2, "score": 0.7, "text": "late fees apply"},
+            {"document_id": "doc-a", "chunk_index": 1, "filename": "a.pdf", "page_num": 1, "score": 0.9, "text": "rent is due monthly"}
+        ]
+        full = to_references(candidates, "full")
+        lean = to_references(candidates, "lean", index_version=2)
+        assert [r["chunk_id"] for r in lean] == ["doc-a_chunk_1", "doc-a_chunk_3"]
+        assert all("text" not in r and r["index_version"] == 2 for r in lean)
+        assert [r["text"] for r in full] == ["rent is due monthly", "late fees apply"]
+
+        lookups = []
+        def texts(keys, user_id, chunk_model, expected_hashes=None):
+            lookups.append((keys, expected_hashes))
+            return {key: {"text": f"stored {key[2]}", "filename": "a.pdf", "page_num": key[2]} for key in keys}
+        monkeypatch.setattr(chat_pipeline, "chunk_texts", texts)
+        collection = FakeDialogues()
+        model = DialogueModel({"dialogues": collection})
+        earlier = dialogue(references=lean)
+        collection.docs[earlier["_id"]] = earlier
+        context = model.build_conversation_context(str(earlier["_id"]), "u1", lambda history: with_reference_texts(history, "u1", None))
+        assert lookups == [([(2, "doc-a", 1), (2, "doc-a", 3)], {(2, "doc-a", 1): chunk_hash("rent is due monthly"), (2, "doc-a", 3): chunk_hash("late fees apply")})]
+        assert "Content: stored 1" in context and "Content: stored 3" in context
+        assert "text" not in collection.docs[earlier["_id"]]["references"][0]
+        assert with_reference_texts([dialogue(references=full)], "u1", None)[0]["references"] == full
+
+class TestFollowUps:
+    def test_previous_dialogue_is_looked_up_once_per_follow_up(self, monkeypatch):
+        import embeddings
+        from index_versions import LEGACY_LAYOUT
+        monkeypatch.setenv("OPENAI_API_KEY", "test")
+        monkeypatch.setattr(embeddings, "get_embeddings_direct", lambda text, api_key, model=None, priority=None: [0.1, 0.2])
+        monkeypatch.setattr(chat_pipeline, "current_layout", lambda: LEGACY_LAYOUT)
+        monkeypatch.setattr(chat_pipeline, "search", lambda *args, **kwargs: [])
+        monkeypatch.setattr(chat_pipeline, "pack_context", lambda candidates: {"text": "", "candidates": [], "blocks": [], "tokens": 0})
+        monkeypatch.setattr(chat_pipeline, "generate_answer", lambda context, query: "answer")
+        monkeypatch.setattr(chat_pipeline, "previous_candidates", lambda references, *args: [])
+        monkeypatch.setattr(dialogue_model, "FOLLOW_UP_WAIT_SECONDS", 0.2)
+        saved = []
+        collection = FakeDialogues()
+        model = DialogueModel({"dialogues": collection})
+        monkeypatch.setattr(model, "save_dialogue", saved.append)
+        lookups = []
+        find_previous = model.find_previous
+        monkeypatch.setattr(model, "find_previous", lambda *args: lookups.append(args) or find_previous(*args))
+        first = dialogue(thread_id="t1")
+        model.insert_dialogues([first])
+        chat_pipeline.run_chat("and then?", "u1", [], str(first["_id"]), model, None)
+        assert len(lookups) == 1 and saved[0]["thread_id"] == "t1"
+        # a previous dialogue that never shows up is waited for once, not once per stage
+        began = time.perf_counter()
+        chat_pipeline.run_chat("and then?", "u1", [], str(ObjectId()), model, None)
+        assert len(lookups) == 2 and time.perf_counter() - began < 0.35
@@ -0,0 +1,48 @@
+from context_packing import overlap_length, merge_adjacent, pack_context
+
+def words(text):
+    return len(text.split())
+
+def candidate(chunk_index, text, score, page=1, document_id="doc-a"):
+    return {"document_id": document_id, "chunk_index": chunk_index, "page_num": page, "filename": f"{document_id}.pdf", "text": text, "score": score}
+
+class TestContextPacking:
+    def test_overlap_length_finds_shared_boundary(self):
+        shared = "the notice period is ninety days from the renewal date"
+        assert overlap_length("either party may terminate. " + shared, shared + " unless agreed otherwise") == len(shared)
+        assert overlap_length("one two three " * 5, "six seven eight " * 5) == 0
+        # a short coincidental match is not an overlap
+        assert overlap_length("payment is due in thirty days", "days later the invoice is sent to the customer") == 0
+
+    def test_adjacent_chunks_on_a_page_are_merged_without_repeats(self):
+        shared = "the supplier shall deliver the goods within fourteen days"
+        blocks = merge_adjacent([
+            candidate(4, shared + " of the order.", 0.7),
+            candidate(3, "section 4. delivery. " + shared, 0.9),
+            candidate(5, "section 5 starts on the next page", 0.5, page=2)
+        ])
+        assert len(blocks) == 2
+        assert blocks[0]["text"] == "section 4. delivery. " + shared + " of the order."
+        assert blocks[0]["chunk_indexes"] == [3, 4]
+        assert blocks[0]["score"] == 0.9
+
+    def test_neighbours_without_overlap_stay_separated(self):
+        blocks = merge_adjacent([candidate(7, "invoices are payable net thirty days.", 0.8), candidate(8, "Termination requires notice.", 0.6)])
+        assert blocks[0]["text"] == "invoices are payable net thirty days.\nTermination requires notice."
+
+    def test_budget_is_filled_in_score_order(self):
+        candidates = [
+            candidate(0, "low " * 40, 0.2, document_id="doc-b"),
+            candidate(0, "high " * 40, 0.9),
+            candidate(7, "mid " * 40, 0.5)
+        ]
+        packed = pack_context(candidates, token_budget=100, count_tokens=words)
+        assert [block["score"] for block in packed["blocks"]] == [0.9, 0.5]
+        assert packed["tokens"] <= 100
+        assert packed["dropped"] == 1
+        assert packed["text"].startswith("[from doc-a.pdf, page 1]: high")
+
+    def test_last_block_is_truncated_to_remaining_budget(self):
+        packed = pack_context([candidate(0, "a " * 50, 0.9), candidate(5, "b " * 200, 0.8)], token_budget=130, count_tokens=words)
+        assert packed["blocks"][1]["truncated"]
+        assert packed["tokens"] <= 130
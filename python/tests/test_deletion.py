@@ -0,0 +1,71 @@
+import importlib
+
+from deletion import delete_documents, purge_user, PURGE_STEPS
+
+class FakeIndex:
+    def __init__(self, listed=None):
+        self.deleted = []
+        self.listed = listed or {}
+        self.namespaces_deleted = []
+
+    def delete(self, ids=None, delete_all=None, namespace=None):
+        if delete_all:
+            self.namespaces_deleted.append(namespace)
+        else:
+            self.deleted.append(list(ids))
+
+    def list(self, prefix, namespace):
+        yield [vector_id for vector_id in self.listed.get(namespace, []) if vector_id.startswith(prefix)]
+
+class Recorder:
+    # stands in for every model; records which bulk method was called with what
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        def method(*args):
+            self.calls.append((name, args))
+            return {"deleted_count": 3} if name == "delete_user_chunks" else 1
+        return method
+
+def pinecone(monkeypatch, index):
+    monkeypatch.setenv("PINECONE_API_KEY", "test")
+    module = importlib.import_module("pinecone_vectors")
+    monkeypatch.setattr(module, "_indexes", {module.INDEX_NAME: index})
+    return module
+
+class TestDeletion:
+    def test_bulk_delete_uses_one_call_per_store(self, monkeypatch):
+        index = FakeIndex(listed={"user-1": ["legacy_chunk_0", "legacy_chunk_1", "other_chunk_0"]})
+        pinecone(monkeypatch, index)
+        models = Recorder()
+        progress = []
+        documents = [{"document_id": "doc-a", "chunk_count": 3}, {"document_id": "legacy", "chunk_count": 0}]
+        result = delete_documents("user-1", documents, models, models, models, models, lambda step, done=None, total=None: progress.append((step, done)))
+        assert [name for name, _ in models.calls] == ["delete_chunks_by_documents", "delete_many", "delete_document_pages", "delete_documents"]
+        assert models.calls[0][1] == (["doc-a", "legacy"], "user-1")
+        assert index.deleted == [["doc-a_chunk_0", "doc-a_chunk_1", "doc-a_chunk_2", "legacy_chunk_0", "legacy_chunk_1"]]
+        assert result["vectors_deleted"] == 5
+        assert ("vectors", 2) in progress
+
+    def test_vector_deletes_are_batched_by_thousand(self, monkeypatch):
+        index = FakeIndex()
+        module = pinecone(monkeypatch, index)
+        done = []
+        deleted = module.delete_documents_vectors("user-1", {"big": 1500, "small": 10}, progress=done.append)
+        assert deleted == 1510
+        assert [len(batch) for batch in index.deleted] == [1000, 500, 10]
+        assert done[-1] == 2
+
+    def test_purge_drops_namespace_then_every_collection(self, monkeypatch):
+        index = FakeIndex()
+        pinecone(monkeypatch, index)
+        models = Recorder()
+        steps = []
+        result = purge_user("user-1", models, models, models, models, models, models, lambda step, done=None, total=None: steps.append(step))
+        assert index.namespaces_deleted == ["user-1"]
+        assert [name for name, _ in models.calls] == [
+            "delete_user_chunks", "delete_user_pages", "delete_user_checkpoints", "delete_user_dialogues", "delete_user_documents", "delete_user"
+        ]
+        assert steps == list(PURGE_STEPS) + ["done"]
+        assert result["chunks_deleted"] == 3
@@ -0,0 +1,62 @@
+import io
+import json
+import shutil
+
+import fitz
+
+from directory_ingest import ingest_directory, load_manifest
+from index_versions import LEGACY_LAYOUT
+
+def write_pdf(path, pages):
+    document = fitz.open()
+    for text in pages:
+        document.new_page().insert_text((72, 72), text)
+    document.save(str(path))
+
+class TestDirectoryIngest:
+    def test_run_skips_duplicates_and_resumes_from_manifest(self, fake_db, tmp_path):
+        source = tmp_path / "docs"
+        (source / "nested").mkdir(parents=True)
+        write_pdf(source / "a.pdf", ["lease terms " * 40, "payment schedule"])
+        write_pdf(source / "nested" / "b.pdf", ["invoice total"])
+        shutil.copy(source / "a.pdf", source / "nested" / "a-copy.pdf")
+        (source / "notes.txt").write_text("not ingested")
+        requests, upserts = [], []
+        def embed(texts):
+            requests.append(len(texts))
+            return [[0.1, 0.2]] * len(texts)
+        store = lambda state, chunks: upserts.append((state.relative, [c["chunk_index"] for c in chunks]))
+        summary = ingest_directory(str(source), "u1", db=fake_db, workers=2, batch_size=4, progress_stream=io.StringIO(), layout=LEGACY_LAYOUT, embed=embed, store=store)
+        assert (summary["total"], summary["done"], summary["skipped"], summary["failed"]) == (3, 2, 1, 0)
+        assert summary["chunks"] == sum(requests) == sum(len(indexes) for _, indexes in upserts)
+        assert max(requests) <= 4
+        assert sorted(record["status"] for record in fake_db["documents"].values()) == ["ready", "ready"]
+        # directory mode inserts chunks with their embeddings
+        assert all(chunk["embedding"] for chunks in fake_db["chunks"].values() for chunk in chunks)
+        manifest = load_manifest(str(source / ".ingest-manifest.jsonl"))
+        assert {path: entry["status"] for path, entry in manifest.items()} == {"a.pdf": "done", "nested/a-copy.pdf": "skipped", "nested/b.pdf": "done"}
+
+        write_pdf(source / "c.pdf", ["new arrival"])
+        requests.clear()
+        again = ingest_directory(str(source), "u1", db=fake_db, workers=2, progress_stream=io.StringIO(), layout=LEGACY_LAYOUT, embed=embed, store=store)
+        assert (again["total"], again["done"], again["skipped"]) == (4, 1, 3)
+        assert len(requests) == 1
+
+    def test_failed_file_is_recorded_and_retried_under_the_same_document(self, fake_db, tmp_path):
+        source = tmp_path / "docs"
+        source.mkdir()
+        write_pdf(source / "good.pdf", ["fine"])
+        write_pdf(source / "bad.pdf", ["rejected text"])
+        def embed(texts):
+            if any("rejected" in text for text in texts):
+                raise RuntimeError("embeddings unavailable")
+            return [[1.0]] * len(texts)
+        summary = ingest_directory(str(source), "u1", db=fake_db, workers=1, batch_size=1, progress_stream=io.StringIO(), layout=LEGACY_LAYOUT, embed=embed, store=lambda state, chunks: None)
+        assert (summary["done"], summary["failed"]) == (1, 1)
+        entries = [json.loads(line) for line in (source / ".ingest-manifest.jsonl").read_text().splitlines()]
+        failed = [entry for entry in entries if entry["status"] == "failed"]
+        assert failed[0]["path"] == "bad.pdf" and "unavailable" in failed[0]["error"]
+
+        retry = ingest_directory(str(source), "u1", db=fake_db, workers=1, progress_stream=io.StringIO(), layout=LEGACY_LAYOUT, embed=lambda texts: [[1.0]] * len(texts), store=lambda state, chunks: None)
+        assert (retry["done"], retry["skipped"], retry["failed"]) == (1, 1, 0)
+        assert len(fake_db["documents"]) == 2 and {r["status"] for r in fake_db["documents"].values()} == {"ready"}
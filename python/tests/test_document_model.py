@@ -0,0 +1,69 @@
+import pytest
+from datetime import datetime
+
+from bson import ObjectId
+
+import document_model
+from document_model import DocumentModel, compute_listing_etag
+from pagination import encode_cursor, decode_cursor
+
+class FakeCollection:
+    def __init__(self, docs=None):
+        self.docs = docs or []
+
+    def _matches(self, doc, query):
+        return all(doc.get(key) not in value["$nin"] if isinstance(value, dict) else doc.get(key) == value for key, value in query.items())
+
+    def find_one(self, query, projection=None):
+        return next((doc for doc in self.docs if self._matches(doc, query)), None)
+
+    def distinct(self, field, query):
+        return list({doc[field] for doc in self.docs if self._matches(doc, query)})
+
+    def update_one(self, query, update, upsert=False):
+        doc = self.find_one(query)
+        if doc is None and upsert:
+            self.docs.append({**query, **update.get("$setOnInsert", {}), **update.get("$set", {})})
+        elif doc is not None:
+            doc.update(update.get("$set", {}))
+
+    def aggregate(self, pipeline):
+        # only the $match + $group by document_id the backfill uses
+        groups = {}
+        for doc in self.docs:
+            if self._matches(doc, pipeline[0]["$match"]):
+                group = groups.setdefault(doc["document_id"], {"_id": doc["document_id"], "filename": doc["filename"], "chunk_count": 0,
+                                                               "page_count": 0, "first_chunk_id": doc["_id"]})
+                group["chunk_count"] += 1
+        return list(groups.values())
+
+class TestDocumentModel:
+    def test_cursor_round_trip(self):
+        created_at = datetime(2024, 5, 1, 12, 30, 15, 123000)
+        cursor = encode_cursor(created_at, "doc-1")
+        assert decode_cursor(cursor) == (created_at, "doc-1")
+
+    def test_invalid_cursor_rejected(self):
+        with pytest.raises(ValueError):
+            decode_cursor("not-a-cursor")
+
+    def test_listing_etag_tracks_status_changes(self):
+        docs = [{"document_id": "doc-1", "status": "processing", "chunk_count": 0, "updated_at": datetime(2024, 5, 1)}]
+        before = compute_listing_etag(docs, None)
+        assert before == compute_listing_etag(docs, None)
+        docs[0]["status"] = "ready"
+        assert compute_listing_etag(docs, None) != before
+
+    def test_backfill_covers_legacy_documents_after_a_new_upload(self, monkeypatch):
+        monkeypatch.setattr(document_model, "_backfilled_users", set())
+        chunks = FakeCollection([{"_id": ObjectId(), "user_id": "u1", "document_id": document_id, "filename": f"{document_id}.pdf"}
+                                 for document_id in ("legacy-1", "legacy-1", "legacy-2", "new-1")])
+        documents = FakeCollection([{"user_id": "u1", "document_id": "new-1", "filename": "new-1.pdf", "status": "processing"}])
+        model = DocumentModel({"documents": documents, "document_backfills": FakeCollection()})
+        assert not model.is_backfilled("u1")
+        assert model.backfill_from_chunks(chunks, "u1") == 2
+        assert {doc["document_id"]: doc["status"] for doc in documents.docs} == {"new-1": "processing", "legacy-1": "ready", "legacy-2": "ready"}
+        assert next(doc for doc in documents.docs if doc["document_id"] == "legacy-1")["chunk_count"] == 2
+        monkeypatch.setattr(document_model, "_backfilled_users", set())
+        # another process sees the flag
+        assert model.is_backfilled("u1")
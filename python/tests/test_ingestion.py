@@ -0,0 +1,107 @@
+from unittest.mock import patch
+
+import pytest
+
+from ingestion import IngestionCheckpointModel, IngestionInProgress, ingest_document, plan_replacement
+from text_chunk_model import chunk_hash
+
+class FakeCheckpoints:
+    def __init__(self):
+        self.docs = {}
+
+    def claim(self, document_id, user_id, filename, owner):
+        return dict(self.docs.setdefault(document_id, {"completed_batches": []}))
+
+    def release(self, document_id, user_id, owner):
+        pass
+
+    def save_pages(self, document_id, user_id, pages):
+        self.docs[document_id]["pages"] = list(pages)
+
+    def mark_chunked(self, document_id, user_id, chunk_count, batch_size):
+        self.docs[document_id].update(chunk_count=chunk_count, batch_size=batch_size, completed_batches=[])
+
+    def complete_batch(self, document_id, user_id, batch_number, owner):
+        self.docs[document_id]["completed_batches"].append(batch_number)
+
+    def delete(self, document_id, user_id):
+        self.docs.pop(document_id, None)
+
+class TestIngestion:
+    def test_failed_run_resumes_from_last_completed_batch(self, monkeypatch, fake_documents, fake_chunks):
+        monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+        checkpoints, chunks, documents = FakeCheckpoints(), fake_chunks, fake_documents
+        embedded, stored = [], []
+
+        def embed(texts, api_key, model=None):
+            if len(embedded) == 2 and not getattr(embed, "recovered", False):
+                raise RuntimeError("embedding service unavailable")
+            embedded.append(list(texts))
+            return [[float(len(text))] for text in texts]
+
+        def store(batch, document_id, user_id, filename, start_index=0, layout=None):
+            stored.append(start_index)
+            return len(batch)
+
+        extract_calls = []
+        def extract(path):
+            extract_calls.append(path)
+            return ["alpha", "beta", "gamma"]
+
+        with patch("ingestion.extract_pages", extract), patch("embeddings.get_embeddings_batch", embed), \
+                patch("pinecone_vectors.store_document_chunks", store):
+            with pytest.raises(RuntimeError):
+                ingest_document("doc-1", "user-1", "a.pdf", "/tmp/a.pdf", checkpoints, documents, chunks, batch_size=2)
+            assert checkpoints.docs["doc-1"]["completed_batches"] == [0, 1]
+            assert documents.records["doc-1"].get("status") != "ready"
+
+            embed.recovered = True
+            result = ingest_document("doc-1", "user-1", "a.pdf", None, checkpoints, documents, chunks, batch_size=2)
+
+        assert extract_calls == ["/tmp/a.pdf"]
+        assert result["resumed_batches"] == 2
+        assert stored == [0, 2, 4]
+        assert len(embedded) == 3
+        assert (documents.records["doc-1"]["page_count"], documents.records["doc-1"]["chunk_count"]) == (3, 6)
+        assert all(c["embedding"] is not None for c in chunks.stored["doc-1"])
+        assert "doc-1" not in checkpoints.docs
+
+    def test_worker_that_lost_its_lease_stops_at_the_next_batch(self):
+        checkpoint = {"document_id": "doc-1", "user_id": "user-1", "lease_owner": "w2", "completed_batches": [0]}
+        class Collection:
+            def update_one(self, query, update):
+                matched = all(checkpoint.get(key) == value for key, value in query.items())
+                if matched:
+                    checkpoint["completed_batches"].append(update["$addToSet"]["completed_batches"])
+                return type("Result", (), {"matched_count": int(matched)})()
+        checkpoints = IngestionCheckpointModel({"ingestion_checkpoints": Collection()})
+        with pytest.raises(IngestionInProgress):
+            checkpoints.complete_batch("doc-1", "user-1", 1, "w1")
+        checkpoints.complete_batch("doc-1", "user-1", 1, "w2")
+        assert checkpoint["lease_owner"] == "w2" and checkpoint["completed_batches"] == [0, 1]
+
+def fingerprint(index, text, page):
+    return {"chunk_index": index, "content_hash": chunk_hash(text), "page": page, "has_embedding": True}
+
+def chunk(text, page):
+    return {"text": text, "metadata": {"page": page}}
+
+class TestReplacementPlan:
+    def test_only_changed_text_is_embedded(self):
+        stored = [fingerprint(0, "intro", 1), fingerprint(1, "terms v1", 2), fingerprint(2, "appendix", 3)]
+        new = [chunk("intro", 1), chunk("terms v2", 2), chunk("appendix", 3)]
+        plan = plan_replacement(stored, new)
+        assert plan == {"unchanged": [0, 2], "reuse": {}, "embed": [1], "removed": []}
+
+    def test_shifted_chunks_reuse_stored_embeddings(self):
+        stored = [fingerprint(0, "intro", 1), fingerprint(1, "terms", 2), fingerprint(2, "appendix", 3)]
+        new = [chunk("intro", 1), chunk("terms", 2), chunk("new clause", 2), chunk("appendix", 3)]
+        plan = plan_replacement(stored, new)
+        assert plan["unchanged"] == [0, 1]
+        assert plan["embed"] == [2]
+        assert plan["reuse"] == {3: 2}
+
+    def test_vanished_tail_is_removed(self):
+        stored = [fingerprint(0, "intro", 1), fingerprint(1, "terms", 2), fingerprint(2, "appendix", 3)]
+        plan = plan_replacement(stored, [chunk("intro", 1)])
+        assert plan["removed"] == [1, 2]
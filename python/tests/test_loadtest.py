@@ -0,0 +1,60 @@
+import numpy as np
+from fastapi.testclient import TestClient
+
+from loadtest.fake_openai import FakeOpenAIConfig, RateLimiter, create_app as create_openai_app
+from loadtest.fake_pinecone import create_app as create_pinecone_app, matches_filter
+from loadtest.loadgen import Recorder, percentile
+
+class TestFakeOpenAI:
+    def test_embeddings_are_deterministic_and_normalized(self):
+        client = TestClient(create_openai_app(FakeOpenAIConfig(latency_ms=0, jitter_ms=0, per_item_ms=0)))
+        body = {"model": "text-embedding-3-large", "input": ["payment terms", "payment terms"]}
+        data = client.post("/v1/embeddings", json=body).json()["data"]
+        assert len(data[0]["embedding"]) == 3072
+        assert data[0]["embedding"] == data[1]["embedding"]
+        assert abs(np.linalg.norm(data[0]["embedding"]) - 1.0) < 1e-5
+
+    def test_rate_limit_returns_429_with_retry_after(self):
+        client = TestClient(create_openai_app(FakeOpenAIConfig(latency_ms=0, jitter_ms=0, per_token_ms=0, rpm_limit=1)))
+        body = {"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": "hello"}]}
+        assert client.post("/v1/chat/completions", json=body).status_code == 200
+        limited = client.post("/v1/chat/completions", json=body)
+        assert limited.status_code == 429
+        assert float(limited.headers["retry-after"]) > 0
+
+    def test_window_frees_up_after_a_minute(self):
+        limiter = RateLimiter(rpm_limit=1, tpm_limit=0)
+        assert limiter.check("m", 10, now=0.0)[0]
+        assert not limiter.check("m", 10, now=30.0)[0]
+        assert limiter.check("m", 10, now=61.0)[0]
+
+class TestFakePinecone:
+    def test_query_ranks_and_filters(self):
+        client = TestClient(create_pinecone_app(latency_ms=0))
+        vectors = [
+            {"id": "a", "values": [1.0, 0.0], "metadata": {"document_id": "d1"}},
+            {"id": "b", "values": [0.9, 0.1], "metadata": {"document_id": "d2"}},
+            {"id": "c", "values": [0.0, 1.0], "metadata": {"document_id": "d1"}}
+        ]
+        client.post("/vectors/upsert", json={"vectors": vectors, "namespace": "u1"})
+        matches = client.post("/query", json={"vector": [1.0, 0.0], "topK": 2, "namespace": "u1", "includeMetadata": True}).json()["matches"]
+        assert [m["id"] for m in matches] == ["a", "b"]
+        filtered = client.post("/query", json={"vector": [1.0, 0.0], "topK": 2, "namespace": "u1", "filter": {"document_id": {"$eq": "d1"}}}).json()["matches"]
+        assert [m["id"] for m in filtered] == ["a", "c"]
+
+    def test_filter_operators(self):
+        metadata = {"document_id": "d1", "page_num": 3}
+        assert matches_filter(metadata, {"$and": [{"document_id": "d1"}, {"page_num": {"$gte": 3}}]})
+        assert not matches_filter(metadata, {"document_id": {"$in": ["d2", "d3"]}})
+
+class TestLoadGenerator:
+    def test_percentiles_and_summary(self):
+        ordered = [i / 1000 for i in range(1, 101)]
+        assert percentile(ordered, 0.5) == 0.05
+        assert percentile(ordered, 0.99) == 0.099
+        recorder = Recorder()
+        recorder.record("chat", 0.1, "200")
+        recorder.record("chat", 0.3, "500")
+        summary = recorder.summary(elapsed=2.0)["chat"]
+        assert summary["requests"] == 2 and summary["errors"] == 1
+        assert summary["throughput_rps"] == 1.0
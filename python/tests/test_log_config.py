@@ -0,0 +1,29 @@
+import logging
+
+from log_config import SamplingFilter, JsonFormatter, diagnostics_enabled
+
+def _record(level=logging.INFO, **extra):
+    record = logging.LogRecord("test", level, __file__, 1, "hello %s", ("world",), None)
+    for key, value in extra.items():
+        setattr(record, key, value)
+    return record
+
+class TestLogConfig:
+    def test_sampling_only_drops_opted_in_records(self):
+        sampler = SamplingFilter(0.0)
+        assert sampler.filter(_record())
+        assert not sampler.filter(_record(sample=True))
+        assert sampler.filter(_record(level=logging.ERROR, sample=True))
+
+    def test_json_formatter_includes_extra_fields(self):
+        line = JsonFormatter().format(_record(trace_id="abc", chunk_count=3))
+        assert '"message": "hello world"' in line
+        assert '"trace_id": "abc"' in line
+        assert '"chunk_count": 3' in line
+
+    def test_production_disables_diagnostics(self, monkeypatch):
+        monkeypatch.delenv("LOG_DIAGNOSTICS", raising=False)
+        monkeypatch.setenv("APP_ENV", "production")
+        assert not diagnostics_enabled()
+        monkeypatch.setenv("LOG_DIAGNOSTICS", "true")
+        assert diagnostics_enabled()
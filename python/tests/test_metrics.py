@@ -0,0 +1,32 @@
+import pytest
+
+from metrics import MetricsRegistry, start_trace, stage, stage_duration
+
+class TestMetrics:
+    def test_histogram_renders_cumulative_buckets(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram("test_seconds", "test histogram", ("stage",), buckets=(0.1, 1.0))
+        histogram.observe(0.05, stage="a")
+        histogram.observe(0.5, stage="a")
+        histogram.observe(5.0, stage="a")
+        output = registry.render()
+        assert 'test_seconds_bucket{stage="a",le="0.1"} 1' in output
+        assert 'test_seconds_bucket{stage="a",le="1"} 2' in output
+        assert 'test_seconds_bucket{stage="a",le="+Inf"} 3' in output
+        assert 'test_seconds_count{stage="a"} 3' in output
+
+    def test_counter_requires_declared_labels(self):
+        registry = MetricsRegistry()
+        counter = registry.counter("test_total", "test counter", ("kind",))
+        counter.inc(kind="x")
+        with pytest.raises(ValueError):
+            counter.inc(other="y")
+
+    def test_stage_timings_are_attached_to_the_current_trace(self):
+        trace = start_trace("trace-1")
+        before = stage_duration.count(stage="test.stage")
+        with stage("test.stage"):
+            pass
+        assert stage_duration.count(stage="test.stage") == before + 1
+        assert "test.stage" in trace.summary()
+        assert trace.server_timing().startswith("test_stage;dur=")
@@ -0,0 +1,49 @@
+from near_duplicates import chunk_without_duplicates, collapse_near_duplicates, strip_page_furniture
+
+DISCLAIMER = "This document is provided for information only and does not constitute legal or financial advice of any kind."
+BODY = [
+    "Revenue grew in the northern region as new distributors signed multi-year agreements.",
+    "Operating costs fell after the consolidation of the two warehouses near the port.",
+    "Headcount stayed flat while the support backlog was cleared ahead of schedule.",
+    "Capital expenditure was limited to replacing the packaging line in the second plant.",
+    "The board approved a dividend in line with the policy set out last year.",
+]
+
+def report_pages():
+    return [
+        f"ACME Holdings Quarterly Report\n{body}\n{DISCLAIMER}\nMore detail on {topic} follows in the appendix.\nPage {n + 1} of 5"
+        for n, (body, topic) in enumerate(zip(BODY, ("sales", "costs", "staffing", "investment", "dividends")))
+    ]
+
+def line_chunker(pages, max_tokens=500, overlap=50):
+    return [{"text": line, "metadata": {"page": n + 1}} for n, page in enumerate(pages) for line in page.split("\n") if line.strip()]
+
+class TestNearDuplicates:
+    def test_repeated_page_furniture_is_stripped(self):
+        cleaned, removed = strip_page_furniture(report_pages())
+        assert removed == 15
+        for page, body in zip(cleaned, BODY):
+            assert body in page and "ACME" not in page and "Page" not in page and "legal" not in page
+        assert "staffing follows" in cleaned[2]
+        assert strip_page_furniture(report_pages()[:2]) == (report_pages()[:2], 0)
+
+    def test_near_identical_chunks_collapse_into_the_first(self):
+        clause = ("The tenant shall keep the premises in good repair and condition and shall not make any alteration to the structure "
+                  "without the prior written consent of the landlord, such consent not to be unreasonably withheld or delayed")
+        chunks = [
+            {"text": clause + " in section 4.", "metadata": {"page": 2}},
+            {"text": BODY[0], "metadata": {"page": 2}},
+            {"text": clause + " in section 9.", "metadata": {"page": 7}},
+            {"text": clause + ".", "metadata": {"page": 11}},
+            {"text": "", "metadata": {"page": 12}},
+        ]
+        kept, collapsed = collapse_near_duplicates(chunks, similarity=0.8)
+        assert collapsed == 2
+        assert [chunk["text"] for chunk in kept] == [clause + " in section 4.", BODY[0], ""]
+        assert kept[0]["metadata"]["duplicate_pages"] == [7, 11]
+
+    def test_report_counts_embeddings_saved(self):
+        chunks, report = chunk_without_duplicates(report_pages(), 500, 50, chunker=line_chunker)
+        assert [chunk["text"] for chunk in chunks][:2] == [BODY[0], "More detail on sales follows in the appendix."]
+        assert report == {"chunks_before": 25, "chunks_after": 10, "furniture_lines_removed": 15, "near_duplicates_collapsed": 0,
+                          "embeddings_saved": 15, "dedup_ratio": 0.6}
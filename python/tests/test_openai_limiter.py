@@ -0,0 +1,56 @@
+import threading
+import time
+
+import pytest
+
+from openai_limiter import OpenAILimiter, OpenAIRetryableError, LimiterTimeout, parse_limits, INTERACTIVE, BULK
+
+class TestOpenAILimiter:
+    def test_interactive_callers_jump_ahead_of_bulk(self):
+        limiter = OpenAILimiter(limits={"m": (600, 0)})
+        limiter._state("m").available_requests = 0.0
+        order = []
+        def take(name, priority):
+            limiter.acquire("m", 1, priority)
+            order.append(name)
+        bulk = threading.Thread(target=take, args=("bulk", BULK))
+        bulk.start()
+        time.sleep(0.02)
+        interactive = threading.Thread(target=take, args=("interactive", INTERACTIVE))
+        interactive.start()
+        bulk.join(2)
+        interactive.join(2)
+        assert order == ["interactive", "bulk"]
+
+    def test_retries_rate_limited_calls_after_retry_after(self):
+        limiter = OpenAILimiter(limits={"m": (0, 0)}, base_backoff=0.01)
+        calls = []
+        def flaky():
+            calls.append(time.monotonic())
+            if len(calls) == 1:
+                raise OpenAIRetryableError("slow down", status_code=429, retry_after=0.05)
+            return "ok"
+        assert limiter.call("m", flaky, tokens=10) == "ok"
+        assert calls[1] - calls[0] >= 0.05
+
+    def test_non_retryable_errors_are_raised(self):
+        limiter = OpenAILimiter(limits={"m": (0, 0)})
+        calls = []
+        def broken():
+            calls.append(1)
+            raise ValueError("bad request")
+        with pytest.raises(ValueError):
+            limiter.call("m", broken, tokens=10)
+        assert len(calls) == 1
+
+    def test_interactive_wait_is_bounded(self):
+        limiter = OpenAILimiter(limits={"m": (0, 60)}, interactive_max_wait=0.05)
+        limiter._state("m").available_tokens = 0.0
+        with pytest.raises(LimiterTimeout):
+            limiter.call("m", lambda: "ok", tokens=30, priority=INTERACTIVE)
+        assert limiter.stats()["m"]["waiting"] == {"interactive": 0, "bulk": 0}
+
+    def test_parse_limits(self):
+        assert parse_limits("gpt-4o=500:30000, text-embedding-3-large=3000:1000000") == {
+            "gpt-4o": (500, 30000), "text-embedding-3-large": (3000, 1000000)
+        }
@@ -0,0 +1,70 @@
+import sys
+import threading
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import admin_auth
+import metrics
+import profiler
+
+def busy_parse(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(200))
+
+class TestProfiler:
+    def test_only_attributed_threads_are_folded(self):
+        profile = profiler.RequestProfile("POST", "/chat", interval=0.001)
+        entered, release = threading.Event(), threading.Event()
+        def request_work():
+            thread_id = profile.enter()
+            entered.set()
+            release.wait()
+            profile.leave(thread_id)
+        worker = threading.Thread(target=request_work, name="request-worker")
+        bystander = threading.Thread(target=release.wait, name="bystander")
+        worker.start(); bystander.start()
+        entered.wait()
+        profile.sample(sys._current_frames())
+        release.set()
+        worker.join(); bystander.join()
+        profile.sample(sys._current_frames())
+        lines = profile.folded().splitlines()
+        assert len(lines) == 1 and lines[0].endswith(" 1")
+        stack = lines[0].rsplit(" ", 1)[0].split(";")
+        assert stack[0] == "request-worker" and any(frame.startswith("TestProfiler.test_only_attributed_threads_are_folded.<locals>.request_work (") for frame in stack)
+        assert profile.samples == 2
+
+    def test_flagged_request_profiles_its_threadpool_endpoint(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(admin_auth, "ADMIN_API_TOKEN", "secret")
+        monkeypatch.setattr(profiler, "PROFILE_DIR", str(tmp_path))
+        app = FastAPI()
+        app.router.route_class = profiler.ProfiledRoute
+
+        @app.middleware("http")
+        async def trace(request: Request, call_next):
+            metrics.start_trace()
+            token = profiler.requested_token(request.headers, request.query_params)
+            profile = profiler.start(request.method, request.url.path) if profiler.authorized(token) else None
+            response = await call_next(request)
+            if profile is not None:
+                profiler.finish(profile, 1.0, response.status_code)
+                response.headers["X-Profile-Id"] = profile.profile_id
+            return response
+
+        @app.get("/slow")
+        def slow():
+            busy_parse(0.15)
+            return {"ok": True}
+
+        client = TestClient(app)
+        assert "X-Profile-Id" not in client.get("/slow").headers
+        assert "X-Profile-Id" not in client.get("/slow", headers={"X-Profile-Token": "wrong"}).headers
+        profile_id = client.get("/slow", params={"profile_token": "secret"}).headers["X-Profile-Id"]
+        folded = profiler.read_profile(profile_id)
+        assert "busy_parse (tests/test_profiler.py:" in folded
+        assert sum(int(line.rsplit(" ", 1)[1]) for line in folded.splitlines()) > 5
+        assert [summary["profile_id"] for summary in profiler.list_profiles()] == [profile_id]
+        assert profiler.read_profile("../" + profile_id) is None
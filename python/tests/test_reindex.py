@@ -0,0 +1,120 @@
+import reindex
+from document_pages import pages_from_chunks
+from index_versions import LEGACY_LAYOUT, layout_from_record
+from reindex import Throttle, run_reindex
+
+RECORD = {"version": 2, "index_name": "doc-ai", "chunk_collection": "text_chunks_v2", "embedding_model": "m", "dimension": 3072,
+          "max_tokens": 300, "overlap": 30, "status": "building"}
+
+class FakeProgress:
+    def __init__(self, done):
+        self.done = done
+
+    def delete_one(self, query):
+        self.done.pop((query["user_id"], query["document_id"]), None)
+
+class FakeVersions:
+    def __init__(self, done=None):
+        self.done = dict(done or {})
+        self.progress = FakeProgress(self.done)
+        self.fields = {}
+        self.activated = []
+        self.released = False
+
+    def get_version(self, version):
+        return dict(RECORD)
+
+    def active_version(self):
+        return 0
+
+    def active_layout(self):
+        return LEGACY_LAYOUT
+
+    def claim_build(self, version, owner, lease_seconds):
+        return True
+
+    def release_build(self, version, owner):
+        self.released = True
+
+    def done_documents(self, version):
+        return dict(self.done)
+
+    def set_fields(self, version, **fields):
+        self.fields.update(fields)
+
+    def mark_document_done(self, version, document, chunk_count):
+        self.done[(document["user_id"], document["document_id"])] = (document.get("content_hash"), document.get("revision", 0))
+
+    def activate(self, version, expected):
+        self.activated.append((version, expected))
+        return True
+
+def install(monkeypatch, versions, fake_documents, documents, fail=()):
+    indexed, removed = [], []
+    for document in documents:
+        fake_documents.records[document["document_id"]] = dict(document, status="ready")
+    monkeypatch.setattr(reindex, "IndexVersionModel", lambda db: versions)
+    monkeypatch.setattr(reindex, "DocumentModel", lambda db: fake_documents)
+    monkeypatch.setattr(reindex, "DocumentPageModel", lambda db: None)
+    monkeypatch.setattr(reindex, "TextChunkModel", lambda db, layout=None: layout)
+    monkeypatch.setattr(reindex.index_layouts, "refresh", lambda: None)
+
+    def reindex_document(document, layout, page_model, chunk_model, active_chunk_model, api_key, batch_size, throttle):
+        if document["document_id"] in fail:
+            raise RuntimeError("embeddings unavailable")
+        indexed.append((document["document_id"], layout.version, layout.max_tokens))
+        return 3
+    monkeypatch.setattr(reindex, "reindex_document", reindex_document)
+    monkeypatch.setattr(reindex, "remove_from_version", lambda document_id, user_id, layout, chunk_model: removed.append(document_id))
+    return indexed, removed
+
+def doc(document_id, content_hash="h", revision=0, user_id="u1"):
+    return {"document_id": document_id, "user_id": user_id, "filename": f"{document_id}.pdf", "content_hash": content_hash, "revision": revision}
+
+class TestReindex:
+    def test_pages_are_rebuilt_from_chunks_without_overlap(self):
+        shared = " the tenant pays the landlord on the first day of each month"
+        chunks = [
+            {"text": "clause one:" + shared, "metadata": {"page": 1}},
+            {"text": shared + ", in advance.", "metadata": {"page": 1}},
+            {"text": "second page", "metadata": {"page": 3}}
+        ]
+        assert pages_from_chunks(chunks) == ["clause one:" + shared + ", in advance.", "", "second page"]
+        assert pages_from_chunks([]) == []
+
+    def test_versions_get_their_own_namespace(self):
+        assert LEGACY_LAYOUT.namespace("u1") == "u1"
+        layout = layout_from_record(RECORD)
+        assert layout.namespace("u1") == "u1__v2" and layout.chunk_collection == "text_chunks_v2"
+
+    def test_resume_skips_done_documents_and_redoes_changed_ones(self, monkeypatch, fake_documents):
+        versions = FakeVersions(done={("u1", "a"): ("h", 0), ("u1", "b"): ("old", 0), ("u1", "gone"): ("h", 0)})
+        indexed, removed = install(monkeypatch, versions, fake_documents, [doc("a"), doc("b"), doc("c")])
+        summary = run_reindex(object(), 2, "key")
+        assert sorted(indexed) == [("b", 2, 300), ("c", 2, 300)]
+        assert sorted(removed) == ["b", "gone"]
+        assert summary["indexed"] == 2 and summary["removed"] == 1 and summary["activated"]
+        assert versions.activated == [(2, 0)] and versions.released
+        assert versions.fields["documents_done"] == 3 and versions.fields["documents_total"] == 3
+
+    def test_failures_block_activation(self, monkeypatch, fake_documents):
+        versions = FakeVersions()
+        indexed, _ = install(monkeypatch, versions, fake_documents, [doc("a"), doc("b")], fail={"b"})
+        summary = run_reindex(object(), 2, "key")
+        assert [d for d, _, _ in indexed] == ["a"]
+        assert set(summary["failed"]) == {"b"} and not summary["activated"]
+        assert versions.activated == [] and versions.released
+
+    def test_throttle_paces_units_per_minute(self):
+        now = [0.0]
+        slept = []
+        def sleep(seconds):
+            slept.append(seconds)
+            now[0] += seconds
+        throttle = Throttle(600, clock=lambda: now[0], sleep=sleep)
+        throttle.wait(100)
+        throttle.wait(100)
+        throttle.wait(50)
+        assert slept == [10.0, 10.0]
+        Throttle(0, sleep=sleep).wait(10 ** 6)
+        assert len(slept) == 2
@@ -0,0 +1,27 @@
+import numpy as np
+
+from reranking import mmr_select
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+class TestReranking:
+    def test_near_duplicates_give_way_to_distinct_candidates(self):
+        query = unit(1, 1, 0)
+        embeddings = [unit(1, 0.9, 0), unit(1, 0.91, 0), unit(1, 0.92, 0), unit(0.6, 1, 0.4)]
+        by_relevance = mmr_select(query, embeddings, k=2, relevance_weight=1.0)
+        diverse = mmr_select(query, embeddings, k=2, relevance_weight=0.5)
+        assert by_relevance[0] == diverse[0]
+        assert embeddings[by_relevance[1]][2] == 0
+        assert diverse[1] == 3
+
+    def test_returns_every_candidate_once_when_k_exceeds_pool(self):
+        rng = np.random.default_rng(0)
+        embeddings = rng.normal(size=(5, 16))
+        order = mmr_select(rng.normal(size=16), embeddings, k=10)
+        assert sorted(order) == [0, 1, 2, 3, 4]
+
+    def test_uses_given_relevance_scores(self):
+        embeddings = [unit(1, 0), unit(0, 1)]
+        assert mmr_select(unit(1, 0), embeddings, k=1, relevance=[0.1, 0.9]) == [1]
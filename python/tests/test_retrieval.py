@@ -0,0 +1,120 @@
+from types import SimpleNamespace
+
+import pytest
+
+from cache import GroupedLRUCache
+import index_versions
+import text_chunk_model
+from index_versions import LEGACY_LAYOUT
+from text_chunk_model import TextChunkModel
+from retrieval import match_candidate, hydrate, chunk_texts, parse_chunk_id, previous_candidates, reuse_previous
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+        self.queries = []
+
+    def find(self, query, projection=None):
+        self.queries.append(query)
+        clauses = query.get("$or") or [{"document_id": query["document_id"], "chunk_index": query["chunk_index"]}]
+        return [
+            doc for doc in self.docs
+            if doc["user_id"] == query["user_id"]
+            and any(doc["document_id"] == c["document_id"] and doc["chunk_index"] in c["chunk_index"]["$in"] for c in clauses)
+        ]
+
+def chunk_model(docs):
+    return TextChunkModel({"text_chunks": FakeCollection(docs)})
+
+def stored_chunk(document_id, chunk_index, text):
+    return {"user_id": "u1", "document_id": document_id, "chunk_index": chunk_index, "text": text, "filename": f"{document_id}.pdf", "metadata": {"page": chunk_index + 1}}
+
+class TestRetrieval:
+    def test_light_matches_are_hydrated_in_one_query(self, monkeypatch):
+        monkeypatch.setattr(text_chunk_model, "chunk_text_cache", GroupedLRUCache(max_entries=100))
+        model = chunk_model([stored_chunk("doc-a", 0, "alpha"), stored_chunk("doc-a", 3, "delta"), stored_chunk("doc-b", 1, "beta")])
+        matches = [
+            SimpleNamespace(id="doc-a_chunk_3", score=0.9, metadata={"document_id": "doc-a", "chunk_index": 3, "page_num": 4}),
+            SimpleNamespace(id="doc-b_chunk_1", score=0.8, metadata={"document_id": "doc-b", "chunk_index": 1, "page_num": 2})
+        ]
+        candidates = hydrate([match_candidate(m) for m in matches], "u1", model)
+        assert [c["text"] for c in candidates] == ["delta", "beta"]
+        assert [c["filename"] for c in candidates] == ["doc-a.pdf", "doc-b.pdf"]
+        assert len(model.collection.queries) == 1
+
+        # the second lookup of the same chunks is served from the hot-chunk cache
+        hydrate([match_candidate(m) for m in matches], "u1", model)
+        assert len(model.collection.queries) == 1
+
+    def test_cached_text_is_only_served_to_its_owner(self, monkeypatch):
+        monkeypatch.setattr(text_chunk_model, "chunk_text_cache", GroupedLRUCache(max_entries=100))
+        model = chunk_model([stored_chunk("doc-a", 0, "alice's lease")])
+        assert model.get_chunk_texts("u1", [("doc-a", 0)])[("doc-a", 0)]["text"] == "alice's lease"
+        assert model.get_chunk_texts("u2", [("doc-a", 0)]) == {}
+        assert [query["user_id"] for query in model.collection.queries] == ["u1", "u2"]
+
+    def test_cached_text_rewritten_elsewhere_is_read_again(self, monkeypatch):
+        monkeypatch.setattr(text_chunk_model, "chunk_text_cache", GroupedLRUCache(max_entries=100))
+        docs = [stored_chunk("doc-a", 0, "old terms")]
+        model = chunk_model(docs)
+        match = SimpleNamespace(id="doc-a_chunk_0", score=0.9, metadata={"document_id": "doc-a", "chunk_index": 0, "page_num": 1})
+        assert hydrate([match_candidate(match)], "u1", model)[0]["text"] == "old terms"
+        # another process (the ingestion worker) replaced the document and upserted a vector for the new text
+        docs[0]["text"] = "new terms"
+        match.metadata["content_hash"] = text_chunk_model.chunk_hash("new terms")
+        assert hydrate([match_candidate(match)], "u1", model)[0]["text"] == "new terms"
+        assert len(model.collection.queries) == 2
+        # once the cache holds the new text it is served from there again
+        hydrate([match_candidate(match)], "u1", model)
+        assert len(model.collection.queries) == 2
+
+    def test_full_metadata_matches_skip_mongo(self):
+        model = chunk_model([])
+        match = SimpleNamespace(id="doc-a_chunk_0", score=0.5, metadata={"document_id": "doc-a", "chunk_index": 0, "page_num": 1, "text": "inline", "filename": "a.pdf"})
+        candidates = hydrate([match_candidate(match)], "u1", model)
+        assert candidates[0]["text"] == "inline"
+        assert model.collection.queries == []
+
+    def test_chunk_index_falls_back_to_vector_id(self):
+        match = SimpleNamespace(id="doc-a_chunk_12", score=0.5, metadata={"document_id": "doc-a"})
+        assert match_candidate(match)["chunk_index"] == 12
+
+    def test_chunk_ids_parse_back_to_document_and_index(self):
+        assert parse_chunk_id("doc_chunk_a_chunk_7") == ("doc_chunk_a", 7)
+        for value in ("doc-a", "doc-a_chunk_", "_chunk_3", "doc-a_chunk_x"):
+            with pytest.raises(ValueError):
+                parse_chunk_id(value)
+
+    def test_chunk_texts_read_each_version_from_its_own_collection(self, monkeypatch):
+        monkeypatch.setattr(text_chunk_model, "chunk_text_cache", GroupedLRUCache(max_entries=100))
+        standby = LEGACY_LAYOUT._replace(version=2, chunk_collection="text_chunks_v2")
+        monkeypatch.setattr(index_versions, "index_layouts", SimpleNamespace(active=lambda: LEGACY_LAYOUT, live=lambda: [LEGACY_LAYOUT, standby]))
+        db = {"text_chunks": FakeCollection([stored_chunk("doc-a", 1, "old chunking")]),
+              "text_chunks_v2": FakeCollection([stored_chunk("doc-a", 1, "new chunking")])}
+        found = chunk_texts([(0, "doc-a", 1), (2, "doc-a", 1), (5, "doc-a", 1)], "u1", TextChunkModel(db))
+        assert found[(0, "doc-a", 1)]["text"] == "old chunking"
+        assert found[(2, "doc-a", 1)]["text"] == "new chunking"
+        assert (5, "doc-a", 1) not in found
+        # a citation of text that has since been replaced at the same position is not resolved to the new text
+        stale = chunk_texts([(0, "doc-a", 1), (2, "doc-a", 1)], "u1", TextChunkModel(db),
+                            {(0, "doc-a", 1): text_chunk_model.chunk_hash("older chunking"), (2, "doc-a", 1): text_chunk_model.chunk_hash("new chunking")})
+        assert list(stale) == [(2, "doc-a", 1)]
+        # only the active version goes through the hot-chunk cache
+        assert text_chunk_model.chunk_text_cache.get_many([("doc-a", 1)])[("doc-a", 1)]["text"] == "old chunking"
+
+    def test_previous_turn_chunks_are_rescored_locally(self):
+        docs = [dict(stored_chunk("doc-a", 0, "rates"), embedding=[1.0, 0.0]), dict(stored_chunk("doc-a", 1, "fees"), embedding=[0.8, 0.6]),
+                dict(stored_chunk("doc-b", 2, "holidays"), embedding=[0.0, 1.0]), stored_chunk("doc-a", 2, "not embedded")]
+        model = chunk_model(docs)
+        references = [{"document_id": "doc-a", "chunk_index": 1, "index_version": 0}, {"document_id": "doc-a", "chunk_index": 0},
+                      {"document_id": "doc-b", "chunk_index": 2, "index_version": 0}, {"document_id": "doc-a", "chunk_index": 2},
+                      {"document_id": "doc-a", "chunk_index": 0, "index_version": 3}]
+        candidates = previous_candidates(references, "u1", ["doc-a", "doc-b"], model, 0)
+        assert [c["vector_id"] for c in candidates] == ["doc-a_chunk_1", "doc-a_chunk_0", "doc-b_chunk_2"]
+        assert len(model.collection.queries) == 1
+
+        reused = reuse_previous(candidates, [2.0, 0.0], threshold=0.5, min_matches=2)
+        assert [(c["text"], round(c["score"], 2)) for c in reused] == [("rates", 1.0), ("fees", 0.8)]
+        # a question the earlier chunks do not answer goes back to the vector search
+        assert reuse_previous(candidates, [0.0, 1.0], threshold=0.7, min_matches=2) is None
+        assert previous_candidates(references, "u1", ["doc-c"], model, 0) == []
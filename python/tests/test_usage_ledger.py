@@ -0,0 +1,72 @@
+import threading
+from datetime import datetime
+from types import SimpleNamespace
+
+import usage_ledger
+from usage_ledger import UsageLedgerModel, UsageWriter, ledger_entry, usage_scope
+
+class TestUsageLedger:
+    def test_entry_carries_usage_and_the_innermost_scope(self):
+        usage = SimpleNamespace(prompt_tokens=1200, completion_tokens=80, prompt_tokens_details=SimpleNamespace(cached_tokens=1024))
+        with usage_scope(endpoint="/chat-query-json", user_id="u1"):
+            with usage_scope(document_id="d1", user_id=None):
+                entry = ledger_entry("chat_completions", "gpt-4o", 0.4321, usage)
+            outer = ledger_entry("embeddings", "text-embedding-3-large", 0.05, {"prompt_tokens": 12}, error=RuntimeError("429"))
+        assert (entry["user_id"], entry["document_id"], entry["endpoint"]) == ("u1", "d1", "/chat-query-json")
+        assert (entry["prompt_tokens"], entry["completion_tokens"], entry["cached_tokens"], entry["cache_hit"]) == (1200, 80, 1024, True)
+        assert entry["latency_ms"] == 432.1 and entry["status"] == "ok"
+        assert outer["document_id"] is None and outer["cache_hit"] is False
+        assert outer["status"] == "error" and "429" in outer["error"]
+        assert ledger_entry("ocr", "gpt-4o", 1.0)["user_id"] is None
+
+    def test_writer_batches_and_retries_failed_inserts(self):
+        stored, failures = [], [RuntimeError("mongo down")]
+        def store(entries):
+            if failures:
+                raise failures.pop()
+            stored.append(len(entries))
+        writer = UsageWriter(batch_size=3, flush_seconds=5, retry_seconds=0.01)
+        writer.record({"n": 0})
+        assert stored == [] and not writer.running
+        writer.start(store)
+        for n in range(7):
+            writer.record({"n": n})
+        assert writer.flush(5)
+        writer.stop()
+        assert sum(stored) == 7 and max(stored) <= 3
+
+    def test_writer_drops_oldest_entries_when_full(self):
+        release = threading.Event()
+        seen = []
+        def store(entries):
+            release.wait(5)
+            seen.extend(entry["n"] for entry in entries)
+        writer = UsageWriter(batch_size=1, flush_seconds=0.01, max_buffer=2)
+        writer.start(store)
+        writer.record({"n": 0})
+        while writer.stats()["pending"] != 1 or writer._queue:
+            pass
+        for n in range(1, 5):
+            writer.record({"n": n})
+        release.set()
+        writer.stop()
+        assert seen == [0, 3, 4]
+
+    def test_regressions_compare_consecutive_windows(self, monkeypatch):
+        def breakdown(self, since, group_by, until=None, limit=50, **kwargs):
+            recent = until is not None and until == now
+            rows = [
+                {"endpoint": "/chat-query-json", "operation": "chat_completions", "model": "gpt-4o", "calls": 100, "errors": 0,
+                 "total_tokens": 90000 if recent else 60000, "avg_latency_ms": 2100.0 if recent else 2000.0},
+                {"endpoint": "/process-sequence", "operation": "embeddings", "model": "text-embedding-3-large", "calls": 50, "errors": 5 if recent else 0,
+                 "total_tokens": 5000, "avg_latency_ms": 300.0},
+                {"endpoint": "/chat-batch", "operation": "chat_completions", "model": "gpt-4o", "calls": 3, "errors": 0,
+                 "total_tokens": 9000 if recent else 10, "avg_latency_ms": 100.0},
+            ]
+            return rows
+        now = datetime(2026, 10, 1, 12)
+        monkeypatch.setattr(UsageLedgerModel, "breakdown", breakdown)
+        found = UsageLedgerModel({"openai_usage": None}).regressions(24, min_calls=20, threshold=0.25, now=now)
+        assert [item["endpoint"] for item in found] == ["/chat-query-json", "/process-sequence"]
+        assert found[0]["regressions"] == {"tokens_per_call": {"before": 600.0, "after": 900.0, "change": 0.5}}
+        assert found[1]["regressions"]["error_rate"] == {"before": 0.0, "after": 0.1, "change": None}
@@ -0,0 +1,64 @@
+import time
+
+from warmup import Warmup
+from benchmarks.startup import parse_importtime
+
+class TestWarmup:
+    def test_ready_only_after_every_step_succeeds(self):
+        calls = []
+        def flaky():
+            calls.append(1)
+            if len(calls) == 1:
+                raise ConnectionError("mongo not up yet")
+        warmup = Warmup(steps=[("ok", lambda: None), ("flaky", flaky)], retry_seconds=0.01)
+        warmup.record_import(time.perf_counter(), time.perf_counter())
+        assert warmup.run_once() is False
+        assert warmup.ready is False
+        assert "mongo not up yet" in warmup.status()["steps"]["flaky"]["error"]
+        assert warmup.run_once() is True
+        status = warmup.status()
+        assert status["ready"] is True
+        assert status["steps"]["ok"]["attempts"] == 1
+        assert status["steps"]["flaky"]["attempts"] == 2
+        assert status["startup_seconds"] is not None
+
+    def test_background_run_retries_until_ready(self):
+        attempts = []
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise RuntimeError("not yet")
+        warmup = Warmup(steps=[("flaky", flaky)], retry_seconds=0.01)
+        warmup.start()
+        deadline = time.monotonic() + 5
+        while not warmup.ready and time.monotonic() < deadline:
+            time.sleep(0.01)
+        warmup.stop()
+        assert warmup.ready
+        assert len(attempts) == 3
+
+    def test_skipped_steps_do_not_run(self):
+        def fail():
+            raise AssertionError("skipped step ran")
+        warmup = Warmup(steps=[("pinecone_index", fail), ("imports", lambda: None)], skip=["pinecone_index"])
+        assert warmup.run_once() is True
+        assert warmup.status()["skipped"] == ["pinecone_index"]
+
+    def test_first_request_is_recorded_once(self):
+        warmup = Warmup(steps=[])
+        warmup.record_first_request(0.8)
+        warmup.record_first_request(0.01)
+        assert warmup.status()["first_request_seconds"] == 0.8
+
+class TestImportProfile:
+    def test_parse_importtime_orders_by_cumulative_time(self):
+        stderr = "\n".join([
+            "import time: self [us] | cumulative | imported package",
+            "import time:       100 |        100 |     tiktoken.core",
+            "import time:       200 |     800000 |   openai",
+            "import time:     14000 |    1200000 | api"
+        ])
+        rows = parse_importtime(stderr, top=2)
+        assert [row["module"] for row in rows] == ["api", "openai"]
+        assert rows[0]["cumulative_seconds"] == 1.2
+        assert rows[1]["depth"] == 1
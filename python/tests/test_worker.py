@@ -0,0 +1,146 @@
+import threading
+from datetime import datetime
+
+import pytest
+
+import dependencies
+import ingestion
+from ingestion import IngestionInProgress
+from jobs import JobModel
+from mongo_connection import mongo_manager
+from upload_store import UploadStore
+from worker import Worker, ingest_job
+
+class FakeQueue:
+    # the queue semantics the worker relies on, in memory
+    def __init__(self, jobs, max_attempts=3):
+        self.jobs = {job["job_id"]: dict(job, status="queued", attempts=0, lease_owner=None) for job in jobs}
+        self.max_attempts = max_attempts
+        self.renew = True
+        self.steps = []
+        self.lock = threading.Lock()
+
+    def claim(self, owner, kinds, lease_seconds):
+        with self.lock:
+            for job in self.jobs.values():
+                if job["status"] == "queued" and job["kind"] in kinds:
+                    job.update(status="running", lease_owner=owner, attempts=job["attempts"] + 1)
+                    return dict(job)
+        return None
+
+    def heartbeat(self, job_id, owner, lease_seconds):
+        return self.renew and self.jobs[job_id]["lease_owner"] == owner
+
+    def progress(self, job_id, step, done=None, total=None):
+        self.steps.append((job_id, step))
+
+    def finish(self, job_id, owner, result):
+        job = self.jobs[job_id]
+        if job["status"] != "running" or job["lease_owner"] != owner:
+            return False
+        job.update(status="completed", result=result, lease_owner=None)
+        return True
+
+    def retry_or_dead(self, job_id, owner, error):
+        job = self.jobs[job_id]
+        job.update(status="dead" if job["attempts"] >= self.max_attempts else "queued", error=error, lease_owner=None)
+        return job["status"]
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def _matches(self, doc, query):
+        return all(doc.get(key) == value for key, value in query.items())
+
+    def find_one(self, query, projection=None):
+        return next((dict(doc) for doc in self.docs if self._matches(doc, query)), None)
+
+    def update_one(self, query, update):
+        for doc in self.docs:
+            if self._matches(doc, query):
+                doc.update(update["$set"])
+                return type("Result", (), {"matched_count": 1})()
+        return type("Result", (), {"matched_count": 0})()
+
+class TestWorker:
+    def test_failing_job_is_retried_then_dead_lettered(self):
+        queue = FakeQueue([{"job_id": "j1", "kind": "ingest"}])
+        calls = []
+        def handler(job, report):
+            calls.append(job["attempts"])
+            report("ingest")
+            raise RuntimeError("ocr service unavailable")
+        worker = Worker(queue, {"ingest": handler}, lease_seconds=30)
+        while worker.run_once():
+            pass
+        assert calls == [1, 2, 3]
+        assert queue.jobs["j1"]["status"] == "dead" and "unavailable" in queue.jobs["j1"]["error"]
+        assert queue.steps == [("j1", "ingest")] * 3
+
+    def test_only_known_kinds_are_claimed_and_results_recorded(self):
+        queue = FakeQueue([{"job_id": "j1", "kind": "export"}, {"job_id": "j2", "kind": "ingest"}])
+        worker = Worker(queue, {"ingest": lambda job, report: {"chunks": 4}})
+        assert worker.run_once() and not worker.run_once()
+        assert queue.jobs["j2"]["result"] == {"chunks": 4}
+        assert queue.jobs["j1"]["status"] == "queued"
+
+    def test_result_is_discarded_after_the_lease_is_lost(self):
+        queue = FakeQueue([{"job_id": "j1", "kind": "ingest"}])
+        queue.renew = False
+        def slow(job, report):
+            threading.Event().wait(0.2)
+            # meanwhile the lease expired and another worker took the job
+            queue.jobs["j1"]["lease_owner"] = "someone-else"
+            return {"chunks": 1}
+        worker = Worker(queue, {"ingest": slow}, lease_seconds=0.15)
+        worker.run_once()
+        assert queue.jobs["j1"]["status"] == "running" and "result" not in queue.jobs["j1"]
+
+    def test_retry_backs_off_until_attempts_run_out(self):
+        docs = [{"job_id": "j1", "status": "running", "lease_owner": "w1", "attempts": 1, "max_attempts": 2}]
+        jobs = JobModel({"jobs": FakeCollection(docs)})
+        assert jobs.retry_or_dead("j1", "w2", "boom") is None
+        assert jobs.retry_or_dead("j1", "w1", "boom") == "queued"
+        assert docs[0]["available_at"] > datetime.utcnow() and docs[0]["lease_owner"] is None
+        docs[0].update(status="running", lease_owner="w1", attempts=2)
+        assert jobs.retry_or_dead("j1", "w1", "boom again") == "dead"
+        assert docs[0]["error"] == "boom again"
+
+class FakeUploads:
+    def __init__(self):
+        self.deleted = []
+
+    def fetch(self, file_id, path):
+        open(path, "wb").close()
+
+    def delete(self, file_id):
+        self.deleted.append(file_id)
+
+class TestIngestJob:
+    @pytest.fixture
+    def uploads(self, monkeypatch, fake_documents):
+        uploads = FakeUploads()
+        monkeypatch.setattr(dependencies, "get_document_model", lambda: fake_documents)
+        monkeypatch.setattr(mongo_manager, "model", lambda model_class: uploads if model_class is UploadStore else None)
+        return uploads
+
+    def job(self, kind="ingest"):
+        return {"job_id": "j1", "kind": kind, "user_id": "user-1",
+                "params": {"document_id": "doc-1", "filename": "a.pdf", "file_id": "f1", "size_bytes": 10, "content_hash": "h1"}}
+
+    def test_a_document_ingested_meanwhile_is_not_ingested_again(self, monkeypatch, fake_documents, uploads):
+        fake_documents.create_document("doc-1", "user-1", "a.pdf", content_hash="h1", status="ready")
+        monkeypatch.setattr(ingestion, "ingest_document", lambda *args, **kwargs: pytest.fail("ingested twice"))
+        assert ingest_job(self.job(), lambda *args: None)["skipped"] == "the document is already ingested"
+        assert uploads.deleted == ["f1"]
+
+    def test_a_document_another_worker_is_ingesting_is_retried_not_failed(self, monkeypatch, fake_documents, uploads):
+        fake_documents.create_document("doc-1", "user-1", "a.pdf", content_hash="h1")
+        def busy(*args, **kwargs):
+            raise IngestionInProgress("document doc-1 is being ingested by another worker")
+        monkeypatch.setattr(ingestion, "ingest_document", busy)
+        queue = FakeQueue([self.job()])
+        Worker(queue, {"ingest": ingest_job}).run_once()
+        assert queue.jobs["j1"]["status"] == "queued" and fake_documents.records["doc-1"]["status"] == "processing"
+        assert uploads.deleted == []
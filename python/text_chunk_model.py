@@ -1,29 +1,169 @@
+import hashlib
+import os
+from pymongo import UpdateOne, ReplaceOne
 from pymongo.collection import Collection
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+from cache import GroupedLRUCache
+from metrics import registry
+from index_versions import IndexLayout, index_layouts
+
+# text of recently retrieved chunks, keyed by (document_id, chunk_index) and dropped per document whenever its chunks are rewritten.
+# that only happens in the process doing the rewrite (with INGESTION_MODE=queue, the worker), so entries carry the chunk's content
+# hash and a lookup that knows the hash it expects (from the vector metadata) refetches entries that no longer match
+chunk_text_cache = GroupedLRUCache(
+    max_entries=int(os.getenv("CHUNK_CACHE_MAX_ENTRIES", "4096")),
+    ttl_seconds=float(os.getenv("CHUNK_CACHE_TTL_SECONDS", "300"))
+)
+# cached text belongs to the version it was read from
+index_layouts.on_change(lambda previous, active: chunk_text_cache.clear())
+chunk_cache_lookups = registry.counter("edgeup_chunk_cache_lookups_total", "chunk text lookups served from the hot-chunk cache or from mongo, or cached but stale", ("result",))
 
 class TextChunkModel:
-    def __init__(self, db):
-        self.collection: Collection = db["text_chunks"]
+    def __init__(self, db, layout: Optional[IndexLayout] = None):
+        # without a layout the model follows the active index version; a re-index pins the version it is building
+        self.db = db
+        self.layout = layout
+
+    @property
+    def collection(self) -> Collection:
+        return self.db[(self.layout or index_layouts.active()).chunk_collection]
+
+    def _deletion_targets(self) -> List[Collection]:
+        # deletes reach every version that may still be searched, unless the model is pinned to one
+        if self.layout is not None:
+            return [self.collection]
+        return [self.db[layout.chunk_collection] for layout in index_layouts.live()]
 
     def insert_chunks(self, chunks: List[Dict[str, Any]], document_id: str, user_id: str, filename: str) -> int:
         # insert a list of text chunks into the collection. each chunk should be a dict with at least 'text', 'metadata', and optionally 'embedding'.
-        docs = []
-        for idx, chunk in enumerate(chunks):
-            doc = {
-                "document_id": document_id,
-                "user_id": user_id,
-                "filename": filename,
-                "chunk_index": idx,
-                "text": chunk.get("text", ""),
-                "metadata": chunk.get("metadata", {}),
-                "embedding": chunk.get("embedding", None)
-            }
-            docs.append(doc)
+        docs = build_chunk_documents(chunks, document_id, user_id, filename)
         if docs:
             result = self.collection.insert_many(docs)
             return len(result.inserted_ids)
         return 0
 
+    def set_embeddings(self, document_id: str, user_id: str, start_index: int, embeddings: List[List[float]]) -> int:
+        # fill in the embeddings of a run of already-inserted chunks, starting at chunk_index start_index
+        if not embeddings:
+            return 0
+        operations = [
+            UpdateOne({"document_id": document_id, "user_id": user_id, "chunk_index": start_index + offset}, {"$set": {"embedding": embedding}})
+            for offset, embedding in enumerate(embeddings)
+        ]
+        result = self.collection.bulk_write(operations, ordered=False)
+        return result.matched_count
+
+    def get_chunks(self, document_id: str, user_id: str) -> List[Dict[str, Any]]:
+        # the chunks of a document in order, without their embeddings
+        cursor = self.collection.find(
+            {"document_id": document_id, "user_id": user_id},
+            {"_id": 0, "chunk_index": 1, "text": 1, "metadata": 1}
+        ).sort("chunk_index", 1)
+        return list(cursor)
+
+    def get_chunk_texts(self, user_id: str, keys: Iterable[Tuple[str, int]],
+                        expected_hashes: Optional[Dict[Tuple[str, int], str]] = None) -> Dict[Tuple[str, int], Dict[str, Any]]:
+        # text, filename, page and content hash of chunks by (document_id, chunk_index): from the hot-chunk cache, the rest in one
+        # $in query. cached entries whose hash differs from expected_hashes were rewritten elsewhere and are read again. entries
+        # record the user they were read for and only serve that user, so the cache never skips the ownership check of the query.
+        # the cache holds the active version only, so a model pinned to a version always reads its collection.
+        keys = list(dict.fromkeys(keys))
+        expected_hashes = expected_hashes or {}
+        cached = self.layout is None
+        found = {key: chunk for key, chunk in chunk_text_cache.get_many(keys).items() if chunk["user_id"] == user_id} if cached else {}
+        stale = [key for key, chunk in found.items() if expected_hashes.get(key, chunk["content_hash"]) != chunk["content_hash"]]
+        for key in stale:
+            del found[key]
+        missing = [key for key in keys if key not in found]
+        chunk_cache_lookups.inc(len(found), result="hit")
+        if stale:
+            chunk_cache_lookups.inc(len(stale), result="stale")
+        if not missing:
+            return found
+        chunk_cache_lookups.inc(len(missing) - len(stale), result="miss")
+        cursor = self.collection.find(
+            _keys_query(user_id, missing),
+            {"_id": 0, "document_id": 1, "chunk_index": 1, "text": 1, "content_hash": 1, "filename": 1, "metadata.page": 1}
+        )
+        loaded = {}
+        for doc in cursor:
+            loaded[(doc["document_id"], doc["chunk_index"])] = {
+                "text": doc.get("text", ""),
+                "content_hash": doc.get("content_hash") or chunk_hash(doc.get("text", "")),
+                "filename": doc.get("filename", "unknown"),
+                "page_num": (doc.get("metadata") or {}).get("page", 0),
+                "user_id": user_id
+            }
+        if cached:
+            chunk_text_cache.set_many(loaded)
+        found.update(loaded)
+        return found
+
+    def get_chunk_embeddings(self, user_id: str, keys: Iterable[Tuple[str, int]]) -> Dict[Tuple[str, int], Dict[str, Any]]:
+        # text, filename, page and stored embedding of chunks by (document_id, chunk_index), for rescoring them without a vector
+        # search. chunks that were deleted or never embedded are left out.
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        cursor = self.collection.find(
+            _keys_query(user_id, keys),
+            {"_id": 0, "document_id": 1, "chunk_index": 1, "text": 1, "filename": 1, "metadata.page": 1, "embedding": 1}
+        )
+        return {
+            (doc["document_id"], doc["chunk_index"]): {
+                "text": doc.get("text", ""),
+                "filename": doc.get("filename", "unknown"),
+                "page_num": (doc.get("metadata") or {}).get("page", 0),
+                "embedding": doc["embedding"]
+            }
+            for doc in cursor if doc.get("embedding")
+        }
+
+    def get_chunk_fingerprints(self, document_id: str, user_id: str) -> List[Dict[str, Any]]:
+        # position, page and content hash of every stored chunk of a document, without embeddings
+        cursor = self.collection.find(
+            {"document_id": document_id, "user_id": user_id},
+            {"_id": 0, "chunk_index": 1, "content_hash": 1, "text": 1, "metadata.page": 1, "embedding": {"$slice": 1}}
+        ).sort("chunk_index", 1)
+        fingerprints = []
+        for doc in cursor:
+            fingerprints.append({
+                "chunk_index": doc["chunk_index"],
+                "content_hash": doc.get("content_hash") or chunk_hash(doc.get("text", "")),
+                "page": (doc.get("metadata") or {}).get("page"),
+                "has_embedding": bool(doc.get("embedding"))
+            })
+        return fingerprints
+
+    def get_embeddings(self, document_id: str, user_id: str, chunk_indexes: List[int]) -> Dict[int, List[float]]:
+        # stored embeddings of some chunks of a document, by chunk_index
+        if not chunk_indexes:
+            return {}
+        cursor = self.collection.find(
+            {"document_id": document_id, "user_id": user_id, "chunk_index": {"$in": list(chunk_indexes)}},
+            {"_id": 0, "chunk_index": 1, "embedding": 1}
+        )
+        return {doc["chunk_index"]: doc["embedding"] for doc in cursor if doc.get("embedding")}
+
+    def replace_chunks(self, chunks: List[Dict[str, Any]], document_id: str, user_id: str, filename: str) -> int:
+        # write chunks that carry their own chunk_index over whatever is stored at those positions
+        if not chunks:
+            return 0
+        operations = []
+        for chunk in chunks:
+            doc = build_chunk_documents([chunk], document_id, user_id, filename)[0]
+            doc["chunk_index"] = chunk["chunk_index"]
+            operations.append(ReplaceOne({"document_id": document_id, "user_id": user_id, "chunk_index": chunk["chunk_index"]}, doc, upsert=True))
+        result = self.collection.bulk_write(operations, ordered=False)
+        chunk_text_cache.invalidate(document_id)
+        return result.matched_count + result.upserted_count
+
+    def delete_chunks_from(self, document_id: str, user_id: str, start_index: int) -> int:
+        # drop the tail of a document that got shorter
+        result = self.collection.delete_many({"document_id": document_id, "user_id": user_id, "chunk_index": {"$gte": start_index}})
+        chunk_text_cache.invalidate(document_id)
+        return result.deleted_count
+
     def get_files_by_user(self, user_id: str) -> List[Dict[str, Any]]:
         # return a list of unique files (by document_id) for a user
         pipeline = [
@@ -50,5 +190,60 @@ class TextChunkModel:
 
     def delete_chunks_by_document(self, document_id: str, user_id: str) -> int:
         # delete all chunks for a document and user
-        result = self.collection.delete_many({"document_id": document_id, "user_id": user_id})
-        return result.deleted_count
+        deleted = sum(collection.delete_many({"document_id": document_id, "user_id": user_id}).deleted_count for collection in self._deletion_targets())
+        chunk_text_cache.invalidate(document_id)
+        return deleted
+
+    def delete_chunks_by_documents(self, document_ids: List[str], user_id: str) -> int:
+        # delete the chunks of several documents with one delete_many per version
+        query = {"document_id": {"$in": list(document_ids)}, "user_id": user_id}
+        deleted = sum(collection.delete_many(query).deleted_count for collection in self._deletion_targets())
+        for document_id in document_ids:
+            chunk_text_cache.invalidate(document_id)
+        return deleted
+
+    def delete_user_chunks(self, user_id: str) -> Dict[str, Any]:
+        # delete every chunk of a user. returns the deleted count and the documents they belonged to, for vector and cache cleanup.
+        document_ids = set()
+        deleted = 0
+        for collection in self._deletion_targets():
+            document_ids.update(collection.distinct("document_id", {"user_id": user_id}))
+            deleted += collection.delete_many({"user_id": user_id}).deleted_count
+        for document_id in document_ids:
+            chunk_text_cache.invalidate(document_id)
+        return {"deleted_count": deleted, "document_ids": sorted(document_ids)}
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def _keys_query(user_id: str, keys: List[Tuple[str, int]]) -> Dict[str, Any]:
+    # one query for chunks named by (document_id, chunk_index)
+    by_document: Dict[str, List[int]] = {}
+    for document_id, chunk_index in keys:
+        by_document.setdefault(document_id, []).append(chunk_index)
+    clauses = [{"document_id": document_id, "chunk_index": {"$in": indexes}} for document_id, indexes in by_document.items()]
+    return {"user_id": user_id, **clauses[0]} if len(clauses) == 1 else {"user_id": user_id, "$or": clauses}
+
+def build_chunk_documents(chunks: List[Dict[str, Any]], document_id: str, user_id: str, filename: str) -> List[Dict[str, Any]]:
+    # shape chunks into text_chunks documents
+    return [
+        {
+            "document_id": document_id,
+            "user_id": user_id,
+            "filename": filename,
+            "chunk_index": idx,
+            "text": chunk.get("text", ""),
+            "content_hash": chunk_hash(chunk.get("text", "")),
+            "metadata": chunk.get("metadata", {}),
+            "embedding": chunk.get("embedding", None)
+        }
+        for idx, chunk in enumerate(chunks)
+    ]
+
+def compute_chunks_etag(chunks: List[Dict[str, Any]], missing: List[str]) -> str:
+    # weak etag over the chunk texts served by /chunks; a replaced document changes the text behind the same chunk id
+    digest = hashlib.sha1()
+    for chunk in chunks:
+        digest.update(f"{chunk['chunk_id']}|{chunk['index_version']}|{chunk['page_num']}|{chunk['text']}\n".encode("utf-8"))
+    digest.update("|".join(missing).encode("utf-8"))
+    return f'W/"{digest.hexdigest()}"'
@@ -0,0 +1,34 @@
+# uploaded files waiting for a worker, kept in gridfs so any worker host can read them with nothing but mongo
+import shutil
+from typing import Optional
+
+from bson import ObjectId
+from gridfs import GridFSBucket
+from gridfs.errors import NoFile
+
+class UploadStore:
+    def __init__(self, db):
+        self.bucket = GridFSBucket(db, bucket_name="uploads")
+
+    def put(self, path: str, filename: str, user_id: str, document_id: str, content_hash: Optional[str] = None) -> str:
+        with open(path, "rb") as f:
+            file_id = self.bucket.upload_from_stream(
+                filename, f, metadata={"user_id": user_id, "document_id": document_id, "content_hash": content_hash}
+            )
+        return str(file_id)
+
+    def fetch(self, file_id: str, path: str) -> None:
+        # write a stored upload to path
+        with open(path, "wb") as f:
+            stream = self.bucket.open_download_stream(ObjectId(file_id))
+            try:
+                shutil.copyfileobj(stream, f, 1024 * 1024)
+            finally:
+                stream.close()
+
+    def delete(self, file_id: str) -> bool:
+        try:
+            self.bucket.delete(ObjectId(file_id))
+        except NoFile:
+            return False
+        return True
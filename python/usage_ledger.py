@@ -0,0 +1,260 @@
+# append-only ledger of openai calls: model, tokens, prompt-cache hits, latency and who the call was made for. calls are recorded
+# in memory and a writer thread inserts them into mongo in batches, so the request path never waits on the ledger. the user,
+# document and endpoint come from usage_scope(), which threadpool and stage threads inherit through the request context.
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from metrics import registry, current_trace_id
+
+logger = logging.getLogger(__name__)
+
+USAGE_LEDGER_ENABLED = os.getenv("USAGE_LEDGER_ENABLED", "true").lower() in ("1", "true", "yes")
+USAGE_BATCH_SIZE = int(os.getenv("USAGE_BATCH_SIZE", "200"))
+# a partial batch is written after this long
+USAGE_FLUSH_SECONDS = float(os.getenv("USAGE_FLUSH_SECONDS", "2"))
+# entries held while mongo is unreachable; beyond this the oldest are dropped
+USAGE_MAX_BUFFER = int(os.getenv("USAGE_MAX_BUFFER", "20000"))
+
+SCOPE_FIELDS = ("user_id", "document_id", "endpoint")
+GROUP_FIELDS = ("user_id", "document_id", "endpoint", "operation", "model")
+
+ledger_depth = registry.gauge("edgeup_usage_ledger_depth", "openai calls recorded but not yet stored in mongo")
+ledger_dropped = registry.counter("edgeup_usage_ledger_dropped_total", "ledger entries dropped because the buffer was full")
+ledger_flush_failures = registry.counter("edgeup_usage_ledger_flush_failures_total", "failed attempts to store ledger entries")
+
+_scope: contextvars.ContextVar = contextvars.ContextVar("edgeup_usage_scope", default={})
+
+@contextmanager
+def usage_scope(**fields):
+    # attribute the openai calls made inside the block (and by threads that inherit its context) to these fields
+    token = _scope.set({**_scope.get(), **{key: value for key, value in fields.items() if value is not None}})
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+def bind_scope(**fields) -> None:
+    # like usage_scope() for the rest of the current context; used once per request, the way traces are started
+    _scope.set({**_scope.get(), **{key: value for key, value in fields.items() if value is not None}})
+
+def current_scope() -> Dict[str, Any]:
+    return dict(_scope.get())
+
+def _usage_value(usage, *path) -> int:
+    # a counter from an openai usage block, which is a raw json dict for embeddings and an sdk object for completions
+    value = usage
+    for key in path:
+        if value is None:
+            return 0
+        value = value.get(key) if isinstance(value, dict) else getattr(value, key, None)
+    return int(value or 0)
+
+def ledger_entry(operation: str, model: str, latency_seconds: float, usage=None, error: Optional[BaseException] = None) -> Dict[str, Any]:
+    cached = _usage_value(usage, "prompt_tokens_details", "cached_tokens")
+    entry = {
+        "at": datetime.utcnow(),
+        "operation": operation,
+        "model": model,
+        "prompt_tokens": _usage_value(usage, "prompt_tokens"),
+        "completion_tokens": _usage_value(usage, "completion_tokens"),
+        "cached_tokens": cached,
+        "cache_hit": cached > 0,
+        "latency_ms": round(latency_seconds * 1000, 1),
+        "status": "error" if error is not None else "ok",
+        "trace_id": current_trace_id(),
+    }
+    scope = _scope.get()
+    for field in SCOPE_FIELDS:
+        entry[field] = scope.get(field)
+    if error is not None:
+        entry["error"] = f"{error.__class__.__name__}: {str(error)[:200]}"
+    return entry
+
+class UsageWriter:
+    def __init__(self, batch_size: int = USAGE_BATCH_SIZE, flush_seconds: float = USAGE_FLUSH_SECONDS, max_buffer: int = USAGE_MAX_BUFFER,
+                 retry_seconds: float = 1.0):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max_buffer
+        self.retry_seconds = retry_seconds
+        self._store: Optional[Callable[[List[Dict[str, Any]]], None]] = None
+        self._queue: deque = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._in_flight = 0
+        # flush() callers waiting; while there are any, partial batches go out right away
+        self._flushing = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self, store: Callable[[List[Dict[str, Any]]], None]) -> None:
+        # store(entries) inserts a batch. nothing is recorded until the writer is started, so tools that never start it pay nothing.
+        if self._thread is not None or not USAGE_LEDGER_ENABLED:
+            return
+        self._store = store
+        with self._cond:
+            self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="usage-ledger", daemon=True)
+        self._thread.start()
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        if self._thread is None:
+            return
+        with self._cond:
+            if len(self._queue) >= self.max_buffer:
+                self._queue.popleft()
+                ledger_dropped.inc()
+            self._queue.append(entry)
+            ledger_depth.set(len(self._queue))
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        # wait until everything recorded so far is stored
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._flushing += 1
+            self._cond.notify_all()
+            try:
+                while self._queue or self._in_flight:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self._flushing -= 1
+        return True
+
+    def stop(self, timeout: float = 10.0) -> None:
+        # store what can be stored within timeout; the rest is lost with the process
+        if self._thread is None:
+            return
+        self.flush(timeout)
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"pending": len(self._queue) + self._in_flight, "running": self.running}
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._stopping and (not self._queue or (not self._flushing and len(self._queue) < self.batch_size)):
+                    self._cond.wait(self.flush_seconds)
+                if not self._queue:
+                    if self._stopping:
+                        return
+                    continue
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                self._in_flight = len(batch)
+            try:
+                self._store(batch)
+            except Exception as e:
+                ledger_flush_failures.inc()
+                logger.error(f"storing {len(batch)} usage ledger entries failed, retrying: {str(e)}")
+                with self._cond:
+                    self._queue.extendleft(reversed(batch))
+                    self._in_flight = 0
+                    self._cond.notify_all()
+                    if self._stopping:
+                        return
+                    self._cond.wait(self.retry_seconds)
+                continue
+            with self._cond:
+                self._in_flight = 0
+                ledger_depth.set(len(self._queue))
+                self._cond.notify_all()
+
+usage_writer = UsageWriter()
+
+def record_call(operation: str, model: str, latency_seconds: float, usage=None, error: Optional[BaseException] = None) -> None:
+    # called once per openai call, after its retries, from the limiter-wrapped call sites
+    if usage_writer.running:
+        usage_writer.record(ledger_entry(operation, model, latency_seconds, usage, error))
+
+_TOTALS = {
+    "calls": {"$sum": 1},
+    "errors": {"$sum": {"$cond": [{"$eq": ["$status", "error"]}, 1, 0]}},
+    "prompt_tokens": {"$sum": "$prompt_tokens"},
+    "completion_tokens": {"$sum": "$completion_tokens"},
+    "cached_tokens": {"$sum": "$cached_tokens"},
+    "cache_hits": {"$sum": {"$cond": ["$cache_hit", 1, 0]}},
+    "latency_ms": {"$sum": "$latency_ms"},
+    "max_latency_ms": {"$max": "$latency_ms"},
+}
+
+def _finish_totals(row: Dict[str, Any]) -> Dict[str, Any]:
+    calls = row.get("calls") or 0
+    row["total_tokens"] = row.get("prompt_tokens", 0) + row.get("completion_tokens", 0)
+    row["avg_latency_ms"] = round(row.get("latency_ms", 0) / calls, 1) if calls else 0.0
+    row["latency_ms"] = round(row.get("latency_ms", 0), 1)
+    row["cache_hit_rate"] = round(row.get("cache_hits", 0) / calls, 3) if calls else 0.0
+    return row
+
+class UsageLedgerModel:
+    def __init__(self, db):
+        self.collection = db["openai_usage"]
+
+    def insert_entries(self, entries: List[Dict[str, Any]]) -> None:
+        if entries:
+            self.collection.insert_many(entries, ordered=False)
+
+    def breakdown(self, since: datetime, group_by: List[str], until: Optional[datetime] = None, sort: str = "total_tokens",
+                  limit: int = 50, match: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        # totals per combination of group_by fields over [since, until), heaviest first
+        unknown = [field for field in group_by if field not in GROUP_FIELDS]
+        if unknown or not group_by:
+            raise ValueError(f"group_by must be some of {', '.join(GROUP_FIELDS)}")
+        query: Dict[str, Any] = {"at": {"$gte": since, **({"$lt": until} if until else {})}, **(match or {})}
+        rows = self.collection.aggregate([
+            {"$match": query},
+            {"$group": {"_id": {field: f"${field}" for field in group_by}, **_TOTALS}},
+            {"$addFields": {"total_tokens": {"$add": ["$prompt_tokens", "$completion_tokens"]}}},
+            {"$sort": {sort if sort in ("total_tokens", "latency_ms", "calls", "errors") else "total_tokens": -1}},
+            {"$limit": limit},
+        ])
+        return [_finish_totals({**row.pop("_id"), **row}) for row in rows]
+
+    def top_users(self, since: datetime, sort: str = "total_tokens", limit: int = 20) -> List[Dict[str, Any]]:
+        return self.breakdown(since, ["user_id"], sort=sort, limit=limit)
+
+    def regressions(self, window_hours: float = 24, group_by: Optional[List[str]] = None, min_calls: int = 20,
+                    threshold: float = 0.25, now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        # groups whose average latency or tokens per call grew by more than threshold between the previous window and the last one
+        group_by = group_by or ["endpoint", "operation", "model"]
+        now = now or datetime.utcnow()
+        window = timedelta(hours=window_hours)
+        current = {tuple(row[field] for field in group_by): row for row in self.breakdown(now - window, group_by, until=now, limit=1000)}
+        previous = {tuple(row[field] for field in group_by): row for row in self.breakdown(now - 2 * window, group_by, until=now - window, limit=1000)}
+        found = []
+        for key, row in current.items():
+            before = previous.get(key)
+            if before is None or row["calls"] < min_calls or before["calls"] < min_calls:
+                continue
+            changes = {
+                "avg_latency_ms": (before["avg_latency_ms"], row["avg_latency_ms"]),
+                "tokens_per_call": (round(before["total_tokens"] / before["calls"], 1), round(row["total_tokens"] / row["calls"], 1)),
+                "error_rate": (round(before["errors"] / before["calls"], 3), round(row["errors"] / row["calls"], 3)),
+            }
+            grown = {
+                metric: {"before": old, "after": new, "change": round(new / old - 1, 3) if old else None}
+                for metric, (old, new) in changes.items()
+                if (old and new / old - 1 > threshold) or (not old and new > 0 and metric == "error_rate")
+            }
+            if grown:
+                found.append({**dict(zip(group_by, key)), "calls": row["calls"], "previous_calls": before["calls"], "regressions": grown})
+        return sorted(found, key=lambda item: max((change["change"] or 0) for change in item["regressions"].values()), reverse=True)
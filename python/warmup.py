@@ -0,0 +1,145 @@
+# startup warm-up: the work the first request after a deploy would otherwise pay for (heavy imports, the tokenizer's bpe ranks,
+# the http clients, the pinecone index lookup, the first mongo connection) done once from the lifespan, with readiness held back until it has finished
+import importlib
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+step_duration = registry.gauge("edgeup_warmup_step_seconds", "time the last attempt of each warm-up step took", ("step",))
+
+def import_modules() -> None:
+    # modules the request handlers import lazily
+    for name in ("embeddings", "pinecone_vectors", "doc_chunks", "text_extractor"):
+        importlib.import_module(name)
+
+def load_tokenizer() -> None:
+    from doc_chunks import get_tokenizer
+    get_tokenizer().encode("warm up")
+
+def open_openai_clients() -> None:
+    from openai_limiter import get_client
+    from embeddings import get_session
+    get_client()
+    get_session()
+
+def resolve_pinecone_index() -> None:
+    from pinecone_vectors import warm_index
+    warm_index()
+
+def connect_mongo() -> None:
+    from mongo_connection import mongo_manager
+    mongo_manager.client.admin.command("ping")
+
+DEFAULT_STEPS: List[Tuple[str, Callable[[], None]]] = [
+    ("imports", import_modules),
+    ("tokenizer", load_tokenizer),
+    ("openai_clients", open_openai_clients),
+    ("pinecone_index", resolve_pinecone_index),
+    ("mongo", connect_mongo)
+]
+
+class Warmup:
+    # runs the steps until every one has succeeded, retrying failed steps, and tracks the startup timings
+    def __init__(self, steps: Iterable[Tuple[str, Callable[[], None]]] = DEFAULT_STEPS, skip: Iterable[str] = (), retry_seconds: float = 10.0):
+        skip = set(skip)
+        self.steps = [(name, fn) for name, fn in steps if name not in skip]
+        self.skipped = sorted(skip)
+        self.retry_seconds = retry_seconds
+        self.results: Dict[str, dict] = {}
+        self.import_seconds: Optional[float] = None
+        self.ready_seconds: Optional[float] = None
+        self.first_request_seconds: Optional[float] = None
+        self._process_started: Optional[float] = None
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "Warmup":
+        skip = [name.strip() for name in os.getenv("WARMUP_SKIP", "").split(",") if name.strip()]
+        return cls(skip=skip, retry_seconds=float(os.getenv("WARMUP_RETRY_SECONDS", "10")))
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def record_import(self, started: float, finished: float) -> None:
+        # perf_counter bounds of the application module import; startup is measured from started
+        self._process_started = started
+        self.import_seconds = finished - started
+
+    def record_first_request(self, seconds: float) -> None:
+        with self._lock:
+            if self.first_request_seconds is None:
+                self.first_request_seconds = seconds
+
+    def run_once(self) -> bool:
+        # attempt every step that has not succeeded yet; true once all of them have
+        for name, fn in self.steps:
+            result = self.results.setdefault(name, {"ok": False, "attempts": 0, "seconds": None, "error": None})
+            if result["ok"]:
+                continue
+            started = time.perf_counter()
+            try:
+                fn()
+                result.update(ok=True, error=None)
+            except Exception as e:
+                result["error"] = f"{e.__class__.__name__}: {e}"
+                logger.warning(f"warm-up step {name} failed: {result['error']}")
+            result["attempts"] += 1
+            result["seconds"] = round(time.perf_counter() - started, 4)
+            step_duration.set(result["seconds"], step=name)
+        if all(result["ok"] for result in self.results.values()):
+            if self._process_started is not None:
+                self.ready_seconds = time.perf_counter() - self._process_started
+            self._ready.set()
+            logger.info("warm-up complete", extra={"steps": {name: result["seconds"] for name, result in self.results.items()}, "startup_seconds": self.ready_seconds})
+            return True
+        return False
+
+    def run(self) -> bool:
+        while not self._stop.is_set():
+            if self.results and self._stop.wait(self.retry_seconds):
+                break
+            if self.run_once():
+                return True
+        return False
+
+    def start(self, blocking: bool = False) -> None:
+        # warm up in a background thread so liveness checks answer meanwhile. when blocking, the first attempt runs inline and only retries go to the thread.
+        if blocking and self.run_once():
+            return
+        self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "steps": {name: dict(result) for name, result in self.results.items()},
+            "skipped": self.skipped,
+            "import_seconds": _round(self.import_seconds),
+            "startup_seconds": _round(self.ready_seconds),
+            "first_request_seconds": _round(self.first_request_seconds)
+        }
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 4) if value is not None else None
+
+warmup = Warmup.from_env()
+
+registry.gauge("edgeup_ready", "1 once the startup warm-up has finished", callback=lambda: 1.0 if warmup.ready else 0.0)
+registry.gauge("edgeup_import_seconds", "time taken to import the application module", callback=lambda: warmup.import_seconds or 0.0)
+registry.gauge("edgeup_startup_seconds", "time from the application import to the end of warm-up", callback=lambda: warmup.ready_seconds or 0.0)
+registry.gauge("edgeup_first_request_seconds", "latency of the first request served by this process", callback=lambda: warmup.first_request_seconds or 0.0)
@@ -0,0 +1,191 @@
+# standalone ingestion worker. the api stores an upload in gridfs and queues a durable job; any number of these processes, on any
+# host that can reach mongo, claim jobs and run the extract/chunk/embed/store pipeline, so ingestion scales (and fails)
+# separately from chat. run with: python worker.py [--concurrency N]
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from jobs import JobModel, JOB_LEASE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "2"))
+# how long an idle worker waits before looking for work again
+WORKER_POLL_SECONDS = float(os.getenv("WORKER_POLL_SECONDS", "2"))
+# how often expired leases are swept back into the queue
+WORKER_SWEEP_SECONDS = float(os.getenv("WORKER_SWEEP_SECONDS", "30"))
+
+Handler = Callable[[Dict[str, Any], Callable[..., None]], Dict[str, Any]]
+
+def ingest_job(job: Dict[str, Any], report: Callable[..., None]) -> Dict[str, Any]:
+    # an "ingest" or "replace" job queued by /process-sequence: fetch the upload and run the same pipeline the api runs inline
+    from dependencies import get_checkpoint_model, get_chunk_model, get_document_model, get_page_model
+    from ingestion import IngestionInProgress, ingest_document, replace_document
+    from mongo_connection import mongo_manager
+    from upload_store import UploadStore
+    from usage_ledger import bind_scope
+    # the worker thread runs one job at a time, so the attribution is simply replaced by the next job's
+    bind_scope(endpoint=f"worker:{job['kind']}")
+    params, user_id = job["params"], job["user_id"]
+    document_id, filename = params["document_id"], params["filename"]
+    documents, uploads = get_document_model(), mongo_manager.model(UploadStore)
+    document = documents.get_document(document_id, user_id)
+    if document is None:
+        uploads.delete(params["file_id"])
+        return {"document_id": document_id, "skipped": "the document was deleted before it was ingested"}
+    # a retried or duplicate job finds the work already done by the attempt or job that ran first
+    if document.get("status") == "ready" and (job["kind"] == "ingest" or document.get("content_hash") == params["content_hash"]):
+        uploads.delete(params["file_id"])
+        if job["kind"] == "replace":
+            return {"document_id": document_id, "replaced": False}
+        return {"document_id": document_id, "skipped": "the document is already ingested"}
+    with tempfile.TemporaryDirectory(prefix="ingest-") as directory:
+        path = os.path.join(directory, "upload" + os.path.splitext(filename)[1].lower())
+        report("download")
+        uploads.fetch(params["file_id"], path)
+        report("ingest")
+        if job["kind"] == "replace":
+            result = replace_document(document_id, user_id, path, params["size_bytes"], params["content_hash"], get_checkpoint_model(),
+                                      documents, get_chunk_model(), page_model=get_page_model())
+        else:
+            documents.mark_processing(document_id, user_id)
+            try:
+                result = ingest_document(document_id, user_id, filename, path, get_checkpoint_model(), documents, get_chunk_model(),
+                                         page_model=get_page_model())
+            except IngestionInProgress:
+                # another worker holds the document's checkpoint lease; the job is retried once the worker's backoff has passed,
+                # and by then finds the document ready or the lease free
+                raise
+            except Exception as e:
+                documents.mark_failed(document_id, user_id, str(e))
+                raise
+            result = {key: result[key] for key in ("document_id", "page_count", "chunk_count", "batch_count", "resumed_batches", "dedup")}
+    uploads.delete(params["file_id"])
+    return result
+
+HANDLERS: Dict[str, Handler] = {"ingest": ingest_job, "replace": ingest_job}
+
+class Worker:
+    def __init__(self, jobs: JobModel, handlers: Dict[str, Handler], concurrency: int = WORKER_CONCURRENCY,
+                 poll_seconds: float = WORKER_POLL_SECONDS, lease_seconds: int = JOB_LEASE_SECONDS, owner: Optional[str] = None):
+        self.jobs = jobs
+        self.handlers = handlers
+        self.concurrency = concurrency
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stopping = threading.Event()
+
+    def run_once(self, slot: int = 0) -> bool:
+        # claim one due job and run it; False when there was none
+        job = self.jobs.claim(f"{self.owner}/{slot}", list(self.handlers), self.lease_seconds)
+        if job is None:
+            return False
+        self._execute(job, f"{self.owner}/{slot}")
+        return True
+
+    def serve(self) -> None:
+        # run until stop(): concurrency claim loops, plus a sweep of expired leases. jobs in progress are finished first.
+        threads = [threading.Thread(target=self._loop, args=(slot,), name=f"worker-{slot}") for slot in range(self.concurrency)]
+        for thread in threads:
+            thread.start()
+        logger.info(f"worker {self.owner} serving {', '.join(self.handlers)} jobs with {self.concurrency} slots")
+        while not self._stopping.is_set():
+            try:
+                self.jobs.requeue_expired()
+            except Exception as e:
+                logger.warning(f"could not sweep expired job leases: {str(e)}")
+            self._stopping.wait(WORKER_SWEEP_SECONDS)
+        for thread in threads:
+            thread.join()
+        logger.info(f"worker {self.owner} stopped")
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+    def _loop(self, slot: int) -> None:
+        while not self._stopping.is_set():
+            try:
+                found = self.run_once(slot)
+            except Exception as e:
+                # mongo unreachable and the like; the job, if any, comes back when its lease expires
+                logger.error(f"worker slot {slot} failed to claim or record a job: {str(e)}")
+                found = False
+            if not found:
+                self._stopping.wait(self.poll_seconds)
+
+    def _execute(self, job: Dict[str, Any], owner: str) -> None:
+        job_id = job["job_id"]
+        lost = threading.Event()
+        done = threading.Event()
+
+        def heartbeat() -> None:
+            while not done.wait(self.lease_seconds / 3):
+                try:
+                    if not self.jobs.heartbeat(job_id, owner, self.lease_seconds):
+                        logger.warning(f"lost the lease of job {job_id}; its result will be discarded")
+                        lost.set()
+                        return
+                except Exception as e:
+                    logger.warning(f"heartbeat of job {job_id} failed: {str(e)}")
+
+        def report(step: str, done_count: Optional[int] = None, total: Optional[int] = None) -> None:
+            self.jobs.progress(job_id, step, done_count, total)
+
+        beat = threading.Thread(target=heartbeat, name=f"heartbeat-{job_id[:8]}", daemon=True)
+        beat.start()
+        logger.info(f"running {job['kind']} job {job_id} (attempt {job['attempts']})")
+        try:
+            result = self.handlers[job["kind"]](job, report)
+        except Exception as e:
+            done.set()
+            status = None if lost.is_set() else self.jobs.retry_or_dead(job_id, owner, str(e))
+            logger.error(f"{job['kind']} job {job_id} failed: {str(e)}" + (f"; {'dead-lettered' if status == 'dead' else 'will retry'}" if status else ""))
+            return
+        finally:
+            done.set()
+            beat.join()
+        if lost.is_set() or not self.jobs.finish(job_id, owner, result):
+            logger.warning(f"job {job_id} finished after its lease was lost; the result was not recorded")
+            return
+        logger.info(f"{job['kind']} job {job_id} completed")
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="claim and run queued ingestion jobs")
+    parser.add_argument("--concurrency", type=int, default=WORKER_CONCURRENCY, help="jobs run at once by this process")
+    parser.add_argument("--kinds", default=",".join(HANDLERS), help="comma-separated job kinds to take")
+    args = parser.parse_args(argv)
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    from index_versions import IndexVersionModel, index_layouts
+    from log_config import configure_logging
+    from mongo_connection import mongo_manager
+    from usage_ledger import UsageLedgerModel, usage_writer
+    configure_logging()
+    kinds = [kind.strip() for kind in args.kinds.split(",") if kind.strip()]
+    unknown = [kind for kind in kinds if kind not in HANDLERS]
+    if unknown:
+        print(f"unknown job kinds: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+    mongo_manager.start()
+    index_layouts.bind(lambda: mongo_manager.model(IndexVersionModel))
+    worker = Worker(mongo_manager.model(JobModel), {kind: HANDLERS[kind] for kind in kinds}, concurrency=args.concurrency)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: worker.stop())
+    usage_writer.start(lambda entries: mongo_manager.model(UsageLedgerModel).insert_entries(entries))
+    try:
+        worker.serve()
+    finally:
+        usage_writer.stop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())